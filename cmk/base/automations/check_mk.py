@@ -23,6 +23,7 @@ import cmk.utils.debug
 import cmk.utils.log as log
 import cmk.utils.man_pages as man_pages
 import cmk.utils.paths
+import cmk.utils.piggyback as piggyback
 import cmk.utils.rulesets.ruleset_matcher as ruleset_matcher
 import cmk.utils.snmp_table as snmp_table
 from cmk.utils.check_utils import section_name_of
@@ -372,6 +373,9 @@ class AutomationRenameHosts(Automation):
                 if self._rename_host_file(piggybase + piggydir, oldname, newname):
                     actions.append("piggyback-pig")
 
+        num_piggybacked, num_sourced = piggyback.rename_host_in_piggyback_store(oldname, newname)
+        actions += ["piggyback-load"] * num_piggybacked + ["piggyback-pig"] * num_sourced
+
         # Logwatch
         if self._rename_host_dir(cmk.utils.paths.logwatch_dir, oldname, newname):
             actions.append("logwatch")
@@ -384,6 +388,8 @@ class AutomationRenameHosts(Automation):
         if self._rename_host_file(cmk.utils.paths.var_dir + "/inventory", oldname, newname):
             self._rename_host_file(cmk.utils.paths.var_dir + "/inventory", oldname + ".gz",
                                    newname + ".gz")
+            self._rename_host_file(cmk.utils.paths.var_dir + "/inventory", oldname + ".sdt",
+                                   newname + ".sdt")
             actions.append("inv")
 
         if self._rename_host_dir(cmk.utils.paths.var_dir + "/inventory_archive", oldname, newname):
@@ -771,6 +777,7 @@ class AutomationDeleteHosts(Automation):
                 "%s/persisted/%s" % (cmk.utils.paths.var_dir, hostname),
                 "%s/inventory/%s" % (cmk.utils.paths.var_dir, hostname),
                 "%s/inventory/%s.gz" % (cmk.utils.paths.var_dir, hostname),
+                "%s/inventory/%s.sdt" % (cmk.utils.paths.var_dir, hostname),
                 "%s/agent_deployment/%s" % (cmk.utils.paths.var_dir, hostname),
         ]:
             self._delete_if_exists(path)
@@ -805,6 +812,7 @@ class AutomationDeleteHosts(Automation):
             except OSError as e:
                 if e.errno != errno.ENOENT:
                     raise
+        piggyback.remove_host_from_piggyback_store(hostname)
 
     def _delete_if_exists(self, path):
         # type: (str) -> None
@@ -1373,6 +1381,10 @@ class AutomationDiagHost(Automation):
         else:
             return 1, "SNMP command not implemented"
 
+        # The built-in backend does not implement SNMPv3
+        is_builtin_snmp_host = (snmp_config.is_builtin_snmp_host and
+                                not isinstance(credentials, tuple))
+
         #TODO: What about SNMP management boards?
         snmp_config = SNMPHostConfig(
             is_ipv6_primary=snmp_config.is_ipv6_primary,
@@ -1392,6 +1404,7 @@ class AutomationDiagHost(Automation):
             character_encoding=snmp_config.character_encoding,
             is_usewalk_host=snmp_config.is_usewalk_host,
             is_inline_snmp_host=snmp_config.is_inline_snmp_host,
+            is_builtin_snmp_host=is_builtin_snmp_host,
             record_stats=config.record_inline_snmp_stats,
         )
 
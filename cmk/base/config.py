@@ -9,8 +9,10 @@ import ast
 import copy
 import inspect
 import marshal
+import mmap
 import numbers
 import os
+import pickle
 import py_compile
 import struct
 import sys
@@ -274,6 +276,8 @@ def _perform_post_config_loading_actions():
 
     get_config_cache().initialize()
 
+    piggyback.set_piggyback_store(piggyback_store)
+
     # In case the checks are not loaded yet it seems the current mode
     # is not working with the checks. In this case also don't load the
     # static checks into the configuration.
@@ -537,6 +541,8 @@ class PackedConfig(object):  # pylint: disable=useless-object-inheritance
 
     b) They must not load the whole Check_MK config. Because they only
        need the options needed for checking
+
+    The configuration is stored in a binary format, see PackedConfigStore.
     """
 
     # These variables are part of the Check_MK configuration, but are not needed
@@ -559,16 +565,15 @@ class PackedConfig(object):  # pylint: disable=useless-object-inheritance
         # type: () -> None
         super(PackedConfig, self).__init__()
         self._path = os.path.join(cmk.utils.paths.var_dir, "base", "precompiled_check_config.mk")
+        self._store = PackedConfigStore(self._path)
 
     def save(self):
         # type: () -> None
         self._write(self._pack())
 
     def _pack(self):
-        # type: () -> str
-        helper_config = ("#!/usr/bin/env python\n"
-                         "# encoding: utf-8\n"
-                         "# Created by Check_MK. Dump of the currently active configuration\n\n")
+        # type: () -> Dict[str, Any]
+        helper_config = {}  # type: Dict[str, Any]
 
         config_cache = get_config_cache()
 
@@ -636,7 +641,7 @@ class PackedConfig(object):  # pylint: disable=useless-object-inheritance
             if varname in filter_var_functions:
                 val = filter_var_functions[varname](val)
 
-            helper_config += "\n%s = %r\n" % (varname, val)
+            helper_config[varname] = val
 
         #
         # Add modified check specific Check_MK base settings
@@ -651,7 +656,7 @@ class PackedConfig(object):  # pylint: disable=useless-object-inheritance
             if not self._packable(varname, val):
                 continue
 
-            helper_config += "\n%s = %r\n" % (varname, val)
+            helper_config[varname] = val
 
         return helper_config
 
@@ -669,25 +674,88 @@ class PackedConfig(object):  # pylint: disable=useless-object-inheritance
             return False
 
     def _write(self, helper_config):
-        # type: (str) -> None
+        # type: (Dict[str, Any]) -> None
         store.makedirs(os.path.dirname(self._path))
 
-        store.save_file(self._path + ".orig", helper_config + "\n")
-
-        code = compile(helper_config, '<string>', 'exec')
-        with open(self._path + ".compiled", "wb") as compiled_file:
-            marshal.dump(code, compiled_file)
+        # Human readable dump of the configuration. It is only written for debugging purposes.
+        store.save_file(
+            self._path + ".orig", "#!/usr/bin/env python\n"
+            "# encoding: utf-8\n"
+            "# Created by Check_MK. Dump of the currently active configuration\n\n" +
+            "".join("\n%s = %r\n" % (varname, val) for varname, val in helper_config.items()) +
+            "\n")
 
-        os.rename(self._path + ".compiled", self._path)
+        self._store.write(helper_config)
 
     def load(self):
         # type: () -> None
         _initialize_config()
-        with open(self._path, "rb") as f:
-            exec(marshal.load(f), globals())
+        globals().update(self._store.read())
         _perform_post_config_loading_actions()
 
 
+class PackedConfigStore(object):  # pylint: disable=useless-object-inheritance
+    """Caring about persistence of the packed configuration
+
+    The file starts with a header (magic and the size of the index), followed by the index and
+    the pickled values of all variables. The index maps the variable names to the offset and
+    size of their values.
+
+    Compared to the former marshalled Python code the file is smaller and loads faster,
+    because no code object holding all constants is created. Every variable is still loaded by
+    every process and each of them holds its own copy of the values, the memory usage of the
+    helpers is not reduced.
+    """
+    _MAGIC = b"CMKPACK1"
+    _HEADER = struct.Struct("!8sI")
+
+    def __init__(self, path):
+        # type: (str) -> None
+        super(PackedConfigStore, self).__init__()
+        self._path = path
+
+    def write(self, helper_config):
+        # type: (Dict[str, Any]) -> None
+        index = {}  # type: Dict[str, Tuple[int, int]]
+        values = []  # type: List[bytes]
+        offset = 0
+        for varname, val in helper_config.items():
+            raw_value = pickle.dumps(val, pickle.HIGHEST_PROTOCOL)
+            index[varname] = (offset, len(raw_value))
+            values.append(raw_value)
+            offset += len(raw_value)
+
+        raw_index = pickle.dumps(index, pickle.HIGHEST_PROTOCOL)
+
+        tmp_path = self._path + ".compiled"
+        with open(tmp_path, "wb") as f:
+            f.write(self._HEADER.pack(self._MAGIC, len(raw_index)))
+            f.write(raw_index)
+            for raw_value in values:
+                f.write(raw_value)
+
+        os.rename(tmp_path, self._path)
+
+    def read(self):
+        # type: () -> Dict[str, Any]
+        with open(self._path, "rb") as f, \
+             mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as packed:
+            magic, index_size = self._HEADER.unpack_from(packed)
+            if magic != self._MAGIC:
+                raise MKGeneralException(
+                    "The packed configuration %s has an unknown format. Please execute "
+                    "\"cmk -U\" to recreate it." % self._path)
+
+            values_offset = self._HEADER.size + index_size
+            index = pickle.loads(packed[self._HEADER.size:values_offset])
+
+            helper_config = {}  # type: Dict[str, Any]
+            for varname, (offset, size) in index.items():
+                start = values_offset + offset
+                helper_config[varname] = pickle.loads(packed[start:start + size])
+            return helper_config
+
+
 @contextlib.contextmanager
 def set_use_core_config(use_core_config):
     # type: (bool) -> Iterator[None]
@@ -2614,6 +2682,7 @@ class HostConfig(object):  # pylint: disable=useless-object-inheritance
             character_encoding=self._snmp_character_encoding(),
             is_usewalk_host=self.is_usewalk_host,
             is_inline_snmp_host=self._is_inline_snmp_host(),
+            is_builtin_snmp_host=self._is_builtin_snmp_host(),
             record_stats=record_inline_snmp_stats,
         )
 
@@ -2685,6 +2754,12 @@ class HostConfig(object):  # pylint: disable=useless-object-inheritance
         return has_inline_snmp and use_inline_snmp \
                and not self._config_cache.in_binary_hostlist(self.hostname, non_inline_snmp_hosts)
 
+    def _is_builtin_snmp_host(self):
+        # type: () -> bool
+        # The builtin backend does not support SNMPv3
+        return self._config_cache.in_binary_hostlist(self.hostname, builtin_snmp_hosts) \
+               and not isinstance(self._snmp_credentials(), tuple)
+
     def _is_cluster(self):
         # type: () -> bool
         """Checks whether or not the given host is a cluster host
@@ -3097,6 +3172,7 @@ class HostConfig(object):  # pylint: disable=useless-object-inheritance
             character_encoding=self._snmp_character_encoding(),
             is_usewalk_host=self.is_usewalk_host,
             is_inline_snmp_host=self._is_inline_snmp_host(),
+            is_builtin_snmp_host=self._is_builtin_snmp_host(),
             record_stats=record_inline_snmp_stats,
         )
 
@@ -262,7 +262,8 @@ def create_core_config(core):
 
     _verify_non_duplicate_hosts()
     _verify_non_deprecated_checkgroups()
-    core.create_config()
+    with ip_lookup.batched_ip_lookup_cache_updates():
+        core.create_config()
     cmk.utils.password_store.save(config.stored_passwords)
 
     return get_configuration_warnings()
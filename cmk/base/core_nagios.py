@@ -6,17 +6,25 @@
 """Code for support of Nagios (and compatible) cores"""
 
 import base64
+import contextlib
+import hashlib
+import importlib.util
+import io
+import marshal
+import multiprocessing
 import os
 import sys
 import py_compile
 import tempfile
 import errno
-from typing import Tuple, Any, IO, Optional, List, Set, Dict
+from typing import Tuple, Any, IO, Iterator, Optional, List, Set, Dict
 
 import six
 
 import cmk.utils.paths
+import cmk.utils.store as store
 import cmk.utils.tty as tty
+import cmk.utils.version as cmk_version
 from cmk.utils.check_utils import section_name_of
 from cmk.utils.exceptions import MKGeneralException
 from cmk.utils.log import console
@@ -37,6 +45,7 @@ import cmk.base.core_config as core_config
 import cmk.base.ip_lookup as ip_lookup
 import cmk.base.data_sources as data_sources
 import cmk.base.check_api_utils as check_api_utils
+from cmk.base.caching import config_cache as _config_cache
 from cmk.base.check_utils import (
     CheckPluginName,)
 from cmk.base.config import (
@@ -69,7 +78,7 @@ class NagiosCore(core_config.MonitoringCore):
                     delete=False) as tmp:
                 tmp_path = tmp.name
                 os.chmod(tmp.name, 0o660)
-                create_config(tmp, hostnames=None)
+                create_config(tmp, hostnames=None, host_objects_cache=HostObjectsCache())
                 os.rename(tmp.name, cmk.utils.paths.nagios_objects_file)
 
         except Exception:
@@ -122,9 +131,24 @@ class NagiosConfig(object):  # pylint: disable=useless-object-inheritance
         # TODO: Something seems to be mixed up in our call sites...
         self._outfile.write(six.ensure_str(x))
 
-
-def create_config(outfile, hostnames):
-    # type: (IO[str], Optional[List[HostName]]) -> None
+    def add_host_objects(self, host_objects):
+        # type: (HostObjects) -> None
+        (text, hostgroups, servicegroups, contactgroups, checknames, active_checks, custom_commands,
+         hostcheck_commands, warnings) = host_objects
+        self.write(text)
+        self.hostgroups_to_define.update(hostgroups)
+        self.servicegroups_to_define.update(servicegroups)
+        self.contactgroups_to_define.update(contactgroups)
+        self.checknames_to_define.update(checknames)
+        self.active_checks_to_define.update(active_checks)
+        self.custom_commands_to_define.update(custom_commands)
+        self.hostcheck_commands_to_define.extend(hostcheck_commands)
+        for warning in warnings:
+            core_config.warning(warning)
+
+
+def create_config(outfile, hostnames, host_objects_cache=None):
+    # type: (IO[str], Optional[List[HostName]], Optional[HostObjectsCache]) -> None
     if config.host_notification_periods != []:
         core_config.warning(
             "host_notification_periods is not longer supported. Please use extra_host_conf['notification_period'] instead."
@@ -153,8 +177,11 @@ def create_config(outfile, hostnames):
 
     _output_conf_header(cfg)
 
-    for hostname in sorted(hostnames):
-        _create_nagios_config_host(cfg, config_cache, hostname)
+    if host_objects_cache is None or not config.use_dns_cache:
+        for hostname in sorted(hostnames):
+            _create_nagios_config_host(cfg, config_cache, hostname)
+    else:
+        _create_nagios_config_hosts_cached(cfg, config_cache, sorted(hostnames), host_objects_cache)
 
     _create_nagios_config_contacts(cfg, hostnames)
     _create_nagios_config_hostgroups(cfg)
@@ -189,6 +216,308 @@ def _create_nagios_config_host(cfg, config_cache, hostname):
     _create_nagios_servicedefs(cfg, config_cache, hostname, host_attrs)
 
 
+#.
+#   .--Host objects cache--------------------------------------------------.
+#   |       _   _           _           _     _           _                |
+#   |      | | | | ___  ___| |_    ___ | |__ (_) ___  ___| |_ ___          |
+#   |      | |_| |/ _ \/ __| __|  / _ \| '_ \| |/ _ \/ __| __/ __|         |
+#   |      |  _  | (_) \__ \ |_  | (_) | |_) | |  __/ (__| |_\__ \         |
+#   |      |_| |_|\___/|___/\__|  \___/|_.__// |\___|\___|\__|___/         |
+#   |                                     |__/                             |
+#   +----------------------------------------------------------------------+
+#   | The objects of a host (host, services, dependencies) only change    |
+#   | when the configuration of the host, its autochecks or the rules     |
+#   | change. They are cached together with a fingerprint of these inputs |
+#   | and only the hosts with a changed fingerprint are created again.    |
+#   '----------------------------------------------------------------------'
+
+# The text of the objects, the hostgroups, servicegroups, contactgroups, check plugins,
+# active checks and custom commands to define, the host check commands and the
+# configuration warnings
+HostObjects = Tuple[str, Set[HostgroupName], Set[ServicegroupName], Set[ContactgroupName],
+                    Set[CheckPluginName], Set[CheckPluginName], Set[CoreCommandName],
+                    List[Tuple[CoreCommand, str]], List[str]]
+
+# These configuration variables are dicts with entries per host. Only the entries of the
+# host itself are part of the fingerprint of its objects.
+_HOST_CONFIG_VARIABLES = [
+    "host_tags",
+    "host_labels",
+    "host_paths",
+    "host_attributes",
+    "ipaddresses",
+    "ipv6addresses",
+    "additional_ipv4addresses",
+    "additional_ipv6addresses",
+    "explicit_snmp_communities",
+    "management_protocol",
+    "management_snmp_credentials",
+    "management_ipmi_credentials",
+]
+
+# The host definitions and the entries of these variables are handled separately
+_HOST_DEFINITION_VARIABLES = _HOST_CONFIG_VARIABLES + [
+    "all_hosts",
+    "clusters",
+    "explicit_host_conf",
+    "explicit_service_custom_variables",
+]
+
+
+class HostObjectsCache(object):  # pylint: disable=useless-object-inheritance
+    """Persistent cache of the objects created for the hosts of the Nagios configuration
+
+    Only the entries of the hosts looked up since loading the cache are saved. The entries
+    of removed hosts are dropped this way."""
+    def __init__(self, path=None):
+        # type: (Optional[str]) -> None
+        super(HostObjectsCache, self).__init__()
+        if path is None:
+            path = os.path.join(cmk.utils.paths.var_dir, "core", "nagios_host_objects.marshal")
+        self._path = path
+        self._entries = self._load()
+        self._seen = {}  # type: Dict[HostName, Tuple[str, HostObjects]]
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        # type: () -> Dict[HostName, Tuple[str, HostObjects]]
+        try:
+            entries = marshal.loads(store.load_bytes_from_file(self._path))
+        except (EOFError, ValueError, TypeError):
+            return {}  # Broken or empty cache. Will be rebuilt.
+        return entries if isinstance(entries, dict) else {}
+
+    def get(self, hostname, fingerprint):
+        # type: (HostName, str) -> Optional[HostObjects]
+        entry = self._entries.get(hostname)
+        if entry is None or entry[0] != fingerprint:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._seen[hostname] = entry
+        return entry[1]
+
+    def set(self, hostname, fingerprint, host_objects):
+        # type: (HostName, str, HostObjects) -> None
+        self._seen[hostname] = (fingerprint, host_objects)
+
+    def save(self):
+        # type: () -> None
+        if self._seen == self._entries:
+            return
+        store.makedirs(os.path.dirname(self._path))
+        store.save_bytes_to_file(self._path, marshal.dumps(self._seen))
+        self._entries = self._seen
+        self._seen = {}
+
+
+class HostObjectsFingerprints(object):  # pylint: disable=useless-object-inheritance
+    """Computes the fingerprints of all inputs of the objects of the hosts
+
+    The fingerprint covers the whole configuration, except for the definitions of the other
+    hosts, the check plugins, the autochecks and discovered host labels of the host and the
+    cached IP addresses. The definitions of the related cluster and node hosts are included,
+    as well as the existence of the parents from the "parents" ruleset."""
+    def __init__(self, config_cache):
+        # type: (ConfigCache) -> None
+        super(HostObjectsFingerprints, self).__init__()
+        self._config_cache = config_cache
+        self._config_fingerprint = _config_fingerprint()
+
+        self._host_entries = {}  # type: Dict[HostName, str]
+        for host_entry in config.all_hosts:
+            self._host_entries[host_entry.split("|", 1)[0]] = host_entry
+
+        self._nodes_of_cluster = {}  # type: Dict[HostName, List[HostName]]
+        self._clusters_of_node = {}  # type: Dict[HostName, List[HostName]]
+        for cluster_entry, nodes in config.clusters.items():
+            cluster_name = cluster_entry.split("|", 1)[0]
+            self._host_entries[cluster_name] = cluster_entry
+            self._nodes_of_cluster[cluster_name] = nodes
+            for node in nodes:
+                self._clusters_of_node.setdefault(node, []).append(cluster_name)
+
+        self._service_custom_variables = {}  # type: Dict[HostName, List]
+        for (hostname, description), value in config.explicit_service_custom_variables.items():
+            self._service_custom_variables.setdefault(hostname, []).append((description, value))
+
+    def of_host(self, hostname):
+        # type: (HostName) -> str
+        fingerprint = hashlib.sha256(self._config_fingerprint)
+        fingerprint.update(self._host_inputs(hostname))
+        for cluster_name in self._clusters_of_node.get(hostname, []):
+            cluster_inputs = (cluster_name, self._host_entries.get(cluster_name),
+                              self._nodes_of_cluster[cluster_name])
+            fingerprint.update(repr(cluster_inputs).encode("utf-8"))
+        for node in self._nodes_of_cluster.get(hostname, []):
+            fingerprint.update(self._host_inputs(node))
+        active_realhosts = self._config_cache.all_active_realhosts()
+        for parent_names in self._config_cache.host_extra_conf(hostname, config.parents):
+            fingerprint.update(
+                repr([(parent_name, parent_name in active_realhosts)
+                      for parent_name in parent_names.split(",")]).encode("utf-8"))
+        return fingerprint.hexdigest()
+
+    def _host_inputs(self, hostname):
+        # type: (HostName) -> bytes
+        ip_lookup_cache = ip_lookup._get_ip_lookup_cache()
+        inputs = (
+            hostname,
+            self._host_entries.get(hostname),
+            [getattr(config, varname).get(hostname) for varname in _HOST_CONFIG_VARIABLES],
+            [(varname, values.get(hostname))
+             for varname, values in sorted(config.explicit_host_conf.items())],
+            self._service_custom_variables.get(hostname),
+            ip_lookup_cache.get((hostname, 4)),
+            ip_lookup_cache.get((hostname, 6)),
+        )
+        return b"".join([
+            _literal_repr(inputs).encode("utf-8"),
+            _read_file(os.path.join(cmk.utils.paths.autochecks_dir, hostname + ".mk")),
+            _read_file(str(cmk.utils.paths.discovered_host_labels_dir / (hostname + ".mk"))),
+        ])
+
+
+def _config_fingerprint():
+    # type: () -> bytes
+    fingerprint = hashlib.sha256(cmk_version.__version__.encode("utf-8"))
+
+    variables = dict(config.get_check_variables())
+    for varname in config.get_variable_names() + list(config.get_derived_config_variable_names()):
+        if varname not in _HOST_DEFINITION_VARIABLES:
+            variables[varname] = getattr(config, varname)
+    for varname, value in sorted(variables.items()):
+        fingerprint.update(_literal_repr((varname, value)).encode("utf-8"))
+
+    for plugin_dir in [
+            cmk.utils.paths.checks_dir,
+            str(cmk.utils.paths.local_checks_dir),
+            str(cmk.utils.paths.local_agent_based_plugins_dir),
+    ]:
+        try:
+            plugin_files = sorted(
+                (entry.name, entry.stat().st_mtime_ns) for entry in os.scandir(plugin_dir))
+        except OSError:
+            plugin_files = []
+        fingerprint.update(repr((plugin_dir, plugin_files)).encode("utf-8"))
+
+    return fingerprint.digest()
+
+
+def _literal_repr(value):
+    # type: (Any) -> str
+    """Returns a representation of the value which is the same in all processes
+
+    Only literal values are represented. Functions and other objects have no stable
+    representation (it contains their memory address), so only their type is represented.
+    The code of the functions defined by the check plugins is covered by the mtimes of the
+    plugin files. The elements of sets are sorted, since their order depends on the hash
+    seed of the process."""
+    if isinstance(value, (str, bytes, int, float, complex, type(None))):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        return "%s(%s)" % (type(value).__name__, ", ".join(_literal_repr(v) for v in value))
+    if isinstance(value, dict):
+        return "%s(%s)" % (type(value).__name__, ", ".join(
+            "%s: %s" % (_literal_repr(k), _literal_repr(v)) for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return "%s(%s)" % (type(value).__name__, ", ".join(sorted(_literal_repr(v) for v in value)))
+    return "<%s.%s>" % (type(value).__module__, type(value).__qualname__)
+
+
+def _read_file(path):
+    # type: (str) -> bytes
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except IOError:
+        return b""
+
+
+def _create_nagios_config_hosts_cached(cfg, config_cache, hostnames, host_objects_cache):
+    # type: (NagiosConfig, ConfigCache, List[HostName], HostObjectsCache) -> None
+    fingerprints = HostObjectsFingerprints(config_cache)
+
+    all_host_objects = {}  # type: Dict[HostName, HostObjects]
+    changed_hostnames = []
+    for hostname in hostnames:
+        host_objects = host_objects_cache.get(hostname, fingerprints.of_host(hostname))
+        if host_objects is None:
+            changed_hostnames.append(hostname)
+        else:
+            all_host_objects[hostname] = host_objects
+
+    for hostname, fingerprint, host_objects in _create_host_objects(config_cache, fingerprints,
+                                                                    changed_hostnames):
+        host_objects_cache.set(hostname, fingerprint, host_objects)
+        all_host_objects[hostname] = host_objects
+
+    for hostname in hostnames:
+        cfg.add_host_objects(all_host_objects[hostname])
+
+    host_objects_cache.save()
+
+
+def _create_host_objects(config_cache, fingerprints, hostnames):
+    # type: (ConfigCache, HostObjectsFingerprints, List[HostName]) -> Iterator[Tuple[HostName, str, HostObjects]]
+    """Create the objects of the hosts, in parallel processes for many hosts
+
+    The processes are forked from this process and share the loaded configuration."""
+    num_processes = min(config.nagios_config_processes, len(hostnames) // 20)
+    if num_processes <= 1:
+        for hostname in hostnames:
+            yield _create_host_objects_of(config_cache, fingerprints, hostname)
+        return
+
+    with multiprocessing.Pool(num_processes,
+                              initializer=_initialize_host_objects_worker,
+                              initargs=(config_cache, fingerprints)) as pool:
+        for result in pool.imap(_create_host_objects_in_worker, hostnames, chunksize=10):
+            yield result
+
+
+_host_objects_worker_args = None  # type: Optional[Tuple[ConfigCache, HostObjectsFingerprints]]
+
+
+def _initialize_host_objects_worker(config_cache, fingerprints):
+    # type: (ConfigCache, HostObjectsFingerprints) -> None
+    global _host_objects_worker_args
+    _host_objects_worker_args = (config_cache, fingerprints)
+
+
+def _create_host_objects_in_worker(hostname):
+    # type: (HostName) -> Tuple[HostName, str, HostObjects]
+    assert _host_objects_worker_args is not None
+    config_cache, fingerprints = _host_objects_worker_args
+    return _create_host_objects_of(config_cache, fingerprints, hostname)
+
+
+def _create_host_objects_of(config_cache, fingerprints, hostname):
+    # type: (ConfigCache, HostObjectsFingerprints, HostName) -> Tuple[HostName, str, HostObjects]
+    outfile = io.StringIO()
+    cfg = NagiosConfig(outfile, [hostname])
+
+    num_warnings = len(core_config.g_configuration_warnings)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _create_nagios_config_host(cfg, config_cache, hostname)
+    warnings = core_config.g_configuration_warnings[num_warnings:]
+    del core_config.g_configuration_warnings[num_warnings:]
+
+    # The fingerprint is computed afterwards to cover the IP addresses looked up meanwhile
+    return hostname, fingerprints.of_host(hostname), (
+        outfile.getvalue(),
+        cfg.hostgroups_to_define,
+        cfg.servicegroups_to_define,
+        cfg.contactgroups_to_define,
+        cfg.checknames_to_define,
+        cfg.active_checks_to_define,
+        cfg.custom_commands_to_define,
+        cfg.hostcheck_commands_to_define,
+        warnings,
+    )
+
+
 def _create_nagios_host_spec(cfg, config_cache, hostname, attrs):
     # type: (NagiosConfig, ConfigCache, HostName, ObjectAttributes) -> ObjectSpec
     host_config = config_cache.get_host_config(hostname)
@@ -219,7 +548,7 @@ def _create_nagios_host_spec(cfg, config_cache, hostname, attrs):
 
     def host_check_via_service_status(service):
         # type: (ServiceName) -> CoreCommand
-        command = "check-mk-host-custom-%d" % (len(cfg.hostcheck_commands_to_define) + 1)
+        command = "check-mk-host-custom-%s" % host_config.hostname
         cfg.hostcheck_commands_to_define.append(
             (command, 'echo "$SERVICEOUTPUT:%s:%s$" && exit $SERVICESTATEID:%s:%s$' %
              (host_config.hostname, service.replace('$HOSTNAME$', host_config.hostname),
@@ -946,18 +1275,79 @@ def precompile_hostchecks():
     config_cache = config.get_config_cache()
 
     console.verbose("Precompiling host checks...\n")
-    for host in config_cache.all_active_hosts():
-        try:
-            _precompile_hostcheck(config_cache, host)
-        except Exception as e:
-            if cmk.utils.debug.enabled():
-                raise
-            console.error("Error precompiling checks for host %s: %s\n" % (host, e))
+    # The shared modules are saved by the (forked) processes precompiling the hosts
+    _config_cache.get_set("precompile_saved_shared_modules").clear()
+    shared_module_names = set()  # type: Set[str]
+    for hostname, shared_module_name, error in _precompile_hostchecks_of(
+            config_cache, sorted(config_cache.all_active_hosts())):
+        if error is not None:
+            console.error("Error precompiling checks for host %s: %s\n" % (hostname, error))
             sys.exit(5)
+        if shared_module_name is not None:
+            shared_module_names.add(shared_module_name)
+
+    _remove_obsolete_shared_hostcheck_modules(shared_module_names)
+
+
+PrecompileResult = Tuple[HostName, Optional[str], Optional[str]]
+
+
+def _precompile_hostchecks_of(config_cache, hostnames):
+    # type: (ConfigCache, List[HostName]) -> Iterator[PrecompileResult]
+    """Precompile the host checks, in parallel processes for many hosts
+
+    Like during the creation of the host objects, the processes are forked from this process
+    and share the loaded configuration. Their output is written in the order of the hosts."""
+    num_processes = min(config.precompile_processes, len(hostnames) // 20)
+    if num_processes <= 1:
+        for hostname in hostnames:
+            yield _precompile_hostcheck_of(config_cache, hostname)
+        return
+
+    with multiprocessing.Pool(num_processes,
+                              initializer=_initialize_precompile_worker,
+                              initargs=(config_cache,)) as pool:
+        for output, result in pool.imap(_precompile_hostcheck_in_worker, hostnames, chunksize=10):
+            sys.stderr.write(output)
+            yield result
+
+
+_precompile_worker_config_cache = None  # type: Optional[ConfigCache]
+
+
+def _initialize_precompile_worker(config_cache):
+    # type: (ConfigCache) -> None
+    global _precompile_worker_config_cache
+    _precompile_worker_config_cache = config_cache
+
+
+def _precompile_hostcheck_in_worker(hostname):
+    # type: (HostName) -> Tuple[str, PrecompileResult]
+    assert _precompile_worker_config_cache is not None
+    output = io.StringIO()
+    with contextlib.redirect_stderr(output):
+        result = _precompile_hostcheck_of(_precompile_worker_config_cache, hostname)
+    return output.getvalue(), result
+
+
+def _precompile_hostcheck_of(config_cache, hostname):
+    # type: (ConfigCache, HostName) -> PrecompileResult
+    try:
+        return hostname, _precompile_hostcheck(config_cache, hostname), None
+    except Exception as e:
+        if cmk.utils.debug.enabled():
+            raise
+        return hostname, None, str(e)
 
 
 def _precompile_hostcheck(config_cache, hostname):
-    # type: (ConfigCache, HostName) -> None
+    # type: (ConfigCache, HostName) -> Optional[str]
+    """Create the precompiled host check of a host
+
+    In the "shared" precompile mode the host check is a stub, which only contains the IP
+    addresses of the host and executes the module shared by all hosts with the same check
+    plugins. This module is saved before the stub, because the core may execute the stub
+    right away. Its name is returned to keep it when removing the obsolete modules."""
     host_config = config_cache.get_host_config(hostname)
 
     console.verbose("%s%s%-16s%s:", tty.bold, tty.blue, hostname, tty.normal, stream=sys.stderr)
@@ -966,66 +1356,174 @@ def _precompile_hostcheck(config_cache, hostname):
 
     compiled_filename = cmk.utils.paths.precompiled_hostchecks_dir + "/" + hostname
     source_filename = compiled_filename + ".py"
-    for fname in [compiled_filename, source_filename]:
-        try:
-            os.remove(fname)
-        except OSError as e:
-            if e.errno != errno.ENOENT:
-                raise
 
     needed_check_plugin_names = _get_needed_check_plugin_names(host_config)
     if not needed_check_plugin_names:
+        for fname in [compiled_filename, source_filename]:
+            try:
+                os.remove(fname)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
         console.verbose("(no Check_MK checks)\n")
-        return
+        return None
+
+    check_file_names = _get_needed_check_file_names(needed_check_plugin_names)
+    console.verbose("".join(" %s%s%s" % (tty.green, check_plugin_name, tty.normal)
+                            for check_plugin_name in sorted(needed_check_plugin_names)),
+                    stream=sys.stderr)
+
+    needed_ipaddresses, needed_ipv6addresses = _get_needed_ip_addresses(config_cache, host_config)
+
+    shared_module_name = None  # type: Optional[str]
+    source = _hostcheck_header(source_filename, compiled_filename)
+    if config.precompile_mode == "shared":
+        shared_module_name, shared_module_code = _shared_hostcheck_module(check_file_names)
+        _save_shared_hostcheck_module(shared_module_name, shared_module_code)
+        source += _shared_hostcheck_stub(shared_module_name, hostname, needed_ipaddresses,
+                                         needed_ipv6addresses)
+    else:
+        source += "hostname = %r\n" % hostname
+        source += "ipaddresses = %r\n" % needed_ipaddresses
+        source += "ipv6addresses = %r\n\n" % needed_ipv6addresses
+        source += _hostcheck_code(check_file_names)
 
-    output = open(source_filename + ".new", "w")
-    output.write("#!/usr/bin/env python3\n")
-    output.write("# encoding: utf-8\n\n")
+    # compile python (either now or delayed), but only if the source
+    # code has not changed. The Python compilation is the most costly
+    # operation here.
+    if _read_file(source_filename) == source.encode("utf-8") and _is_compiled(compiled_filename):
+        console.verbose(" (%s is unchanged)\n", source_filename, stream=sys.stderr)
+        return shared_module_name
+    console.verbose(" (new content)", stream=sys.stderr)
 
-    output.write("import logging\n")
-    output.write("import sys\n\n")
+    with open(source_filename + ".new", "w") as output:
+        output.write(source)
+    os.rename(source_filename + ".new", source_filename)
 
-    output.write("if not sys.executable.startswith('/omd'):\n")
-    output.write("    sys.stdout.write(\"ERROR: Only executable with sites python\\n\")\n")
-    output.write("    sys.exit(2)\n\n")
+    if os.path.exists(compiled_filename) or os.path.islink(compiled_filename):
+        os.remove(compiled_filename)
+    if not config.delay_precompile:
+        py_compile.compile(source_filename, compiled_filename, compiled_filename, True)
+        os.chmod(compiled_filename, 0o755)
+    else:
+        os.symlink(hostname + ".py", compiled_filename)
+
+    console.verbose(" ==> %s.\n", compiled_filename, stream=sys.stderr)
+    return shared_module_name
+
+
+def _is_compiled(compiled_filename):
+    # type: (str) -> bool
+    """Whether or not the host check has been compiled for the Python of this version
+
+    The link of a delayed compilation is replaced by the compiled file during the
+    first execution."""
+    if os.path.islink(compiled_filename):
+        return True
+    try:
+        with open(compiled_filename, "rb") as f:
+            return f.read(len(importlib.util.MAGIC_NUMBER)) == importlib.util.MAGIC_NUMBER
+    except IOError:
+        return False
+
+
+def _get_needed_ip_addresses(config_cache, host_config):
+    # type: (ConfigCache, config.HostConfig) -> Tuple[Dict[HostName, Optional[HostAddress]], Dict[HostName, Optional[HostAddress]]]
+    hostname = host_config.hostname
+    needed_ipaddresses, needed_ipv6addresses, = {}, {}
+    if host_config.is_cluster:
+        if host_config.nodes is None:
+            raise TypeError()
+
+        for node in host_config.nodes:
+            node_config = config_cache.get_host_config(node)
+            if node_config.is_ipv4_host:
+                needed_ipaddresses[node] = ip_lookup.lookup_ipv4_address(node)
+
+            if node_config.is_ipv6_host:
+                needed_ipv6addresses[node] = ip_lookup.lookup_ipv6_address(node)
+
+        try:
+            if host_config.is_ipv4_host:
+                needed_ipaddresses[hostname] = ip_lookup.lookup_ipv4_address(hostname)
+        except Exception:
+            pass
+
+        try:
+            if host_config.is_ipv6_host:
+                needed_ipv6addresses[hostname] = ip_lookup.lookup_ipv6_address(hostname)
+        except Exception:
+            pass
+    else:
+        if host_config.is_ipv4_host:
+            needed_ipaddresses[hostname] = ip_lookup.lookup_ipv4_address(hostname)
+
+        if host_config.is_ipv6_host:
+            needed_ipv6addresses[hostname] = ip_lookup.lookup_ipv6_address(hostname)
+
+    return needed_ipaddresses, needed_ipv6addresses
+
+
+def _hostcheck_header(source_filename, compiled_filename):
+    # type: (str, str) -> str
+    """The start of the executed host check file, which is the same in both precompile modes"""
+    header = "#!/usr/bin/env python3\n"
+    header += "# encoding: utf-8\n\n"
+
+    header += "import sys\n\n"
+
+    header += "if not sys.executable.startswith('/omd'):\n"
+    header += "    sys.stdout.write(\"ERROR: Only executable with sites python\\n\")\n"
+    header += "    sys.exit(2)\n\n"
 
     # Remove precompiled directory from sys.path. Leaving it in the path
     # makes problems when host names (name of precompiled files) are equal
     # to python module names like "random"
-    output.write("sys.path.pop(0)\n")
-
-    output.write("import cmk.utils.log\n")
-    output.write("import cmk.utils.debug\n")
-    output.write("from cmk.utils.exceptions import MKTerminate\n")
-    output.write("\n")
-    output.write("import cmk.base.utils\n")
-    output.write("import cmk.base.config as config\n")
-    output.write("from cmk.utils.log import console\n")
-    output.write("import cmk.base.checking as checking\n")
-    output.write("import cmk.base.check_api as check_api\n")
-    output.write("import cmk.base.ip_lookup as ip_lookup\n")
+    header += "sys.path.pop(0)\n"
 
     # Self-compile: replace symlink with precompiled python-code, if
     # we are run for the first time
     if config.delay_precompile:
-        output.write("""
+        header += """
 import os
 if os.path.islink(%(dst)r):
     import py_compile
     os.remove(%(dst)r)
     py_compile.compile(%(src)r, %(dst)r, %(dst)r, True)
-    os.chmod(%(dst)r, 0755)
+    os.chmod(%(dst)r, 0o755)
 
 """ % {
             "src": source_filename,
             "dst": compiled_filename
-        })
+        }
+
+    return header
+
+
+def _hostcheck_code(check_file_names):
+    # type: (List[str]) -> str
+    """The code loading the check plugins and checking the host
+
+    It needs the global variables hostname, ipaddresses and ipv6addresses to be set."""
+    code = "import logging\n"
+    code += "import sys\n\n"
+
+    code += "import cmk.utils.log\n"
+    code += "import cmk.utils.debug\n"
+    code += "from cmk.utils.exceptions import MKTerminate\n"
+    code += "\n"
+    code += "import cmk.base.utils\n"
+    code += "import cmk.base.config as config\n"
+    code += "from cmk.utils.log import console\n"
+    code += "import cmk.base.checking as checking\n"
+    code += "import cmk.base.check_api as check_api\n"
+    code += "import cmk.base.ip_lookup as ip_lookup\n"
 
     # Register default Check_MK signal handler
-    output.write("cmk.base.utils.register_sigint_handler()\n")
+    code += "cmk.base.utils.register_sigint_handler()\n"
 
     # initialize global variables
-    output.write("""
+    code += """
 # very simple commandline parsing: only -v (once or twice) and -d are supported
 
 cmk.utils.log.setup_console_logging()
@@ -1038,94 +1536,130 @@ cmk.utils.log.logger.setLevel(cmk.utils.log.verbosity_to_log_level(len([ a for a
 if '-d' in sys.argv:
     cmk.utils.debug.enable()
 
-""")
+"""
 
-    output.write("config.load_checks(check_api.get_check_api_context, %r)\n" %
-                 _get_needed_check_file_names(needed_check_plugin_names))
+    code += "config.load_checks(check_api.get_check_api_context, %r)\n" % check_file_names
+    code += "config.load_packed_config()\n"
 
-    for check_plugin_name in sorted(needed_check_plugin_names):
-        console.verbose(" %s%s%s", tty.green, check_plugin_name, tty.normal, stream=sys.stderr)
+    # IP addresses
+    code += "config.ipaddresses = ipaddresses\n\n"
+    code += "config.ipv6addresses = ipv6addresses\n\n"
 
-    output.write("config.load_packed_config()\n")
+    # perform actual check with a general exception handler
+    code += "try:\n"
+    code += "    sys.exit(checking.do_check(hostname, None))\n"
+    code += "except MKTerminate:\n"
+    code += "    out.output('<Interrupted>\\n', stream=sys.stderr)\n"
+    code += "    sys.exit(1)\n"
+    code += "except SystemExit as e:\n"
+    code += "    sys.exit(e.code)\n"
+    code += "except Exception as e:\n"
+    code += "    import traceback, pprint\n"
 
-    # IP addresses
-    needed_ipaddresses, needed_ipv6addresses, = {}, {}
-    if host_config.is_cluster:
-        if host_config.nodes is None:
-            raise TypeError()
+    # status output message
+    code += "    sys.stdout.write(\"UNKNOWN - Exception in precompiled check: %s (details in long output)\\n\" % e)\n"
 
-        for node in host_config.nodes:
-            node_config = config_cache.get_host_config(node)
-            if node_config.is_ipv4_host:
-                needed_ipaddresses[node] = ip_lookup.lookup_ipv4_address(node)
+    # generate traceback for long output
+    code += "    sys.stdout.write(\"Traceback: %s\\n\" % traceback.format_exc())\n"
 
-            if node_config.is_ipv6_host:
-                needed_ipv6addresses[node] = ip_lookup.lookup_ipv6_address(node)
+    code += "\n"
+    code += "    sys.exit(3)\n"
+    return code
 
-        try:
-            if host_config.is_ipv4_host:
-                needed_ipaddresses[hostname] = ip_lookup.lookup_ipv4_address(hostname)
-        except Exception:
-            pass
 
-        try:
-            if host_config.is_ipv6_host:
-                needed_ipv6addresses[hostname] = ip_lookup.lookup_ipv6_address(hostname)
-        except Exception:
-            pass
-    else:
-        if host_config.is_ipv4_host:
-            needed_ipaddresses[hostname] = ip_lookup.lookup_ipv4_address(hostname)
+def _shared_hostcheck_modules_dir():
+    # type: () -> str
+    # Valid DNS names do not start with a dot, so this does not clash with the host checks
+    return cmk.utils.paths.precompiled_hostchecks_dir + "/.shared"
 
-        if host_config.is_ipv6_host:
-            needed_ipv6addresses[hostname] = ip_lookup.lookup_ipv6_address(hostname)
 
-    output.write("config.ipaddresses = %r\n\n" % needed_ipaddresses)
-    output.write("config.ipv6addresses = %r\n\n" % needed_ipv6addresses)
+def _shared_hostcheck_module(check_file_names):
+    # type: (List[str]) -> Tuple[str, str]
+    """Name and source code of the module shared by all hosts needing these check files"""
+    code = "# encoding: utf-8\n\n" + _hostcheck_code(check_file_names)
+    return "checks_%s" % hashlib.sha256(code.encode("utf-8")).hexdigest()[:16], code
 
-    # perform actual check with a general exception handler
-    output.write("try:\n")
-    output.write("    sys.exit(checking.do_check(%r, None))\n" % hostname)
-    output.write("except MKTerminate:\n")
-    output.write("    out.output('<Interrupted>\\n', stream=sys.stderr)\n")
-    output.write("    sys.exit(1)\n")
-    output.write("except SystemExit as e:\n")
-    output.write("    sys.exit(e.code)\n")
-    output.write("except Exception as e:\n")
-    output.write("    import traceback, pprint\n")
 
-    # status output message
-    output.write(
-        "    sys.stdout.write(\"UNKNOWN - Exception in precompiled check: %s (details in long output)\\n\" % e)\n"
-    )
+def _shared_hostcheck_stub(module_name, hostname, needed_ipaddresses, needed_ipv6addresses):
+    # type: (str, HostName, Dict[HostName, Optional[HostAddress]], Dict[HostName, Optional[HostAddress]]) -> str
+    module_path = "%s/%s.py" % (_shared_hostcheck_modules_dir(), module_name)
+    stub = "import importlib.util\n\n"
+    stub += "spec = importlib.util.spec_from_file_location(%r, %r)\n" % (module_name, module_path)
+    stub += "hostcheck = importlib.util.module_from_spec(spec)\n"
+    stub += "hostcheck.hostname = %r\n" % hostname
+    stub += "hostcheck.ipaddresses = %r\n" % needed_ipaddresses
+    stub += "hostcheck.ipv6addresses = %r\n" % needed_ipv6addresses
+    stub += "spec.loader.exec_module(hostcheck)\n"
+    return stub
 
-    # generate traceback for long output
-    output.write("    sys.stdout.write(\"Traceback: %s\\n\" % traceback.format_exc())\n")
 
-    output.write("\n")
-    output.write("    sys.exit(3)\n")
-    output.close()
+def _save_shared_hostcheck_module(module_name, code):
+    # type: (str, str) -> None
+    """Save and compile a shared module, once per precompilation and process
 
-    # compile python (either now or delayed), but only if the source
-    # code has not changed. The Python compilation is the most costly
-    # operation here.
-    if os.path.exists(source_filename):
-        if open(source_filename).read() == open(source_filename + ".new").read():
-            console.verbose(" (%s is unchanged)\n", source_filename, stream=sys.stderr)
-            os.remove(source_filename + ".new")
-            return
-        console.verbose(" (new content)", stream=sys.stderr)
+    The module is compiled to the __pycache__ directory, where the import machinery of
+    Python finds it. In case of a delayed compilation this is done by the first import."""
+    saved_modules = _config_cache.get_set("precompile_saved_shared_modules")
+    if module_name in saved_modules:
+        return
 
-    os.rename(source_filename + ".new", source_filename)
-    if not config.delay_precompile:
-        py_compile.compile(source_filename, compiled_filename, compiled_filename, True)
-        os.chmod(compiled_filename, 0o755)
-    else:
-        if os.path.exists(compiled_filename) or os.path.islink(compiled_filename):
-            os.remove(compiled_filename)
-        os.symlink(hostname + ".py", compiled_filename)
+    modules_dir = _shared_hostcheck_modules_dir()
+    if not os.path.exists(modules_dir):
+        os.makedirs(modules_dir, exist_ok=True)
+
+    module_path = "%s/%s.py" % (modules_dir, module_name)
+    if _read_file(module_path) != code.encode("utf-8"):
+        store.save_text_to_file(module_path, code)
+        if not config.delay_precompile:
+            _compile_shared_hostcheck_module(module_path)
+    elif not config.delay_precompile and not os.path.exists(
+            importlib.util.cache_from_source(module_path)):
+        _compile_shared_hostcheck_module(module_path)
+
+    saved_modules.add(module_name)
+
+
+def _compile_shared_hostcheck_module(module_path):
+    # type: (str) -> None
+    """Compile a shared module to a temporary file, which then replaces the compiled module
+
+    The processes precompiling the hosts may compile the same module at the same time. The
+    temporary file of py_compile can not be used for this, its name is the same in all the
+    forked processes."""
+    compiled_path = importlib.util.cache_from_source(module_path)
+    os.makedirs(os.path.dirname(compiled_path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(compiled_path),
+                                    prefix=".%s.new" % os.path.basename(compiled_path))
+    os.close(fd)
+    try:
+        py_compile.compile(module_path, cfile=tmp_path, doraise=True)
+        os.replace(tmp_path, compiled_path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _remove_obsolete_shared_hostcheck_modules(module_names):
+    # type: (Set[str]) -> None
+    modules_dir = _shared_hostcheck_modules_dir()
+    try:
+        file_names = os.listdir(modules_dir)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return
 
-    console.verbose(" ==> %s.\n", compiled_filename, stream=sys.stderr)
+    for file_name in file_names:
+        module_name, ext = os.path.splitext(file_name)
+        if ext != ".py" or module_name in module_names:
+            continue
+        module_path = "%s/%s" % (modules_dir, file_name)
+        for path in [module_path, importlib.util.cache_from_source(module_path)]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
 
 
 def _get_needed_check_plugin_names(host_config):
@@ -1166,11 +1700,20 @@ def _get_needed_check_plugin_names(host_config):
 
 def _get_needed_check_file_names(needed_check_plugin_names):
     # type: (Set[CheckPluginName]) -> List[str]
+    # Many hosts need the same check plugins. Cache the files found for them, because looking
+    # them up is the most costly part of precompiling these hosts.
+    cache = _config_cache.get_dict("precompile_check_file_names")
+    cache_key = frozenset(needed_check_plugin_names)
+    try:
+        return cache[cache_key]
+    except KeyError:
+        pass
+
     # check info table
     # We need to include all those plugins that are referenced in the host's
     # check table.
     filenames = []  # type: List[str]
-    for check_plugin_name in needed_check_plugin_names:
+    for check_plugin_name in sorted(needed_check_plugin_names):
         section_name = section_name_of(check_plugin_name)
         # Add library files needed by check (also look in local)
         for lib in set(config.check_includes.get(section_name, [])):
@@ -1193,4 +1736,5 @@ def _get_needed_check_file_names(needed_check_plugin_names):
             if path not in filenames:
                 filenames.append(path)
 
+    cache[cache_key] = filenames
     return filenames
@@ -14,7 +14,7 @@
 #                cache info and piggyback lines that is used to process the
 #                data within Check_MK.
 
-from typing import Iterable, TYPE_CHECKING, List, Dict, Optional, Set
+from typing import Iterable, Iterator, TYPE_CHECKING, List, Dict, Optional, Set
 
 import cmk.utils.paths
 import cmk.utils.debug
@@ -258,3 +258,39 @@ class DataSources(object):  # pylint: disable=useless-object-inheritance
                                                          host_sections.piggybacked_raw_data)
 
         return multi_host_sections
+
+
+def prefetching_agent_data(hostnames, max_cachefile_age):
+    # type: (Iterable[HostName], int) -> Iterator[HostName]
+    """Yield the host names while the data of their TCP agents is fetched ahead in batches
+
+    The agents of a batch of hosts are contacted concurrently before the first host of
+    the batch is yielded. The TCP data sources of these hosts then use the fetched data
+    instead of contacting their agent one after another.
+    """
+    hostnames = list(hostnames)
+    if config.agent_fetch_concurrency <= 1:
+        yield from hostnames
+        return
+
+    batch_size = config.agent_fetch_concurrency * 4
+    for start in range(0, len(hostnames), batch_size):
+        batch = hostnames[start:start + batch_size]
+        sources = []  # type: List[TCPDataSource]
+        for hostname in batch:
+            if config.get_config_cache().get_host_config(hostname).is_cluster:
+                continue
+            try:
+                ipaddress = ip_lookup.lookup_ip_address(hostname)
+                for source in DataSources(hostname, ipaddress).get_data_sources():
+                    if isinstance(source, TCPDataSource):
+                        source.set_max_cachefile_age(max_cachefile_age)
+                        sources.append(source)
+            except Exception:
+                if cmk.utils.debug.enabled():
+                    raise
+                # The host is skipped here and handled by the regular execution
+
+        TCPDataSource.prefetch(sources)
+        yield from batch
+    TCPDataSource.prefetch([])
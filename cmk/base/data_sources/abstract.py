@@ -12,7 +12,8 @@ import socket
 import sys
 import time
 from pathlib import Path
-from typing import AnyStr, Dict, Generic, List, Optional, Set, Tuple, TypeVar, Union, cast
+from typing import (AnyStr, Dict, Generic, Iterator, List, Optional, Set, Tuple, TypeVar, Union,
+                    cast)
 
 import six
 from six import ensure_binary
@@ -60,6 +61,173 @@ from cmk.base.exceptions import MKAgentError, MKEmptyAgentData, MKIPAddressLooku
 
 from .host_sections import AbstractHostSections
 
+# The characters removed by bytes.strip()
+_ASCII_WHITESPACE = " \t\n\r\x0b\x0c"
+
+# A byte range of the raw agent data together with the options of the section header which are
+# needed to tokenize the lines: raw data, start, end, separator, encoding, nostrip
+_AgentSectionChunk = Tuple[bytes, int, int, Optional[str], Optional[str], bool]
+
+
+def _iter_section_header_lines(raw_data):
+    # type: (bytes) -> Iterator[Tuple[int, int, bytes]]
+    """Yields start, end and the stripped content of all section header lines
+
+    Section headers look like <<<name:opt1(args):opt2>>> or <<<<piggybacked_host>>>>. Only the
+    lines containing "<<<" need to be looked at, which is much faster than splitting the whole
+    agent output into lines."""
+    position = raw_data.find(b"<<<")
+    while position != -1:
+        line_start = raw_data.rfind(b"\n", 0, position) + 1
+        line_end = raw_data.find(b"\n", position)
+        if line_end == -1:
+            line_end = len(raw_data)
+
+        stripped_line = raw_data[line_start:line_end].strip()
+        if stripped_line[:3] == b'<<<' and stripped_line[-3:] == b'>>>':
+            yield line_start, line_end, stripped_line
+
+        position = raw_data.find(b"<<<", line_end)
+
+
+class _UnparsedAgentSection(object):  # pylint: disable=useless-object-inheritance
+    """The not yet decoded and tokenized content of an agent section
+
+    A section may occur multiple times in the agent output, each time with its own section
+    options. Every occurrence is recorded as a separate chunk. Instances are never modified
+    after creation, so they can be shared between multiple LazyAgentSections."""
+    __slots__ = ["chunks"]
+
+    def __init__(self, chunks):
+        # type: (List[_AgentSectionChunk]) -> None
+        super(_UnparsedAgentSection, self).__init__()
+        self.chunks = chunks
+
+    def parse(self):
+        # type: () -> AgentSectionContent
+        section_content = []  # type: AgentSectionContent
+        for raw_data, start, end, separator, encoding, nostrip in self.chunks:
+            if start == end:
+                continue
+
+            raw_chunk = raw_data[start:end]
+            if not encoding:
+                # Decoding the whole chunk at once is equal to decoding it line by line, because
+                # the line separator is never part of an UTF-8 multi byte sequence.
+                try:
+                    lines = raw_chunk.decode("utf-8").split("\n")
+                except UnicodeDecodeError:
+                    pass
+                else:
+                    for line in lines:
+                        stripped_line = line.strip(_ASCII_WHITESPACE)
+                        if stripped_line:
+                            section_content.append(
+                                (line.rstrip("\r") if nostrip else stripped_line).split(separator))
+                    continue
+
+            for raw_line in raw_chunk.split(b"\n"):
+                stripped_raw_line = raw_line.strip()
+                if not stripped_raw_line:
+                    continue
+                decoded_line = convert_to_unicode(
+                    raw_line.rstrip(b"\r") if nostrip else stripped_raw_line,
+                    std_encoding=encoding or "utf-8")
+                section_content.append(decoded_line.split(separator))
+
+        return section_content
+
+
+class LazyAgentSections(dict):
+    """The sections of the agent output, which are decoded and tokenized on first access
+
+    The agent parser only records where the sections are located in the raw agent data.
+    Sections that are never accessed, e.g. because no plugin needs them, are never
+    decoded and split. From the outside, this behaves like a regular dictionary of
+    section names to the section content.
+    """
+    def __getitem__(self, section_name):
+        # type: (SectionName) -> AgentSectionContent
+        section_content = dict.__getitem__(self, section_name)
+        if isinstance(section_content, _UnparsedAgentSection):
+            section_content = section_content.parse()
+            dict.__setitem__(self, section_name, section_content)
+        return section_content
+
+    def get(self, section_name, default=None):
+        # type: (SectionName, Optional[AgentSectionContent]) -> Optional[AgentSectionContent]
+        if section_name not in self:
+            return default
+        return self[section_name]
+
+    def setdefault(self, section_name, default=None):
+        # type: (SectionName, Optional[AgentSectionContent]) -> AgentSectionContent
+        if section_name not in self:
+            dict.__setitem__(self, section_name, default)
+        return self[section_name]
+
+    def pop(self, section_name, *args):
+        # type: (SectionName, *AgentSectionContent) -> AgentSectionContent
+        if section_name not in self:
+            return dict.pop(self, section_name, *args)
+        section_content = self[section_name]
+        dict.__delitem__(self, section_name)
+        return section_content
+
+    def items(self):  # type: ignore[override]
+        # type: () -> List[Tuple[SectionName, AgentSectionContent]]
+        return [(section_name, self[section_name]) for section_name in self]
+
+    def values(self):  # type: ignore[override]
+        # type: () -> List[AgentSectionContent]
+        return [self[section_name] for section_name in self]
+
+    def copy(self):
+        # type: () -> LazyAgentSections
+        return LazyAgentSections(self.unparsed_items())
+
+    def __eq__(self, other):
+        # type: (object) -> bool
+        if not isinstance(other, dict):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        # type: (object) -> bool
+        return not self == other
+
+    def __repr__(self):
+        # type: () -> str
+        return repr(dict(self.items()))
+
+    def unparsed_items(self):
+        # type: () -> Iterator[Tuple[SectionName, Union[AgentSectionContent, _UnparsedAgentSection]]]
+        """Iterate the sections without parsing them"""
+        return iter(dict.items(self))
+
+    def add_chunk(self, section_name, chunk):
+        # type: (SectionName, _AgentSectionChunk) -> None
+        self.extend_section(section_name, _UnparsedAgentSection([chunk]))
+
+    def extend_section(self, section_name, section_content):
+        # type: (SectionName, Union[AgentSectionContent, _UnparsedAgentSection]) -> None
+        existing_content = dict.get(self, section_name)
+        if existing_content is None:
+            if not isinstance(section_content, _UnparsedAgentSection):
+                section_content = list(section_content)
+            dict.__setitem__(self, section_name, section_content)
+
+        elif isinstance(existing_content, _UnparsedAgentSection) \
+                and isinstance(section_content, _UnparsedAgentSection):
+            dict.__setitem__(
+                self, section_name,
+                _UnparsedAgentSection(existing_content.chunks + section_content.chunks))
+
+        else:
+            if isinstance(section_content, _UnparsedAgentSection):
+                section_content = section_content.parse()
+            self[section_name].extend(section_content)
+
 
 class AgentHostSections(AbstractHostSections[RawAgentData, AgentSections, PersistedAgentSections,
                                              AgentSectionContent]):
@@ -69,16 +237,28 @@ class AgentHostSections(AbstractHostSections[RawAgentData, AgentSections, Persis
                  piggybacked_raw_data=None,
                  persisted_sections=None):
         # type: (Optional[AgentSections], Optional[SectionCacheInfo], Optional[PiggybackRawData], Optional[PersistedAgentSections]) -> None
+        if not isinstance(sections, LazyAgentSections):
+            sections = LazyAgentSections(sections or {})
         super(AgentHostSections, self).__init__(
-            sections=sections if sections is not None else {},
+            sections=sections,
             cache_info=cache_info if cache_info is not None else {},
             piggybacked_raw_data=piggybacked_raw_data if piggybacked_raw_data is not None else {},
             persisted_sections=persisted_sections if persisted_sections is not None else {},
         )
 
+    def _extend_sections(self, sections):
+        # type: (AgentSections) -> None
+        if not isinstance(sections, LazyAgentSections):
+            super(AgentHostSections, self)._extend_sections(sections)
+            return
+
+        # Take over the not yet parsed sections without parsing them
+        for section_name, section_content in sections.unparsed_items():
+            self._extend_section(section_name, section_content)
+
     def _extend_section(self, section_name, section_content):
-        # type: (SectionName, AgentSectionContent) -> None
-        self.sections.setdefault(section_name, []).extend(section_content)
+        # type: (SectionName, Union[AgentSectionContent, _UnparsedAgentSection]) -> None
+        cast(LazyAgentSections, self.sections).extend_section(section_name, section_content)
 
 
 class SectionStore:
@@ -175,26 +355,34 @@ class FileCache:
             source._logger,
         )
 
-    def read(self):
-        # type: () -> Optional[BoundedAbstractRawData]
+    def may_read(self):
+        # type: () -> bool
+        """Whether or not read() may use the cache file, without reading it"""
         assert self._max_cachefile_age is not None
         if not self.path.exists():
             self._logger.debug("Not using cache (Does not exist)")
-            return None
+            return False
 
         if self._is_agent_cache_disabled:
             self._logger.debug("Not using cache (Cache usage disabled)")
-            return None
+            return False
 
         if not self._may_use_cache_file and not config.simulation_mode:
             self._logger.debug("Not using cache (Don't try it)")
-            return None
+            return False
 
         may_use_outdated = config.simulation_mode or self._use_outdated_cache_file
         cachefile_age = cmk.utils.cachefile_age(self.path)
         if not may_use_outdated and cachefile_age > self._max_cachefile_age:
             self._logger.debug("Not using cache (Too old. Age is %d sec, allowed is %s sec)",
                                cachefile_age, self._max_cachefile_age)
+            return False
+
+        return True
+
+    def read(self):
+        # type: () -> Optional[BoundedAbstractRawData]
+        if not self.may_read():
             return None
 
         # TODO: Use some generic store file read function to generalize error handling,
@@ -716,11 +904,16 @@ class CheckMKAgentDataSource(DataSource[RawAgentData, AgentSections, PersistedAg
         # type: (RawAgentData) -> AgentHostSections
         """Split agent output in chunks, splits lines by whitespaces.
 
+        Only the section headers are processed here. The section contents are recorded as
+        byte ranges of the raw data and are decoded and split on first access (see
+        LazyAgentSections). Piggybacked data is passed through as byte chunks.
+
         Returns a HostSections() object.
         """
-        sections = {}  # type: AgentSections
+        sections = LazyAgentSections()
         # Unparsed info for other hosts. A dictionary, indexed by the piggybacked host name.
-        # The value is a list of lines which were received for this host.
+        # The value is a list of byte chunks (lines or blocks of lines) which were received for
+        # this host.
         piggybacked_raw_data = {}  # type: PiggybackRawData
         piggybacked_hostname = None
         piggybacked_cached_at = int(time.time())
@@ -728,31 +921,44 @@ class CheckMKAgentDataSource(DataSource[RawAgentData, AgentSections, PersistedAg
         piggybacked_cache_age = int(1.5 * 60 * self._host_config.check_mk_check_interval)
 
         # handle sections with option persist(...)
-        persisted_sections = {}  # type: PersistedAgentSections
-        section_content = []  # type: AgentSectionContent
-        section_options = {}  # type: Dict[str, Optional[str]]
+        persisted_section_times = {}  # type: Dict[SectionName, Tuple[int, int]]
+        section_name = None  # type: Optional[SectionName]
         agent_cache_info = {}  # type: SectionCacheInfo
         separator = None  # type: Optional[str]
-        encoding = None
-        for line in raw_data.split(b"\n"):
-            line = line.rstrip(b"\r")
-            stripped_line = line.strip()
+        encoding = None  # type: Optional[str]
+        nostrip = False
+
+        # Lines in front of the first section header are ignored
+        body_start = None  # type: Optional[int]
+        for line_start, line_end, stripped_line in _iter_section_header_lines(raw_data):
+            # Process the lines between the previous and this header line
+            if body_start is not None and body_start < line_start:
+                body_end = line_start - 1
+                if piggybacked_hostname:
+                    self._add_piggybacked_chunk(piggybacked_raw_data, piggybacked_hostname,
+                                                raw_data[body_start:body_end])
+                elif section_name is not None:
+                    sections.add_chunk(
+                        section_name,
+                        (raw_data, body_start, body_end, separator, encoding, nostrip))
+            body_start = line_end + 1
+
             if stripped_line[:4] == b'<<<<' and stripped_line[-4:] == b'>>>>':
                 piggybacked_hostname =\
                     self._get_sanitized_and_translated_piggybacked_hostname(stripped_line)
 
             elif piggybacked_hostname:  # processing data for an other host
-                if stripped_line[:3] == b'<<<' and stripped_line[-3:] == b'>>>':
-                    line = self._add_cached_info_to_piggybacked_section_header(
-                        stripped_line, piggybacked_cached_at, piggybacked_cache_age)
-                piggybacked_raw_data.setdefault(piggybacked_hostname, []).append(line)
+                piggybacked_raw_data.setdefault(piggybacked_hostname, []).append(
+                    self._add_cached_info_to_piggybacked_section_header(
+                        stripped_line, piggybacked_cached_at, piggybacked_cache_age))
 
             # Found normal section header
             # section header has format <<<name:opt1(args):opt2:opt3(args)>>>
-            elif stripped_line[:3] == b'<<<' and stripped_line[-3:] == b'>>>':
+            else:
                 section_name, section_options = self._parse_section_header(stripped_line[3:-3])
 
-                section_content = sections.setdefault(section_name, [])
+                # Sections without lines exist with an empty content
+                sections.extend_section(section_name, _UnparsedAgentSection([]))
 
                 raw_separator = section_options.get("sep")
                 if raw_separator is None:
@@ -767,7 +973,7 @@ class CheckMKAgentDataSource(DataSource[RawAgentData, AgentSections, PersistedAg
                     cached_at = int(time.time())  # Estimate age of the data
                     cache_interval = int(until - cached_at)
                     agent_cache_info[section_name] = (cached_at, cache_interval)
-                    persisted_sections[section_name] = (cached_at, until, section_content)
+                    persisted_section_times[section_name] = (cached_at, until)
 
                 raw_cached = section_options.get("cached")
                 if raw_cached is not None:
@@ -777,21 +983,36 @@ class CheckMKAgentDataSource(DataSource[RawAgentData, AgentSections, PersistedAg
                 # The section data might have a different encoding
                 encoding = section_options.get("encoding")
 
-            elif stripped_line != b'':
-                raw_nostrip = section_options.get("nostrip")
-                if raw_nostrip is None:
-                    line = stripped_line
-
-                if encoding:
-                    decoded_line = convert_to_unicode(line, std_encoding=six.ensure_str(encoding))
-                else:
-                    decoded_line = convert_to_unicode(line)
-
-                section_content.append(decoded_line.split(separator))
+                # Only a nostrip option with a value keeps the whitespace. A plain :nostrip,
+                # e.g. of the dmidecode section, has never had an effect.
+                nostrip = section_options.get("nostrip") is not None
+
+        # Process the lines behind the last header line
+        if body_start is not None and body_start <= len(raw_data):
+            if piggybacked_hostname:
+                self._add_piggybacked_chunk(piggybacked_raw_data, piggybacked_hostname,
+                                            raw_data[body_start:])
+            elif section_name is not None:
+                sections.add_chunk(
+                    section_name,
+                    (raw_data, body_start, len(raw_data), separator, encoding, nostrip))
+
+        # Persisted sections are always needed for storing them
+        persisted_sections = {
+            section_name: (cached_at, until, sections[section_name])
+            for section_name, (cached_at, until) in persisted_section_times.items()
+        }  # type: PersistedAgentSections
 
         return AgentHostSections(sections, agent_cache_info, piggybacked_raw_data,
                                  persisted_sections)
 
+    @staticmethod
+    def _add_piggybacked_chunk(piggybacked_raw_data, piggybacked_hostname, chunk):
+        # type: (PiggybackRawData, HostName, bytes) -> None
+        if b"\r" in chunk:
+            chunk = b"\n".join(line.rstrip(b"\r") for line in chunk.split(b"\n"))
+        piggybacked_raw_data.setdefault(piggybacked_hostname, []).append(chunk)
+
     @staticmethod
     def _parse_section_header(headerline):
         # type: (bytes) -> Tuple[str, Dict[str, Optional[str]]]
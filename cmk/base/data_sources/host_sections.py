@@ -75,8 +75,7 @@ class AbstractHostSections(Generic[BoundedAbstractRawData, BoundedAbstractSectio
     def update(self, host_sections):
         # type: (AbstractHostSections) -> None
         """Update this host info object with the contents of another one"""
-        for section_name, section_content in host_sections.sections.items():
-            self._extend_section(section_name, section_content)
+        self._extend_sections(host_sections.sections)
 
         for hostname, raw_lines in host_sections.piggybacked_raw_data.items():
             self.piggybacked_raw_data.setdefault(hostname, []).extend(raw_lines)
@@ -87,6 +86,11 @@ class AbstractHostSections(Generic[BoundedAbstractRawData, BoundedAbstractSectio
         if host_sections.persisted_sections:
             self.persisted_sections.update(host_sections.persisted_sections)
 
+    def _extend_sections(self, sections):
+        # type: (BoundedAbstractSections) -> None
+        for section_name, section_content in sections.items():
+            self._extend_section(section_name, section_content)
+
     @abc.abstractmethod
     def _extend_section(self, section_name, section_content):
         # type: (SectionName, BoundedAbstractSectionContent) -> None
@@ -5,14 +5,18 @@
 # conditions defined in the file COPYING, which is part of this source code package.
 
 import socket
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
+import cmk.base.config as config
 from cmk.base.check_utils import RawAgentData
 from cmk.base.exceptions import MKAgentError, MKEmptyAgentData
-from cmk.fetchers import TCPDataFetcher  # pylint: disable=cmk-module-layer-violation
+from cmk.fetchers import TCPDataFetcher, fetch_concurrently  # pylint: disable=cmk-module-layer-violation
+from cmk.utils.log import console
 from cmk.utils.type_defs import HostName, HostAddress
 
-from .abstract import CheckMKAgentDataSource, verify_ipaddress
+from .abstract import CheckMKAgentDataSource, FileCache, verify_ipaddress
+
+_FetcherArgs = Tuple[socket.AddressFamily, Tuple[HostAddress, int], float, Dict[str, str]]
 
 #.
 #   .--Agent---------------------------------------------------------------.
@@ -29,6 +33,8 @@ from .abstract import CheckMKAgentDataSource, verify_ipaddress
 
 class TCPDataSource(CheckMKAgentDataSource):
     _use_only_cache = False
+    # The agent data fetched by prefetch() together with the arguments of the fetcher
+    _prefetched = {}  # type: Dict[HostName, Tuple[_FetcherArgs, RawAgentData]]
 
     def __init__(self, hostname, ipaddress):
         # type: (HostName, Optional[HostAddress]) -> None
@@ -64,6 +70,16 @@ class TCPDataSource(CheckMKAgentDataSource):
         # type: (Optional[float]) -> None
         self._timeout = value
 
+    def _fetcher_args(self):
+        # type: () -> _FetcherArgs
+        assert self._ipaddress
+        return (
+            socket.AF_INET6 if self._host_config.is_ipv6_primary else socket.AF_INET,
+            (self._ipaddress, self.port),
+            self.timeout,
+            self._host_config.agent_encryption,
+        )
+
     def _execute(self):
         # type: () -> RawAgentData
         if self._use_only_cache:
@@ -73,21 +89,65 @@ class TCPDataSource(CheckMKAgentDataSource):
         verify_ipaddress(self._ipaddress)
         assert self._ipaddress
 
-        with TCPDataFetcher(
-                socket.AF_INET6 if self._host_config.is_ipv6_primary else socket.AF_INET,
-            (self._ipaddress, self.port),
-                self.timeout,
-                self._host_config.agent_encryption,
-        ) as fetcher:
-            output = fetcher.data()
-            if not output:  # may be caused by xinetd not allowing our address
-                raise MKEmptyAgentData("Empty output from agent at %s:%d" %
-                                       (self._ipaddress, self.port))
-            if len(output) < 16:
-                raise MKAgentError("Too short output from agent: %r" % output)
-            return output
+        fetcher_args = self._fetcher_args()
+        prefetched = TCPDataSource._prefetched.pop(self._hostname, None)
+        if prefetched is not None and prefetched[0] == fetcher_args:
+            self._logger.debug("Using prefetched agent data")
+            return self._verify_output(prefetched[1])
+
+        with TCPDataFetcher(*fetcher_args) as fetcher:
+            return self._verify_output(fetcher.data())
         raise MKAgentError("Failed to read data")
 
+    def _verify_output(self, output):
+        # type: (RawAgentData) -> RawAgentData
+        if not output:  # may be caused by xinetd not allowing our address
+            raise MKEmptyAgentData("Empty output from agent at %s:%d" %
+                                   (self._ipaddress, self.port))
+        if len(output) < 16:
+            raise MKAgentError("Too short output from agent: %r" % output)
+        return output
+
+    @classmethod
+    def prefetch(cls, sources):
+        # type: (Iterable[TCPDataSource]) -> None
+        """Fetch the agent data of the sources concurrently for their next execution
+
+        Sources which will use their cache file are skipped. The data of a former
+        prefetch which has not been used is dropped. Only the data which has been
+        fetched successfully is kept. The agents which failed or did not answer in
+        time (e.g. slow agents exceeding agent_fetch_timeout) are contacted again
+        as usual on execution.
+        """
+        cls._prefetched = {}
+        if cls._use_only_cache or config.simulation_mode:
+            return
+
+        fetcher_args = {}  # type: Dict[HostName, _FetcherArgs]
+        for source in sources:
+            if source._ipaddress is None or FileCache.from_source(source).may_read():
+                continue
+            fetcher_args[source._hostname] = source._fetcher_args()
+
+        if len(fetcher_args) < 2:
+            return
+
+        console.verbose("Fetching data of %d agents (%d at once)\n" %
+                        (len(fetcher_args), config.agent_fetch_concurrency))
+        results = fetch_concurrently(
+            {hostname: TCPDataFetcher(*args) for hostname, args in fetcher_args.items()},
+            config.agent_fetch_concurrency,
+            config.agent_fetch_timeout,
+        )
+        cls._prefetched = {
+            hostname: (fetcher_args[hostname], result)
+            for hostname, result in results.items()
+            if not isinstance(result, Exception)
+        }
+        if len(cls._prefetched) < len(results):
+            console.verbose("Failed to fetch data of %d agents, fetching it again later\n" %
+                            (len(results) - len(cls._prefetched)))
+
     def describe(self):
         # type: () -> str
         """Return a short textual description of the agent"""
@@ -30,8 +30,15 @@ agent_exclude_sections = []  # type: _List
 snmp_ports = []  # type: _List
 tcp_connect_timeout = 5.0
 tcp_connect_timeouts = []  # type: _List
+agent_fetch_concurrency = 20  # agents contacted at once by discovery and inventory of many hosts
+agent_fetch_timeout = 60.0  # secs. for fetching the data of one agent during these runs
+nagios_config_processes = 4  # processes creating the changed host objects of the Nagios config
 use_dns_cache = True  # prevent DNS by using own cache file
+dns_lookup_concurrency = 32  # host names resolved at once when updating the DNS cache
+dns_lookup_timeout = 5.0  # secs. for resolving a single host name during this update
 delay_precompile = False  # delay Python compilation to Nagios execution
+precompile_mode = "shared"  # also possible: "host" (one complete Python file per host)
+precompile_processes = 4  # processes precompiling the host checks
 restart_locking = "abort"  # also possible: "wait", None
 check_submission = "file"  # alternative: "pipe"
 agent_min_version = 0  # warn, if plugin has not at least version
@@ -40,6 +47,7 @@ default_host_group = 'check_mk'
 check_max_cachefile_age = 0  # per default do not use cache files when checking
 cluster_max_cachefile_age = 90  # secs.
 piggyback_max_cachefile_age = 3600  # secs
+piggyback_store = "directory"  # also possible: "indexed"
 # Ruleset for translating piggyback host names
 piggyback_translation = []  # type: _List
 # Ruleset for translating service descriptions
@@ -66,6 +74,8 @@ http_proxies = {}  # type: _Dict
 use_inline_snmp = True
 # Ruleset to disable Inline-SNMP per host when use_inline_snmp is enabled.
 non_inline_snmp_hosts = []  # type: _List
+# Ruleset to use the builtin SNMP backend (SNMP v1/v2c only) for hosts
+builtin_snmp_hosts = []  # type: _List
 
 # Ruleset to recduce fetched OIDs of a check, only inline SNMP
 snmp_limit_oid_range = []  # type: _List
@@ -4,9 +4,14 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
+import contextlib
+import functools
+import io
+import multiprocessing
 import os
 import signal
 import socket
+import sys
 import time
 from types import FrameType
 from typing import (
@@ -104,45 +109,96 @@ DiscoveryFunction = Callable[[FinalSectionContent], DiscoveryResult]
 # being called from the main option parsing code. The list of
 # hostnames is already prepared by the main code. If it is
 # empty then we use all hosts and switch to using cache files.
-def do_discovery(arg_hostnames, arg_check_plugin_names, arg_only_new):
-    # type: (Set[HostName], Optional[Set[CheckPluginName]], bool) -> None
+def do_discovery(arg_hostnames, arg_check_plugin_names, arg_only_new, max_processes=1):
+    # type: (Set[HostName], Optional[Set[CheckPluginName]], bool, int) -> None
     config_cache = config.get_config_cache()
     use_caches = not arg_hostnames or data_sources.abstract.DataSource.get_may_use_cache_file()
     on_error = "raise" if cmk.utils.debug.enabled() else "warn"
 
     host_names = _preprocess_hostnames(arg_hostnames, config_cache)
 
+    if max_processes > 1 and len(host_names) > 1:
+        _do_parallel_discovery(sorted(host_names), arg_check_plugin_names, arg_only_new, use_caches,
+                               on_error, max_processes)
+        return
+
     # Now loop through all hosts
-    for hostname in sorted(host_names):
-        section.section_begin(hostname)
+    max_cachefile_age = config.inventory_max_cachefile_age if use_caches else 0
+    for hostname in data_sources.prefetching_agent_data(sorted(host_names), max_cachefile_age):
+        _do_discovery_of_host(hostname, arg_check_plugin_names, arg_only_new, use_caches, on_error)
 
-        try:
 
-            ipaddress = ip_lookup.lookup_ip_address(hostname)
+def _do_discovery_of_host(hostname, check_plugin_names, only_new, use_caches, on_error):
+    # type: (HostName, Optional[Set[CheckPluginName]], bool, bool, str) -> Optional[str]
+    """Discover the services of a single host and return the error message in case it failed"""
+    section.section_begin(hostname)
 
-            # Usually we disable SNMP scan if cmk -I is used without a list of
-            # explicit hosts. But for host that have never been service-discovered
-            # yet (do not have autochecks), we enable SNMP scan.
-            do_snmp_scan = not use_caches or not autochecks.has_autochecks(hostname)
+    try:
 
-            sources = _get_sources_for_discovery(hostname, ipaddress, do_snmp_scan, on_error)
+        ipaddress = ip_lookup.lookup_ip_address(hostname)
 
-            # When check types are specified via command line,
-            # enforce them and disable auto detection
-            if arg_check_plugin_names:
-                sources.enforce_check_plugin_names(arg_check_plugin_names)
+        # Usually we disable SNMP scan if cmk -I is used without a list of
+        # explicit hosts. But for host that have never been service-discovered
+        # yet (do not have autochecks), we enable SNMP scan.
+        do_snmp_scan = not use_caches or not autochecks.has_autochecks(hostname)
 
-            multi_host_sections = _get_host_sections_for_discovery(sources, use_caches=use_caches)
+        sources = _get_sources_for_discovery(hostname, ipaddress, do_snmp_scan, on_error)
 
-            _do_discovery_for(hostname, ipaddress, multi_host_sections, arg_check_plugin_names,
-                              arg_only_new, on_error)
+        # When check types are specified via command line,
+        # enforce them and disable auto detection
+        if check_plugin_names:
+            sources.enforce_check_plugin_names(check_plugin_names)
 
-        except Exception as e:
-            if cmk.utils.debug.enabled():
-                raise
-            section.section_error("%s" % e)
-        finally:
-            cmk.base.cleanup.cleanup_globals()
+        multi_host_sections = _get_host_sections_for_discovery(sources, use_caches=use_caches)
+
+        _do_discovery_for(hostname, ipaddress, multi_host_sections, check_plugin_names, only_new,
+                          on_error)
+
+    except Exception as e:
+        if cmk.utils.debug.enabled():
+            raise
+        section.section_error("%s" % e)
+        return "%s" % e
+    finally:
+        cmk.base.cleanup.cleanup_globals()
+    return None
+
+
+def _do_parallel_discovery(host_names, check_plugin_names, only_new, use_caches, on_error,
+                           max_processes):
+    # type: (List[HostName], Optional[Set[CheckPluginName]], bool, bool, str, int) -> None
+    """Distribute the hosts over a pool of forked worker processes
+
+    The workers inherit the loaded configuration from this process. Each host is
+    discovered by exactly one worker, which is the only one writing the autochecks and
+    host labels of that host. The output of the workers is collected per host and
+    written here in the order of the host names."""
+    console.verbose("Discovering services with %d processes\n" %
+                    min(max_processes, len(host_names)))
+    failed_hosts = {}  # type: Dict[HostName, str]
+    discover_host = functools.partial(_do_discovery_of_host_in_worker,
+                                      check_plugin_names=check_plugin_names,
+                                      only_new=only_new,
+                                      use_caches=use_caches,
+                                      on_error=on_error)
+    with multiprocessing.Pool(min(max_processes, len(host_names))) as pool:
+        for hostname, output, error in pool.imap(discover_host, host_names):
+            sys.stdout.write(output)
+            sys.stdout.flush()
+            if error is not None:
+                failed_hosts[hostname] = error
+
+    if failed_hosts:
+        console.verbose("Discovery failed on %d of %d hosts: %s\n" %
+                        (len(failed_hosts), len(host_names), ", ".join(sorted(failed_hosts))))
+
+
+def _do_discovery_of_host_in_worker(hostname, check_plugin_names, only_new, use_caches, on_error):
+    # type: (HostName, Optional[Set[CheckPluginName]], bool, bool, str) -> Tuple[HostName, str, Optional[str]]
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        error = _do_discovery_of_host(hostname, check_plugin_names, only_new, use_caches, on_error)
+    return hostname, output.getvalue(), error
 
 
 def _preprocess_hostnames(arg_host_names, config_cache):
@@ -18,7 +18,7 @@ import cmk.utils.store as store
 import cmk.utils.tty as tty
 from cmk.utils.exceptions import MKGeneralException
 from cmk.utils.log import console
-from cmk.utils.structured_data import StructuredDataTree
+from cmk.utils.structured_data import StructuredDataTree, binary_tree_file_path
 from cmk.utils.type_defs import (
     CheckPluginName,
     HostAddress,
@@ -60,7 +60,7 @@ def do_inv(hostnames):
     store.makedirs(cmk.utils.paths.inventory_output_dir)
     store.makedirs(cmk.utils.paths.inventory_archive_dir)
 
-    for hostname in hostnames:
+    for hostname in data_sources.prefetching_agent_data(hostnames, config.check_max_cachefile_age):
         section.section_begin(hostname)
         try:
             config_cache = config.get_config_cache()
@@ -237,6 +237,8 @@ def _cleanup_status_data(hostname):
         os.remove(filepath)
     if os.path.exists(filepath + ".gz"):
         os.remove(filepath + ".gz")
+    if os.path.exists(binary_tree_file_path(filepath)):
+        os.remove(binary_tree_file_path(filepath))
 
 
 def _do_inv_for(sources, multi_host_sections, host_config, ipaddress):
@@ -390,6 +392,8 @@ def _save_inventory_tree(hostname, inventory_tree):
             os.remove(filepath)
         if os.path.exists(filepath + ".gz"):
             os.remove(filepath + ".gz")
+        if os.path.exists(binary_tree_file_path(filepath)):
+            os.remove(binary_tree_file_path(filepath))
         return None
 
     old_tree = StructuredDataTree().load_from(filepath)
@@ -405,7 +409,10 @@ def _save_inventory_tree(hostname, inventory_tree):
         old_time = os.stat(filepath).st_mtime
         arcdir = "%s/%s" % (cmk.utils.paths.inventory_archive_dir, hostname)
         store.makedirs(arcdir)
-        os.rename(filepath, arcdir + ("/%d" % old_time))
+        archive_path = arcdir + ("/%d" % old_time)
+        os.rename(filepath, archive_path)
+        if os.path.exists(binary_tree_file_path(filepath)):
+            os.rename(binary_tree_file_path(filepath), binary_tree_file_path(archive_path))
     inventory_tree.save_to(cmk.utils.paths.inventory_output_dir, hostname)
     return old_tree
 
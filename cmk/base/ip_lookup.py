@@ -4,10 +4,17 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
+import asyncio
+import concurrent.futures
+import contextlib
 import socket
 import errno
 import os
 from typing import (
+    Callable,
+    ContextManager,
+    Iterable,
+    Iterator,
     Optional,
     Dict,
     Tuple,
@@ -31,6 +38,7 @@ IPLookupCacheId = Tuple[HostName, int]
 NewIPLookupCache = Dict[IPLookupCacheId, str]
 LegacyIPLookupCache = Dict[str, str]
 UpdateDNSCacheResult = Tuple[int, List[HostName]]
+DNSResolver = Callable[[HostName, int], HostAddress]
 
 _fake_dns = None  # type: Optional[HostAddress]
 _enforce_localhost = False
@@ -78,6 +86,16 @@ def lookup_ip_address(hostname, family=None):
     if family is None:  # choose primary family
         family = 6 if host_config.is_ipv6_primary else 4
 
+    ipa = _get_configured_ip_address(config_cache, host_config, family)
+    if ipa is not None:
+        return ipa
+
+    return cached_dns_lookup(hostname, family)
+
+
+def _get_configured_ip_address(config_cache, host_config, family):
+    # type: (config.ConfigCache, config.HostConfig, int) -> Optional[str]
+    """The IP address of a host which is known without a DNS lookup, otherwise None"""
     # Honor simulation mode und usewalk hosts. Never contact the network.
     if config.simulation_mode or _enforce_localhost or \
          (host_config.is_usewalk_host and host_config.is_snmp_host):
@@ -88,24 +106,42 @@ def lookup_ip_address(hostname, family=None):
 
     # Now check, if IP address is hard coded by the user
     if family == 4:
-        ipa = config.ipaddresses.get(hostname)
+        ipa = config.ipaddresses.get(host_config.hostname)
     else:
-        ipa = config.ipv6addresses.get(hostname)
+        ipa = config.ipv6addresses.get(host_config.hostname)
 
     if ipa:
         return ipa
 
     # Hosts listed in dyndns hosts always use dynamic DNS lookup.
     # The use their hostname as IP address at all places
-    if config_cache.in_binary_hostlist(hostname, config.dyndns_hosts):
-        return hostname
+    if config_cache.in_binary_hostlist(host_config.hostname, config.dyndns_hosts):
+        return host_config.hostname
+
+    return None
 
-    return cached_dns_lookup(hostname, family)
+
+def _needs_dns_lookup(hostname, family):
+    # type: (HostName, int) -> bool
+    """Whether or not lookup_ip_address() would resolve the host name via DNS"""
+    if _fake_dns or config.fake_dns:
+        return False
+
+    config_cache = config.get_config_cache()
+    host_config = config_cache.get_host_config(hostname)
+    return (_get_configured_ip_address(config_cache, host_config, family) is None and
+            not host_config.is_no_ip_host)
+
+
+def _resolve_via_dns(hostname, family):
+    # type: (HostName, int) -> HostAddress
+    return socket.getaddrinfo(hostname, None, family == 4 and socket.AF_INET or
+                              socket.AF_INET6)[0][4][0]
 
 
 # Variables needed during the renaming of hosts (see automation.py)
-def cached_dns_lookup(hostname, family):
-    # type: (HostName, int) -> Optional[str]
+def cached_dns_lookup(hostname, family, resolve=_resolve_via_dns):
+    # type: (HostName, int, DNSResolver) -> Optional[str]
     cache = _config_cache.get_dict("cached_dns_lookup")
     cache_id = hostname, family
 
@@ -130,8 +166,7 @@ def cached_dns_lookup(hostname, family):
 
     # Now do the actual DNS lookup
     try:
-        ipa = socket.getaddrinfo(hostname, None, family == 4 and socket.AF_INET or
-                                 socket.AF_INET6)[0][4][0]
+        ipa = resolve(hostname, family)
 
         # Update our cached address if that has changed or was missing
         if ipa != cached_ip:
@@ -162,6 +197,8 @@ class IPLookupCache(cmk.base.caching.DictCache):
         # type: () -> None
         super(IPLookupCache, self).__init__()
         self.persist_on_update = True
+        self._batched_updates = None  # type: Optional[NewIPLookupCache]
+        self._batch_pid = None  # type: Optional[int]
 
     def load_persisted(self):
         # type: () -> None
@@ -193,6 +230,7 @@ class IPLookupCache(cmk.base.caching.DictCache):
         out the resulting data structure.
 
         This could really be solved in a better way, but may be sufficient for the moment.
+        Within batched_updates() this is only done once for all updates.
 
         The cache can only be cleaned up with the "Update DNS cache" option in WATO
         or the "cmk --update-dns-cache" call that both call update_dns_cache().
@@ -201,9 +239,35 @@ class IPLookupCache(cmk.base.caching.DictCache):
             self[cache_id] = ipa
             return
 
+        # Processes forked in the meantime persist their updates on their own
+        if self._batched_updates is not None and self._batch_pid == os.getpid():
+            self[cache_id] = ipa
+            self._batched_updates[cache_id] = ipa
+            return
+
+        self._persist_updates({cache_id: ipa})
+
+    @contextlib.contextmanager
+    def batched_updates(self):
+        # type: () -> Iterator[None]
+        """Persist all updates of the cache made within this context at once when leaving it"""
+        if self._batched_updates is not None:
+            yield
+            return
+
+        self._batched_updates, self._batch_pid = {}, os.getpid()
+        try:
+            yield
+        finally:
+            updates, self._batched_updates, self._batch_pid = self._batched_updates, None, None
+            if updates:
+                self._persist_updates(updates)
+
+    def _persist_updates(self, updates):
+        # type: (NewIPLookupCache) -> None
         try:
             self.update(_load_ip_lookup_cache(lock=True))
-            self[cache_id] = ipa
+            self.update(updates)
             self.save_persisted()
         finally:
             store.release_lock(_cache_path())
@@ -213,6 +277,12 @@ class IPLookupCache(cmk.base.caching.DictCache):
         store.save_object_to_file(_cache_path(), self, pretty=False)
 
 
+def batched_ip_lookup_cache_updates():
+    # type: () -> ContextManager[None]
+    """Persist the addresses resolved within this context at once when leaving it"""
+    return _get_ip_lookup_cache().batched_updates()
+
+
 def _get_ip_lookup_cache():
     # type: () -> IPLookupCache
     """A file based fall-back DNS cache in case resolution fails"""
@@ -254,8 +324,8 @@ def _cache_path():
     return cmk.utils.paths.var_dir + "/ipaddresses.cache"
 
 
-def update_dns_cache():
-    # type: () -> UpdateDNSCacheResult
+def update_dns_cache(resolve=_resolve_via_dns):
+    # type: (DNSResolver) -> UpdateDNSCacheResult
     failed = []
 
     ip_lookup_cache = _get_ip_lookup_cache()
@@ -264,11 +334,28 @@ def update_dns_cache():
     console.verbose("Cleaning up existing DNS cache...\n")
     _clear_ip_lookup_cache(ip_lookup_cache)
 
+    lookups = _get_dns_cache_lookup_hosts()
+    dns_lookups = [lookup for lookup in lookups if _needs_dns_lookup(*lookup)]
+    console.verbose("Resolving %d host names (%d at once)...\n" %
+                    (len(dns_lookups), config.dns_lookup_concurrency))
+    resolved = resolve_concurrently(dns_lookups, resolve, config.dns_lookup_concurrency,
+                                    config.dns_lookup_timeout)
+
+    def resolve_from(hostname, family):
+        # type: (HostName, int) -> HostAddress
+        result = resolved[(hostname, family)]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
     console.verbose("Updating DNS cache...\n")
-    for hostname, family in _get_dns_cache_lookup_hosts():
+    for hostname, family in lookups:
         console.verbose("%s (IPv%d)..." % (hostname, family))
         try:
-            ip = lookup_ip_address(hostname, family)
+            if (hostname, family) in resolved:
+                ip = cached_dns_lookup(hostname, family, resolve_from)
+            else:
+                ip = lookup_ip_address(hostname, family)
             console.verbose("%s\n" % ip)
 
         except (MKTerminate, MKTimeout):
@@ -289,6 +376,51 @@ def update_dns_cache():
     return len(ip_lookup_cache), failed
 
 
+def resolve_concurrently(lookups, resolve, max_concurrency, timeout):
+    # type: (Iterable[IPLookupCacheId], DNSResolver, int, float) -> Dict[IPLookupCacheId, Union[HostAddress, Exception]]
+    """Resolve many host names at the same time
+
+    The blocking resolver is called in at most max_concurrency threads at once. A single
+    lookup is given up after timeout seconds. The thread of such a lookup can not be
+    interrupted, so its slot is given to the next lookup not before it has finished.
+    Instead of raising, the errors of the single lookups are returned in place of their
+    addresses.
+    """
+    async def resolve_one(executor, semaphore, lookup, futures):
+        # type: (concurrent.futures.Executor, asyncio.Semaphore, IPLookupCacheId, List[asyncio.Future]) -> Union[HostAddress, Exception]
+        await semaphore.acquire()
+        future = asyncio.get_running_loop().run_in_executor(executor, resolve, *lookup)
+        future.add_done_callback(lambda _future: semaphore.release())
+        futures.append(future)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return MKIPAddressLookupError("Timeout after %.1f seconds" % timeout)
+        except Exception as e:
+            return e
+
+    async def resolve_all(executor):
+        # type: (concurrent.futures.Executor) -> Dict[IPLookupCacheId, Union[HostAddress, Exception]]
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        futures = []  # type: List[asyncio.Future]
+        results = await asyncio.gather(
+            *[resolve_one(executor, semaphore, key, futures) for key in keys])
+        # Detach the lookups which have timed out from the event loop closed afterwards
+        for future in futures:
+            future.cancel()
+        return dict(zip(keys, results))
+
+    keys = list(lookups)
+    if not keys:
+        return {}
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=max(1, max_concurrency))
+    try:
+        return asyncio.run(resolve_all(executor))
+    finally:
+        executor.shutdown(wait=False)
+
+
 def _clear_ip_lookup_cache(ip_lookup_cache):
     # type: (IPLookupCache) -> None
     """Clear the persisted AND in memory cache"""
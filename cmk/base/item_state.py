@@ -17,11 +17,18 @@ item. The value is free form.
 Note: The item state is kept in tmpfs and not reboot-persistant.
 Do not store long-time things here. Also do not store complex
 structures like log files or stuff.
+
+The item states of a host are stored in a log of marshalled changes
+(see ItemStateFile). Saving appends the changes made while checking
+the host to that log, so changes of concurrent processes are kept.
 """
 
+import errno
+import marshal
 import os
+import struct
 import traceback
-from typing import AnyStr, Union, List, Optional, Dict, Any, Tuple
+from typing import AnyStr, Union, List, Optional, Dict, Any, Iterator, Tuple
 
 import cmk.utils.paths
 import cmk.utils.store as store
@@ -62,8 +69,6 @@ class CachedItemStates(object):  # pylint: disable=useless-object-inheritance
         # type: () -> None
         self._item_states = {}  # type: ItemStates
         self._item_state_prefix = ()  # type: ItemStateKey
-        # timestamp of last modification
-        self._last_mtime = None  # type: Optional[float]
         self._removed_item_state_keys = []  # type: List[ItemStateKey]
         self._updated_item_states = {}  # type: ItemStates
 
@@ -75,57 +80,19 @@ class CachedItemStates(object):  # pylint: disable=useless-object-inheritance
 
     def load(self, hostname):
         # type: (HostName) -> None
-        filename = cmk.utils.paths.counters_dir + "/" + hostname
-        try:
-            # TODO: refactoring. put these two values into a named tuple
-            self._item_states = store.load_object_from_file(
-                filename,
-                default={},
-                lock=True,
-            )
-            self._last_mtime = os.stat(filename).st_mtime
-        finally:
-            store.release_lock(filename)
+        self._item_states = ItemStateFile(hostname).load()
 
-    # TODO: self._last_mtime needs be updated accordingly after the save_object_to_file operation
-    #       right now, the current mechanism is sufficient enough, since the save() function is only
-    #       called as the final operation, just before the lifecycle of the CachedItemState ends
     def save(self, hostname):
         # type: (HostName) -> None
         """ The job of the save function is to update the item state on disk.
-        It simply returns, if it detects that the data wasn't changed at all since the last loading
-        If the data on disk has been changed in the meantime, the cached data is updated from disk.
-        Afterwards only the actual modifications (update/remove) are applied to the updated cached
-        data before it is written back to disk.
+        It simply returns, if the data wasn't changed at all since the last loading.
+        Otherwise only the actual modifications (update/remove) are appended to the data
+        on disk. Modifications made by other processes in the meantime are kept.
         """
-        filename = cmk.utils.paths.counters_dir + "/" + hostname
         if not self._removed_item_state_keys and not self._updated_item_states:
             return
 
-        try:
-            if not os.path.exists(cmk.utils.paths.counters_dir):
-                os.makedirs(cmk.utils.paths.counters_dir)
-
-            store.aquire_lock(filename)
-            last_mtime = os.stat(filename).st_mtime
-            if last_mtime != self._last_mtime:
-                self._item_states = store.load_object_from_file(filename, default={})
-
-                # Remove obsolete keys
-                for key in self._removed_item_state_keys:
-                    try:
-                        del self._item_states[key]
-                    except KeyError:
-                        pass
-
-                # Add updated keys
-                self._item_states.update(self._updated_item_states)
-
-            store.save_object_to_file(filename, self._item_states, pretty=False)
-        except Exception:
-            raise MKGeneralException("Cannot write to %s: %s" % (filename, traceback.format_exc()))
-        finally:
-            store.release_lock(filename)
+        ItemStateFile(hostname).append(self._removed_item_state_keys, self._updated_item_states)
 
     def clear_item_state(self, user_key):
         # type: (str) -> None
@@ -139,6 +106,7 @@ class CachedItemStates(object):  # pylint: disable=useless-object-inheritance
 
     def remove_full_key(self, full_key):
         # type: (ItemStateKey) -> None
+        self._updated_item_states.pop(full_key, None)
         try:
             self._removed_item_state_keys.append(full_key)
             del self._item_states[full_key]
@@ -173,6 +141,150 @@ class CachedItemStates(object):  # pylint: disable=useless-object-inheritance
         return self._item_state_prefix + (user_key,)
 
 
+class ItemStateFile(object):  # pylint: disable=useless-object-inheritance
+    """The item states of a host as a log of changes
+
+    The file starts with a magic, followed by records of marshalled changes, each prefixed by its
+    size. Saving appends a record, the log is compacted once it has grown too large. Files of the
+    former format are replaced with the next save."""
+    _MAGIC = b"CMKIS01\n"
+    _RECORD_HEADER = struct.Struct("!I")
+    # Compact when the log is this many times larger than its first record
+    _COMPACTION_FACTOR = 4
+    # ... but not while it is smaller than this
+    _COMPACTION_MIN_SIZE = 64 * 1024
+
+    def __init__(self, hostname):
+        # type: (HostName) -> None
+        super(ItemStateFile, self).__init__()
+        self.path = cmk.utils.paths.counters_dir + "/" + hostname
+
+    def load(self):
+        # type: () -> ItemStates
+        try:
+            store.aquire_lock(self.path)
+            return self._read()
+        finally:
+            store.release_lock(self.path)
+
+    def append(self, removed_keys, updated_item_states):
+        # type: (List[ItemStateKey], ItemStates) -> None
+        record = self._record(removed_keys, updated_item_states)
+        try:
+            if not os.path.exists(cmk.utils.paths.counters_dir):
+                os.makedirs(cmk.utils.paths.counters_dir)
+
+            store.aquire_lock(self.path)
+            fd = os.open(self.path, os.O_RDWR | os.O_APPEND)
+            try:
+                self._truncate_incomplete_record(fd)
+                if self._needs_compaction(fd, len(record)):
+                    self._compact(removed_keys, updated_item_states)
+                else:
+                    self._write_record(fd, record)
+            finally:
+                os.close(fd)
+        except Exception:
+            raise MKGeneralException("Cannot write to %s: %s" % (self.path, traceback.format_exc()))
+        finally:
+            store.release_lock(self.path)
+
+    def _truncate_incomplete_record(self, fd):
+        # type: (int) -> None
+        """Cut off the partial record left by a crash while it was written
+
+        The record appended next would be taken as the rest of it otherwise. Only the
+        headers of the records are read to find the end of the last complete one.
+        """
+        size = os.fstat(fd).st_size
+        if os.pread(fd, len(self._MAGIC), 0) != self._MAGIC:
+            return  # New file or former format, is replaced by the compaction
+
+        records_end = len(self._MAGIC)
+        while records_end + self._RECORD_HEADER.size <= size:
+            header = os.pread(fd, self._RECORD_HEADER.size, records_end)
+            record_end = records_end + len(header) + self._RECORD_HEADER.unpack(header)[0]
+            if record_end > size:
+                break
+            records_end = record_end
+        if records_end < size:
+            os.ftruncate(fd, records_end)
+
+    def _needs_compaction(self, fd, record_size):
+        # type: (int, int) -> bool
+        """Decide about compaction by only looking at the size of the log and its first record"""
+        head = os.pread(fd, len(self._MAGIC) + self._RECORD_HEADER.size, 0)
+        if len(head) < len(self._MAGIC) + self._RECORD_HEADER.size or \
+           not head.startswith(self._MAGIC):
+            return True  # New file or former format
+
+        first_record_size = self._RECORD_HEADER.unpack_from(head, len(self._MAGIC))[0]
+        log_size = os.fstat(fd).st_size + record_size
+        return log_size > max(self._COMPACTION_MIN_SIZE,
+                              self._COMPACTION_FACTOR * (len(head) + first_record_size))
+
+    @staticmethod
+    def _write_record(fd, record):
+        # type: (int, bytes) -> None
+        size = os.fstat(fd).st_size
+        try:
+            if os.write(fd, record) != len(record):
+                raise OSError(errno.ENOSPC, "Incomplete write")
+        except OSError:
+            # Don't leave a partial record which would hide the records appended later
+            os.ftruncate(fd, size)
+            raise
+
+    def _compact(self, removed_keys, updated_item_states):
+        # type: (List[ItemStateKey], ItemStates) -> None
+        item_states = self._read()
+        for key in removed_keys:
+            item_states.pop(key, None)
+        item_states.update(updated_item_states)
+        store.save_bytes_to_file(self.path, self._MAGIC + self._record([], item_states))
+
+    def _read(self):
+        # type: () -> ItemStates
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return {}
+            raise
+
+        if not data.startswith(self._MAGIC):
+            return store.load_object_from_file(self.path, default={})
+
+        item_states = {}  # type: ItemStates
+        for record_start, record_end in self._iter_records(data):
+            try:
+                removed_keys, updated_item_states = marshal.loads(data[record_start:record_end])
+            except (EOFError, ValueError, TypeError):
+                break  # Undecodable record, the records following it are not trusted
+            for key in removed_keys:
+                item_states.pop(key, None)
+            item_states.update(updated_item_states)
+        return item_states
+
+    def _iter_records(self, data):
+        # type: (bytes) -> Iterator[Tuple[int, int]]
+        """The start and end offsets of the payloads of the complete records"""
+        offset = len(self._MAGIC)
+        while offset + self._RECORD_HEADER.size <= len(data):
+            record_start = offset + self._RECORD_HEADER.size
+            record_end = record_start + self._RECORD_HEADER.unpack_from(data, offset)[0]
+            if record_end > len(data):
+                return  # Partial record, is cut off before the next record is appended
+            yield record_start, record_end
+            offset = record_end
+
+    def _record(self, removed_keys, updated_item_states):
+        # type: (List[ItemStateKey], ItemStates) -> bytes
+        payload = marshal.dumps((removed_keys, updated_item_states))
+        return self._RECORD_HEADER.pack(len(payload)) + payload
+
+
 _cached_item_states = CachedItemStates()
 
 
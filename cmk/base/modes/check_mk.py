@@ -1524,7 +1524,10 @@ def mode_discover(options, args):
     if check_plugin_names is not None:
         check_plugin_names = set(check_plugin_names)
 
-    discovery.do_discovery(set(hostnames), check_plugin_names, options["discover"] == 1)
+    discovery.do_discovery(set(hostnames),
+                           check_plugin_names,
+                           options["discover"] == 1,
+                           max_processes=options.get("procs", 1))
 
 
 modes.register(
@@ -1545,7 +1548,9 @@ modes.register(
              "list of all check types. Use 'tcp' for all TCP based checks and "
              "'snmp' for all SNMP based checks.",
              "-II does the same as -I but deletes all existing checks of the "
-             "specified types and hosts."
+             "specified types and hosts.",
+             "Use '--procs N' to discover the services of N hosts in parallel "
+             "processes.",
          ],
          sub_options=[
              Option(
@@ -1561,6 +1566,13 @@ modes.register(
                  argument_descr="C",
                  argument_conv=lambda x: list(config.check_info) if x == "@all" else x.split(","),
              ),
+             Option(
+                 long_option="procs",
+                 argument=True,
+                 argument_descr="N",
+                 argument_conv=int,
+                 short_help="Discover up to N hosts in parallel. Defaults to 1.",
+             ),
          ]))
 
 #.
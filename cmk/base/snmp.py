@@ -32,6 +32,7 @@ import cmk.base.cleanup
 import cmk.base.config as config
 import cmk.base.ip_lookup as ip_lookup
 from cmk.fetchers.factory import SNMPBackendFactory  # pylint: disable=cmk-module-layer-violation
+from cmk.fetchers.snmp_backend import cleanup_builtin_snmp_sessions, cleanup_stored_walk_cache  # pylint: disable=cmk-module-layer-violation
 
 try:
     from cmk.fetchers.cee.snmp_backend import inline  # pylint: disable=cmk-module-layer-violation, ungrouped-imports
@@ -328,5 +329,7 @@ def do_snmpget(oid, hostnames):
 
 
 cmk.base.cleanup.register_cleanup(snmp_cache.cleanup_host_caches)
+cmk.base.cleanup.register_cleanup(cleanup_stored_walk_cache)
+cmk.base.cleanup.register_cleanup(cleanup_builtin_snmp_sessions)
 if inline:
     cmk.base.cleanup.register_cleanup(inline.cleanup_inline_snmp_globals)
@@ -4,6 +4,7 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
+import marshal
 import os
 import struct
 import subprocess
@@ -15,6 +16,7 @@ from typing import Any, AnyStr, Dict, Iterable, List, Optional, Tuple, Union
 
 from cmk.utils.log import VERBOSE
 from cmk.utils.render import date_and_time
+import cmk.utils.store as store
 
 from .actions import quote_shell_string
 from .query import QueryGET
@@ -33,6 +35,8 @@ class History:
         self._event_columns = event_columns
         self._history_columns = history_columns
         self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._indexes = {}  # type: Dict[Path, HistoryFileIndex]
         self._mongodb = MongoDB()
         self._active_history_period = ActiveHistoryPeriod()
         self.reload_configuration(config)
@@ -312,11 +316,13 @@ def _reload_configuration_files(history):
 def _flush_files(history):
     # type: (History) -> None
     _expire_logfiles(history._settings, history._config, history._logger, history._lock, True)
+    _forget_expired_indexes(history)
 
 
 def _housekeeping_files(history):
     # type: (History) -> None
     _expire_logfiles(history._settings, history._config, history._logger, history._lock, False)
+    _forget_expired_indexes(history)
 
 
 # Make a new entry in the event history. Each entry is tab-separated line
@@ -431,6 +437,10 @@ def _expire_logfiles(settings, config, logger, lock_history, flush):
                     logger.info("Deleting log file %s (age %s)" %
                                 (path, date_and_time(path.stat().st_mtime)))
                     path.unlink()
+            # Also cleans up the indexes of log files which have been removed otherwise
+            for index_path in settings.paths.history_dir.value.glob('*.idx'):
+                if not index_path.with_suffix(".log").exists():
+                    index_path.unlink()
         except Exception as e:
             if settings.options.debug:
                 raise
@@ -523,7 +533,11 @@ def _get_files(history, logger, query):
                     history._logger.info("Skipping logfile %s.log because of time filter" % ts)
                 continue  # skip this file
 
-        new_entries = _parse_history_file(history, path, query, greptexts, limit, history._logger)
+        if _indexed_filters(query.filters):
+            new_entries = _parse_indexed_history_file(history, path, query, limit, history._logger)
+        else:
+            new_entries = _parse_history_file(history, path, query, greptexts, limit,
+                                              history._logger)
         history_entries += new_entries
         if limit is not None:
             limit -= len(new_entries)
@@ -564,6 +578,233 @@ def _parse_history_file(history, path, query, greptexts, limit, logger):
     return entries
 
 
+# Each history file "<timestamp>.log" has a sidecar index file "<timestamp>.idx". It is
+# updated on demand when the history file is queried and has grown since the last update.
+
+# Positions of the indexed values in the lines of the history files
+_INDEXED_FIELDS = {
+    "event_host": 11,
+    "event_rule_id": 17,
+}
+
+_TIME_OPERATORS = {
+    "=": lambda first, last, argument: first <= argument <= last,
+    ">": lambda first, last, argument: last > argument,
+    ">=": lambda first, last, argument: last >= argument,
+    "<": lambda first, last, argument: first < argument,
+    "<=": lambda first, last, argument: first <= argument,
+}
+
+
+class HistoryFileIndex:
+    """Index of the lines of one history file
+
+    The lines are grouped into blocks of BLOCK_LINES consecutive lines. For each block the byte
+    offset, the number of its first line and the time span of its entries are stored. For each
+    of the indexed fields, the values are mapped to the numbers of the blocks containing them."""
+    VERSION = 1
+    BLOCK_LINES = 256
+
+    def __init__(self):
+        # type: () -> None
+        super().__init__()
+        self.clear()
+
+    def clear(self):
+        # type: () -> None
+        self.size = 0  # Number of indexed bytes of the history file
+        self.num_lines = 0
+        # offset, number of first line, first and last history time
+        self.blocks = []  # type: List[Tuple[int, int, float, float]]
+        self.postings = {field: {} for field in _INDEXED_FIELDS
+                        }  # type: Dict[str, Dict[str, List[int]]]
+
+    @classmethod
+    def load(cls, index_path):
+        # type: (Path) -> HistoryFileIndex
+        index = cls()
+        try:
+            data = marshal.loads(store.load_bytes_from_file(index_path))
+        except Exception:
+            return index  # Missing or broken index, simply create it again
+        if not isinstance(data, dict) or data.get("version") != cls.VERSION:
+            return index
+        index.size = data["size"]
+        index.num_lines = data["num_lines"]
+        index.blocks = data["blocks"]
+        index.postings = data["postings"]
+        return index
+
+    def save(self, index_path):
+        # type: (Path) -> None
+        store.save_bytes_to_file(
+            index_path,
+            marshal.dumps({
+                "version": self.VERSION,
+                "size": self.size,
+                "num_lines": self.num_lines,
+                "blocks": self.blocks,
+                "postings": self.postings,
+            }))
+
+    def update(self, path):
+        # type: (Path) -> bool
+        """Index the lines which have been appended to the history file since the last update"""
+        size = path.stat().st_size
+        if size < self.size:
+            self.clear()  # The history file has been replaced
+        if size == self.size:
+            return False
+
+        # Continue filling the last block
+        if self.blocks and self.num_lines - self.blocks[-1][1] < self.BLOCK_LINES:
+            block_nr = len(self.blocks) - 1
+            self.size, self.num_lines = self.blocks.pop()[:2]
+            for postings in self.postings.values():
+                for block_nrs in postings.values():
+                    if block_nrs[-1] == block_nr:
+                        block_nrs.pop()
+
+        offset = self.size
+        with path.open("rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # The line is currently being written
+                if self.num_lines % self.BLOCK_LINES == 0:
+                    self.blocks.append((offset, self.num_lines, float("inf"), float("-inf")))
+                self._add_line(line[:-1])
+                offset += len(line)
+                self.num_lines += 1
+        self.size = offset
+        return True
+
+    def _add_line(self, line):
+        # type: (bytes) -> None
+        block_nr = len(self.blocks) - 1
+        fields = line.split(b"\t", max(_INDEXED_FIELDS.values()) + 1)
+        try:
+            history_time = float(fields[0])
+            values = {
+                field: fields[position].decode("utf-8")
+                for field, position in _INDEXED_FIELDS.items()
+                if position < len(fields)
+            }
+        except (ValueError, UnicodeDecodeError):
+            return  # Invalid lines are skipped when reading the history file
+
+        block_offset, first_line, first_time, last_time = self.blocks[-1]
+        self.blocks[-1] = (block_offset, first_line, min(first_time, history_time),
+                           max(last_time, history_time))
+
+        for field, value in values.items():
+            block_nrs = self.postings[field].setdefault(value, [])
+            if not block_nrs or block_nrs[-1] != block_nr:
+                block_nrs.append(block_nr)
+
+    def matching_blocks(self, filters):
+        # type: (List[Tuple[str, str, Any, Any]]) -> List[int]
+        """Numbers of the blocks which may contain lines matching all of the filters"""
+        block_nrs = set(range(len(self.blocks)))
+        for column_name, operator_name, _predicate, argument in _indexed_filters(filters):
+            if column_name == "history_time":
+                matches = _TIME_OPERATORS[operator_name]
+                block_nrs = {
+                    block_nr for block_nr in block_nrs
+                    if matches(self.blocks[block_nr][2], self.blocks[block_nr][3], argument)
+                }
+                continue
+
+            postings = self.postings[column_name]
+            if operator_name == "=":
+                values = [argument]  # type: Iterable[str]
+            elif operator_name == "in":
+                values = argument
+            else:  # "=~"
+                values = [value for value in postings if value.lower() == argument.lower()]
+            block_nrs &= {block_nr for value in values for block_nr in postings.get(value, [])}
+        return sorted(block_nrs)
+
+
+def _indexed_filters(filters):
+    # type: (List[Tuple[str, str, Any, Any]]) -> List[Tuple[str, str, Any, Any]]
+    return [f for f in filters if _is_indexed_filter(f[0], f[1])]
+
+
+def _is_indexed_filter(column_name, operator_name):
+    # type: (str, str) -> bool
+    if column_name == "history_time":
+        return operator_name in _TIME_OPERATORS
+    return column_name in _INDEXED_FIELDS and operator_name in ["=", "=~", "in"]
+
+
+def _history_index_path(path):
+    # type: (Path) -> Path
+    return path.with_suffix(".idx")
+
+
+def _get_history_file_index(history, path):
+    # type: (History, Path) -> HistoryFileIndex
+    with history._index_lock:
+        index_path = _history_index_path(path)
+        index = history._indexes.get(path)
+        if index is None:
+            index = history._indexes[path] = HistoryFileIndex.load(index_path)
+        if index.update(path):
+            index.save(index_path)
+        return index
+
+
+def _forget_expired_indexes(history):
+    # type: (History) -> None
+    with history._index_lock:
+        for path in list(history._indexes):
+            if not path.exists():
+                del history._indexes[path]
+
+
+def _parse_indexed_history_file(history, path, query, limit, logger):
+    # type: (History, Path, Any, Optional[int], Logger) -> List[Any]
+    """Read only the blocks of the history file which may contain matching lines
+
+    Like _parse_history_file, the newer lines are processed first. The line numbers are counted
+    from the end of the indexed part of the history file."""
+    index = _get_history_file_index(history, path)
+    # The indexed fields are not converted, so their filters can be applied to the raw fields of
+    # the lines in the blocks before converting the whole lines.
+    field_filters = [(_INDEXED_FIELDS[column_name], predicate)
+                     for column_name, _operator_name, predicate, _argument in query.filters
+                     if column_name in _INDEXED_FIELDS]
+    max_split = max(_INDEXED_FIELDS.values()) + 1
+    entries = []  # type: List[Any]
+    with path.open("rb") as f:
+        for block_nr in reversed(index.matching_blocks(query.filters)):
+            offset, first_line = index.blocks[block_nr][:2]
+            end = index.blocks[block_nr + 1][0] if block_nr + 1 < len(index.blocks) else index.size
+            f.seek(offset)
+            lines = f.read(end - offset).split(b"\n")[:-1]
+            for line_nr in range(len(lines) - 1, -1, -1):
+                if limit is not None and len(entries) > limit:
+                    return entries
+
+                line = lines[line_nr]
+                try:
+                    if field_filters:
+                        fields = line.split(b"\t", max_split)
+                        if not all(
+                                predicate(fields[position].decode("utf-8"))
+                                for position, predicate in field_filters):
+                            continue
+                    parts = line.decode('utf-8').split('\t')  # type: List[Any]
+                    _convert_history_line(history, parts)
+                    values = [index.num_lines - first_line - line_nr] + parts
+                    if query.filter_row(values):
+                        entries.append(values)
+                except Exception as e:
+                    logger.exception("Invalid line '%r' in history file %s: %s" % (line, path, e))
+    return entries
+
+
 # Speed-critical function for converting string representation
 # of log line back to Python values
 def _convert_history_line(history, values):
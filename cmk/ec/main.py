@@ -51,6 +51,7 @@ from .actions import do_notify, do_event_action, do_event_actions, event_has_ope
 from .crash_reporting import ECCrashReport, CrashReportStore
 from .history import ActiveHistoryPeriod, History, scrub_string, quote_tab, get_logfile
 from .query import MKClientError, Query, QueryGET
+from .rule_index import RuleLiteralIndex
 from .rule_packs import load_config as load_config_using
 from .settings import FileDescriptor, PortNumber, Settings, settings as create_settings
 from .snmp import SNMPTrapEngine
@@ -646,6 +647,7 @@ class EventServer(ECServerThread):
         self._hash_stats = []
         for _unused_facility in range(32):
             self._hash_stats.append([0] * 8)
+        self._rule_literal_index = None  # type: Optional[RuleLiteralIndex]
 
         self.host_config = HostConfig(self._logger)
         self._perfcounters = perfcounters
@@ -1297,6 +1299,7 @@ class EventServer(ECServerThread):
         self._rule_by_id = {}
         # Speedup-Hash for rule execution
         self._rule_hash = {}  # type: Dict[int, Dict[int, Any]]
+        self._rule_literal_index = None
         count_disabled = 0
         count_rules = 0
         count_unspecific = 0
@@ -1366,6 +1369,7 @@ class EventServer(ECServerThread):
             self._logger.info(
                 "Rule hash: %d rules - %d hashed, %d unspecific" %
                 (len(self._rules), len(self._rules) - count_unspecific, count_unspecific))
+            self._rule_literal_index = RuleLiteralIndex(self._rules, self._rule_hash)
             for facility in list(range(23)) + [31]:
                 if facility in self._rule_hash:
                     stats = []
@@ -1436,6 +1440,13 @@ class EventServer(ECServerThread):
                               (SyslogFacility(facility), SyslogPriority(priority), count,
                                (100.0 * count / float(total_count))))
 
+        if self._rule_literal_index is not None:
+            index = self._rule_literal_index
+            tried = index.hits + index.skips
+            self._logger.info(
+                "Literal index: %d hits, %d skips (%.2f%% of the indexed rules skipped)" %
+                (index.hits, index.skips, (100.0 * index.skips / tried) if tried else 0.0))
+
     def process_line(self, line, address):
         line = line.rstrip()
         if self._config["debug_rules"]:
@@ -1455,9 +1466,10 @@ class EventServer(ECServerThread):
             self.log_message(event)
 
         # Rule optimizer
-        if self._config["rule_optimizer"]:
+        if self._rule_literal_index is not None:
             self._hash_stats[event["facility"]][event["priority"]] += 1
-            rule_candidates = self._rule_hash.get(event["facility"], {}).get(event["priority"], [])
+            rule_candidates = self._rule_literal_index.rule_candidates(
+                event["facility"], event["priority"], event["text"])
         else:
             rule_candidates = self._rules
 
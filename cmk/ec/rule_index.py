@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+"""Preselection of the rules which may match the text of an event
+
+Most rules of large rule packs match the message text with a pattern containing some
+literal text. These literals are extracted from the "match" conditions of the rules and
+are searched for with a single pass over the message text (Aho-Corasick). Only rules
+having at least one of their literals in the text need to be tried. Rules without
+extractable literals are always tried.
+"""
+
+from collections import deque
+import sre_constants
+import sre_parse
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+Rule = Dict[str, Any]
+_Bucket = Tuple[List[Rule], List[int], Set[int]]
+
+# The characters which a case insensitive pattern matches with an ASCII character
+# although they are no ASCII characters when lowered. The literals are ASCII only.
+_ASCII_FOLDING = {0x130: u"i", 0x131: u"i", 0x17f: u"s", 0x212a: u"k"}
+
+# Rules with more alternative literals are tried for all events
+_MAX_ALTERNATIVES = 32
+
+_REPEATS = tuple(
+    getattr(sre_constants, name)
+    for name in ["MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"]
+    if hasattr(sre_constants, name))
+
+
+class RuleLiteralIndex:
+    """Selects the candidate rules of a facility/priority for a message text
+
+    The rules and the facility/priority hash are those of the EventServer. The order of
+    the rules is kept.
+    """
+    def __init__(self, rules, rule_hash):
+        # type: (List[Rule], Dict[int, Dict[int, List[Rule]]]) -> None
+        super().__init__()
+        self.hits = 0
+        self.skips = 0
+        self._rules = rules
+
+        positions = {}  # type: Dict[int, int]
+        literal_numbers = {}  # type: Dict[str, int]
+        self._literal_positions = []  # type: List[List[int]]
+        indexed = set()  # type: Set[int]
+        for position, rule in enumerate(rules):
+            positions[id(rule)] = position
+            literals = rule_literals(rule)
+            if literals is None:
+                continue
+
+            indexed.add(position)
+            for literal in literals:
+                number = literal_numbers.setdefault(literal, len(literal_numbers))
+                if number == len(self._literal_positions):
+                    self._literal_positions.append([])
+                self._literal_positions[number].append(position)
+        self._automaton = _LiteralAutomaton(list(literal_numbers))
+
+        self._buckets = {}  # type: Dict[Tuple[int, int], _Bucket]
+        for facility, prio_hash in rule_hash.items():
+            for priority, bucket_rules in prio_hash.items():
+                bucket_positions = [positions[id(rule)] for rule in bucket_rules]
+                unindexed_positions = [p for p in bucket_positions if p not in indexed]
+                self._buckets[(facility, priority)] = (
+                    [rules[p] for p in unindexed_positions],
+                    unindexed_positions,
+                    indexed.intersection(bucket_positions),
+                )
+
+    def rule_candidates(self, facility, priority, text):
+        # type: (int, int, str) -> List[Rule]
+        try:
+            unindexed_rules, unindexed_positions, indexed_positions = self._buckets[(facility,
+                                                                                     priority)]
+        except KeyError:
+            return []
+
+        if not indexed_positions:
+            return unindexed_rules
+
+        hit_positions = indexed_positions.intersection(self._matching_positions(text))
+        self.hits += len(hit_positions)
+        self.skips += len(indexed_positions) - len(hit_positions)
+        if not hit_positions:
+            return unindexed_rules
+
+        hit_positions.update(unindexed_positions)
+        return [self._rules[p] for p in sorted(hit_positions)]
+
+    def _matching_positions(self, text):
+        # type: (str) -> Set[int]
+        positions = set()  # type: Set[int]
+        for number in self._automaton.search(text.translate(_ASCII_FOLDING).lower()):
+            positions.update(self._literal_positions[number])
+        return positions
+
+
+class _LiteralAutomaton:
+    """Aho-Corasick automaton finding all occurrences of a set of literals"""
+    def __init__(self, literals):
+        # type: (List[str]) -> None
+        super().__init__()
+        self._goto = [{}]  # type: List[Dict[str, int]]
+        self._fail = [0]
+        self._output = [()]  # type: List[Tuple[int, ...]]
+
+        for number, literal in enumerate(literals):
+            state = 0
+            for char in literal:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                state = next_state
+            self._output[state] += (number,)
+
+        # Breadth first, the failure state of a state is always less deep than the state
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(char, 0)
+                self._fail[next_state] = fail
+                self._output[next_state] += self._output[fail]
+
+    def search(self, text):
+        # type: (str) -> Set[int]
+        """The numbers of the literals contained in the text"""
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()  # type: Set[int]
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if output[state]:
+                found.update(output[state])
+        return found
+
+
+def rule_literals(rule):
+    # type: (Rule) -> Optional[FrozenSet[str]]
+    """The lowered literals of which every message text matched by the rule contains one
+
+    None is returned in case the rule may match without one of them. This is the case for
+    inverted and cancelling rules and for patterns without literal text.
+    """
+    if rule.get("invert_matching") or any(
+            key in rule for key in ["match_ok", "cancel_application", "cancel_priority"]):
+        return None
+
+    pattern = rule.get("match")
+    if pattern is None:
+        return None
+
+    if isinstance(pattern, str):
+        return frozenset([pattern.lower()]) if pattern and pattern.isascii() else None
+
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except (sre_constants.error, TypeError):
+        return None
+    return _required_literals(parsed)
+
+
+def _required_literals(items):
+    # type: (Iterable[Tuple[Any, Any]]) -> Optional[FrozenSet[str]]
+    """Find the most selective set of literals required by a parsed pattern"""
+    candidates = []  # type: List[FrozenSet[str]]
+    run = []  # type: List[str]
+    for op, av in items:
+        if op == sre_constants.LITERAL and av < 128:
+            run.append(chr(av).lower())
+            continue
+
+        if run:
+            candidates.append(frozenset(["".join(run)]))
+            run = []
+
+        if op == sre_constants.SUBPATTERN:
+            literals = _required_literals(av[-1])
+        elif op in _REPEATS and av[0] >= 1:
+            literals = _required_literals(av[2])
+        elif op == sre_constants.BRANCH:
+            literals = _alternative_literals(av[1])
+        else:
+            literals = None
+
+        if literals is not None:
+            candidates.append(literals)
+
+    if run:
+        candidates.append(frozenset(["".join(run)]))
+
+    if not candidates:
+        return None
+    return max(candidates, key=lambda c: (min(len(literal) for literal in c), -len(c)))
+
+
+def _alternative_literals(branches):
+    # type: (Iterable[Iterable[Tuple[Any, Any]]]) -> Optional[FrozenSet[str]]
+    alternatives = set()  # type: Set[str]
+    for branch in branches:
+        literals = _required_literals(branch)
+        if literals is None:
+            return None
+        alternatives.update(literals)
+        if len(alternatives) > _MAX_ALTERNATIVES:
+            return None
+    return frozenset(alternatives)
@@ -9,4 +9,4 @@ from .ipmi import IPMIDataFetcher
 from .piggyback import PiggyBackDataFetcher
 from .program import ProgramDataFetcher
 from .snmp import SNMPDataFetcher
-from .tcp import TCPDataFetcher
+from .tcp import TCPDataFetcher, fetch_concurrently
@@ -4,7 +4,7 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
-from typing import Optional
+from typing import List, Optional
 
 from cmk.utils.type_defs import (
     ABCSNMPBackend,
@@ -16,7 +16,7 @@ from cmk.utils.type_defs import (
     SNMPRowInfo,
 )
 
-from .snmp_backend import ClassicSNMPBackend, StoredWalkSNMPBackend
+from .snmp_backend import BuiltinSNMPBackend, ClassicSNMPBackend, StoredWalkSNMPBackend
 
 try:
     from .cee.snmp_backend import inline
@@ -48,6 +48,9 @@ class SNMPBackendFactory(object):  # pylint: disable=useless-object-inheritance
         if use_cache or snmp_config.is_usewalk_host:
             return StoredWalkSNMPBackend()
 
+        if snmp_config.is_builtin_snmp_host:
+            return BuiltinSNMPBackend()
+
         if snmp_config.is_inline_snmp_host:
             return inline.InlineSNMPBackend(snmp_config.record_stats)
 
@@ -79,3 +82,26 @@ class SNMPBackendFactory(object):  # pylint: disable=useless-object-inheritance
             check_plugin_name=check_plugin_name,
             table_base_oid=table_base_oid,
         )
+
+    @classmethod
+    def walk_columns(cls,
+                     snmp_config,
+                     *,
+                     oids,
+                     context_name=None,
+                     check_plugin_name=None,
+                     table_base_oid=None,
+                     use_cache=None):
+        # type: (SNMPHostConfig, List[OID], Optional[ContextName], Optional[CheckPluginName], Optional[OID], Optional[bool]) -> List[SNMPRowInfo]
+        return cls._factory(snmp_config, use_cache=use_cache).walk_columns(
+            snmp_config,
+            oids=oids,
+            context_name=context_name,
+            check_plugin_name=check_plugin_name,
+            table_base_oid=table_base_oid,
+        )
+
+    @classmethod
+    def merges_columns(cls, snmp_config, *, use_cache=None):
+        # type: (SNMPHostConfig, Optional[bool]) -> bool
+        return cls._factory(snmp_config, use_cache=use_cache).merges_columns
@@ -10,6 +10,7 @@ from typing import Dict, List, Optional, Type, Union
 
 import cmk.utils.snmp_table as snmp_table
 from cmk.utils.check_utils import section_name_of
+from cmk.utils.log import VERBOSE
 from cmk.utils.type_defs import ABCSNMPTree, OIDInfo, RawSNMPData, SNMPHostConfig, SNMPTable
 
 
@@ -38,6 +39,7 @@ class SNMPDataFetcher:
     def data(self):
         # type: () -> RawSNMPData
         info = {}  # type: RawSNMPData
+        fetched_walks = snmp_table.FetchedWalks()
         for check_plugin_name, oid_info in self._oid_infos.items():
             section_name = section_name_of(check_plugin_name)
             # Prevent duplicate data fetching of identical section in case of SNMP sub checks
@@ -55,10 +57,19 @@ class SNMPDataFetcher:
                 # branch: List[ABCSNMPTree]
                 check_info = []  # type: List[SNMPTable]
                 for entry in oid_info:
-                    check_info_part = get_snmp(self._snmp_config, check_plugin_name, entry)
+                    check_info_part = get_snmp(self._snmp_config, check_plugin_name, entry,
+                                               fetched_walks)
                     check_info.append(check_info_part)
                 info[section_name] = check_info
             else:
                 # branch: OIDInfo
-                info[section_name] = get_snmp(self._snmp_config, check_plugin_name, oid_info)
+                info[section_name] = get_snmp(self._snmp_config, check_plugin_name, oid_info,
+                                              fetched_walks)
+
+        if fetched_walks.requested:
+            self._logger.log(
+                VERBOSE, "SNMP walks of %s: %d columns, %d walks saved "
+                "(%d by deduplication, %d by merging columns)", self._snmp_config.hostname,
+                fetched_walks.requested, fetched_walks.saved, fetched_walks.deduplicated,
+                fetched_walks.merged)
         return info
@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+"""SNMP v1/v2c backend talking to the devices from within the Checkmk process
+
+The requests are sent from one UDP socket per device which is kept for the whole fetch
+of the host data. The columns of a table are walked with the same GETBULK (v2c) or
+GETNEXT (v1) requests. Several of these requests are sent at once when the table has
+many columns. The values are taken from the BER encoded responses directly.
+"""
+
+import errno
+import itertools
+import random
+import select
+import socket
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from cmk.utils.exceptions import MKSNMPError
+from cmk.utils.log import console
+from cmk.utils.type_defs import (
+    ABCSNMPBackend,
+    CheckPluginName,
+    ContextName,
+    OID,
+    RawValue,
+    SNMPHostConfig,
+    SNMPRowInfo,
+)
+
+__all__ = ["BuiltinSNMPBackend", "cleanup_builtin_snmp_sessions"]
+
+_OIDTuple = Tuple[int, ...]
+_VarBind = Tuple[_OIDTuple, int, bytes]
+# Error status, error index and the variable bindings of a response
+_Response = Tuple[int, int, List[_VarBind]]
+
+# ASN.1 / SNMP tags
+_INTEGER = 0x02
+_OCTET_STRING = 0x04
+_NULL = 0x05
+_OBJECT_IDENTIFIER = 0x06
+_SEQUENCE = 0x30
+_IP_ADDRESS = 0x40
+_COUNTER32 = 0x41
+_GAUGE32 = 0x42
+_TIME_TICKS = 0x43
+_OPAQUE = 0x44
+_COUNTER64 = 0x46
+_NO_SUCH_OBJECT = 0x80
+_NO_SUCH_INSTANCE = 0x81
+_END_OF_MIB_VIEW = 0x82
+
+_GET_REQUEST = 0xa0
+_GET_NEXT_REQUEST = 0xa1
+_RESPONSE = 0xa2
+_GET_BULK_REQUEST = 0xa5
+
+_VERSION_1 = 0
+_VERSION_2C = 1
+
+# Error status of a response
+_NO_ERROR = 0
+_TOO_BIG = 1
+_NO_SUCH_NAME = 2
+
+_ERROR_STATUS_TEXTS = {
+    1: "tooBig",
+    2: "noSuchName",
+    3: "badValue",
+    4: "readOnly",
+    5: "genErr",
+}
+
+_UNSIGNED_TYPES = {_COUNTER32, _GAUGE32, _TIME_TICKS, _COUNTER64}
+_NO_VALUE_TYPES = {_NO_SUCH_OBJECT, _NO_SUCH_INSTANCE, _END_OF_MIB_VIEW}
+
+# Columns walked with the same request, the remaining columns are walked with further
+# requests which are sent at the same time
+_MAX_COLUMNS_PER_REQUEST = 16
+
+# The defaults of the net-snmp tools
+_DEFAULT_TIMEOUT = 1.0
+_DEFAULT_RETRIES = 5
+
+_PRINTABLE = frozenset(range(0x20, 0x7f)) | frozenset(b"\t\n\v\f\r")
+
+# The sessions opened by this process, cleaned up after each host
+_sessions = {}  # type: Dict[Tuple[int, str, int], _Session]
+
+
+def cleanup_builtin_snmp_sessions():
+    # type: () -> None
+    global _sessions
+    for session in _sessions.values():
+        session.close()
+    _sessions = {}
+
+
+class BuiltinSNMPBackend(ABCSNMPBackend):
+    merges_columns = True
+
+    def get(self, snmp_config, oid, context_name=None):
+        # type: (SNMPHostConfig, OID, Optional[ContextName]) -> Optional[RawValue]
+        if oid.endswith(".*"):
+            oid_prefix = _parse_oid(oid[:-2])
+            pdu_type = _GET_NEXT_REQUEST
+        else:
+            oid_prefix = _parse_oid(oid)
+            pdu_type = _GET_REQUEST
+
+        try:
+            error_status, _error_index, varbinds = _get_session(snmp_config).request(
+                snmp_config, pdu_type, [oid_prefix])
+        except MKSNMPError as e:
+            console.verbose("SNMP error: %s\n" % e)
+            return None
+
+        if error_status != _NO_ERROR or not varbinds:
+            return None
+
+        value_oid, tag, content = varbinds[0]
+        if tag in _NO_VALUE_TYPES:
+            return None
+        # In case of .*, check if prefix is the one we are looking for
+        if pdu_type == _GET_NEXT_REQUEST and not _is_below(value_oid, oid_prefix):
+            return None
+
+        value = _raw_value(tag, content)
+        console.vverbose("SNMP answer: ==> [%r]\n" % value)
+        return value
+
+    def walk(self,
+             snmp_config,
+             oid,
+             check_plugin_name=None,
+             table_base_oid=None,
+             context_name=None):
+        # type: (SNMPHostConfig, OID, Optional[CheckPluginName], Optional[OID], Optional[ContextName]) -> SNMPRowInfo
+        return self.walk_columns(snmp_config, [oid])[0]
+
+    def walk_columns(self,
+                     snmp_config,
+                     oids,
+                     check_plugin_name=None,
+                     table_base_oid=None,
+                     context_name=None):
+        # type: (SNMPHostConfig, List[OID], Optional[CheckPluginName], Optional[OID], Optional[ContextName]) -> List[SNMPRowInfo]
+        session = _get_session(snmp_config)
+        columns = [_WalkedColumn(_parse_oid(oid)) for oid in oids]
+        use_bulk = _uses_bulk(snmp_config)
+        max_repetitions = max(1, snmp_config.bulk_walk_size_of)
+
+        while True:
+            pending = [column for column in columns if not column.done]
+            if not pending:
+                break
+
+            chunks = [
+                pending[index:index + _MAX_COLUMNS_PER_REQUEST]
+                for index in range(0, len(pending), _MAX_COLUMNS_PER_REQUEST)
+            ]
+            responses = session.requests(
+                snmp_config,
+                _GET_BULK_REQUEST if use_bulk else _GET_NEXT_REQUEST,
+                [[column.last_oid for column in chunk] for chunk in chunks],
+                max_repetitions=max_repetitions if use_bulk else 0,
+            )
+
+            progress = False
+            for chunk, (error_status, error_index, varbinds) in zip(chunks, responses):
+                if error_status == _TOO_BIG and use_bulk and max_repetitions > 1:
+                    max_repetitions //= 2
+                    progress = True
+                    continue
+
+                if error_status == _NO_SUCH_NAME and 0 < error_index <= len(chunk):
+                    # SNMP v1: The column at the error index is at the end of the MIB. The
+                    # request has to be repeated for the other columns.
+                    chunk[error_index - 1].done = True
+                    progress = True
+                    continue
+
+                if error_status != _NO_ERROR:
+                    error_text = _ERROR_STATUS_TEXTS.get(error_status, str(error_status))
+                    raise MKSNMPError("SNMP Error on %s: %s (error index %d)" %
+                                      (snmp_config.ipaddress, error_text, error_index))
+
+                # The variable bindings of GETBULK repetitions follow each other column
+                # by column. A truncated response ends after a complete binding.
+                for index, (value_oid, tag, content) in enumerate(varbinds):
+                    progress |= chunk[index % len(chunk)].add(value_oid, tag, content)
+
+            if not progress:
+                raise MKSNMPError("SNMP Error on %s: Walk of %s does not proceed" %
+                                  (snmp_config.ipaddress, ", ".join(
+                                      _format_oid(column.base_oid) for column in pending)))
+
+        # Like snmpwalk, a walk finding nothing below the OID gets the OID itself. This is
+        # how scalar OIDs like .1.3.6.1.2.1.1.1.0 are walked.
+        empty = [column for column in columns if not column.rows]
+        if empty:
+            responses = session.requests(snmp_config, _GET_REQUEST,
+                                         [[column.base_oid] for column in empty])
+            for column, (error_status, _error_index, varbinds) in zip(empty, responses):
+                if error_status == _NO_ERROR and varbinds:
+                    column.add_base(*varbinds[0])
+
+        return [column.rows for column in columns]
+
+
+class _WalkedColumn(object):  # pylint: disable=useless-object-inheritance
+    def __init__(self, base_oid):
+        # type: (_OIDTuple) -> None
+        super(_WalkedColumn, self).__init__()
+        self.base_oid = base_oid
+        self.last_oid = base_oid
+        self.done = False
+        self.rows = []  # type: SNMPRowInfo
+
+    def add(self, value_oid, tag, content):
+        # type: (_OIDTuple, int, bytes) -> bool
+        """Add the value of a response, whether or not the walk proceeded"""
+        if self.done:
+            return False
+        # Some agents return OIDs not increasing. Stop walking them instead of looping.
+        if (tag == _END_OF_MIB_VIEW or not _is_below(value_oid, self.base_oid) or
+                value_oid <= self.last_oid):
+            self.done = True
+            return True
+        self.last_oid = value_oid
+        if tag not in _NO_VALUE_TYPES:
+            self.rows.append((_format_oid(value_oid), _raw_value(tag, content)))
+        return True
+
+    def add_base(self, value_oid, tag, content):
+        # type: (_OIDTuple, int, bytes) -> None
+        """Add the value of a GET of the base OID"""
+        if value_oid == self.base_oid and tag not in _NO_VALUE_TYPES:
+            self.rows.append((_format_oid(value_oid), _raw_value(tag, content)))
+
+
+def _uses_bulk(snmp_config):
+    # type: (SNMPHostConfig) -> bool
+    return snmp_config.is_bulkwalk_host
+
+
+def _get_session(snmp_config):
+    # type: (SNMPHostConfig) -> _Session
+    family = socket.AF_INET6 if snmp_config.is_ipv6_primary else socket.AF_INET
+    key = (int(family), snmp_config.ipaddress, snmp_config.port)
+    try:
+        return _sessions[key]
+    except KeyError:
+        pass
+
+    session = _Session(family, (snmp_config.ipaddress, snmp_config.port))
+    _sessions[key] = session
+    return session
+
+
+class _Session(object):  # pylint: disable=useless-object-inheritance
+    """The UDP socket to a device and the requests sent from it"""
+    def __init__(self, family, address):
+        # type: (socket.AddressFamily, Tuple[str, int]) -> None
+        super(_Session, self).__init__()
+        self._address = address
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        try:
+            # Only responses from the device are received
+            self._socket.connect(address)
+        except socket.error as e:
+            self._socket.close()
+            raise MKSNMPError("Cannot connect to %s:%d: %s" % (address[0], address[1], e))
+        self._request_ids = itertools.count(random.randint(1, 2**30))
+
+    def close(self):
+        # type: () -> None
+        self._socket.close()
+
+    def request(self, snmp_config, pdu_type, oids):
+        # type: (SNMPHostConfig, int, List[_OIDTuple]) -> _Response
+        return self.requests(snmp_config, pdu_type, [oids])[0]
+
+    def requests(self, snmp_config, pdu_type, oid_lists, max_repetitions=0):
+        # type: (SNMPHostConfig, int, List[List[_OIDTuple]], int) -> List[_Response]
+        """Send the requests at once and wait for all their responses
+
+        Unanswered requests are sent again until the retries are exhausted.
+        """
+        version = _VERSION_2C if (snmp_config.is_bulkwalk_host or
+                                  snmp_config.is_snmpv2or3_without_bulkwalk_host) else _VERSION_1
+        if not isinstance(snmp_config.credentials, str):
+            raise MKSNMPError("SNMPv3 is not supported by the builtin SNMP backend")
+        community = snmp_config.credentials.encode("utf-8")
+        timeout = snmp_config.timing.get("timeout", _DEFAULT_TIMEOUT)
+        retries = snmp_config.timing.get("retries", _DEFAULT_RETRIES)
+
+        messages = {}  # type: Dict[int, bytes]
+        for oids in oid_lists:
+            request_id = next(self._request_ids) % 2**31
+            messages[request_id] = _encode_message(version, community, pdu_type, request_id, 0,
+                                                   max_repetitions, oids)
+
+        responses = {}  # type: Dict[int, _Response]
+        for _attempt in range(retries + 1):
+            for request_id, message in messages.items():
+                if request_id not in responses:
+                    self._send(message)
+            self._receive(responses, messages, timeout)
+            if len(responses) == len(messages):
+                return [responses[request_id] for request_id in messages]
+
+        raise MKSNMPError("SNMP Error on %s: Timeout: No Response from %s" %
+                          (self._address[0], self._address[0]))
+
+    def _send(self, message):
+        # type: (bytes) -> None
+        try:
+            self._socket.send(message)
+        except socket.error as e:
+            raise MKSNMPError("SNMP Error on %s: %s" % (self._address[0], e))
+
+    def _receive(self, responses, messages, timeout):
+        # type: (Dict[int, _Response], Dict[int, bytes], float) -> None
+        deadline = time.time() + timeout
+        while len(responses) < len(messages):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            readable = select.select([self._socket], [], [], remaining)[0]
+            if not readable:
+                return
+            try:
+                data = self._socket.recv(65535)
+            except socket.error as e:
+                if e.errno == errno.ECONNREFUSED:
+                    raise MKSNMPError("SNMP Error on %s: Connection refused" % self._address[0])
+                continue
+
+            try:
+                request_id, error_status, error_index, varbinds = _decode_response(data)
+            except ValueError as e:
+                console.vverbose("Ignoring invalid SNMP response: %s\n" % e)
+                continue
+            # Responses of former attempts of requests already answered are ignored
+            if request_id in messages and request_id not in responses:
+                responses[request_id] = (error_status, error_index, varbinds)
+
+
+#.
+#   .--BER-----------------------------------------------------------------.
+#   |                          ____  _____ ____                            |
+#   |                         | __ )| ____|  _ \                           |
+#   |                         |  _ \|  _| | |_) |                          |
+#   |                         | |_) | |___|  _ <                           |
+#   |                         |____/|_____|_| \_\                          |
+#   |                                                                      |
+#   +----------------------------------------------------------------------+
+#   | Encoding and decoding of the SNMP messages                           |
+#   '----------------------------------------------------------------------'
+
+
+def _parse_oid(oid):
+    # type: (OID) -> _OIDTuple
+    try:
+        return tuple(int(sub_id) for sub_id in oid.strip(".").split("."))
+    except ValueError:
+        raise MKSNMPError("Invalid OID %s" % oid)
+
+
+def _format_oid(oid):
+    # type: (_OIDTuple) -> OID
+    return "." + ".".join(map(str, oid))
+
+
+def _is_below(oid, base_oid):
+    # type: (_OIDTuple, _OIDTuple) -> bool
+    return len(oid) > len(base_oid) and oid[:len(base_oid)] == base_oid
+
+
+def _raw_value(tag, content):
+    # type: (int, bytes) -> RawValue
+    """The value like the net-snmp tools print it with -OQ -OU -On -Ot, after stripping"""
+    if tag == _OCTET_STRING:
+        # Printable strings are written as text and stripped, others as hex bytes
+        if all(byte in _PRINTABLE for byte in content):
+            return content.strip()
+        return content
+    if tag == _INTEGER:
+        return b"%d" % int.from_bytes(content, "big", signed=True)
+    if tag in _UNSIGNED_TYPES:
+        return b"%d" % int.from_bytes(content, "big", signed=False)
+    if tag == _OBJECT_IDENTIFIER:
+        return _format_oid(_decode_oid(content)).encode("ascii")
+    if tag == _IP_ADDRESS:
+        return ".".join(map(str, bytearray(content))).encode("ascii")
+    if tag == _NULL:
+        return b""
+    return content
+
+
+def _encode_length(length):
+    # type: (int) -> bytes
+    if length < 0x80:
+        return bytes([length])
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, "big")
+    return bytes([0x80 | len(encoded)]) + encoded
+
+
+def _encode_tlv(tag, content):
+    # type: (int, bytes) -> bytes
+    return bytes([tag]) + _encode_length(len(content)) + content
+
+
+def _encode_integer(value, tag=_INTEGER):
+    # type: (int, int) -> bytes
+    return _encode_tlv(tag, value.to_bytes(value.bit_length() // 8 + 1, "big", signed=True))
+
+
+def _encode_oid(oid):
+    # type: (Sequence[int]) -> bytes
+    if len(oid) < 2:
+        oid = tuple(oid) + (0,) * (2 - len(oid))
+    encoded = bytearray([40 * oid[0] + oid[1]])
+    for sub_id in oid[2:]:
+        chunk = bytearray([sub_id & 0x7f])
+        sub_id >>= 7
+        while sub_id:
+            chunk.insert(0, 0x80 | (sub_id & 0x7f))
+            sub_id >>= 7
+        encoded += chunk
+    return _encode_tlv(_OBJECT_IDENTIFIER, bytes(encoded))
+
+
+def _encode_message(version,
+                    community,
+                    pdu_type,
+                    request_id,
+                    error_status,
+                    error_index,
+                    oids,
+                    values=None):
+    # type: (int, bytes, int, int, int, int, Sequence[_OIDTuple], Optional[Sequence[Tuple[int, bytes]]]) -> bytes
+    """An SNMP message, the error fields are non-repeaters and max-repetitions of GETBULK"""
+    if values is None:
+        values = [(_NULL, b"")] * len(oids)
+    varbinds = b"".join(
+        _encode_tlv(_SEQUENCE,
+                    _encode_oid(oid) + _encode_tlv(tag, content))
+        for oid, (tag, content) in zip(oids, values))
+    pdu = _encode_tlv(
+        pdu_type,
+        _encode_integer(request_id) + _encode_integer(error_status) + _encode_integer(error_index) +
+        _encode_tlv(_SEQUENCE, varbinds))
+    return _encode_tlv(_SEQUENCE,
+                       _encode_integer(version) + _encode_tlv(_OCTET_STRING, community) + pdu)
+
+
+def _decode_tlv(data, offset):
+    # type: (bytes, int) -> Tuple[int, int, int]
+    """Tag, start and end of the content of the element at the offset"""
+    try:
+        tag = data[offset]
+        length = data[offset + 1]
+        start = offset + 2
+        if length & 0x80:
+            num_bytes = length & 0x7f
+            length = int.from_bytes(data[start:start + num_bytes], "big")
+            start += num_bytes
+    except IndexError:
+        raise ValueError("Truncated element at %d" % offset)
+    end = start + length
+    if end > len(data):
+        raise ValueError("Truncated element at %d" % offset)
+    return tag, start, end
+
+
+def _decode_elements(data, start, end):
+    # type: (bytes, int, int) -> Iterator[Tuple[int, int, int]]
+    offset = start
+    while offset < end:
+        tag, content_start, content_end = _decode_tlv(data, offset)
+        yield tag, content_start, content_end
+        offset = content_end
+
+
+def _decode_integer(content):
+    # type: (bytes) -> int
+    return int.from_bytes(content, "big", signed=True)
+
+
+def _decode_oid(content):
+    # type: (bytes) -> _OIDTuple
+    if not content:
+        return ()
+    oid = list(divmod(content[0], 40)) if content[0] < 80 else [2, content[0] - 80]
+    sub_id = 0
+    for byte in content[1:]:
+        sub_id = (sub_id << 7) | (byte & 0x7f)
+        if not byte & 0x80:
+            oid.append(sub_id)
+            sub_id = 0
+    return tuple(oid)
+
+
+def _decode_message(data):
+    # type: (bytes) -> Tuple[int, bytes, int, int, int, int, List[_VarBind]]
+    """Version, community, PDU type, request ID, the two error fields and the bindings"""
+    tag, start, end = _decode_tlv(data, 0)
+    if tag != _SEQUENCE:
+        raise ValueError("Not an SNMP message")
+
+    elements = list(_decode_elements(data, start, end))
+    if len(elements) != 3 or elements[0][0] != _INTEGER or elements[1][0] != _OCTET_STRING:
+        raise ValueError("Not an SNMP message")
+    version = _decode_integer(data[elements[0][1]:elements[0][2]])
+    community = data[elements[1][1]:elements[1][2]]
+
+    pdu_type, pdu_start, pdu_end = elements[2]
+    fields = list(_decode_elements(data, pdu_start, pdu_end))
+    if len(fields) != 4 or fields[3][0] != _SEQUENCE:
+        raise ValueError("Invalid PDU")
+    request_id, error_status, error_index = (
+        _decode_integer(data[field_start:field_end]) for _tag, field_start, field_end in fields[:3])
+
+    varbinds = []  # type: List[_VarBind]
+    for _tag, varbind_start, varbind_end in _decode_elements(data, fields[3][1], fields[3][2]):
+        varbind = list(_decode_elements(data, varbind_start, varbind_end))
+        if len(varbind) != 2 or varbind[0][0] != _OBJECT_IDENTIFIER:
+            raise ValueError("Invalid variable binding")
+        (_oid_tag, oid_start, oid_end), (value_tag, value_start, value_end) = varbind
+        varbinds.append(
+            (_decode_oid(data[oid_start:oid_end]), value_tag, data[value_start:value_end]))
+
+    return version, community, pdu_type, request_id, error_status, error_index, varbinds
+
+
+def _decode_response(data):
+    # type: (bytes) -> Tuple[int, int, int, List[_VarBind]]
+    _version, _community, pdu_type, request_id, error_status, error_index, varbinds = (
+        _decode_message(data))
+    if pdu_type != _RESPONSE:
+        raise ValueError("Not a response PDU")
+    return request_id, error_status, error_index, varbinds
@@ -5,19 +5,24 @@
 # conditions defined in the file COPYING, which is part of this source code package.
 """Abstract classes and types."""
 
-from typing import List, Optional, Tuple
-
-from six import ensure_binary, ensure_str
+import array
+import bisect
+import errno
+import mmap
+import os
+import struct
+from typing import Dict, List, Optional, Tuple, Union
 
 import cmk.utils.agent_simulator as agent_simulator
 import cmk.utils.paths
-import cmk.utils.snmp_cache as snmp_cache
+import cmk.utils.store as store
 from cmk.utils.exceptions import MKGeneralException, MKSNMPError
 from cmk.utils.log import console
 from cmk.utils.type_defs import (
     ABCSNMPBackend,
     CheckPluginName,
     ContextName,
+    HostName,
     OID,
     RawValue,
     SNMPHostConfig,
@@ -26,20 +31,28 @@ from cmk.utils.type_defs import (
 
 from ._utils import strip_snmp_value
 
-__all__ = ["StoredWalkSNMPBackend"]
+__all__ = ["StoredWalkSNMPBackend", "cleanup_stored_walk_cache"]
+
+_Buffer = Union[bytes, mmap.mmap]
+_WalkIndex = Tuple["_OIDKeys", _Buffer, int, array.array, array.array, array.array]
+
+# The stored walks opened by this process, cleaned up after each host
+_walk_cache = {}  # type: Dict[HostName, StoredWalk]
+
+
+def cleanup_stored_walk_cache():
+    # type: () -> None
+    global _walk_cache
+    _walk_cache = {}
 
 
 class StoredWalkSNMPBackend(ABCSNMPBackend):
     def get(self, snmp_config, oid, context_name=None):
         # type: (SNMPHostConfig, OID, Optional[ContextName]) -> Optional[RawValue]
-        walk = self.walk(snmp_config, oid)
-        # get_stored_snmpwalk returns all oids that start with oid but here
-        # we need an exact match
-        if len(walk) == 1 and oid == walk[0][0]:
-            return walk[0][1]
-        if oid.endswith(".*") and len(walk) > 0:
-            return walk[0][1]
-        return None
+        if oid.endswith(".*"):
+            rows = self.walk(snmp_config, oid)
+            return rows[0][1] if rows else None
+        return self._get_stored_walk(snmp_config.hostname).get(oid)
 
     def walk(self,
              snmp_config,
@@ -48,101 +61,228 @@ class StoredWalkSNMPBackend(ABCSNMPBackend):
              table_base_oid=None,
              context_name=None):
         # type: (SNMPHostConfig, OID, Optional[CheckPluginName], Optional[OID], Optional[ContextName]) -> SNMPRowInfo
-        if oid.startswith("."):
-            oid = oid[1:]
+        stored_walk = self._get_stored_walk(snmp_config.hostname)
+        console.vverbose("  Loading %s from %s\n" % (oid, stored_walk.path))
 
         if oid.endswith(".*"):
-            oid_prefix = oid[:-2]
-            dot_star = True
-        else:
-            oid_prefix = oid
-            dot_star = False
-
-        path = cmk.utils.paths.snmpwalks_dir + "/" + snmp_config.hostname
-
-        console.vverbose("  Loading %s from %s\n" % (oid, path))
-
-        if snmp_cache.host_cache_contains(snmp_config.hostname):
-            lines = snmp_cache.host_cache_get(snmp_config.hostname)
-        else:
-            try:
-                lines = open(path).readlines()
-            except IOError:
-                raise MKSNMPError("No snmpwalk file %s" % path)
-            snmp_cache.host_cache_set(snmp_config.hostname, lines)
-
-        begin = 0
-        end = len(lines)
-        hit = None
-        while end - begin > 0:
-            current = (begin + end) // 2
-            # skip over values including newlines to the next oid
-            while not lines[current].startswith(".") and current < end:
-                current += 1
-            parts = lines[current].split(None, 1)
-            comp = parts[0]
-            hit = self._compare_oids(oid_prefix, comp)
-            if hit == 0:
-                break
-            if hit == 1:  # we are too low
-                begin = current + 1
-            else:
-                end = current
-
-        if hit != 0:
-            return []  # not found
-
-        rowinfo = self._collect_until(oid, oid_prefix, lines, current, -1)
-        rowinfo.reverse()
-        rowinfo += self._collect_until(oid, oid_prefix, lines, current + 1, 1)
-
-        if dot_star:
-            return [rowinfo[0]]
-
-        return rowinfo
-
-    def _compare_oids(self, a, b):
-        # type: (OID, OID) -> int
-        aa = self._to_bin_string(a)
-        bb = self._to_bin_string(b)
-        if len(aa) <= len(bb) and bb[:len(aa)] == aa:
-            result = 0
-        else:
-            result = (aa > bb) - (aa < bb)
-        return result
-
-    def _to_bin_string(self, oid):
-        # type: (OID) -> Tuple[int, ...]
+            return stored_walk.walk(oid[:-2], include_base=False)[:1]
+        return stored_walk.walk(oid, include_base=True)
+
+    def _get_stored_walk(self, hostname):
+        # type: (HostName) -> StoredWalk
+        try:
+            return _walk_cache[hostname]
+        except KeyError:
+            pass
+
+        stored_walk = StoredWalk(cmk.utils.paths.snmpwalks_dir + "/" + hostname)
+        _walk_cache[hostname] = stored_walk
+        return stored_walk
+
+
+class StoredWalk(object):  # pylint: disable=useless-object-inheritance
+    """A walk file written by "cmk --snmpwalk" together with a sorted OID index
+
+    The index is built once per walk file and stored next to it. It is built again
+    when the walk file has been modified. It is mapped into memory and holds:
+
+    * the OIDs as sequences of 32 bit big endian integers, sorted by OID. These keys
+      compare like the OIDs and make "is below OID" a prefix test.
+    * per OID the OID as written in the walk and the already stripped value
+
+    Values containing agent simulator functions are stored as they are and are
+    processed on each access.
+    """
+    _MAGIC = b"CMKSWIX2"
+    # magic, mtime and size of the walk file, number of OIDs
+    _HEADER = struct.Struct("=8sqQQ")
+    _ARRAY_TYPE = "I"
+
+    def __init__(self, path):
+        # type: (str) -> None
+        super(StoredWalk, self).__init__()
+        self.path = path
+        self.index_path = os.path.join(os.path.dirname(path), ".%s.index" % os.path.basename(path))
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise MKSNMPError("No snmpwalk file %s" % path)
+
+        walk_id = (stat.st_mtime_ns, stat.st_size)
+        index = self._load_index(walk_id)
+        if index is None:
+            index = self._build_index(walk_id)
+        (self._keys, self._buffer, self._data_start, self._data_offsets, self._value_offsets,
+         self._dynamic) = index
+
+    @staticmethod
+    def _map(fileno, size):
+        # type: (int, int) -> _Buffer
+        if not size:
+            return b""
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_READ)
+
+    def get(self, oid):
+        # type: (OID) -> Optional[RawValue]
+        key = _oid_key(oid.encode("ascii"))
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            return self._value(index)
+        return None
+
+    def walk(self, oid, include_base):
+        # type: (OID, bool) -> SNMPRowInfo
+        """All rows of the OID and below in the order of the OIDs"""
+        key = _oid_key(oid.encode("ascii"))
+        start = bisect.bisect_left(self._keys, key)
+        successor = _successor(key)
+        end = len(self._keys) if successor is None else bisect.bisect_left(
+            self._keys, successor, start)
+        if not include_base and start < end and self._keys[start] == key:
+            start += 1
+
+        data_start = self._data_start
+        data_offsets = self._data_offsets
+        value_offsets = self._value_offsets
+        return [(
+            self._buffer[data_start + data_offsets[index]:data_start +
+                         value_offsets[index]].decode("ascii"),
+            self._value(index),
+        ) for index in range(start, end)]
+
+    def _value(self, index):
+        # type: (int) -> RawValue
+        value = self._buffer[self._data_start + self._value_offsets[index]:self._data_start +
+                             self._data_offsets[index + 1]]
+        if self._dynamic[index]:
+            return _strip_value(agent_simulator.process(value))
+        return value
+
+    def _load_index(self, walk_id):
+        # type: (Tuple[int, int]) -> Optional[_WalkIndex]
+        try:
+            with open(self.index_path, "rb") as f:
+                buf = self._map(f.fileno(), os.fstat(f.fileno()).st_size)
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+        if len(buf) < self._HEADER.size:
+            return None  # Is just being written by another process
+
+        magic, mtime_ns, size, count = self._HEADER.unpack_from(buf)
+        if magic != self._MAGIC or (mtime_ns, size) != walk_id:
+            return None
+        return self._parse_index(buf, count)
+
+    def _parse_index(self, buf, count):
+        # type: (_Buffer, int) -> _WalkIndex
+        arrays = []
+        offset = self._HEADER.size
+        for type_code, length in [
+            (self._ARRAY_TYPE, count + 1),
+            (self._ARRAY_TYPE, count + 1),
+            (self._ARRAY_TYPE, count),
+            ("B", count),
+        ]:
+            arr = array.array(type_code)
+            end = offset + length * arr.itemsize
+            arr.frombytes(buf[offset:end])
+            arrays.append(arr)
+            offset = end
+
+        key_offsets, data_offsets, value_offsets, dynamic = arrays
+        return (_OIDKeys(buf, offset, key_offsets), buf, offset + key_offsets[-1], data_offsets,
+                value_offsets, dynamic)
+
+    def _build_index(self, walk_id):
+        # type: (Tuple[int, int]) -> _WalkIndex
+        console.vverbose("  Indexing %s\n" % self.path)
         try:
-            return tuple(map(int, oid.strip(".").split(".")))
-        except Exception:
-            raise MKGeneralException("Invalid OID %s" % oid)
-
-    def _collect_until(self, oid, oid_prefix, lines, index, direction):
-        # type: (OID, OID, List[str], int, int) -> SNMPRowInfo
-        rows = []
-        # Handle case, where we run after the end of the lines list
-        if index >= len(lines):
-            if direction > 0:
-                return []
-            index -= 1
-        while True:
-            line = lines[index]
+            with open(self.path, "rb") as f:
+                walk = f.read()
+        except IOError:
+            raise MKSNMPError("No snmpwalk file %s" % self.path)
+
+        entries = []  # type: List[Tuple[bytes, bytes, bytes, bool]]
+        for line in walk.split(b"\n"):
+            # Lines not starting with a dot are continuation lines of multi line values
+            if not line.startswith(b"."):
+                continue
+
             parts = line.split(None, 1)
-            o = parts[0]
-            if o.startswith('.'):
-                o = o[1:]
-            if o == oid or o.startswith(oid_prefix + "."):
-                if len(parts) > 1:
-                    # FIXME: This encoding ping-pong os horrible...
-                    value = ensure_str(agent_simulator.process(ensure_binary(parts[1])))
-                else:
-                    value = ""
-                # Fix for missing starting oids
-                rows.append(('.' + o, strip_snmp_value(value)))
-                index += direction
-                if index < 0 or index >= len(lines):
-                    break
-            else:
-                break
-        return rows
+            value = parts[1] if len(parts) > 1 else b""
+            dynamic = b"%{" in value
+            entries.append(
+                (_oid_key(parts[0]), parts[0], value if dynamic else _strip_value(value), dynamic))
+        entries.sort(key=lambda entry: entry[0])
+
+        key_offsets = array.array(self._ARRAY_TYPE, [0])
+        data_offsets = array.array(self._ARRAY_TYPE, [0])
+        value_offsets = array.array(self._ARRAY_TYPE)
+        for key, oid, value, _dynamic in entries:
+            key_offsets.append(key_offsets[-1] + len(key))
+            value_offsets.append(data_offsets[-1] + len(oid))
+            data_offsets.append(value_offsets[-1] + len(value))
+
+        index = b"".join([
+            self._HEADER.pack(self._MAGIC, walk_id[0], walk_id[1], len(entries)),
+            key_offsets.tobytes(),
+            data_offsets.tobytes(),
+            value_offsets.tobytes(),
+            array.array("B", [entry[3] for entry in entries]).tobytes(),
+            b"".join(entry[0] for entry in entries),
+            b"".join(entry[1] + entry[2] for entry in entries),
+        ])
+
+        try:
+            store.save_bytes_to_file(self.index_path, index)
+        except (IOError, OSError) as e:
+            # Use the index anyway, it only has to be built again by the next process
+            console.verbose("Cannot write SNMP walk index %s: %s\n" % (self.index_path, e))
+
+        return self._parse_index(index, len(entries))
+
+
+class _OIDKeys(object):  # pylint: disable=useless-object-inheritance
+    """The sorted OID keys of a walk index as a sequence which bisect can work with"""
+    def __init__(self, buf, blob_offset, key_offsets):
+        # type: (_Buffer, int, array.array) -> None
+        super(_OIDKeys, self).__init__()
+        self._buffer = buf
+        self._blob_offset = blob_offset
+        self._key_offsets = key_offsets
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._key_offsets) - 1
+
+    def __getitem__(self, index):
+        # type: (int) -> bytes
+        return self._buffer[self._blob_offset + self._key_offsets[index]:self._blob_offset +
+                            self._key_offsets[index + 1]]
+
+
+def _oid_key(oid):
+    # type: (bytes) -> bytes
+    try:
+        sub_ids = [int(sub_id) for sub_id in oid.strip(b".").split(b".")]
+        return struct.pack(">%dI" % len(sub_ids), *sub_ids)
+    except (ValueError, struct.error):
+        raise MKGeneralException("Invalid OID %s" % oid.decode("ascii", "replace"))
+
+
+def _successor(key):
+    # type: (bytes) -> Optional[bytes]
+    """The smallest key which is greater than all keys starting with the given one"""
+    stripped = key.rstrip(b"\xff")
+    if not stripped:
+        return None
+    return stripped[:-1] + bytes([stripped[-1] + 1])
+
+
+def _strip_value(value):
+    # type: (bytes) -> RawValue
+    return strip_snmp_value(value.decode("utf-8"))
@@ -4,11 +4,12 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
+import asyncio
 import logging
 import socket
 from hashlib import sha256, md5
 from types import TracebackType
-from typing import Dict, List, Optional, Tuple, Type
+from typing import Dict, Hashable, List, Optional, Tuple, Type, TypeVar, Union
 
 from Cryptodome.Cipher import AES
 
@@ -17,6 +18,8 @@ from cmk.utils.type_defs import HostAddress, RawAgentData
 
 from ._base import AbstractDataFetcher, MKFetcherError
 
+_Key = TypeVar("_Key", bound=Hashable)
+
 
 class TCPDataFetcher(AbstractDataFetcher):
     def __init__(
@@ -86,6 +89,37 @@ class TCPDataFetcher(AbstractDataFetcher):
                 raise
             raise MKFetcherError("Communication failed: %s" % e)
 
+    async def async_data(self):
+        # type: () -> RawAgentData
+        """Connect, read and decrypt like data() does, without blocking the event loop"""
+        self._logger.debug("Connecting via TCP to %s:%d (%ss timeout)", self._address[0],
+                           self._address[1], self._timeout)
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(self._address[0], self._address[1], family=self._family),
+                self._timeout)
+        except (OSError, asyncio.TimeoutError):
+            raise MKFetcherError("Not connected")
+
+        self._logger.debug("Reading data from agent")
+        buffer = []  # type: List[bytes]
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                buffer.append(data)
+        except OSError as e:
+            if cmk.utils.debug.enabled():
+                raise
+            raise MKFetcherError("Communication failed: %s" % e)
+        finally:
+            self._logger.debug("Closing TCP connection to %s:%d", self._address[0],
+                               self._address[1])
+            writer.close()
+
+        return self._decrypt(b"".join(buffer))
+
     def _decrypt(self, output):
         # type: (RawAgentData) -> RawAgentData
         if output.startswith(b"<<<"):
@@ -141,3 +175,33 @@ class TCPDataFetcher(AbstractDataFetcher):
         decrypted_pkg = decryption_suite.decrypt(encrypted_pkg)
         # Strip of fill bytes of openssl
         return decrypted_pkg[0:-decrypted_pkg[-1]]
+
+
+def fetch_concurrently(fetchers, max_concurrency, timeout):
+    # type: (Dict[_Key, TCPDataFetcher], int, Optional[float]) -> Dict[_Key, Union[RawAgentData, Exception]]
+    """Fetch the data of many agents at the same time
+
+    At most max_concurrency agents are contacted at once. Fetching the data of a single
+    agent is given up after timeout seconds. Instead of raising, the errors of the
+    single agents are returned in place of their data.
+    """
+    async def fetch(semaphore, fetcher):
+        # type: (asyncio.Semaphore, TCPDataFetcher) -> Union[RawAgentData, Exception]
+        async with semaphore:
+            try:
+                return await asyncio.wait_for(fetcher.async_data(), timeout)
+            except asyncio.TimeoutError:
+                return MKFetcherError("Timeout after %.1f seconds" % timeout)
+            except Exception as e:
+                return e
+
+    async def fetch_all():
+        # type: () -> Dict[_Key, Union[RawAgentData, Exception]]
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        keys = list(fetchers)
+        results = await asyncio.gather(*[fetch(semaphore, fetchers[key]) for key in keys])
+        return dict(zip(keys, results))
+
+    if not fetchers:
+        return {}
+    return asyncio.run(fetch_all())
@@ -7,9 +7,12 @@
 from __future__ import division
 import time
 import os
+import itertools
+import operator
 
 from typing import Callable, Set, Dict, Any, Union, List, Tuple as _Tuple, Optional as _Optional
 import six
+import numpy as np  # type: ignore[import]
 
 from livestatus import SiteId
 
@@ -832,152 +835,372 @@ def spans_by_object(spans, logrow_limit_reached_entry):
 def compute_availability(what, av_rawdata, avoptions):
     # type: (AVObjectType, AVRawData, AVOptions) -> AVData
     reclassified_rawdata = reclassify_by_annotations(what, av_rawdata)
+    availability_table = _compute_availability_table(what, reclassified_rawdata, avoptions)
 
-    # Now compute availability table. We have the following possible states:
-    # 1. "unmonitored"
-    # 2. monitored -->
-    #    2.1 "outof_service_period"
-    #    2.2 in service period -->
-    #        2.2.1 "outof_notification_period"
-    #        2.2.2 in notification period -->
-    #             2.2.2.1 "in_downtime" (also in_host_downtime)
-    #             2.2.2.2 not in downtime -->
-    #                   2.2.2.2.1 "host_down"
-    #                   2.2.2.2.2 host not down -->
-    #                        2.2.2.2.2.1 "ok"
-    #                        2.2.2.2.2.2 "warn"
-    #                        2.2.2.2.2.3 "crit"
-    #                        2.2.2.2.2.4 "unknown"
-    availability_table = []  # type: AVData
-    os_aggrs, os_states = get_outage_statistic_options(avoptions)
-    need_statistics = os_aggrs and os_states
-    grouping = avoptions["grouping"]
+    # Apply filters
+    filtered_table = []  # Type: AVData
+    for row in sorted(availability_table, key=key_av_entry):
+        if pass_availability_filter(row, avoptions):
+            filtered_table.append(row)
+    return filtered_table
 
-    # Note: in case of timeline, we have data from exacly one host/service
-    for site_host, site_host_entry in reclassified_rawdata.items():
-        for service, service_entry in site_host_entry.items():
 
-            if grouping == "host":
-                group_ids = [site_host]  # type: AVGroupIds
-            elif grouping in ["host_groups", "service_groups"]:
-                group_ids = set()
-            else:
-                group_ids = None
+# The spans of all objects are processed column wise: Each span attribute which is needed for the
+# computation is put into a NumPy array, the spans of one object being consecutive. The timelines
+# of all objects are then classified, merged and melted at once instead of object by object.
+def _compute_availability_table(what, av_rawdata, avoptions):
+    # type: (AVObjectType, AVRawData, AVOptions) -> AVData
+    objects = [(site_host, service, service_entry)
+               for site_host, site_host_entry in av_rawdata.items()
+               for service, service_entry in site_host_entry.items()
+               if service_entry]
+    spans = [span for _site_host, _service, service_entry in objects for span in service_entry]
+    if not spans:
+        return []
+
+    spans_per_object = np.array(
+        [len(service_entry) for _site_host, _service, service_entry in objects])
+    object_ids = np.repeat(np.arange(len(objects)), spans_per_object)
+    object_starts = np.cumsum(spans_per_object) - spans_per_object
+    columns = _span_columns(spans)
+    durations = columns["duration"]
+    state_names, state_ids, consider = _classify_spans(what, columns, avoptions)
+
+    total_durations = np.add.reduceat(durations, object_starts).tolist()
+    considered_durations = np.add.reduceat(np.where(consider, durations, 0), object_starts).tolist()
+
+    timeline = _AVTimeline(state_names, object_ids[consider], np.flatnonzero(consider),
+                           state_ids[consider], columns["from"][consider],
+                           columns["until"][consider], durations[consider])
+
+    # Now merge consecutive rows with identical state
+    if not avoptions["dont_merge"]:
+        timeline = timeline.merge(spans)
+
+    # Melt down short intervals
+    if avoptions["short_intervals"]:
+        timeline = timeline.melt_short_intervals(spans, avoptions["short_intervals"],
+                                                 avoptions["dont_merge"])
 
-            # First compute timeline
-            timeline_rows = []  # type:  AVTimelineRows
-            total_duration = 0
-            considered_duration = 0
-            for span in service_entry:
+    os_aggrs, os_states = get_outage_statistic_options(avoptions)
+    need_statistics = bool(os_aggrs and os_states)
+    states_of_objects, statistics_of_objects = timeline.condense(len(objects), need_statistics)
+    timelines_of_objects = timeline.rows_of_objects(len(objects), spans)
 
-                # Information about host/service groups are in the actual entries
-                if grouping in ["host_groups", "service_groups"] and what != "bi":
-                    assert isinstance(group_ids, set)
+    availability_table = []  # type: AVData
+    grouping = avoptions["grouping"]
+    for index, (site_host, service, service_entry) in enumerate(objects):
+        if grouping == "host":
+            group_ids = [site_host]  # type: AVGroupIds
+        elif grouping in ["host_groups", "service_groups"]:
+            group_ids = set()
+            # Information about host/service groups are in the actual entries
+            if what != "bi":
+                for span in service_entry:
                     group_ids.update(span[grouping])  # List of host/service groups
+        else:
+            group_ids = None
+
+        last_span = service_entry[-1]
+        availability_entry = {
+            "site": site_host[0],
+            "host": site_host[1],
+            "alias": last_span.get("host_alias", site_host[1]),
+            "service": service,
+            "display_name": last_span.get("service_display_name", service),
+            "states": states_of_objects[index],
+            "considered_duration": considered_durations[index],
+            "total_duration": total_durations[index],
+            "statistics": statistics_of_objects[index],
+            "groups": group_ids,
+            "timeline": timelines_of_objects[index],
+        }  # type: AVEntry
+        availability_table.append(availability_entry)
+
+    return availability_table
+
+
+# The numeric span attributes which are needed for the computation
+_AV_SPAN_COLUMNS = [
+    "from",
+    "until",
+    "duration",
+    "in_service_period",
+    "in_notification_period",
+    "in_downtime",
+    "in_host_downtime",
+    "host_down",
+    "is_flapping",
+]
+
+
+def _span_columns(spans):
+    # type: (List[AVSpan]) -> Dict[str, np.ndarray]
+    # Fetching all values of a span at once is way faster than fetching column by column
+    values = np.fromiter(
+        itertools.chain.from_iterable(map(operator.itemgetter(*_AV_SPAN_COLUMNS), spans)),
+        dtype=float,
+        count=len(spans) * len(_AV_SPAN_COLUMNS)).reshape(len(spans), len(_AV_SPAN_COLUMNS))
+    # Keep the integer durations and time stamps of the spans, which they usually are
+    if (values == np.floor(values)).all():
+        values = values.astype(np.int64)
+    columns = dict(zip(_AV_SPAN_COLUMNS, values.T))
+    states = [span["state"] for span in spans]
+    # state is None means that this element was not known at this given time
+    columns["unknown_state"] = np.array([state is None for state in states], dtype=bool)
+    columns["state"] = np.array([-1 if state is None else state for state in states], dtype=int)
+    return columns
+
+
+# We have the following possible states:
+# 1. "unmonitored"
+# 2. monitored -->
+#    2.1 "outof_service_period"
+#    2.2 in service period -->
+#        2.2.1 "outof_notification_period"
+#        2.2.2 in notification period -->
+#             2.2.2.1 "in_downtime" (also in_host_downtime)
+#             2.2.2.2 not in downtime -->
+#                   2.2.2.2.1 "host_down"
+#                   2.2.2.2.2 host not down -->
+#                        2.2.2.2.2.1 "ok"
+#                        2.2.2.2.2.2 "warn"
+#                        2.2.2.2.2.3 "crit"
+#                        2.2.2.2.2.4 "unknown"
+# The state names are numbered, the spans get the index of their state name (-1 for spans which
+# are not considered). Returns the state names, the state ids of the spans and whether or not
+# the spans are considered at all. The first matching rule decides about a span.
+def _classify_spans(what, columns, avoptions):
+    # type: (AVObjectType, Dict[str, np.ndarray], AVOptions) -> _Tuple[List[AVTimelineStateName], np.ndarray, np.ndarray]
+    states = columns["state"]
+    unknown_state = columns["unknown_state"]
+    num_spans = len(states)
+
+    state_names = []  # type: List[AVTimelineStateName]
+
+    def state_id(state_name):
+        # type: (_Optional[AVTimelineStateName]) -> int
+        if state_name is None:
+            return -1
+        if state_name not in state_names:
+            state_names.append(state_name)
+        return state_names.index(state_name)
+
+    state_ids = np.empty(num_spans, dtype=int)
+    for state in np.unique(states).tolist():
+        state_ids[states == state] = state_id(_state_name(what, state, avoptions))
+    consider = np.ones(num_spans, dtype=bool)
+    undecided = np.ones(num_spans, dtype=bool)
+
+    def decide(matches, state_name, considered):
+        # type: (np.ndarray, _Optional[AVTimelineStateName], bool) -> None
+        matches = matches & undecided
+        state_ids[matches] = state_id(state_name)
+        consider[matches] = considered
+        undecided[matches] = False
+
+    service_period = avoptions["service_period"]
+    if service_period != "ignore":
+        in_service_period = columns["in_service_period"].astype(bool)
+        decide(~in_service_period if service_period == "honor" else in_service_period,
+               "outof_service_period", False)
+
+    decide((states == -1) & ~unknown_state, "unmonitored", avoptions["consider"]["unmonitored"])
+    # There is no reason for creating a fake pending state for unknown elements
+    decide(unknown_state, None, False)
+
+    notification_period = avoptions["notification_period"]
+    if notification_period in ["exclude", "honor"]:
+        outof_notification_period = columns["in_notification_period"] == 0
+        if notification_period == "exclude":
+            decide(outof_notification_period, None, False)
+        else:
+            decide(outof_notification_period, "outof_notification_period", True)
+
+    downtimes = avoptions["downtimes"]
+    if downtimes["include"] != "ignore":
+        in_downtime = (columns["in_downtime"].astype(bool) |
+                       columns["in_host_downtime"].astype(bool))
+        if downtimes["exclude_ok"]:
+            in_downtime &= states != 0
+        if downtimes["include"] == "exclude":
+            decide(in_downtime, None, False)
+        else:
+            decide(in_downtime, "in_downtime", True)
 
-                display_name = span.get("service_display_name", service)
-                state = span["state"]
-                host_alias = span.get("host_alias", site_host[1])
-                consider = True
-
-                if avoptions["service_period"] != "ignore" and (
-                    (span["in_service_period"] and avoptions["service_period"] != "honor") or
-                    (not span["in_service_period"] and avoptions["service_period"] == "honor")):
-                    s = "outof_service_period"
-                    consider = False
-                elif state == -1:
-                    s = "unmonitored"
-                    if not avoptions["consider"]["unmonitored"]:
-                        consider = False
-                elif state is None:
-                    # state is None means that this element was not known at this given time
-                    # So there is no reason for creating a fake pending state
-                    consider = False
-                elif span["in_notification_period"] == 0 and avoptions[
-                        "notification_period"] == "exclude":
-                    consider = False
-
-                elif span["in_notification_period"] == 0 and avoptions[
-                        "notification_period"] == "honor":
-                    s = "outof_notification_period"
-
-                elif (span["in_downtime"] or span["in_host_downtime"]
-                     ) and not (avoptions["downtimes"]["exclude_ok"] and
-                                state == 0) and not avoptions["downtimes"]["include"] == "ignore":
-                    if avoptions["downtimes"]["include"] == "exclude":
-                        consider = False
-                    else:
-                        s = "in_downtime"
-                elif what != "host" and span["host_down"] and avoptions["consider"]["host_down"]:
-                    # Reclassification due to state grouping
-                    s = avoptions["state_grouping"].get("host_down", "host_down")
+    if what != "host" and avoptions["consider"]["host_down"]:
+        # Reclassification due to state grouping
+        decide(columns["host_down"].astype(bool),
+               avoptions["state_grouping"].get("host_down", "host_down"), True)
 
-                elif span["is_flapping"] and avoptions["consider"]["flapping"]:
-                    s = "flapping"
-                else:
-                    if what in ["service", "bi"]:
-                        s = {0: "ok", 1: "warn", 2: "crit", 3: "unknown"}.get(state, "unmonitored")
-                    else:
-                        s = {0: "up", 1: "down", 2: "unreach"}.get(state, "unmonitored")
-
-                    # Reclassification due to state grouping
-                    if s in avoptions["state_grouping"]:
-                        s = avoptions["state_grouping"][s]
-
-                    elif s in avoptions["host_state_grouping"]:
-                        s = avoptions["host_state_grouping"][s]
-
-                total_duration += span["duration"]
-                if consider:
-                    timeline_rows.append((span, s))
-                    considered_duration += span["duration"]
-
-            # Now merge consecutive rows with identical state
-            if not avoptions["dont_merge"]:
-                merge_timeline(timeline_rows)
-
-            # Melt down short intervals
-            if avoptions["short_intervals"]:
-                melt_short_intervals(timeline_rows, avoptions["short_intervals"],
-                                     avoptions["dont_merge"])
-
-            # Condense into availability
-            states = {}  # type: AVTimelineStates
-            statistics = {}  # type: AVTimelineStatistics
-            for span, s in timeline_rows:
-                states.setdefault(s, 0)
-                duration = span["duration"]
-                states[s] += duration
-                if need_statistics:
-                    entry = statistics.get(s)
-                    if entry:
-                        statistics[s] = (entry[0] + 1, min(entry[1],
-                                                           duration), max(entry[2], duration))
-                    else:
-                        statistics[s] = (1, duration, duration)  # count, min, max
-
-            availability_entry = {
-                "site": site_host[0],
-                "host": site_host[1],
-                "alias": host_alias,
-                "service": service,
-                "display_name": display_name,
-                "states": states,
-                "considered_duration": considered_duration,
-                "total_duration": total_duration,
-                "statistics": statistics,
-                "groups": group_ids,
-                "timeline": timeline_rows,
-            }  # type: AVEntry
-
-            availability_table.append(availability_entry)
+    if avoptions["consider"]["flapping"]:
+        decide(columns["is_flapping"].astype(bool), "flapping", True)
 
-    # Apply filters
-    filtered_table = []  # Type: AVData
-    for row in sorted(availability_table, key=key_av_entry):
-        if pass_availability_filter(row, avoptions):
-            filtered_table.append(row)
-    return filtered_table
+    state_ids[~consider] = -1
+    return state_names, state_ids, consider
+
+
+def _state_name(what, state, avoptions):
+    # type: (AVObjectType, int, AVOptions) -> AVTimelineStateName
+    if what in ["service", "bi"]:
+        s = {0: "ok", 1: "warn", 2: "crit", 3: "unknown"}.get(state, "unmonitored")
+    else:
+        s = {0: "up", 1: "down", 2: "unreach"}.get(state, "unmonitored")
+
+    # Reclassification due to state grouping
+    if s in avoptions["state_grouping"]:
+        return avoptions["state_grouping"][s]
+    if s in avoptions["host_state_grouping"]:
+        return avoptions["host_state_grouping"][s]
+    return s
+
+
+class _AVTimeline(object):
+    """The considered timeline rows of all objects in columns, ordered like the spans
+
+    The rows refer to their spans by index and to their state names by the index in the list
+    of state names. Merging rows modifies the duration and until time of the span of the first
+    row of the merged rows, just like merge_timeline() does."""
+    def __init__(self, state_names, object_ids, span_indices, state_ids, from_times, until_times,
+                 durations):
+        # type: (List[AVTimelineStateName], np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray) -> None
+        super(_AVTimeline, self).__init__()
+        self.state_names = state_names
+        self.object_ids = object_ids
+        self.span_indices = span_indices
+        self.state_ids = state_ids
+        self.from_times = from_times
+        self.until_times = until_times
+        self.durations = durations
+
+    def __len__(self):
+        # type: () -> int
+        return len(self.object_ids)
+
+    def _same_object_as_previous(self):
+        # type: () -> np.ndarray
+        return self.object_ids[1:] == self.object_ids[:-1]
+
+    def merge(self, spans):
+        # type: (List[AVSpan]) -> _AVTimeline
+        """Merge consecutive rows of an object with same state"""
+        if len(self) < 2:
+            return self
+
+        merge_with_previous = (self._same_object_as_previous() &
+                               (self.state_ids[1:] == self.state_ids[:-1]) &
+                               (self.from_times[1:] == self.until_times[:-1]))
+        if not merge_with_previous.any():
+            return self
+
+        first_rows = np.flatnonzero(np.concatenate(([True], ~merge_with_previous)))
+        last_rows = np.append(first_rows[1:] - 1, len(self) - 1)
+        durations = np.add.reduceat(self.durations, first_rows)
+        until_times = self.until_times[last_rows]
+
+        for span_index, duration, until in zip(
+                self.span_indices[first_rows][first_rows != last_rows].tolist(),
+                durations[first_rows != last_rows].tolist(),
+                until_times[first_rows != last_rows].tolist()):
+            spans[span_index]["duration"] = duration
+            spans[span_index]["until"] = until
+
+        return _AVTimeline(self.state_names, self.object_ids[first_rows],
+                           self.span_indices[first_rows], self.state_ids[first_rows],
+                           self.from_times[first_rows], until_times, durations)
+
+    def melt_short_intervals(self, spans, duration, dont_merge):
+        # type: (List[AVSpan], int, bool) -> _AVTimeline
+        """Give short rows the state of their neighbours in case both neighbours are equal
+
+        Like in melt_short_intervals() the rows of an object are processed from the second to
+        the last but one: A row gets the state of its predecessor in case the predecessor and the
+        successor have the same state. If a row changes its state, the next row compares its
+        successor to the new state of the row, which is its own state then. Because of that, only
+        every second row of a sequence of rows which would change their state does so."""
+        timeline = self
+        while len(timeline) > 2:
+            state_ids = timeline.state_ids
+            from_times = timeline.from_times
+            until_times = timeline.until_times
+            same_object = timeline._same_object_as_previous()
+
+            melt = np.zeros(len(timeline), dtype=bool)
+            melt[1:-1] = (same_object[:-1] & same_object[1:] &
+                          (timeline.durations[1:-1] <= duration) &
+                          ((until_times[:-2] == from_times[1:-1]) |
+                           (until_times[1:-1] == from_times[2:])) &
+                          (state_ids[:-2] == state_ids[2:]))
+            if not melt.any():
+                break
+
+            changes = np.zeros(len(timeline), dtype=bool)
+            changes[1:] = melt[1:] & (state_ids[:-1] != state_ids[1:])
+            sequence_starts = changes & ~np.concatenate(([False], changes[:-1]))
+            row_numbers = np.arange(len(timeline))
+            first_of_sequence = np.maximum.accumulate(np.where(sequence_starts, row_numbers, 0))
+            changes &= (row_numbers - first_of_sequence) % 2 == 0
+
+            state_ids = state_ids.copy()
+            state_ids[1:][changes[1:]] = state_ids[:-1][changes[1:]]
+            timeline = _AVTimeline(timeline.state_names, timeline.object_ids, timeline.span_indices,
+                                   state_ids, from_times, until_times, timeline.durations)
+
+            # Due to melting, we need to merge again
+            if dont_merge:
+                break
+            timeline = timeline.merge(spans)
+
+        return timeline
+
+    def condense(self, num_objects, need_statistics):
+        # type: (int, bool) -> _Tuple[List[AVTimelineStates], List[AVTimelineStatistics]]
+        """Sum up the durations of the states of each object
+
+        The states appear in the order of their first row, like it is when adding up the
+        rows one after another."""
+        states_of_objects = [{} for _n in range(num_objects)]  # type: List[AVTimelineStates]
+        statistics_of_objects = [{} for _n in range(num_objects)
+                                ]  # type: List[AVTimelineStatistics]
+        if not len(self):
+            return states_of_objects, statistics_of_objects
+
+        num_state_names = len(self.state_names)
+        keys = self.object_ids * num_state_names + self.state_ids
+        order = np.argsort(keys, kind="mergesort")
+        sorted_keys = keys[order]
+        group_starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+        group_keys = sorted_keys[group_starts]
+        durations = self.durations[order]
+
+        # Stable sorting makes the first row of each group the first row of the state
+        columns = [
+            (group_keys // num_state_names).tolist(),
+            [self.state_names[state_id] for state_id in (group_keys % num_state_names).tolist()],
+            np.add.reduceat(durations, group_starts).tolist(),
+        ]
+        if need_statistics:
+            columns += [
+                np.diff(np.append(group_starts, len(order))).tolist(),
+                np.minimum.reduceat(durations, group_starts).tolist(),
+                np.maximum.reduceat(durations, group_starts).tolist(),
+            ]
+
+        for group_index in np.argsort(order[group_starts], kind="mergesort").tolist():
+            values = [column[group_index] for column in columns]
+            object_id, state_name, duration = values[:3]
+            states_of_objects[object_id][state_name] = duration
+            if need_statistics:
+                statistics_of_objects[object_id][state_name] = tuple(values[3:])  # count, min, max
+        return states_of_objects, statistics_of_objects
+
+    def rows_of_objects(self, num_objects, spans):
+        # type: (int, List[AVSpan]) -> List[AVTimelineRows]
+        rows = list(
+            zip([spans[index] for index in self.span_indices.tolist()],
+                [self.state_names[state_id] for state_id in self.state_ids.tolist()]))
+        boundaries = np.searchsorted(self.object_ids, np.arange(num_objects + 1)).tolist()
+        return [rows[boundaries[n]:boundaries[n + 1]] for n in range(num_objects)]
 
 
 # Note: Reclassifications of host/service periods do currently *not* have
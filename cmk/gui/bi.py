@@ -16,7 +16,7 @@ import fcntl
 import multiprocessing
 from contextlib import contextmanager
 import traceback
-from typing import Any, Dict, List, Optional, Set, Tuple, Type, Union
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Type, Union
 
 import six
 from livestatus import SiteId, LivestatusRow
@@ -187,6 +187,119 @@ regex_host_miss_cache = set()  # type: Set[Tuple[Any, Any]]
 regex_svc_hit_cache = set()  # type: Set[Tuple[Any, Any]]
 regex_svc_miss_cache = set()  # type: Set[Tuple[Any, Any]]
 
+# Dependencies of compiled aggregations on the host data: whether all hosts have been scanned for
+# matching hosts, the hosts whose data has been used and the host names which have been looked up
+BIDependencies = Tuple[bool, Set[BIHostSpec], Set[HostName]]
+BIHostFingerprints = Dict[BIHostSpec, Tuple[bytes, bytes]]
+# The aggregations compiled by a top level rule: their hashes, the aggregations and the dependencies
+BIPreviousRules = Dict[str, Tuple[List[str], List[BIAggregationTree], BIDependencies]]
+
+
+def get_host_fingerprints(services):
+    # type: (Dict[BIHostSpec, Tuple[Any, Any, Any, Any, Any]]) -> BIHostFingerprints
+    """Fingerprints of the host data relevant for matching hosts (tags and alias) and of all data"""
+    return {
+        host_spec: (_fingerprint((entry[0], entry[4])), _fingerprint(entry))
+        for host_spec, entry in services.items()
+    }
+
+
+def _fingerprint(data):
+    # type: (Any) -> bytes
+    return hashlib.md5(six.ensure_binary(repr(data))).digest()
+
+
+class BIHostChanges(object):
+    """The hosts which have been added, removed or changed since the previous compilation"""
+    def __init__(self, old_fingerprints, new_fingerprints):
+        # type: (BIHostFingerprints, BIHostFingerprints) -> None
+        super(BIHostChanges, self).__init__()
+        # Set if the result of scanning all hosts for matches may have changed
+        self.structure_changed = False
+        self.hosts = set()  # type: Set[BIHostSpec]
+        for host_spec in set(old_fingerprints).union(new_fingerprints):
+            old_fingerprint = old_fingerprints.get(host_spec)
+            new_fingerprint = new_fingerprints.get(host_spec)
+            if old_fingerprint == new_fingerprint:
+                continue
+            self.hosts.add(host_spec)
+            if old_fingerprint is None or new_fingerprint is None or old_fingerprint[
+                    0] != new_fingerprint[0]:
+                self.structure_changed = True
+        self.host_names = {host_name for _site, host_name in self.hosts}
+
+    def affects(self, dependencies):
+        # type: (BIDependencies) -> bool
+        scanned, host_specs, host_names = dependencies
+        return ((scanned and self.structure_changed) or not self.hosts.isdisjoint(host_specs) or
+                not self.host_names.isdisjoint(host_names))
+
+
+class BIDependencyTracker(object):
+    """Records the host data the aggregations of a compilation job are compiled from
+
+    The dependencies are recorded for the whole job and for each of its top level rules. A top level
+    rule, e.g. one incarnation of a FOREACH_HOST aggregation, is taken from the previous compilation
+    of the job as long as none of the hosts it depends on has changed."""
+    def __init__(self, host_changes=None, previous_rules=None):
+        # type: (Optional[BIHostChanges], Optional[BIPreviousRules]) -> None
+        super(BIDependencyTracker, self).__init__()
+        self._host_changes = host_changes
+        self._previous_rules = previous_rules or {}
+        # The dependencies currently recorded: [scanned, host specs, host names]
+        self._job_dependencies = [False, set(), set()]  # type: List[Any]
+        self._recording = [self._job_dependencies]  # type: List[List[Any]]
+        self.compiled_rules = {}  # type: Dict[str, Tuple[List[BIAggregationTree], BIDependencies]]
+        self.num_reused_rules = 0
+        # The hashes of the reused aggregations, by their id()
+        self.reused_hashes = {}  # type: Dict[int, str]
+
+    def track_scan(self):
+        # type: () -> None
+        for dependencies in self._recording:
+            dependencies[0] = True
+
+    def track_host(self, host_spec):
+        # type: (BIHostSpec) -> None
+        for dependencies in self._recording:
+            dependencies[1].add(host_spec)
+
+    def track_host_name(self, host_name):
+        # type: (HostName) -> None
+        for dependencies in self._recording:
+            dependencies[2].add(host_name)
+
+    def job_dependencies(self):
+        # type: () -> BIDependencies
+        return self._job_dependencies[0], self._job_dependencies[1], self._job_dependencies[2]
+
+    def compile_root_rule(self, rule_key, compile_function):
+        # type: (str, Callable[[], List[BIAggregationTree]]) -> List[BIAggregationTree]
+        previous = self._previous_rules.get(rule_key)
+        if (previous is not None and self._host_changes is not None and
+                not self._host_changes.affects(previous[2])):
+            hashes, entries, dependencies = previous
+            scanned, host_specs, host_names = dependencies
+            self._job_dependencies[0] |= scanned
+            self._job_dependencies[1].update(host_specs)
+            self._job_dependencies[2].update(host_names)
+            self.reused_hashes.update(zip(map(id, entries), hashes))
+            self.num_reused_rules += 1
+        else:
+            recording = [False, set(), set()]  # type: List[Any]
+            self._recording.append(recording)
+            try:
+                entries = compile_function()
+            finally:
+                self._recording.pop()
+            dependencies = recording[0], recording[1], recording[2]
+
+        self.compiled_rules[rule_key] = (entries, dependencies)
+        return entries
+
+
+g_dependency_tracker = BIDependencyTracker()
+
 
 # Load the static configuration of all services and hosts (including tags)
 # without state.
@@ -387,8 +500,6 @@ class JobWorker(multiprocessing.Process):
 
     # Does the compilation of one aggregation
     def compile_job(self, job, job_info):
-        # This variable holds all newly found entries and is returned later on
-        new_data = BICacheManager.empty_compiled_tree()
         aggr_type, aggr_idx, groups = job
 
         global g_services
@@ -448,6 +559,10 @@ class JobWorker(multiprocessing.Process):
                 _("<h1>Invalid aggregation <tt>%s</tt></h1>"
                   "Must have at least 3 entries (has %d)") % (aggr, len(aggr)))
 
+        global g_dependency_tracker
+        g_dependency_tracker = BIDependencyTracker(job_info.pop("host_changes", None),
+                                                   job_info.pop("previous_rules", None))
+
         new_entries = compile_rule_node(aggr_type, aggr[1:], 0)
 
         for this_entry in new_entries:
@@ -462,20 +577,45 @@ class JobWorker(multiprocessing.Process):
             entry["aggr_group_tree"] = groups
             entry["aggr_type"] = "multi" if aggr_type == AGGR_MULTI else "single"
 
-        # Generates a unique id for the given entry
-        def get_hash(entry):
-            return hashlib.md5(six.ensure_binary(repr(entry))).hexdigest()
+        # The reused aggregations are unchanged by the steps above
+        new_entries_hash = [
+            g_dependency_tracker.reused_hashes.get(id(entry)) or get_aggregation_hash(entry)
+            for entry in new_entries
+        ]
+        new_data = JobWorker.create_compiled_data(aggr_type, groups, new_entries, new_entries_hash)
+
+        # Remember the top level rules of the job together with their dependencies for the next
+        # compilation. Rules whose aggregations are all empty are kept with an empty list.
+        hashes = {id(entry): aggr_hash for entry, aggr_hash in zip(new_entries, new_entries_hash)}
+        rules = {}  # type: Dict[str, Tuple[List[str], BIDependencies]]
+        for rule_key, (entries, dependencies) in g_dependency_tracker.compiled_rules.items():
+            rules[rule_key] = ([hashes[id(entry)] for entry in entries if id(entry) in hashes],
+                               dependencies)
+        new_data["compile_state"] = {
+            "hashes": new_entries_hash,
+            "dependencies": g_dependency_tracker.job_dependencies(),
+            "rules": rules,
+        }
+        log("Reused %d of %d top level rules of the previous compilation" %
+            (g_dependency_tracker.num_reused_rules, len(g_dependency_tracker.compiled_rules)))
+        g_dependency_tracker = BIDependencyTracker()
+        return new_data
+
+    @staticmethod
+    def create_compiled_data(aggr_type, groups, new_entries, new_entries_hash=None):
+        """Create the compiled data of a job including the speed-up indices from its aggregations"""
+        new_data = BICacheManager.empty_compiled_tree()
+        if new_entries_hash is None:
+            new_entries_hash = list(map(get_aggregation_hash, new_entries))
 
         for group in set(groups):  # Flattened groups
-            new_entries_hash = list(map(get_hash, new_entries))
             if group not in new_data['forest']:
-                new_data['forest_ref'][group] = new_entries_hash
+                new_data['forest_ref'][group] = list(new_entries_hash)
             else:
                 new_data['forest_ref'][group] += new_entries_hash
 
             # Update several global speed-up indices
-            for aggr in new_entries:
-                aggr_hash = get_hash(aggr)
+            for aggr, aggr_hash in zip(new_entries, new_entries_hash):
                 # There are better was to create the hash (frozenset(aggr.items()))
                 new_data["aggr_ref"][aggr_hash] = aggr
                 req_hosts = aggr["reqhosts"]
@@ -527,6 +667,11 @@ class JobWorker(multiprocessing.Process):
         return new_data
 
 
+# Generates a unique id for the given entry
+def get_aggregation_hash(entry):
+    return hashlib.md5(six.ensure_binary(repr(entry))).hexdigest()
+
+
 # This class handles the fcntl-locking of one file
 # There are multiple locking options:
 # - shared access
@@ -867,6 +1012,35 @@ class BISitedataManager(object):
         return True
 
 
+def reuse_compiled_job(job, previous_compilation, host_changes):
+    # type: (Dict[str, Any], Dict[str, Any], BIHostChanges) -> Optional[Dict[str, Any]]
+    """Returns the compiled data of a job if it is not affected by the changed hosts at all
+
+    Otherwise the job is prepared to only recompile the top level rules which depend on changed
+    hosts and None is returned."""
+    job_state = previous_compilation["compile_state"].get(job["id"])
+    if job_state is None:
+        return None
+
+    aggr_ref = previous_compilation["aggr_ref"]
+    aggr_type, _idx, groups = job["id"]
+    if not host_changes.affects(job_state["dependencies"]):
+        new_data = JobWorker.create_compiled_data(
+            aggr_type, groups, [aggr_ref[aggr_hash] for aggr_hash in job_state["hashes"]],
+            job_state["hashes"])
+        new_data["compile_state"] = job_state
+        if aggr_type == AGGR_HOST:
+            new_data["compiled_hosts"] = job["info"]["queued_hosts"]
+        return new_data
+
+    job["info"]["host_changes"] = host_changes
+    job["info"]["previous_rules"] = {
+        rule_key: (hashes, [aggr_ref[aggr_hash] for aggr_hash in hashes], dependencies)
+        for rule_key, (hashes, dependencies) in job_state["rules"].items()
+    }
+    return None
+
+
 class BIJobManager(object):
     # TODO: Make this a *real* class with a *real* constructor... :-/
     def __init__(self):
@@ -1017,9 +1191,11 @@ class BIJobManager(object):
                 return
 
             log("Do compilation, discarding old caches")
+            previous_compilation = g_bi_cache_manager.load_previous_compilation(current_sitestats)
             self._queued_jobs = self._get_all_jobs()
             self._prepare_compilation(discard_old_cache=True)
             self._set_compilation_info(current_sitestats)
+            self._reuse_previous_compilation(previous_compilation)
 
             error_info = ""
             self._start_workers()
@@ -1052,6 +1228,37 @@ class BIJobManager(object):
         g_bi_cache_manager.discard_cachefile_data()
         return True  # Did compilation
 
+    def _reuse_previous_compilation(self, previous_compilation):
+        """Take the aggregations not affected by changed hosts from the previous compilation
+
+        Jobs not depending on any changed host are merged right away. The other jobs only recompile
+        the top level rules depending on changed hosts."""
+        if g_bi_cache_manager is None:
+            raise Exception("_reuse_previous_compilation: g_bi_cache_manager is None")
+        if g_bi_sitedata_manager is None:
+            raise Exception("_reuse_previous_compilation: g_bi_sitedata_manager is None")
+
+        host_fingerprints = get_host_fingerprints(g_bi_sitedata_manager.get_data()["services"])
+        g_bi_cache_manager.get_compiled_trees()["host_fingerprints"] = host_fingerprints
+        if previous_compilation is None:
+            return
+
+        host_changes = BIHostChanges(previous_compilation["host_fingerprints"], host_fingerprints)
+        log("Incremental compilation, %d changed hosts" % len(host_changes.hosts))
+        queued_jobs = []
+        results = []
+        for job in self._queued_jobs:
+            new_data = reuse_compiled_job(job, previous_compilation, host_changes)
+            if new_data is None:
+                queued_jobs.append(job)
+            else:
+                results.append((job, new_data))
+
+        log("Reusing %d of %d jobs of the previous compilation" %
+            (len(results), len(self._queued_jobs)))
+        self._queued_jobs = queued_jobs
+        self._merge_worker_results(results)
+
     def _get_all_jobs(self):
         # type: () -> List[Dict[str, Any]]
         if g_bi_sitedata_manager is None:
@@ -1112,6 +1319,10 @@ class BICacheManager(object):
             "host_aggregations_ref": {},
             "affected_hosts_ref": {},
             "affected_services_ref": {},
+
+            # Parameters of the incremental compilation
+            "compile_state": {},
+            "host_fingerprints": {},
         }
 
     # Resets everything the class knows of
@@ -1267,6 +1478,8 @@ class BICacheManager(object):
             "compiled_host_aggr",
             "compiled_multi_aggr",
             "compiled_all",
+            "compile_state",
+            "host_fingerprints",
         ]
         cache_to_dump = {}
         for what in keys_for_cachefile:
@@ -1276,6 +1489,21 @@ class BICacheManager(object):
         self._bicache_file.save(cache_to_dump)
         log("SAVED CACHEFILE, took %.4f sec" % (time.time() - start_time))
 
+    def load_previous_compilation(self, new_sitestats):
+        """Returns the content of the cachefile if it can be used for an incremental compilation
+
+        This is the case for a complete compilation of the current BI configuration. The site data
+        may have changed."""
+        old_sitestats = self.get_bicacheinfo()
+        if not old_sitestats or old_sitestats["timestamps"] != new_sitestats["timestamps"]:
+            return None
+
+        cachefile_content = self._bicache_file.load()
+        if not cachefile_content or not cachefile_content.get("compiled_all") or \
+                not cachefile_content.get("host_fingerprints"):
+            return None
+        return cachefile_content
+
     def get_compiled_all(self):
         info = self.get_compiled_trees()
         return info.get('compiled_all', False) if info else False
@@ -1320,6 +1548,9 @@ class BICacheManager(object):
             self._compiled_trees["compiled_multi_aggr"].setdefault(job_id, {})
             self._compiled_trees["compiled_multi_aggr"][job_id]["compiled"] = True
 
+        if "compile_state" in new_data:
+            self._compiled_trees["compile_state"][job_id] = new_data["compile_state"]
+
 
 def get_enabled_aggregations():
     result = []
@@ -1588,16 +1819,23 @@ def compile_rule_node(aggr_type, calllist, lvl):
         for (hostname, hostalias), matchgroups in matches:
             args = substitute_matches(arglist, hostname, hostalias, matchgroups)
             if tuple(args) not in handled_args:
-                new_elements += compile_aggregation_rule(aggr_type,
-                                                         rule,
-                                                         args,
-                                                         lvl,
-                                                         rulename=rulename)
+                new_elements += _compile_aggregation_rule_tracked(aggr_type, rule, args, lvl,
+                                                                  rulename)
                 handled_args.add(tuple(args))
 
         return new_elements
 
-    return compile_aggregation_rule(aggr_type, rule, arglist, lvl, rulename=rulename)
+    return _compile_aggregation_rule_tracked(aggr_type, rule, arglist, lvl, rulename)
+
+
+def _compile_aggregation_rule_tracked(aggr_type, rule, args, lvl, rulename):
+    if lvl > 0:
+        return compile_aggregation_rule(aggr_type, rule, args, lvl, rulename=rulename)
+
+    # Top level rules may be taken from the previous compilation
+    return g_dependency_tracker.compile_root_rule(
+        "%s/%r" % (rulename, args),
+        lambda: compile_aggregation_rule(aggr_type, rule, args, lvl, rulename=rulename))
 
 
 def find_matching_services(aggr_type, what, calllist):
@@ -1643,11 +1881,13 @@ def find_matching_services(aggr_type, what, calllist):
         host_matches = match_host(hostname, alias, host_spec, tags, required_tags, site, honor_site)
         list_of_matches = []
         if host_matches is not None:
+            g_dependency_tracker.track_host((site, hostname))
             if what == config.FOREACH_CHILD:
                 list_of_matches = [host_matches + (child_name,) for child_name in childs]
 
             elif what == config.FOREACH_CHILD_WITH:
                 for child_name in childs:
+                    g_dependency_tracker.track_host_name(child_name)
                     child_tags = g_services_by_hostname[child_name][0][1][0]
                     child_alias = g_services_by_hostname[child_name][0][1][4]
                     child_matches = match_host(child_name, child_alias, child_spec, child_tags,
@@ -1689,6 +1929,7 @@ def find_matching_services(aggr_type, what, calllist):
 
 def get_services_filtered_by_host_alias(host_spec):
     honor_site = SITE_SEP in host_spec[1]
+    g_dependency_tracker.track_scan()
     if g_services_items:
         return host_spec, honor_site, g_services_items
     return host_spec, honor_site, g_services.items()
@@ -1700,16 +1941,19 @@ def get_services_filtered_by_host_name(host_re):
     if host_re.startswith("^(") and host_re.endswith(")$"):
         # Exact host match
         middle = host_re[2:-2]
+        g_dependency_tracker.track_host_name(middle)
         if middle in g_services_by_hostname:
             entries = [((e[0], host_re), e[1]) for e in g_services_by_hostname[middle]]
             host_re = "(.*)"
 
     elif not honor_site and '*' not in host_re and '$' not in host_re and '|' not in host_re and '[' not in host_re:
         # Exact host match
+        g_dependency_tracker.track_host_name(host_re)
         entries = [((e[0], host_re), e[1]) for e in g_services_by_hostname.get(host_re, [])]
 
     else:
         # All services
+        g_dependency_tracker.track_scan()
         if g_services_items:
             entries = g_services_items
         else:
@@ -1975,6 +2219,7 @@ def compile_aggregation_rule(aggr_type, rule, args, lvl, rulename=None):
 
 
 def find_remaining_services(hostspec, aggregation):
+    g_dependency_tracker.track_host(hostspec)
     _tags, all_services, _childs, _parents, _alias = g_services[hostspec]
     all_services = set(all_services)
 
@@ -2075,9 +2320,11 @@ def compile_leaf_node(host_re, service_re=config.HOST_STATE):
     honor_site = SITE_SEP in host_re
     if not honor_site and '*' not in host_re and '$' not in host_re and '|' not in host_re and '[' not in host_re:
         # Exact host match
+        g_dependency_tracker.track_host_name(host_re)
         entries = [((e[0], host_re), e[1]) for e in g_services_by_hostname.get(host_re, [])]
 
     else:
+        g_dependency_tracker.track_scan()
         if g_services_items:
             entries = g_services_items
         else:
@@ -2113,6 +2360,7 @@ def compile_leaf_node(host_re, service_re=config.HOST_STATE):
                 regex_host_miss_cache.add(cache_id)
                 continue
 
+        g_dependency_tracker.track_host((site, hostname))
         if service_re == config.HOST_STATE:
             found.append({
                 "type": NT_LEAF,
@@ -2398,32 +2646,90 @@ def execute_rule_node(node, status_info, aggregation_options):
 
 # Get all status information we need for the aggregation from
 # a known lists of lists (list of site/host pairs)
+class BIStatusCache(object):
+    """Cache of the host and service states needed to execute BI trees during a request
+
+    All trees executed by a request share the states, e.g. all trees rendered by a BI view.
+    Sites for which a large part of their hosts are required are
+    queried for all of their hosts at once instead of sending one filter per host."""
+    # Fraction of the hosts of a site above which all hosts of the site are queried
+    bulk_query_ratio = 0.2
+
+    def __init__(self):
+        # type: () -> None
+        super(BIStatusCache, self).__init__()
+        self._rows = {}  # type: BIStatusInfo
+        self._fetched_sites = set()  # type: Set[SiteId]
+        self._fetched_hosts = set()  # type: Set[BIHostSpec]
+
+    def get_status_info(self, required_hosts):
+        # type: (BINeededHosts) -> BIStatusInfo
+        missing_hosts = {}  # type: Dict[SiteId, Set[HostName]]
+        for host_spec in required_hosts:
+            if host_spec[0] not in self._fetched_sites and host_spec not in self._fetched_hosts:
+                missing_hosts.setdefault(host_spec[0], set()).add(host_spec[1])
+
+        site_states = sites.states()
+        bulk_sites = [
+            site for site, host_names in missing_hosts.items()
+            if len(host_names) >= self.bulk_query_ratio *
+            site_states.get(site, {}).get("num_hosts", float("inf"))
+        ]
+        if bulk_sites:
+            self._fetch(bulk_sites, None)
+
+        filtered_sites = [site for site in missing_hosts if site not in bulk_sites]
+        if filtered_sites:
+            host_names = set()  # type: Set[HostName]
+            for site in filtered_sites:
+                host_names.update(missing_hosts[site])
+            self._fetch(filtered_sites, host_names)
+
+        return {
+            host_spec: self._rows[host_spec]
+            for host_spec in required_hosts
+            if host_spec in self._rows
+        }
+
+    def _fetch(self, site_ids, host_names):
+        # type: (List[SiteId], Optional[Set[HostName]]) -> None
+        """Query the states of the given hosts or of all hosts of the given sites"""
+        host_filter = ""
+        if host_names is not None:
+            for host in host_names:
+                host_filter += "Filter: name = %s\n" % host
+            if len(host_names) > 1:
+                host_filter += "Or: %d\n" % len(host_names)
+
+        try:
+            sites.live().set_auth_domain('bi')
+            sites.live().set_only_sites(site_ids)
+            sites.live().set_prepend_site(True)
+            data = sites.live().query(
+                "GET hosts\n"
+                "Columns: name state hard_state plugin_output scheduled_downtime_depth "
+                "acknowledged in_service_period services_with_fullstate\n" + host_filter)
+        finally:
+            sites.live().set_auth_domain('read')
+            sites.live().set_only_sites(None)
+            sites.live().set_prepend_site(False)
+
+        if host_names is None:
+            self._fetched_sites.update(site_ids)
+        else:
+            self._fetched_hosts.update((site, host) for site in site_ids for host in host_names)
+
+        for e in data:
+            self._rows[(e[0], e[1])] = LivestatusRow(e[2:])
+
+
 def get_status_info(required_hosts):
     # type: (BINeededHosts) -> BIStatusInfo
-    # Query each site only for hosts that that site provides
-    req_hosts = set()  # type: Set[HostName]
-    req_sites = set()  # type: Set[SiteId]
-
-    for site, host in required_hosts:
-        req_hosts.add(host)
-        req_sites.add(site)
-
-    host_filter = ""
-    for host in req_hosts:
-        host_filter += "Filter: name = %s\n" % host
-    if len(req_hosts) > 1:
-        host_filter += "Or: %d\n" % len(req_hosts)
-    sites.live().set_auth_domain('bi')
-    sites.live().set_only_sites(list(req_sites))
-    sites.live().set_prepend_site(True)
-    data = sites.live().query(
-        "GET hosts\n"
-        "Columns: name state hard_state plugin_output scheduled_downtime_depth "
-        "acknowledged in_service_period services_with_fullstate\n" + host_filter)
-    sites.live().set_auth_domain('read')
-    sites.live().set_only_sites(None)
-    sites.live().set_prepend_site(False)
-    return {(e[0], e[1]): LivestatusRow(e[2:]) for e in data}
+    # The states are cached per request only, so that the changes made by the actions of the
+    # GUI, e.g. acknowledgements, are shown by the next request
+    if "bi_status_cache" not in g:
+        g.bi_status_cache = BIStatusCache()
+    return g.bi_status_cache.get_status_info(required_hosts)
 
 
 # This variant of the function is configured not with a list of
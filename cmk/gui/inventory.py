@@ -18,7 +18,13 @@ import dicttoxml  # type: ignore[import]
 import livestatus
 
 import cmk.utils.paths
-from cmk.utils.structured_data import StructuredDataTree, Container, Numeration, Attributes
+from cmk.utils.structured_data import (
+    BINARY_TREE_FILE_SUFFIX,
+    StructuredDataTree,
+    Container,
+    Numeration,
+    Attributes,
+)
 from cmk.utils.exceptions import (
     MKException,
     MKGeneralException,
@@ -157,7 +163,8 @@ def get_history_deltas(hostname, search_timestamp=None):
     latest_timestamp = str(int(os.stat(inventory_path).st_mtime))
     inventory_archive_dir = "%s/inventory_archive/%s" % (cmk.utils.paths.var_dir, hostname)
     try:
-        archived_timestamps = sorted(os.listdir(inventory_archive_dir))
+        archived_timestamps = sorted(
+            f for f in os.listdir(inventory_archive_dir) if not f.endswith(BINARY_TREE_FILE_SUFFIX))
     except OSError:
         return [], []
 
@@ -190,8 +197,9 @@ def get_history_deltas(hostname, search_timestamp=None):
             tree_lookup[timestamp] = inventory_tree
         else:
             inventory_archive_path = "%s/%s" % (inventory_archive_dir, timestamp)
-            tree_lookup[timestamp] = _filter_tree(
-                StructuredDataTree().load_from(inventory_archive_path))
+            archived_tree = StructuredDataTree().load_from(inventory_archive_path,
+                                                           _get_permitted_tree_paths())
+            tree_lookup[timestamp] = _filter_tree(archived_tree)
         return tree_lookup[timestamp]
 
     corrupted_history_files = []
@@ -286,7 +294,7 @@ def _load_inventory_tree(hostname):
             return None
         cache_path = "%s/inventory/%s" % (cmk.utils.paths.var_dir, hostname)
         try:
-            inventory_tree = StructuredDataTree().load_from(cache_path)
+            inventory_tree = StructuredDataTree().load_from(cache_path, _get_permitted_tree_paths())
         except Exception as e:
             if config.debug:
                 html.show_warning("%s" % e)
@@ -322,6 +330,15 @@ def _filter_tree(struct_tree):
     return struct_tree.get_filtered_tree(_get_permitted_inventory_paths())
 
 
+def _get_permitted_tree_paths():
+    # type: () -> Optional[List[List]]
+    """Returns the paths of the sub trees which need to be loaded for filtering"""
+    permitted_paths = _get_permitted_inventory_paths()
+    if permitted_paths is None:
+        return None
+    return [path for path, _attribute_keys in permitted_paths]
+
+
 def _get_permitted_inventory_paths():
     """
     Returns either a list of permitted paths or
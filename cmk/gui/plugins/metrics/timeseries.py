@@ -4,8 +4,9 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
-import operator
-import functools
+from typing import Dict, Tuple
+
+import numpy as np  # type: ignore[import]
 
 import cmk.utils.version as cmk_version
 from cmk.utils.prediction import TimeSeries
@@ -29,6 +30,8 @@ from cmk.gui.plugins.metrics import stats
 
 def compute_graph_curves(metrics, rrd_data):
     curves = []
+    # The curves of a graph share the arrays of their RRD data
+    rrd_arrays = {}  # type: Dict[Tuple, np.ndarray]
     for metric_definition in metrics:
         expression = metric_definition["expression"]
         if expression[0] == "transformation" and expression[1][0] == "forecast":
@@ -39,7 +42,7 @@ def compute_graph_curves(metrics, rrd_data):
                 "line_type": metric_definition["line_type"],
                 "color": metric_definition["color"],
                 "title": metric_definition["title"],
-                "rrddata": evaluate_time_series_expression(expression, rrd_data),
+                "rrddata": evaluate_time_series_expression(expression, rrd_data, rrd_arrays),
             })
     return curves
 
@@ -56,45 +59,92 @@ def multiline_curves(metric_definition, rrd_data):
         }
 
 
-def evaluate_time_series_expression(expression, rrd_data):
+def evaluate_time_series_expression(expression, rrd_data, rrd_arrays=None):
+    if expression[0] == "transformation" and expression[1][0] == "forecast":
+        (_transform, conf), operands = expression[1:]
+        operands_evaluated = evaluate_time_series_expression(operands[0], rrd_data, rrd_arrays)
+        if cmk_version.is_raw_edition():
+            raise MKGeneralException(
+                _("Forecast calculations are only available with the "
+                  "Checkmk Enterprise Editions"))
+        # Suppression is needed to silence pylint in CRE environment
+        from cmk.gui.cee.plugins.metrics.forecasts import time_series_transform_forecast  # pylint: disable=no-name-in-module
+        return time_series_transform_forecast(TimeSeries(operands_evaluated, rrd_data['__range']),
+                                              conf)
+
+    if expression[0] == "rrd" and tuple(expression[1:]) in rrd_data:
+        return rrd_data[tuple(expression[1:])]
+
     if rrd_data:
         num_points = len(list(rrd_data.values())[0])
     else:
         num_points = 1
 
+    return time_series_values(
+        evaluate_time_series_array(expression, rrd_data, num_points,
+                                   {} if rrd_arrays is None else rrd_arrays))
+
+
+def evaluate_time_series_array(expression, rrd_data, num_points, rrd_arrays):
+    """Evaluate the expression to an array of floats, in which NaN stands for a missing value
+
+    The operators are applied to all points of their operands at once. The RRD data is
+    converted to arrays only once, which are kept in rrd_arrays."""
     if expression[0] == "operator":
         operator_id, operands = expression[1:]
-        operands_evaluated = [evaluate_time_series_expression(a, rrd_data) for a in operands]
-        return time_series_math(operator_id, operands_evaluated)
+        return time_series_math_array(
+            operator_id,
+            [evaluate_time_series_array(a, rrd_data, num_points, rrd_arrays) for a in operands])
 
     if expression[0] == "transformation":
         (transform, conf), operands = expression[1:]
-        operands_evaluated = evaluate_time_series_expression(operands[0], rrd_data)
         if transform == 'percentile':
-            return time_series_operator_perc(operands_evaluated, conf)
+            return time_series_operator_perc(
+                evaluate_time_series_array(operands[0], rrd_data, num_points, rrd_arrays), conf)
         if transform == 'forecast':
-            if cmk_version.is_raw_edition():
-                raise MKGeneralException(
-                    _("Forecast calculations are only available with the "
-                      "Checkmk Enterprise Editions"))
-            # Suppression is needed to silence pylint in CRE environment
-            from cmk.gui.cee.plugins.metrics.forecasts import time_series_transform_forecast  # pylint: disable=no-name-in-module
-            return time_series_transform_forecast(
-                TimeSeries(operands_evaluated, rrd_data['__range']), conf)
+            # A forecast results in several curves, see multiline_curves
+            raise MKGeneralException(
+                _("Forecasts can not be used as operands of other graph expressions"))
 
     if expression[0] == "rrd":
         key = tuple(expression[1:])
-        if key in rrd_data:
-            return rrd_data[key]
-        return [None] * num_points
+        if key not in rrd_data:
+            return np.full(num_points, np.nan)
+        if key not in rrd_arrays:
+            rrd_arrays[key] = time_series_array(rrd_data[key])
+        return rrd_arrays[key]
 
     if expression[0] == "constant":
-        return [expression[1]] * num_points
+        return np.full(num_points, expression[1], dtype=float)
 
     raise NotImplementedError()
 
 
+def time_series_array(values):
+    """Convert the values of a time series to an array, None becomes NaN"""
+    if isinstance(values, TimeSeries):
+        values = values.values
+    return np.array(values, dtype=float)
+
+
+def time_series_values(array):
+    """Convert an array to the values of a time series, NaN becomes None"""
+    values = array.astype(object)
+    values[np.isnan(array)] = None
+    return values.tolist()
+
+
+def clean_time_series_point(tsp):
+    """removes "None" entries from input list"""
+    return [x for x in tsp if x is not None]
+
+
 def time_series_math(operator_id, operands_evaluated):
+    return time_series_values(
+        time_series_math_array(operator_id, [time_series_array(o) for o in operands_evaluated]))
+
+
+def time_series_math_array(operator_id, operands_evaluated):
     operators = time_series_operators()
     if operator_id not in operators:
         raise MKGeneralException(
@@ -102,63 +152,57 @@ def time_series_math(operator_id, operands_evaluated):
             escaping.escape_attribute(operator_id))
     _op_title, op_func = operators[operator_id]
 
-    return [op_func_wrapper(op_func, tsp) for tsp in zip(*operands_evaluated)]
+    # Like zip(), only use the points all operands have
+    num_points = min(len(operand) for operand in operands_evaluated)
+    operands = np.array([operand[:num_points] for operand in operands_evaluated], dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return op_func(operands)
 
 
-def op_func_wrapper(op_func, tsp):
-    if tsp.count(None) < len(tsp):  # At least one non-None value
-        try:
-            return op_func(tsp)
-        except ZeroDivisionError:
-            pass
-    return None
+def _missing(operands):
+    """Whether or not all operands are missing at the points"""
+    return np.isnan(operands).all(axis=0)
 
 
-def clean_time_series_point(tsp):
-    """removes "None" entries from input list"""
-    return [x for x in tsp if x is not None]
+def time_series_operator_sum(operands):
+    return np.where(_missing(operands), np.nan, np.nansum(operands, axis=0))
 
 
-def time_series_operator_sum(tsp):
-    return sum(clean_time_series_point(tsp))
+def time_series_operator_product(operands):
+    return np.prod(operands, axis=0)
 
 
-def time_series_operator_product(tsp):
-    if None in tsp:
-        return None
-    return functools.reduce(operator.mul, tsp, 1)
+def time_series_operator_difference(operands):
+    return operands[0] - operands[1]
 
 
-def time_series_operator_difference(tsp):
-    if None in tsp:
-        return None
-    return tsp[0] - tsp[1]
+def time_series_operator_fraction(operands):
+    return np.where(operands[1] == 0, np.nan, operands[0] / operands[1])
 
 
-def time_series_operator_fraction(tsp):
-    if None in tsp:
-        return None
-    return tsp[0] / tsp[1]
+def time_series_operator_maximum(operands):
+    return np.where(_missing(operands), np.nan,
+                    np.where(np.isnan(operands), -np.inf, operands).max(axis=0))
 
 
-def time_series_operator_maximum(tsp):
-    return max(clean_time_series_point(tsp))
+def time_series_operator_minimum(operands):
+    return np.where(_missing(operands), np.nan,
+                    np.where(np.isnan(operands), np.inf, operands).min(axis=0))
 
 
-def time_series_operator_minimum(tsp):
-    return min(clean_time_series_point(tsp))
+def time_series_operator_average(operands):
+    return np.nansum(operands, axis=0) / (~np.isnan(operands)).sum(axis=0)
 
 
-def time_series_operator_average(tsp):
-    tsp = clean_time_series_point(tsp)
-    return sum(tsp) / len(tsp)
+def time_series_operator_merge(operands):
+    first_present = np.argmax(~np.isnan(operands), axis=0)
+    return operands[first_present, np.arange(operands.shape[1])]
 
 
-def time_series_operator_perc(tsp, percentile):
-    points = len(tsp)
-    tsp = clean_time_series_point(tsp)
-    perc = stats.percentile(tsp, percentile) if tsp else None
-    return [perc] * points
+def time_series_operator_perc(values, percentile):
+    present = values[~np.isnan(values)]
+    perc = stats.percentile(np.sort(present), percentile) if len(present) else np.nan
+    return np.full(len(values), perc, dtype=float)
 
 
 def time_series_operators():
@@ -170,5 +214,5 @@ def time_series_operators():
         "MAX": (_("Maximum"), time_series_operator_maximum),
         "MIN": (_("Minimum"), time_series_operator_minimum),
         "AVERAGE": (_("Average"), time_series_operator_average),
-        "MERGE": ("First non None", lambda x: next(iter(clean_time_series_point(x)))),
+        "MERGE": ("First non None", time_series_operator_merge),
     }
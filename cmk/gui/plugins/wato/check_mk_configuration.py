@@ -2562,6 +2562,34 @@ class ConfigVariablePiggybackMaxCachefileAge(ConfigVariable):
         )
 
 
+@config_variable_registry.register
+class ConfigVariablePiggybackStore(ConfigVariable):
+    def group(self):
+        return ConfigVariableGroupCheckExecution
+
+    def domain(self):
+        return ConfigDomainCore
+
+    def ident(self):
+        return "piggyback_store"
+
+    def valuespec(self):
+        return DropdownChoice(
+            title=_("Storage of piggyback data"),
+            help=_("Per default the piggyback data is stored in one file per source host and "
+                   "piggybacked host. With many piggybacked hosts, e.g. when monitoring "
+                   "vSphere or AWS, looking up and cleaning up these files can become "
+                   "expensive. The indexed store keeps all piggyback data in a single file "
+                   "which can be looked up without scanning directories. Piggyback data "
+                   "stored before changing this setting is not taken over, the piggybacked "
+                   "hosts get their data again with the next check of their sources."),
+            choices=[
+                ("directory", _("One file per source and piggybacked host")),
+                ("indexed", _("Single indexed file")),
+            ],
+        )
+
+
 @config_variable_registry.register
 class ConfigVariableCheckMKPerfdataWithTimes(ConfigVariable):
     def group(self):
@@ -4380,6 +4408,24 @@ rulespec_registry.register(
     ))
 
 
+def _help_builtin_snmp_hosts():
+    return _("Check_MK can talk SNMP to the devices without starting the net-snmp command line "
+             "tools. This builtin SNMP implementation keeps one session per device for the "
+             "whole fetch of the host data and walks the columns of a table with the same "
+             "requests. It supports SNMP v1 and v2c. SNMPv3 hosts continue to use the other "
+             "SNMP implementations. Use this rule to enable the builtin SNMP implementation "
+             "for hosts. It is used instead of Inline SNMP for these hosts.")
+
+
+rulespec_registry.register(
+    BinaryHostRulespec(
+        group=RulespecGroupAgentSNMP,
+        help_func=_help_builtin_snmp_hosts,
+        name="builtin_snmp_hosts",
+        title=lambda: _("Hosts using the builtin SNMP implementation"),
+    ))
+
+
 def _help_usewalk_hosts():
     return _("This ruleset helps in test and development. You can create stored SNMP walks on "
              "the command line with cmk --snmpwalk HOSTNAME. A host that is configured with "
@@ -444,6 +444,17 @@ class ModeEditSite(WatoMode):
                    "directory will be also transferred to the slave site. Note: <b>all other MKPs and files "
                    "below <tt>~/local/</tt> on the slave will be removed</b>."),
              )),
+            ("sync_deltas",
+             Checkbox(
+                 title=_("Transfer changes as deltas"),
+                 label=_("Transfer only the changed parts of large configuration files"),
+                 help=
+                 _("When enabled, large configuration files that changed only slightly since the last "
+                   "synchronization are not transferred completely. Only the changed parts are sent "
+                   "to the remote site. This reduces the amount of transferred data of large setups, "
+                   "but needs some additional computation on both sites. Remote sites of older "
+                   "versions always receive the complete files."),
+             )),
         ]
 
 
@@ -718,6 +729,8 @@ class ModeDistributedMonitoring(WatoMode):
             parts.append("EC")
         if site.get("replicate_mkps"):
             parts.append("MKPs")
+        if site.get("sync_deltas"):
+            parts.append(_("Deltas"))
         if parts:
             html.write_text(" (%s)" % ", ".join(parts))
 
@@ -19,16 +19,21 @@ import io
 import errno
 import ast
 import os
+import re
 import shutil
+import tempfile
 import time
 import abc
 import multiprocessing
 import traceback
 import subprocess
 import hashlib
+import uuid
+import marshal
+from stat import S_ISLNK
 from logging import Logger
 from pathlib import Path
-from typing import Dict, Set, List, Optional, Tuple, Union, NamedTuple
+from typing import Dict, Iterator, Set, List, Optional, Tuple, Union, NamedTuple
 
 import psutil  # type: ignore[import]
 import six
@@ -78,6 +83,7 @@ import cmk.gui.watolib.snapshots
 from cmk.gui.watolib.config_sync import SnapshotCreator, ReplicationPath
 from cmk.gui.watolib.wato_background_job import WatoBackgroundJob
 from cmk.gui.watolib.config_sync import extract_from_buffer
+from cmk.gui.watolib.config_sync import apply_delta, create_delta, get_delta_signature
 from cmk.gui.watolib.global_settings import save_site_global_settings
 from cmk.gui.watolib.automation_commands import automation_command_registry, AutomationCommand
 
@@ -294,6 +300,12 @@ def remove_site_config_directory(site_id):
         if e.errno != errno.ENOENT:  # No such file or directory
             raise
 
+    try:
+        _config_sync_hash_cache_path(site_id).unlink()
+    except OSError as e:
+        if e.errno != errno.ENOENT:  # No such file or directory
+            raise
+
 
 class ActivateChanges(object):
     def __init__(self):
@@ -1462,15 +1474,20 @@ class ActivateChangesSite(multiprocessing.Process, ActivateChanges):
         self._set_sync_state(_("Fetching sync state"))
         self._logger.debug("Starting config sync with >1.7 site")
         replication_paths = self._snapshot_settings.snapshot_components
-        remote_file_infos, remote_config_generation = self._get_config_sync_state(replication_paths)
+        remote_file_infos, remote_config_generation, remote_features = self._get_config_sync_state(
+            replication_paths)
         self._logger.debug("Received %d file infos from remote", len(remote_file_infos))
 
         # In case we experience performance issues here, we could postpone the hashing of the
         # central files to only be done ad-hoc in _get_file_names_to_sync when the other attributes
         # are not enough to detect a differing file.
         site_config_dir = Path(self._snapshot_settings.work_dir)
-        central_file_infos = _get_config_sync_file_infos(replication_paths, site_config_dir)
-        self._logger.debug("Got %d file infos from %s", len(remote_file_infos), site_config_dir)
+        hash_cache = ConfigSyncHashCache(_config_sync_hash_cache_path(self._site_id))
+        central_file_infos = _get_config_sync_file_infos(replication_paths, site_config_dir,
+                                                         hash_cache)
+        self._logger.debug("Got %d file infos from %s (%d hashes cached, %d computed)",
+                           len(central_file_infos), site_config_dir, hash_cache.hits,
+                           hash_cache.misses)
 
         self._set_sync_state(_("Computing differences"))
         to_sync_new, to_sync_changed, to_delete = _get_file_names_to_sync(
@@ -1487,8 +1504,18 @@ class ActivateChangesSite(multiprocessing.Process, ActivateChanges):
         self._set_sync_state(
             _("Transfering: %d new, %d changed and %d vanished files") %
             (len(to_sync_new), len(to_sync_changed), len(to_delete)))
-        self._synchronize_files(to_sync_new + to_sync_changed, to_delete, remote_config_generation,
-                                site_config_dir)
+        if _SYNC_FEATURE_CHUNKED_UPLOAD not in remote_features:
+            self._synchronize_files(to_sync_new + to_sync_changed, to_delete,
+                                    remote_config_generation, site_config_dir)
+        else:
+            delta_candidates = {}  # type: Dict[str, SyncDelta]
+            if _SYNC_FEATURE_DELTAS in remote_features and config.site(
+                    self._site_id).get("sync_deltas"):
+                delta_candidates = _get_delta_candidates(to_sync_changed, central_file_infos,
+                                                         remote_file_infos)
+            self._synchronize_files_streamed(to_sync_new + to_sync_changed, to_delete,
+                                             remote_config_generation, site_config_dir,
+                                             delta_candidates)
         self._logger.debug("Finished config sync")
 
     def _set_sync_state(self, status_details=None):
@@ -1496,11 +1523,12 @@ class ActivateChangesSite(multiprocessing.Process, ActivateChanges):
         self._set_result(PHASE_SYNC, _("Synchronizing"), status_details=status_details)
 
     def _get_config_sync_state(self, replication_paths):
-        # type: (List[ReplicationPath]) -> Tuple[Dict[str, ConfigSyncFileInfo], int]
+        # type: (List[ReplicationPath]) -> Tuple[Dict[str, ConfigSyncFileInfo], int, List[str]]
         """Get the config file states from the remote sites
 
         Calls the automation call "get-config-sync-state" on the remote site,
-        which is handled by AutomationGetConfigSyncState."""
+        which is handled by AutomationGetConfigSyncState. Remote sites not supporting
+        any of the sync features do not send them."""
         site = config.site(self._site_id)
         response = cmk.gui.watolib.automations.do_remote_automation(
             site,
@@ -1508,7 +1536,8 @@ class ActivateChangesSite(multiprocessing.Process, ActivateChanges):
             [("replication_paths", repr([tuple(r) for r in replication_paths]))],
         )
 
-        return {k: ConfigSyncFileInfo(*v) for k, v in response[0].items()}, response[1]
+        return ({k: ConfigSyncFileInfo(*v) for k, v in response[0].items()}, response[1],
+                response[2] if len(response) > 2 else [])
 
     def _synchronize_files(self, files_to_sync, files_to_delete, remote_config_generation,
                            site_config_dir):
@@ -1539,6 +1568,114 @@ class ActivateChangesSite(multiprocessing.Process, ActivateChanges):
         if response is not True:
             raise MKGeneralException(_("Failed to synchronize with site: %s") % response)
 
+    def _synchronize_files_streamed(self, files_to_sync, files_to_delete, remote_config_generation,
+                                    site_config_dir, delta_candidates):
+        # type: (List[str], List[str], int, Path, Dict[str, SyncDelta]) -> None
+        """Send the files as compressed tar archive in chunks to the remote site
+
+        The archive is written to a temporary file and uploaded in chunks of limited size, so the
+        memory needed does not depend on the size of the configuration. Changed files being
+        delta candidates are transferred as deltas against the remote files in case this saves
+        enough. The deltas are sent as a separate archive.
+        """
+        site = config.site(self._site_id)
+        store.makedirs(cmk.utils.paths.tmp_dir)
+        with tempfile.TemporaryDirectory(dir=cmk.utils.paths.tmp_dir,
+                                         prefix="config-sync-") as tmp_dir:
+            deltas_dir = Path(tmp_dir, "deltas")
+            deltas = self._create_sync_deltas(delta_candidates, site_config_dir, deltas_dir)
+            self._logger.debug("Files to be transferred as deltas: %r", sorted(deltas))
+
+            sync_archive_path = Path(tmp_dir, "sync_archive.tar.gz")
+            _create_sync_archive_file([f for f in files_to_sync if f not in deltas],
+                                      site_config_dir, sync_archive_path)
+            request_vars = [
+                ("site_id", self._site_id),
+                ("sync_archive_upload", self._upload_sync_file(sync_archive_path)),
+                ("to_delete", repr(files_to_delete)),
+                ("config_generation", "%d" % remote_config_generation),
+            ]
+
+            if deltas:
+                sync_deltas_path = Path(tmp_dir, "sync_deltas.tar.gz")
+                _create_sync_archive_file(sorted(deltas), deltas_dir, sync_deltas_path)
+                request_vars += [
+                    ("sync_deltas_upload", self._upload_sync_file(sync_deltas_path)),
+                    ("deltas", repr(deltas)),
+                ]
+
+            response = cmk.gui.watolib.automations.do_remote_automation(
+                site,
+                "receive-config-sync",
+                request_vars,
+            )
+
+        if response is not True:
+            raise MKGeneralException(_("Failed to synchronize with site: %s") % response)
+
+    def _create_sync_deltas(self, delta_candidates, site_config_dir, deltas_dir):
+        # type: (Dict[str, SyncDelta], Path, Path) -> Dict[str, SyncDelta]
+        """Write the deltas of the candidates worth to be transferred as delta to the deltas_dir
+
+        The signatures of the remote files are fetched with the automation call
+        "get-config-sync-signatures", which is handled by AutomationGetConfigSyncSignatures.
+        """
+        if not delta_candidates:
+            return {}
+
+        signatures = cmk.gui.watolib.automations.do_remote_automation(
+            config.site(self._site_id),
+            "get-config-sync-signatures",
+            [("site_paths", repr(sorted(delta_candidates)))],
+        )
+
+        deltas = {}  # type: Dict[str, SyncDelta]
+        for site_path, sync_delta in sorted(delta_candidates.items()):
+            try:
+                base_hash, signature = signatures[site_path]
+            except KeyError:
+                continue  # Vanished or no regular file anymore
+
+            if base_hash != sync_delta[0]:
+                continue
+
+            delta_path = deltas_dir.joinpath(site_path)
+            store.makedirs(delta_path.parent)
+            if create_delta(site_config_dir.joinpath(site_path), signature, delta_path):
+                deltas[site_path] = sync_delta
+        return deltas
+
+    def _upload_sync_file(self, path):
+        # type: (Path) -> str
+        """Upload a file in chunks to the remote site and return the ID of the upload
+
+        The chunks are received by AutomationReceiveConfigSyncChunk.
+        """
+        site = config.site(self._site_id)
+        upload_id = uuid.uuid4().hex
+        offset = 0
+        with path.open("rb") as f:
+            while True:
+                chunk = f.read(_SYNC_CHUNK_SIZE)
+                response = cmk.gui.watolib.automations.do_remote_automation(
+                    site,
+                    "receive-config-sync-chunk",
+                    [
+                        ("site_id", self._site_id),
+                        ("upload_id", upload_id),
+                        ("offset", "%d" % offset),
+                    ],
+                    files={
+                        "chunk": io.BytesIO(chunk),
+                    },
+                )
+                if response is not True:
+                    raise MKGeneralException(_("Failed to upload to site: %s") % response)
+
+                offset += len(chunk)
+                if len(chunk) < _SYNC_CHUNK_SIZE:
+                    return upload_id
+
     # TODO: Compatibility for 1.6 -> 1.7 migration. Can be removed with 1.8.
     def _synchronize_pre_17_site(self):
         # type: () -> None
@@ -1974,6 +2111,33 @@ def _get_file_names_to_sync(site_logger, central_file_infos, remote_file_infos):
     return to_sync_new, to_sync_changed, to_delete
 
 
+# Remote sites announce the sync features they support in the sync state
+_SYNC_FEATURE_CHUNKED_UPLOAD = "chunked-upload"
+_SYNC_FEATURE_DELTAS = "deltas"
+_SYNC_FEATURES = [_SYNC_FEATURE_CHUNKED_UPLOAD, _SYNC_FEATURE_DELTAS]
+
+_SYNC_CHUNK_SIZE = 4 * 1024 * 1024
+_SYNC_DELTA_MIN_SIZE = 256 * 1024
+
+# The hash of the remote file the delta is based on, the hash of the result and its mode
+SyncDelta = Tuple[str, str, int]
+
+
+def _get_delta_candidates(to_sync_changed, central_file_infos, remote_file_infos):
+    # type: (List[str], Dict[str, ConfigSyncFileInfo], Dict[str, ConfigSyncFileInfo]) -> Dict[str, SyncDelta]
+    """The changed regular files large enough to be worth a delta transfer"""
+    candidates = {}
+    for site_path in to_sync_changed:
+        central_info = central_file_infos[site_path]
+        remote_info = remote_file_infos[site_path]
+        if (central_info.file_hash is None or remote_info.file_hash is None or
+                central_info.st_size < _SYNC_DELTA_MIN_SIZE):
+            continue
+        candidates[site_path] = (remote_info.file_hash, central_info.file_hash,
+                                 central_info.st_mode)
+    return candidates
+
+
 def _get_sync_archive(to_sync, base_dir):
     # type: (List[str], Path) -> bytes
     # Use native tar instead of python tarfile for performance reasons
@@ -2000,12 +2164,14 @@ def _get_sync_archive(to_sync, base_dir):
     return archive
 
 
-def _unpack_sync_archive(sync_archive, base_dir):
-    # type: (bytes, Path) -> None
+def _create_sync_archive_file(to_sync, base_dir, archive_path):
+    # type: (List[str], Path, Path) -> None
+    """Write the gzip compressed archive directly to a file instead of buffering it"""
     p = subprocess.Popen(
         [
-            "tar", "-x", "-C",
-            str(base_dir), "-f", "-", "-U", "--recursive-unlink", "--preserve-permissions"
+            "tar", "-c", "-z", "-C",
+            str(base_dir), "-f",
+            str(archive_path), "--null", "-T", "-", "--preserve-permissions"
         ],
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
@@ -2013,16 +2179,65 @@ def _unpack_sync_archive(sync_archive, base_dir):
         close_fds=True,
         shell=False,
     )
-    assert p.stdin is not None
+
+    stderr = p.communicate(b"\0".join(six.ensure_binary(f) for f in to_sync))[1]
+    if p.returncode != 0:
+        raise MKGeneralException(
+            _("Failed to create sync archive [%d]: %s") % (p.returncode, six.ensure_text(stderr)))
+
+
+def _unpack_sync_archive(sync_archive, base_dir):
+    # type: (Union[bytes, Path], Path) -> None
+    """Unpack an archive received in memory or a compressed archive file received in chunks"""
+    if isinstance(sync_archive, Path):
+        archive_args = ["-z", "-f", str(sync_archive)]
+        archive_input = None  # type: Optional[bytes]
+    else:
+        archive_args = ["-f", "-"]
+        archive_input = sync_archive
+
+    p = subprocess.Popen(
+        ["tar", "-x", "-C", str(base_dir)] + archive_args +
+        ["-U", "--recursive-unlink", "--preserve-permissions"],
+        stdin=subprocess.PIPE if archive_input is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        close_fds=True,
+        shell=False,
+    )
     assert p.stdout is not None
     assert p.stderr is not None
 
-    stderr = p.communicate(sync_archive)[1]
+    stderr = p.communicate(archive_input)[1]
     if p.returncode != 0:
         raise MKGeneralException(
             _("Failed to create sync archive [%d]: %s") % (p.returncode, six.ensure_text(stderr)))
 
 
+def _apply_sync_deltas(sync_deltas, deltas, base_dir):
+    # type: (Path, Dict[str, SyncDelta], Path) -> None
+    """Unpack the archive of deltas to a temporary directory and apply them to the files"""
+    store.makedirs(cmk.utils.paths.tmp_dir)
+    with tempfile.TemporaryDirectory(dir=cmk.utils.paths.tmp_dir,
+                                     prefix="config-sync-deltas-") as tmp_dir:
+        _unpack_sync_archive(sync_deltas, Path(tmp_dir))
+        for site_path, (base_hash, file_hash, mode) in deltas.items():
+            apply_delta(base_dir.joinpath(site_path), Path(tmp_dir, site_path), base_hash,
+                        file_hash, mode)
+
+
+def _config_sync_upload_dir():
+    # type: () -> Path
+    return Path(cmk.utils.paths.tmp_dir) / "config_sync_uploads"
+
+
+def _config_sync_upload_path(upload_id):
+    # type: (str) -> Path
+    if not re.match("^[0-9a-f]{32}$", upload_id):
+        raise MKGeneralException(_("Invalid upload ID: %s") % upload_id)
+    return _config_sync_upload_dir() / upload_id
+
+
 ConfigSyncFileInfo = NamedTuple("ConfigSyncFileInfo", [
     ("st_mode", int),
     ("st_size", int),
@@ -2036,7 +2251,8 @@ ConfigSyncFileInfo = NamedTuple("ConfigSyncFileInfo", [
 #    ("file_infos", Dict[str, ConfigSyncFileInfo]),
 #    ("config_generation", int),
 #])
-GetConfigSyncStateResponse = Tuple[Dict[str, Tuple[int, int, Optional[str], Optional[str]]], int]
+GetConfigSyncStateResponse = Tuple[Dict[str, Tuple[int, int, Optional[str], Optional[str]]], int,
+                                   List[str]]
 
 
 @automation_command_registry.register
@@ -2046,7 +2262,8 @@ class AutomationGetConfigSyncState(AutomationCommand):
     The central site hands over the list of replication paths it will try to synchronize later.  The
     remote site computes the list of replication files and sends it back together with the current
     configuration generation ID. The config generation ID is increased on every WATO modification
-    and ensures that nothing is changed between the two config sync steps.
+    and ensures that nothing is changed between the two config sync steps. The sync features
+    supported by the remote site are sent last. Older central sites ignore them.
     """
     def command_name(self):
         return "get-config-sync-state"
@@ -2061,21 +2278,116 @@ class AutomationGetConfigSyncState(AutomationCommand):
     def execute(self, request):
         # type: (List[ReplicationPath]) -> GetConfigSyncStateResponse
         with store.lock_checkmk_configuration():
+            hash_cache = ConfigSyncHashCache(_config_sync_hash_cache_path())
             file_infos = _get_config_sync_file_infos(request,
-                                                     base_dir=Path(cmk.utils.paths.omd_root))
+                                                     base_dir=Path(cmk.utils.paths.omd_root),
+                                                     hash_cache=hash_cache)
             transport_file_infos = {
                 k: (v.st_mode, v.st_size, v.link_target, v.file_hash)
                 for k, v in file_infos.items()
             }
-            return (transport_file_infos, _get_current_config_generation())
+            return (transport_file_infos, _get_current_config_generation(), _SYNC_FEATURES)
+
+
+@automation_command_registry.register
+class AutomationGetConfigSyncSignatures(AutomationCommand):
+    """Called on remote site from a central site to get the delta signatures of files
 
+    The central site hands over the changed files it wants to transfer as deltas. The remote site
+    sends back the hash and the signature of the regular ones.
+    """
+    def command_name(self):
+        return "get-config-sync-signatures"
 
-def _get_config_sync_file_infos(replication_paths, base_dir):
-    # type: (List[ReplicationPath], Path) -> Dict[str, ConfigSyncFileInfo]
+    def get_request(self):
+        # type: () -> List[str]
+        return ast.literal_eval(html.request.get_ascii_input_mandatory("site_paths"))
+
+    def execute(self, request):
+        # type: (List[str]) -> Dict[str, Tuple[str, List[str]]]
+        base_dir = Path(cmk.utils.paths.omd_root)
+        signatures = {}
+        with store.lock_checkmk_configuration():
+            for site_path in request:
+                file_path = base_dir.joinpath(site_path)
+                if file_path.is_symlink() or not file_path.is_file():
+                    continue
+                signatures[site_path] = get_delta_signature(file_path)
+        return signatures
+
+
+ReceiveConfigSyncChunkRequest = NamedTuple("ReceiveConfigSyncChunkRequest", [
+    ("upload_id", str),
+    ("offset", int),
+    ("chunk", bytes),
+])
+
+
+@automation_command_registry.register
+class AutomationReceiveConfigSyncChunk(AutomationCommand):
+    """Called on remote site from a central site to upload a chunk of a file
+
+    The chunks are appended to the upload file in the order of their offsets. The complete file is
+    referenced by the upload ID in the following automation calls. Uploads of aborted activations
+    are cleaned up with the next upload.
+    """
+    _max_upload_age = 86400
+
+    def command_name(self):
+        return "receive-config-sync-chunk"
+
+    def get_request(self):
+        # type: () -> ReceiveConfigSyncChunkRequest
+        site_id = SiteId(html.request.get_ascii_input_mandatory("site_id"))
+        verify_remote_site_config(site_id)
+
+        return ReceiveConfigSyncChunkRequest(
+            html.request.get_ascii_input_mandatory("upload_id"),
+            html.request.get_integer_input_mandatory("offset"),
+            html.request.uploaded_file("chunk")[2],
+        )
+
+    def execute(self, request):
+        # type: (ReceiveConfigSyncChunkRequest) -> bool
+        upload_path = _config_sync_upload_path(request.upload_id)
+        if request.offset == 0:
+            self._cleanup_uploads()
+            store.makedirs(upload_path.parent)
+            mode = "wb"
+        else:
+            mode = "ab"
+
+        with upload_path.open(mode) as f:
+            if f.tell() != request.offset:
+                raise MKGeneralException(
+                    _("Received chunk at offset %d, but the upload has %d bytes") %
+                    (request.offset, f.tell()))
+            f.write(request.chunk)
+        return True
+
+    def _cleanup_uploads(self):
+        # type: () -> None
+        min_mtime = time.time() - self._max_upload_age
+        try:
+            upload_paths = list(_config_sync_upload_dir().iterdir())
+        except FileNotFoundError:
+            return
+
+        for upload_path in upload_paths:
+            try:
+                if upload_path.stat().st_mtime < min_mtime:
+                    upload_path.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _get_config_sync_file_infos(replication_paths, base_dir, hash_cache=None):
+    # type: (List[ReplicationPath], Path, Optional[ConfigSyncHashCache]) -> Dict[str, ConfigSyncFileInfo]
     """Scans the given replication paths for the information needed for the config sync
 
     It produces a dictionary of sync file infos. One entry is created for each file.  Directories
-    are not added to the dictionary.
+    are not added to the dictionary. The hashes of unchanged files are taken from the given hash
+    cache, which is updated and saved afterwards.
     """
     infos = {}
 
@@ -2086,37 +2398,58 @@ def _get_config_sync_file_infos(replication_paths, base_dir):
             continue  # Only report back existing things
 
         if replication_path.ty == "file":
-            infos[replication_path.site_path] = _get_config_sync_file_info(path)
+            infos[replication_path.site_path] = _get_config_sync_file_info(
+                str(path), path.lstat(), replication_path.site_path, hash_cache)
 
         elif replication_path.ty == "dir":
-            for entry in path.glob("**/*"):
-                if entry.is_dir() and not entry.is_symlink():
-                    continue  # Do not add directories at all
-
-                entry_site_path = entry.relative_to(base_dir)
-                infos[str(entry_site_path)] = _get_config_sync_file_info(entry)
+            for entry_path, entry_stat, entry_site_path in _scan_config_sync_dir(
+                    str(path), str(path.relative_to(base_dir))):
+                infos[entry_site_path] = _get_config_sync_file_info(entry_path, entry_stat,
+                                                                    entry_site_path, hash_cache)
 
         else:
             raise NotImplementedError()
+
+    if hash_cache is not None:
+        hash_cache.save()
     return infos
 
 
-def _get_config_sync_file_info(file_path):
-    # type: (Path) -> ConfigSyncFileInfo
-    stat = file_path.lstat()
-    is_symlink = file_path.is_symlink()
-    return ConfigSyncFileInfo(
-        stat.st_mode,
-        stat.st_size,
-        os.readlink(str(file_path)) if is_symlink else None,
-        _create_config_sync_file_hash(file_path) if not is_symlink else None,
-    )
+def _scan_config_sync_dir(dir_path, dir_site_path):
+    # type: (str, str) -> Iterator[Tuple[str, os.stat_result, str]]
+    """Recursively yields all entries of a directory except the directories
+
+    Symlinks to directories are yielded, but not followed. Compared to Path.glob("**/*") this
+    saves the Path objects and the additional stat calls of each entry. This matters for
+    large WATO folder trees.
+    """
+    with os.scandir(dir_path) as it:
+        entries = list(it)
+
+    for entry in entries:
+        entry_site_path = dir_site_path + "/" + entry.name
+        if entry.is_dir(follow_symlinks=False):
+            yield from _scan_config_sync_dir(entry.path, entry_site_path)
+        else:
+            yield entry.path, entry.stat(follow_symlinks=False), entry_site_path
+
+
+def _get_config_sync_file_info(file_path, stat, site_path, hash_cache=None):
+    # type: (str, os.stat_result, str, Optional[ConfigSyncHashCache]) -> ConfigSyncFileInfo
+    if S_ISLNK(stat.st_mode):
+        return ConfigSyncFileInfo(stat.st_mode, stat.st_size, os.readlink(file_path), None)
+
+    if hash_cache is None:
+        file_hash = _create_config_sync_file_hash(file_path)
+    else:
+        file_hash = hash_cache.file_hash(site_path, file_path, stat)
+    return ConfigSyncFileInfo(stat.st_mode, stat.st_size, None, file_hash)
 
 
 def _create_config_sync_file_hash(file_path):
-    # type: (Path) -> str
+    # type: (str) -> str
     sha256 = hashlib.sha256()
-    with file_path.open("rb") as f:
+    with open(file_path, "rb") as f:
         while True:
             chunk = f.read(65536)
             if not chunk:
@@ -2125,6 +2458,77 @@ def _create_config_sync_file_hash(file_path):
     return sha256.hexdigest()
 
 
+class ConfigSyncHashCache(object):  # pylint: disable=useless-object-inheritance
+    """Persistent cache of the file hashes computed during the config sync
+
+    Hashing all replicated files is the most expensive part of the sync state computation of
+    large setups, although only a few of the files change between two activations. The hash of
+    a file is reused as long as its inode, size and modification time are the same as during the
+    last hashing. The files of the site config directories are hard links to the files of the
+    central site, so they keep these attributes across activations.
+
+    Files modified shortly before they are hashed are not cached. A modification in the same
+    clock tick would not change the modification time.
+
+    Only the entries of the files looked up since loading the cache are saved. The entries of
+    vanished files are dropped this way.
+    """
+    _racy_mtime_ns = 2 * 1000000000
+
+    def __init__(self, path):
+        # type: (Path) -> None
+        super(ConfigSyncHashCache, self).__init__()
+        self._path = path
+        self._entries = self._load()
+        self._seen = {}  # type: Dict[str, Tuple[int, int, int, str]]
+        self._changed = False
+        self._racy_limit_ns = time.time_ns() - self._racy_mtime_ns
+        self.hits = 0
+        self.misses = 0
+
+    def _load(self):
+        # type: () -> Dict[str, Tuple[int, int, int, str]]
+        try:
+            entries = marshal.loads(store.load_bytes_from_file(self._path))
+        except (EOFError, ValueError, TypeError):
+            return {}  # Broken or empty cache. Will be rebuilt.
+        return entries if isinstance(entries, dict) else {}
+
+    def file_hash(self, site_path, file_path, stat):
+        # type: (str, str, os.stat_result) -> str
+        key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        entry = self._entries.get(site_path)
+        if entry is not None and entry[:3] == key:
+            self.hits += 1
+            self._seen[site_path] = entry
+            return entry[3]
+
+        self.misses += 1
+        file_hash = _create_config_sync_file_hash(file_path)
+        if stat.st_mtime_ns < self._racy_limit_ns:
+            self._seen[site_path] = key + (file_hash,)
+            self._changed = True
+        return file_hash
+
+    def save(self):
+        # type: () -> None
+        if not self._changed and len(self._seen) == len(self._entries):
+            return
+        store.makedirs(self._path.parent)
+        store.save_bytes_to_file(self._path, marshal.dumps(self._seen))
+        self._entries = self._seen
+        self._seen = {}
+        self._changed = False
+
+
+def _config_sync_hash_cache_path(site_id=None):
+    # type: (Optional[SiteId]) -> Path
+    """The hash cache of a site config directory or, without site, the one of the local site"""
+    if site_id is None:
+        return Path(cmk.utils.paths.var_dir) / "wato" / "config-sync-hashes.marshal"
+    return Path(cmk.utils.paths.var_dir) / "wato" / "config-sync-hashes" / ("%s.marshal" % site_id)
+
+
 def update_config_generation():
     """Increase the config generation ID
 
@@ -2147,9 +2551,11 @@ def _config_generation_path():
 
 ReceiveConfigSyncRequest = NamedTuple("ReceiveConfigSyncRequest", [
     ("site_id", SiteId),
-    ("sync_archive", bytes),
+    ("sync_archive", Union[bytes, Path]),
     ("to_delete", List[str]),
     ("config_generation", int),
+    ("sync_deltas", Optional[Path]),
+    ("deltas", Dict[str, SyncDelta]),
 ])
 
 
@@ -2160,6 +2566,9 @@ class AutomationReceiveConfigSync(AutomationCommand):
     The central site hands over the a tar archive with the files to be written and a list of
     files to be deleted. The configuration generation is used to validate that no modification has
     been made between the two sync steps (get-config-sync-state and this autmoation).
+
+    Central sites supporting the chunked upload hand over the IDs of the uploaded compressed
+    archive and, optionally, of the uploaded archive of deltas instead.
     """
     def command_name(self):
         return "receive-config-sync"
@@ -2169,30 +2578,51 @@ class AutomationReceiveConfigSync(AutomationCommand):
         site_id = SiteId(html.request.get_ascii_input_mandatory("site_id"))
         verify_remote_site_config(site_id)
 
+        sync_deltas = None  # type: Optional[Path]
+        deltas = {}  # type: Dict[str, SyncDelta]
+        if not html.request.has_var("sync_archive_upload"):
+            sync_archive = html.request.uploaded_file("sync_archive")[2]  # type: Union[bytes, Path]
+        else:
+            sync_archive = _config_sync_upload_path(
+                html.request.get_ascii_input_mandatory("sync_archive_upload"))
+            if html.request.has_var("sync_deltas_upload"):
+                sync_deltas = _config_sync_upload_path(
+                    html.request.get_ascii_input_mandatory("sync_deltas_upload"))
+                deltas = ast.literal_eval(html.request.get_ascii_input_mandatory("deltas"))
+
         return ReceiveConfigSyncRequest(
             site_id,
-            html.request.uploaded_file("sync_archive")[2],
+            sync_archive,
             ast.literal_eval(html.request.get_ascii_input_mandatory("to_delete")),
             html.request.get_integer_input_mandatory("config_generation"),
+            sync_deltas,
+            deltas,
         )
 
     def execute(self, request):
         # type: (ReceiveConfigSyncRequest) -> bool
-        with store.lock_checkmk_configuration():
-            if request.config_generation != _get_current_config_generation():
-                raise MKGeneralException(
-                    _("The configuration was changed during activation. "
-                      "Terminating this activation to ensure configuration integrity. "
-                      "Please try again."))
-
-            self._update_config_on_remote_site(request.sync_archive, request.to_delete)
-
-            _execute_post_config_sync_actions(request.site_id)
-            return True
-
-    def _update_config_on_remote_site(self, sync_archive, to_delete):
-        # type: (bytes, List[str]) -> None
-        """Use the given tar archive and list of files to be deleted to update the local files"""
+        try:
+            with store.lock_checkmk_configuration():
+                if request.config_generation != _get_current_config_generation():
+                    raise MKGeneralException(
+                        _("The configuration was changed during activation. "
+                          "Terminating this activation to ensure configuration integrity. "
+                          "Please try again."))
+
+                self._update_config_on_remote_site(request.sync_archive, request.to_delete,
+                                                   request.sync_deltas, request.deltas)
+
+                _execute_post_config_sync_actions(request.site_id)
+                return True
+        finally:
+            for upload_path in [request.sync_archive, request.sync_deltas]:
+                if isinstance(upload_path, Path) and upload_path.exists():
+                    upload_path.unlink()
+
+    def _update_config_on_remote_site(self, sync_archive, to_delete, sync_deltas, deltas):
+        # type: (Union[bytes, Path], List[str], Optional[Path], Dict[str, SyncDelta]) -> None
+        """Use the given tar archive, deltas and list of files to be deleted to update the local
+        files"""
         base_dir = Path(cmk.utils.paths.omd_root)
 
         for site_path in to_delete:
@@ -2206,3 +2636,6 @@ class AutomationReceiveConfigSync(AutomationCommand):
                     raise
 
         _unpack_sync_archive(sync_archive, base_dir)
+
+        if sync_deltas is not None:
+            _apply_sync_deltas(sync_deltas, deltas, base_dir)
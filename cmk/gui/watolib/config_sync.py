@@ -14,12 +14,14 @@ import multiprocessing
 import os
 from pathlib import Path
 import shutil
+import struct
 import subprocess
 import tarfile
 import time
 import traceback
 from types import TracebackType
-from typing import Any, Optional, Type, Tuple, Dict, List, NamedTuple
+from typing import Any, BinaryIO, Iterator, Optional, Type, Tuple, Dict, List, NamedTuple
+import zlib
 
 import cmk.utils.store as store
 import cmk.utils.paths
@@ -490,3 +492,147 @@ def _update_contacts_dict(master, site):
         site_contacts.update({user_id: settings})
 
     return site_contacts
+
+
+# Large changed files can be transferred as deltas against the version the remote site has. The
+# files are split into content defined chunks: A chunk ends after a line having a CRC with the lower
+# bits unset, so the chunks resynchronize after inserted or removed lines. The remote site sends the
+# digests of its chunks (the signature), the central site sends the chunks the remote site lacks.
+_DELTA_MAGIC = b"CMKSYNCDELTA1\n"
+_DELTA_CHUNK_BITS = 6  # Chunks of 64 lines on average
+_DELTA_MAX_CHUNK_SIZE = 65536
+_DELTA_OP = struct.Struct("!cI")
+_DELTA_COPY = b"C"
+_DELTA_LITERAL = b"L"
+
+
+def _iter_delta_chunks(f):
+    # type: (BinaryIO) -> Iterator[bytes]
+    lines = []  # type: List[bytes]
+    size = 0
+    while True:
+        line = f.readline(_DELTA_MAX_CHUNK_SIZE)
+        if not line:
+            break
+
+        lines.append(line)
+        size += len(line)
+        if size >= _DELTA_MAX_CHUNK_SIZE or _is_delta_chunk_end(line):
+            yield b"".join(lines)
+            lines, size = [], 0
+
+    if lines:
+        yield b"".join(lines)
+
+
+def _is_delta_chunk_end(line):
+    # type: (bytes) -> bool
+    # The CRC of similar lines, e.g. of host names differing in some digits, differ only in some
+    # bits. A multiplicative hash of the CRC spreads them over the high bits.
+    return ((zlib.crc32(line) * 0x9e3779b1) & 0xffffffff) >> (32 - _DELTA_CHUNK_BITS) == 0
+
+
+def _delta_chunk_digest(chunk):
+    # type: (bytes) -> str
+    return hashlib.blake2b(chunk, digest_size=16).hexdigest()
+
+
+def get_delta_signature(file_path):
+    # type: (Path) -> Tuple[str, List[str]]
+    """Returns the SHA256 hash of a file together with the digests of its chunks"""
+    sha256 = hashlib.sha256()
+    digests = []
+    with file_path.open("rb") as f:
+        for chunk in _iter_delta_chunks(f):
+            sha256.update(chunk)
+            digests.append(_delta_chunk_digest(chunk))
+    return sha256.hexdigest(), digests
+
+
+def create_delta(file_path, signature, delta_path, max_literal_ratio=0.5):
+    # type: (Path, List[str], Path, float) -> bool
+    """Writes the delta of a file against the file having the given signature
+
+    Returns False and writes no delta in case more than the given ratio of the file would have
+    to be transferred literally. The file is better transferred completely then.
+    """
+    chunk_indexes = {}  # type: Dict[str, int]
+    for index, digest in enumerate(signature):
+        chunk_indexes.setdefault(digest, index)
+
+    max_literal_size = file_path.stat().st_size * max_literal_ratio
+    literal_size = 0
+    with file_path.open("rb") as f, delta_path.open("wb") as delta:
+        delta.write(_DELTA_MAGIC)
+        for chunk in _iter_delta_chunks(f):
+            index = chunk_indexes.get(_delta_chunk_digest(chunk))
+            if index is not None:
+                delta.write(_DELTA_OP.pack(_DELTA_COPY, index))
+                continue
+
+            literal_size += len(chunk)
+            if literal_size > max_literal_size:
+                break
+            delta.write(_DELTA_OP.pack(_DELTA_LITERAL, len(chunk)))
+            delta.write(chunk)
+
+    if literal_size > max_literal_size:
+        delta_path.unlink()
+        return False
+    return True
+
+
+def apply_delta(file_path, delta_path, base_hash, file_hash, mode):
+    # type: (Path, Path, str, str, int) -> None
+    """Replaces a file with the result of applying a delta to it
+
+    The file needs to have the base hash the delta was created for. The result is written to a
+    temporary file first, which replaces the file once it has been verified.
+    """
+    sha256 = hashlib.sha256()
+    chunk_positions = []  # type: List[Tuple[int, int]]
+    offset = 0
+    with file_path.open("rb") as f:
+        for chunk in _iter_delta_chunks(f):
+            sha256.update(chunk)
+            chunk_positions.append((offset, len(chunk)))
+            offset += len(chunk)
+
+    if sha256.hexdigest() != base_hash:
+        raise MKGeneralException(
+            _("Can not apply the delta of %s: The file has changed") % file_path)
+
+    tmp_path = file_path.with_name(".%s.new" % file_path.name)
+    sha256 = hashlib.sha256()
+    try:
+        with file_path.open("rb") as base, delta_path.open("rb") as delta, \
+             tmp_path.open("wb") as tmp:
+            if delta.read(len(_DELTA_MAGIC)) != _DELTA_MAGIC:
+                raise MKGeneralException(_("Invalid delta of %s") % file_path)
+
+            while True:
+                header = delta.read(_DELTA_OP.size)
+                if not header:
+                    break
+
+                op, value = _DELTA_OP.unpack(header)
+                if op == _DELTA_COPY and value < len(chunk_positions):
+                    offset, length = chunk_positions[value]
+                    base.seek(offset)
+                    data = base.read(length)
+                elif op == _DELTA_LITERAL:
+                    data = delta.read(value)
+                else:
+                    raise MKGeneralException(_("Invalid delta of %s") % file_path)
+
+                sha256.update(data)
+                tmp.write(data)
+
+        if sha256.hexdigest() != file_hash:
+            raise MKGeneralException(_("Invalid delta of %s: Hash mismatch") % file_path)
+
+        os.chmod(str(tmp_path), mode & 0o7777)
+        os.rename(str(tmp_path), str(file_path))
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
@@ -5,13 +5,16 @@
 # conditions defined in the file COPYING, which is part of this source code package.
 import abc
 from collections.abc import Mapping
+import hashlib
+import marshal
 import operator
 import os
 import time
 import re
 import shutil
+import tempfile
 import uuid
-from typing import Any, Dict, List, Optional, Set, Tuple, Type, Union
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Type, Union
 
 import six
 from livestatus import SiteId
@@ -50,6 +53,7 @@ from cmk.gui.watolib.host_attributes import (
 from cmk.gui.plugins.watolib.utils import wato_fileheader
 
 import cmk.utils.version as cmk_version
+import cmk.utils.paths
 
 from cmk.utils import store
 from cmk.utils.iterables import first
@@ -158,13 +162,17 @@ class WithUniqueIdentifier(metaclass=abc.ABCMeta):
         Returns:
             The loaded data.
         """
-        data = store.load_object_from_file(self._store_file_name(), default={})
+        data = self._load_instance_data()
         data = self._upgrade_keys(data)
         unique_id = data.get('__id')
         if self._id is None:
             self._id = unique_id
         self._set_instance_data(data)
 
+    def _load_instance_data(self):
+        # type: () -> Dict[str, Any]
+        return store.load_object_from_file(self._store_file_name(), default={})
+
     @abc.abstractmethod
     def _set_instance_data(self, wato_info):
         """Hook method which is called by 'load_instance'.
@@ -526,6 +534,192 @@ def update_metadata(
     return attributes
 
 
+# Identifies the version of a file or directory: inode, size and mtime_ns. The files of the WATO
+# tree are replaced by renaming on every save, which changes the inode.
+_StatKey = Tuple[int, int, int]
+
+# The key of a missing file, e.g. the .wato file of a root folder which has never been edited
+_MISSING_FILE_KEY = (0, -1, 0)  # type: _StatKey
+
+
+def _stat_key(path):
+    # type: (str) -> _StatKey
+    try:
+        st = os.stat(path)
+    except OSError:
+        return _MISSING_FILE_KEY
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+
+class _FolderTreeCache(object):  # pylint: disable=useless-object-inheritance
+    """Persistent cache of the parsed .wato files, subfolder lists and hosts.mk files
+
+    Building the folder tree needs the .wato file and the subfolders of every folder on every
+    request. The parsed data is cached in a global index instead and taken from there as long as
+    the .wato file and the directory of a folder are unchanged. The hosts.mk files are cached
+    per folder and only loaded when the hosts of a folder are needed.
+
+    Entries of files modified shortly before they are read are not cached. A modification in the
+    same clock tick would not change the modification time. The index only keeps the entries used
+    since it has been loaded. The entries of removed folders are dropped this way, their cached
+    hosts.mk files are removed when saving the index.
+    """
+    _racy_mtime_ns = 2 * 1000000000
+
+    def __init__(self, cache_dir):
+        # type: (str) -> None
+        super(_FolderTreeCache, self).__init__()
+        self._cache_dir = cache_dir
+        self._racy_limit_ns = time.time_ns() - self._racy_mtime_ns
+        self._wato_infos = {}  # type: Dict[str, Tuple[_StatKey, bytes]]
+        self._subfolders = {}  # type: Dict[str, Tuple[_StatKey, List[str]]]
+        self._used_wato_infos = {}  # type: Dict[str, Tuple[_StatKey, bytes]]
+        self._used_subfolders = {}  # type: Dict[str, Tuple[_StatKey, List[str]]]
+        self._folder_dirs = set()  # type: Set[str]
+        self._changed = False
+        self._load_index()
+
+    def _index_path(self):
+        # type: () -> str
+        return self._cache_dir + "/index.marshal"
+
+    def _hosts_cache_dir(self):
+        # type: () -> str
+        return self._cache_dir + "/hosts"
+
+    def _hosts_cache_path(self, hosts_file_path):
+        # type: (str) -> str
+        return "%s/%s.marshal" % (self._hosts_cache_dir(),
+                                  hashlib.sha256(hosts_file_path.encode("utf-8")).hexdigest())
+
+    def _load_index(self):
+        # type: () -> None
+        index = self._load_marshal(self._index_path())
+        if isinstance(index, tuple) and len(index) == 2:
+            self._wato_infos, self._subfolders = index
+
+    def _load_marshal(self, path):
+        # type: (str) -> Any
+        try:
+            with open(path, "rb") as f:
+                return marshal.load(f)
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+
+    def _save_marshal(self, path, data):
+        # type: (str, Any) -> None
+        """Write atomically without locking. Concurrent requests may only lose some entries"""
+        content = marshal.dumps(data)
+        store.makedirs(os.path.dirname(path))
+        with tempfile.NamedTemporaryFile("wb",
+                                         dir=os.path.dirname(path),
+                                         prefix=".%s.new" % os.path.basename(path),
+                                         delete=False) as tmp:
+            tmp.write(content)
+        os.rename(tmp.name, path)
+
+    def _is_cacheable(self, key):
+        # type: (_StatKey) -> bool
+        return key[2] < self._racy_limit_ns
+
+    def wato_info(self, wato_info_path):
+        # type: (str) -> Dict[str, Any]
+        key = _stat_key(wato_info_path)
+        entry = self._wato_infos.get(wato_info_path)
+        if entry is not None and entry[0] == key:
+            self._used_wato_infos[wato_info_path] = entry
+            return marshal.loads(entry[1])
+
+        wato_info = store.load_object_from_file(wato_info_path, default={})
+        if self._is_cacheable(key):
+            try:
+                self._used_wato_infos[wato_info_path] = (key, marshal.dumps(wato_info))
+                self._changed = True
+            except ValueError:
+                pass  # Not only built-in types
+        return wato_info
+
+    def subfolder_names(self, dir_path):
+        # type: (str) -> List[str]
+        self._folder_dirs.add(dir_path.rstrip("/"))
+        st = os.stat(dir_path)
+        key = (st.st_ino, 0, st.st_mtime_ns)
+        entry = self._subfolders.get(dir_path)
+        if entry is not None and entry[0] == key:
+            self._used_subfolders[dir_path] = entry
+            return entry[1]
+
+        names = [
+            entry_name for entry_name in os.listdir(dir_path)
+            if os.path.isdir(dir_path + "/" + entry_name)
+        ]
+        if self._is_cacheable(key):
+            self._used_subfolders[dir_path] = (key, names)
+            self._changed = True
+        return names
+
+    def hosts_variables(self, hosts_file_path, load_hosts_file):
+        # type: (str, Callable[[], Dict[str, Any]]) -> Dict[str, Any]
+        key = _stat_key(hosts_file_path)
+        cache_path = self._hosts_cache_path(hosts_file_path)
+        cached = self._load_marshal(cache_path)
+        if isinstance(cached, tuple) and len(cached) == 2 and cached[0] == key:
+            return cached[1]
+
+        variables = load_hosts_file()
+        if self._is_cacheable(key):
+            try:
+                self._save_marshal(cache_path, (key, variables))
+            except ValueError:
+                pass  # Not only built-in types, e.g. when a hosts.mk has been edited manually
+        return variables
+
+    def save(self):
+        # type: () -> None
+        """Save the index in case something changed or some folders have been removed"""
+        if (not self._changed and len(self._used_wato_infos) == len(self._wato_infos) and
+                len(self._used_subfolders) == len(self._subfolders)):
+            return
+
+        self._wato_infos, self._subfolders = self._used_wato_infos, self._used_subfolders
+        self._used_wato_infos, self._used_subfolders = {}, {}
+        self._changed = False
+        try:
+            self._save_marshal(self._index_path(), (self._wato_infos, self._subfolders))
+        except (IOError, OSError):
+            pass  # Only a cache
+        self._remove_obsolete_hosts_caches()
+
+    def _remove_obsolete_hosts_caches(self):
+        # type: () -> None
+        """Remove the cached hosts.mk files of the folders which have been removed or moved"""
+        file_names = {
+            os.path.basename(self._hosts_cache_path(dir_path + "/hosts.mk"))
+            for dir_path in self._folder_dirs
+        }
+        try:
+            cached_file_names = os.listdir(self._hosts_cache_dir())
+        except OSError:
+            return
+
+        for file_name in cached_file_names:
+            # Skip the temporary files of concurrent requests
+            if file_name in file_names or file_name.startswith("."):
+                continue
+            try:
+                os.remove(self._hosts_cache_dir() + "/" + file_name)
+            except OSError:
+                pass
+
+
+def _folder_tree_cache():
+    # type: () -> _FolderTreeCache
+    if "wato_folder_tree_cache" not in g:
+        g.wato_folder_tree_cache = _FolderTreeCache(cmk.utils.paths.tmp_dir +
+                                                    "/wato/folder_tree_cache")
+    return g.wato_folder_tree_cache
+
+
 class CREFolder(WithPermissions, WithAttributes, WithUniqueIdentifier, BaseFolder):
     """This class represents a WATO folder that contains other folders and hosts."""
 
@@ -538,6 +732,7 @@ class CREFolder(WithPermissions, WithAttributes, WithUniqueIdentifier, BaseFolde
         if 'wato_folders' not in g:
             wato_folders = g.wato_folders = {}
             Folder("", "").add_to_dictionary(wato_folders)
+            _folder_tree_cache().save()
         return g.wato_folders
 
     @staticmethod
@@ -704,7 +899,8 @@ class CREFolder(WithPermissions, WithAttributes, WithUniqueIdentifier, BaseFolde
         if not os.path.exists(self.hosts_file_path()):
             return
 
-        variables = self._load_hosts_file()
+        variables = _folder_tree_cache().hosts_variables(self.hosts_file_path(),
+                                                         self._load_hosts_file)
         # Can either be set to True or a string (which will be used as host lock message)
         self._locked_hosts = variables["_lock"]
 
@@ -1093,6 +1289,10 @@ class CREFolder(WithPermissions, WithAttributes, WithUniqueIdentifier, BaseFolde
         Folder.invalidate_caches()
         self.load_instance()
 
+    def _load_instance_data(self):
+        # type: () -> Dict[str, Any]
+        return _folder_tree_cache().wato_info(self._store_file_name())
+
     def _get_identifier(self):
         return uuid.uuid4().hex
 
@@ -1117,17 +1317,15 @@ class CREFolder(WithPermissions, WithAttributes, WithUniqueIdentifier, BaseFolde
         dir_path = self._root_dir + self.path()
         if not os.path.exists(dir_path):
             return
-        for entry in os.listdir(dir_path):
-            subfolder_dir = dir_path + "/" + entry
-            if os.path.isdir(subfolder_dir):
-                if self.path():
-                    subfolder_path = self.path() + "/" + entry
-                else:
-                    subfolder_path = entry
-                self._subfolders[entry] = Folder(entry,
-                                                 subfolder_path,
-                                                 parent_folder=self,
-                                                 root_dir=self._root_dir)
+        for entry in _folder_tree_cache().subfolder_names(dir_path):
+            if self.path():
+                subfolder_path = self.path() + "/" + entry
+            else:
+                subfolder_path = entry
+            self._subfolders[entry] = Folder(entry,
+                                             subfolder_path,
+                                             parent_folder=self,
+                                             root_dir=self._root_dir)
 
     def wato_info_path(self):
         return self.filesystem_path() + "/.wato"
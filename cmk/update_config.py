@@ -10,6 +10,7 @@ all sites and on remote sites after receiving a snapshot and does not need to
 be called manually.",
 """
 
+import itertools
 import re
 import os
 from pathlib import Path
@@ -32,6 +33,7 @@ import cmk.utils.log as log
 from cmk.utils.log import VERBOSE
 import cmk.utils.debug
 import cmk.utils.paths
+import cmk.utils.structured_data
 import cmk.utils
 import cmk.gui.watolib.tags  # pylint: disable=cmk-module-layer-violation
 import cmk.gui.watolib.hosts_and_folders  # pylint: disable=cmk-module-layer-violation
@@ -94,6 +96,7 @@ class UpdateConfig:
             (self._rewrite_autochecks, "Rewriting autochecks"),
             (self._cleanup_version_specific_caches, "Cleanup version specific caches"),
             (self._update_fs_used_name, "Migrating fs_used name"),
+            (self._migrate_inventory_trees, "Migrating inventory trees to binary format"),
         ]
 
     # FS_USED UPDATE DELETE THIS FOR CMK 1.8, THIS ONLY migrates 1.6->1.7
@@ -144,6 +147,24 @@ class UpdateConfig:
         all_rulesets.load()
         all_rulesets.save()
 
+    def _migrate_inventory_trees(self):
+        # type: () -> None
+        suffixes = (".gz", cmk.utils.structured_data.BINARY_TREE_FILE_SUFFIX)
+        tree_files = itertools.chain(
+            Path(cmk.utils.paths.inventory_output_dir).glob("*"),
+            Path(cmk.utils.paths.inventory_archive_dir).glob("*/*"),
+            Path(cmk.utils.paths.status_data_dir).glob("*"),
+        )
+
+        num_converted = 0
+        for tree_file in tree_files:
+            if (tree_file.name.startswith(".") or tree_file.suffix in suffixes or
+                    not tree_file.is_file()):
+                continue
+            if cmk.utils.structured_data.convert_tree_file(str(tree_file)):
+                num_converted += 1
+        self._logger.log(VERBOSE, "Converted %d inventory trees" % num_converted)
+
     def _initialize_gui_environment(self):
         self._logger.log(VERBOSE, "Loading GUI plugins...")
         cmk.gui.modules.load_all_plugins()
@@ -6,10 +6,14 @@
 
 import errno
 import logging
+import mmap
 import os
 from pathlib import Path
+import pickle
+import struct
 import tempfile
-from typing import Optional, Dict, Iterator, List, Tuple, NamedTuple
+import time
+from typing import Any, Optional, Dict, Iterator, List, Tuple, NamedTuple
 
 import cmk.utils
 import cmk.utils.paths
@@ -43,6 +47,16 @@ PiggybackRawDataInfo = NamedTuple('PiggybackRawDataInfo', [
 
 PiggybackTimeSettings = List[Tuple[Optional[str], str, int]]
 
+# (time the payload was stored, offset, size) of a payload in the PiggybackStore
+_PiggybackStoreEntry = Tuple[float, int, int]
+
+# (piggybacked host, source hosts, matching time settings) per piggybacked host
+_PiggybackedHostsTimeSettings = List[Tuple[str, List[str], Dict[Tuple[Optional[str], str], int]]]
+
+# Is set by set_piggyback_store() when the indexed store is configured. Otherwise the
+# directory layout described below is used.
+_indexed_store = None  # type: Optional[PiggybackStore]
+
 # ***** Terminology *****
 # "piggybacked_host_folder":
 # - tmp/check_mk/piggyback/HOST
@@ -72,6 +86,10 @@ def get_piggyback_raw_data(piggybacked_hostname, time_settings):
     if not piggybacked_hostname:
         return []
 
+    if _indexed_store is not None:
+        return _get_piggyback_raw_data_from_store(_indexed_store, piggybacked_hostname,
+                                                  time_settings)
+
     piggyback_file_infos = _get_piggyback_processed_file_infos(piggybacked_hostname, time_settings)
     if not piggyback_file_infos:
         logger.log(
@@ -133,6 +151,16 @@ def get_source_and_piggyback_hosts(time_settings):
     # type: (PiggybackTimeSettings) -> Iterator[Tuple[str, str]]
     """Generates all piggyback pig/piggybacked host pairs that have up-to-date data"""
 
+    if _indexed_store is not None:
+        snapshot = _indexed_store.snapshot()
+        for piggybacked_hostname in snapshot.stored:
+            for source_hostname, successfully_processed, _reason, _reason_status in \
+                _get_piggyback_processed_store_infos(snapshot, piggybacked_hostname,
+                                                     time_settings):
+                if successfully_processed:
+                    yield source_hostname, piggybacked_hostname
+        return
+
     # Pylint bug (https://github.com/PyCQA/pylint/issues/1660). Fixed with pylint 2.x
     for piggybacked_host_folder in _get_piggybacked_host_folders():
         for file_info in _get_piggyback_processed_file_infos(
@@ -146,6 +174,14 @@ def get_source_and_piggyback_hosts(time_settings):
 
 def has_piggyback_raw_data(piggybacked_hostname, time_settings):
     # type: (str, PiggybackTimeSettings) -> bool
+    if _indexed_store is not None:
+        store_infos = _get_piggyback_processed_store_infos(_indexed_store.snapshot(),
+                                                           piggybacked_hostname, time_settings)
+        for _source_hostname, successfully_processed, _reason, _reason_status in store_infos:
+            if successfully_processed:
+                return True
+        return False
+
     for file_info in _get_piggyback_processed_file_infos(piggybacked_hostname, time_settings):
         if file_info.successfully_processed:
             return True
@@ -201,25 +237,38 @@ def _get_matching_time_settings(source_hostnames, piggybacked_hostname, time_set
 def _get_piggyback_processed_file_info(source_hostname, piggybacked_hostname, piggyback_file_path,
                                        time_settings):
     # type: (str, str, Path, Dict[Tuple[Optional[str], str], int]) -> Tuple[bool, str, int]
-
-    max_cache_age = _get_max_cache_age(source_hostname, piggybacked_hostname, time_settings)
-    validity_period = _get_validity_period(source_hostname, piggybacked_hostname, time_settings)
-    validity_state = _get_validity_state(source_hostname, piggybacked_hostname, time_settings)
-
     try:
         file_age = cmk.utils.cachefile_age(piggyback_file_path)
     except MKGeneralException:
         return False, "Piggyback file might have been deleted", 0
 
+    status_file_path = _get_source_status_file_path(source_hostname)
+    is_sending = status_file_path.exists()
+    return _eval_piggyback_data_age(
+        source_hostname,
+        piggybacked_hostname,
+        time_settings,
+        file_age,
+        is_sending,
+        is_sending and _is_piggyback_file_outdated(status_file_path, piggyback_file_path),
+    )
+
+
+def _eval_piggyback_data_age(source_hostname, piggybacked_hostname, time_settings, file_age,
+                             is_sending, is_outdated):
+    # type: (str, str, Dict[Tuple[Optional[str], str], int], float, bool, bool) -> Tuple[bool, str, int]
+    max_cache_age = _get_max_cache_age(source_hostname, piggybacked_hostname, time_settings)
+    validity_period = _get_validity_period(source_hostname, piggybacked_hostname, time_settings)
+    validity_state = _get_validity_state(source_hostname, piggybacked_hostname, time_settings)
+
     if file_age > max_cache_age:
         return False, "Piggyback file too old: %s" % Age(file_age - max_cache_age), 0
 
-    status_file_path = _get_source_status_file_path(source_hostname)
-    if not status_file_path.exists():
+    if not is_sending:
         reason = "Source '%s' not sending piggyback data" % source_hostname
         return _eval_file_in_validity_period(file_age, validity_period, validity_state, reason)
 
-    if _is_piggyback_file_outdated(status_file_path, piggyback_file_path):
+    if is_outdated:
         reason = "Piggyback file not updated by source '%s'" % source_hostname
         return _eval_file_in_validity_period(file_age, validity_period, validity_state, reason)
 
@@ -287,12 +336,29 @@ def remove_source_status_file(source_hostname):
     # type: (str) -> bool
     """Remove the source_status_file of this piggyback host which will
     mark the piggyback data from this source as outdated."""
+    if _indexed_store is not None:
+        return _indexed_store.remove_source_status(source_hostname)
+
     source_status_path = _get_source_status_file_path(source_hostname)
     return _remove_piggyback_file(source_status_path)
 
 
 def store_piggyback_raw_data(source_hostname, piggybacked_raw_data):
     # type: (str, Dict[str, List[bytes]]) -> None
+    if _indexed_store is not None:
+        for piggybacked_hostname in piggybacked_raw_data:
+            logger.log(
+                VERBOSE,
+                "Storing piggyback data for: %s",
+                piggybacked_hostname,
+            )
+        _indexed_store.update(
+            source_hostname, {
+                piggybacked_hostname: b"%s\n" % b"\n".join(lines)
+                for piggybacked_hostname, lines in piggybacked_raw_data.items()
+            })
+        return
+
     piggyback_file_paths = []
     for piggybacked_hostname, lines in piggybacked_raw_data.items():
         piggyback_file_path = _get_piggybacked_file_path(source_hostname, piggybacked_hostname)
@@ -365,6 +431,9 @@ def _store_status_file_of(status_file_path, piggyback_file_paths):
 
 def get_source_hostnames(piggybacked_hostname=None):
     # type: (Optional[str]) -> List[str]
+    if _indexed_store is not None:
+        return _indexed_store.snapshot().source_hostnames(piggybacked_hostname)
+
     if piggybacked_hostname is None:
         return [
             source_host.name
@@ -456,6 +525,10 @@ def cleanup_piggyback_files(time_settings):
         time_settings,
     )
 
+    if _indexed_store is not None:
+        _cleanup_piggyback_store(_indexed_store, time_settings)
+        return
+
     piggybacked_hosts_settings = _get_piggybacked_hosts_settings(time_settings)
 
     _cleanup_old_source_status_files(piggybacked_hosts_settings)
@@ -482,19 +555,11 @@ def _cleanup_old_source_status_files(piggybacked_hosts_settings):
     """Remove source status files which exceed configured maximum cache age.
     There may be several 'Piggybacked Host Files' rules where the max age is configured.
     We simply use the greatest one per source."""
-
-    max_cache_age_by_sources = {}  # type: Dict[str, int]
+    hostnames_settings = []  # type: _PiggybackedHostsTimeSettings
     for piggybacked_host_folder, source_hosts, time_settings in piggybacked_hosts_settings:
-        for source_host in source_hosts:
-            max_cache_age = _get_max_cache_age(source_host.name, piggybacked_host_folder.name,
-                                               time_settings)
-
-            max_cache_age_of_source = max_cache_age_by_sources.get(source_host.name)
-            if max_cache_age_of_source is None:
-                max_cache_age_by_sources[source_host.name] = max_cache_age
-
-            elif max_cache_age >= max_cache_age_of_source:
-                max_cache_age_by_sources[source_host.name] = max_cache_age
+        source_hostnames = [source_host.name for source_host in source_hosts]
+        hostnames_settings.append((piggybacked_host_folder.name, source_hostnames, time_settings))
+    max_cache_age_by_sources = _get_max_cache_age_by_sources(hostnames_settings)
 
     for source_state_file in _get_source_state_files():
         try:
@@ -522,6 +587,22 @@ def _cleanup_old_source_status_files(piggybacked_hosts_settings):
             _remove_piggyback_file(source_state_file)
 
 
+def _get_max_cache_age_by_sources(piggybacked_hosts_settings):
+    # type: (_PiggybackedHostsTimeSettings) -> Dict[str, int]
+    max_cache_age_by_sources = {}  # type: Dict[str, int]
+    for piggybacked_hostname, source_hostnames, time_settings in piggybacked_hosts_settings:
+        for source_hostname in source_hostnames:
+            max_cache_age = _get_max_cache_age(source_hostname, piggybacked_hostname, time_settings)
+
+            max_cache_age_of_source = max_cache_age_by_sources.get(source_hostname)
+            if max_cache_age_of_source is None:
+                max_cache_age_by_sources[source_hostname] = max_cache_age
+
+            elif max_cache_age >= max_cache_age_of_source:
+                max_cache_age_by_sources[source_hostname] = max_cache_age
+    return max_cache_age_by_sources
+
+
 def _cleanup_old_piggybacked_files(piggybacked_hosts_settings):
     # type: (List[Tuple[Path, List[Path], Dict[Tuple[Optional[str], str], int]]]) -> None
     """Remove piggybacked data files which exceed configured maximum cache age."""
@@ -557,3 +638,479 @@ def _cleanup_old_piggybacked_files(piggybacked_hosts_settings):
                 "Piggyback folder '%s' is empty. Removed it.",
                 piggybacked_host_folder,
             )
+
+
+#.
+#   .--store-------------------------------------------------------------.
+#   |                            _                                         |
+#   |                        ___| |_ ___  _ __ ___                         |
+#   |                       / __| __/ _ \| '__/ _ \                        |
+#   |                       \__ \ || (_) | | |  __/                        |
+#   |                       |___/\__\___/|_|  \___|                        |
+#   |                                                                      |
+#   '----------------------------------------------------------------------'
+
+
+def set_piggyback_store(store_type):
+    # type: (str) -> None
+    """Select where the piggyback data is kept
+
+    "directory" uses one file per source and piggybacked host (see above),
+    "indexed" keeps all piggyback data in a single PiggybackStore file."""
+    global _indexed_store
+    if store_type != "indexed":
+        _indexed_store = None
+    elif _indexed_store is None or _indexed_store.path != cmk.utils.paths.piggyback_store_file:
+        _indexed_store = PiggybackStore(cmk.utils.paths.piggyback_store_file)
+
+
+def rename_host_in_piggyback_store(oldname, newname):
+    # type: (str, str) -> Tuple[int, int]
+    """Rename a host in the piggyback store, if the store is used
+
+    Returns the number of piggybacked hosts renamed (0 or 1) and the number of
+    piggybacked hosts with data sent by the renamed host, like the files renamed
+    in the directory layout."""
+    if _indexed_store is None:
+        return 0, 0
+    return _indexed_store.rename(oldname, newname)
+
+
+def remove_host_from_piggyback_store(piggybacked_hostname):
+    # type: (str) -> bool
+    """Remove the piggyback data of a piggybacked host from the store, if the store is used"""
+    if _indexed_store is None:
+        return False
+    return _indexed_store.remove_piggybacked_host(piggybacked_hostname)
+
+
+def _get_piggyback_raw_data_from_store(piggyback_store, piggybacked_hostname, time_settings):
+    # type: (PiggybackStore, str, PiggybackTimeSettings) -> List[PiggybackRawDataInfo]
+    snapshot = piggyback_store.snapshot()
+    store_infos = _get_piggyback_processed_store_infos(snapshot, piggybacked_hostname,
+                                                       time_settings)
+    if not store_infos:
+        logger.log(
+            VERBOSE,
+            "No piggyback data for '%s'. Skip processing.",
+            piggybacked_hostname,
+        )
+        return []
+
+    piggyback_data = []
+    for source_hostname, successfully_processed, reason, reason_status in store_infos:
+        file_path = piggyback_store.path / piggybacked_hostname / source_hostname
+        if successfully_processed:
+            logger.log(VERBOSE, "Piggyback data '%s': %s", file_path, reason)
+        else:
+            logger.log(VERBOSE, "Piggyback data '%s' is outdated (%s). Skip processing.", file_path,
+                       reason)
+        piggyback_data.append(
+            PiggybackRawDataInfo(source_hostname, str(file_path), successfully_processed, reason,
+                                 reason_status,
+                                 snapshot.payload(piggybacked_hostname, source_hostname)))
+    return piggyback_data
+
+
+def _get_piggyback_processed_store_infos(snapshot, piggybacked_hostname, time_settings):
+    # type: (PiggybackStoreSnapshot, str, PiggybackTimeSettings) -> List[Tuple[str, bool, str, int]]
+    stored = snapshot.stored.get(piggybacked_hostname, {})
+    matching_time_settings = _get_matching_time_settings(list(stored), piggybacked_hostname,
+                                                         time_settings)
+    now = time.time()
+    store_infos = []  # type: List[Tuple[str, bool, str, int]]
+    for source_hostname, (stored_at, _offset, _size) in stored.items():
+        last_contact = snapshot.source_status.get(source_hostname)
+        store_infos.append((source_hostname,) + _eval_piggyback_data_age(
+            source_hostname,
+            piggybacked_hostname,
+            matching_time_settings,
+            now - stored_at,
+            last_contact is not None,
+            last_contact is not None and last_contact > stored_at,
+        ))
+    return store_infos
+
+
+def _cleanup_piggyback_store(piggyback_store, time_settings):
+    # type: (PiggybackStore, PiggybackTimeSettings) -> None
+    """Same as _cleanup_old_source_status_files() and _cleanup_old_piggybacked_files(),
+    but for the piggyback store"""
+    snapshot = piggyback_store.snapshot()
+    now = time.time()
+
+    piggybacked_hosts_settings = []  # type: _PiggybackedHostsTimeSettings
+    for piggybacked_hostname, stored in snapshot.stored.items():
+        source_hostnames = list(stored)
+        matching_time_settings = _get_matching_time_settings(source_hostnames, piggybacked_hostname,
+                                                             time_settings)
+        piggybacked_hosts_settings.append(
+            (piggybacked_hostname, source_hostnames, matching_time_settings))
+    max_cache_age_by_sources = _get_max_cache_age_by_sources(piggybacked_hosts_settings)
+
+    outdated_sources = []  # type: List[str]
+    for source_hostname, last_contact in snapshot.source_status.items():
+        max_cache_age_of_source = max_cache_age_by_sources.get(source_hostname)
+        if max_cache_age_of_source is None:
+            logger.log(VERBOSE, "No piggyback data from source '%s'", source_hostname)
+            continue
+
+        if now - last_contact > max_cache_age_of_source:
+            logger.log(
+                VERBOSE,
+                "Piggyback source status of '%s' is outdated (Too old: %s). Remove it.",
+                source_hostname,
+                Age(now - last_contact - max_cache_age_of_source),
+            )
+            outdated_sources.append(source_hostname)
+
+    outdated_payloads = []  # type: List[Tuple[str, str]]
+    for piggybacked_hostname, source_hostnames, matching_time_settings in piggybacked_hosts_settings:
+        for source_hostname in source_hostnames:
+            stored_at = snapshot.stored[piggybacked_hostname][source_hostname][0]
+            last_contact = snapshot.source_status.get(source_hostname)
+            successfully_processed, reason, _reason_status = _eval_piggyback_data_age(
+                source_hostname,
+                piggybacked_hostname,
+                matching_time_settings,
+                now - stored_at,
+                last_contact is not None,
+                last_contact is not None and last_contact > stored_at,
+            )
+            if not successfully_processed:
+                logger.log(
+                    VERBOSE,
+                    "Piggyback data '%s' is outdated (%s). Remove it.",
+                    piggyback_store.path / piggybacked_hostname / source_hostname,
+                    reason,
+                )
+                outdated_payloads.append((piggybacked_hostname, source_hostname))
+
+    piggyback_store.remove(snapshot, outdated_sources, outdated_payloads)
+
+
+class PiggybackStoreSnapshot(object):  # pylint: disable=useless-object-inheritance
+    """The content of the PiggybackStore at the time it was read
+
+    source_status: The time of the last contact per source host. This is what the
+        mtimes of the source status files are in the directory layout.
+    stored: Per piggybacked host and source host the time the payload was stored
+        together with the location of the payload in the store file.
+    """
+    def __init__(self, source_status, stored, buf):
+        # type: (Dict[str, float], Dict[str, Dict[str, _PiggybackStoreEntry]], Optional[mmap.mmap]) -> None
+        super(PiggybackStoreSnapshot, self).__init__()
+        self.source_status = source_status
+        self.stored = stored
+        self._buffer = buf
+
+    def source_hostnames(self, piggybacked_hostname=None):
+        # type: (Optional[str]) -> List[str]
+        if piggybacked_hostname is None:
+            return [
+                source_hostname for stored in self.stored.values() for source_hostname in stored
+            ]
+        return list(self.stored.get(piggybacked_hostname, {}))
+
+    def payload(self, piggybacked_hostname, source_hostname):
+        # type: (str, str) -> bytes
+        _stored_at, offset, size = self.stored[piggybacked_hostname][source_hostname]
+        if self._buffer is None:
+            return b""
+        return self._buffer[offset:offset + size]
+
+    def payloads_size(self):
+        # type: () -> int
+        return sum(size for entries in self.stored.values()
+                   for _stored_at, _offset, size in entries.values())
+
+
+def _unchanged_source_status(snapshot, outdated_snapshot, source_hostname):
+    # type: (PiggybackStoreSnapshot, PiggybackStoreSnapshot, str) -> bool
+    source_status = snapshot.source_status.get(source_hostname)
+    return (source_status is not None and
+            source_status == outdated_snapshot.source_status.get(source_hostname))
+
+
+def _unchanged_payload(snapshot, outdated_snapshot, payload_key):
+    # type: (PiggybackStoreSnapshot, PiggybackStoreSnapshot, Tuple[str, str]) -> bool
+    piggybacked_hostname, source_hostname = payload_key
+    entry = snapshot.stored.get(piggybacked_hostname, {}).get(source_hostname)
+    return (entry is not None and
+            entry[0] == outdated_snapshot.stored[piggybacked_hostname][source_hostname][0])
+
+
+class PiggybackStore(object):  # pylint: disable=useless-object-inheritance
+    """Keeps the piggyback data of all sources in a single indexed file
+
+    The file is a log of records. Each record consists of a pickled header,
+    which describes a change of the index, and the payloads it adds:
+
+        | magic | record | record | ...
+        record: | header size | payloads size | header | payload | payload | ...
+
+    Writers lock the store file and append a record, e.g. with the payloads
+    received from a single source. The data of the other sources is not touched.
+    Once the outdated payloads make up the bigger part of the file, the writer
+    compacts the store: The current state is written as a single record to a new
+    file, which replaces the store file atomically.
+
+    Readers map the file into memory and replay the records to build the index
+    of the piggybacked hosts (see PiggybackStoreSnapshot). When the file has
+    grown since the last read, only the appended records are replayed. Looking
+    up the data of a piggybacked host then only needs a single stat() instead of
+    listing and stating the files of all sources.
+    """
+    _MAGIC = b"CMKPIGG2"
+    _RECORD_HEADER = struct.Struct("!II")
+    # Smaller stores are not compacted, it's not worth rewriting them
+    _MIN_COMPACTION_SIZE = 1024 * 1024
+
+    def __init__(self, path):
+        # type: (Path) -> None
+        super(PiggybackStore, self).__init__()
+        self.path = path
+        self._inode = None  # type: Optional[int]
+        self._read_size = 0
+        self._snapshot = PiggybackStoreSnapshot({}, {}, None)
+
+    def snapshot(self):
+        # type: () -> PiggybackStoreSnapshot
+        try:
+            stat = os.stat(str(self.path))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            self._inode = None
+            self._read_size = 0
+            self._snapshot = PiggybackStoreSnapshot({}, {}, None)
+            return self._snapshot
+
+        if stat.st_ino != self._inode or stat.st_size != self._read_size:
+            self._read()
+        return self._snapshot
+
+    def _read(self):
+        # type: () -> None
+        with self.path.open("rb") as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != self._inode or stat.st_size < self._read_size:
+                # The store has been compacted. The mapped old file stays valid for the
+                # snapshots handed out before.
+                self._inode = stat.st_ino
+                self._read_size = 0
+                self._snapshot = PiggybackStoreSnapshot({}, {}, None)
+            if not stat.st_size:
+                # Has just been created by a writer acquiring the lock
+                return
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        offset = self._read_size
+        if not offset:
+            if buf[:len(self._MAGIC)] != self._MAGIC:
+                self._inode = None
+                raise MKGeneralException("The piggyback store %s has an unknown format" % self.path)
+            offset = len(self._MAGIC)
+
+        # Copy the index to not change the snapshots handed out before
+        source_status = dict(self._snapshot.source_status)
+        stored = dict(self._snapshot.stored)
+        while offset + self._RECORD_HEADER.size <= len(buf):
+            header_size, payloads_size = self._RECORD_HEADER.unpack_from(buf, offset)
+            payloads_offset = offset + self._RECORD_HEADER.size + header_size
+            if payloads_offset + payloads_size > len(buf):
+                break  # Is still being written
+            header = pickle.loads(buf[offset + self._RECORD_HEADER.size:payloads_offset])
+            _replay_piggyback_store_record(header, payloads_offset, source_status, stored)
+            offset = payloads_offset + payloads_size
+
+        self._read_size = offset
+        self._snapshot = PiggybackStoreSnapshot(source_status, stored, buf)
+
+    def update(self, source_hostname, payloads):
+        # type: (str, Dict[str, bytes]) -> None
+        """Store the piggyback data received from a source
+
+        The data this source sent for other piggybacked hosts before is kept,
+        but is outdated from now on. When the source sent no piggyback data at
+        all, its status is removed."""
+        with store.locked(self.path):
+            snapshot = self._locked_snapshot()
+            if not payloads and source_hostname not in snapshot.source_status:
+                return
+
+            entries = {}  # type: Dict[str, Tuple[int, int]]
+            offset = 0
+            for piggybacked_hostname, payload in payloads.items():
+                entries[piggybacked_hostname] = (offset, len(payload))
+                offset += len(payload)
+            self._append(("update", source_hostname, time.time(), entries), list(payloads.values()))
+
+    def remove_source_status(self, source_hostname):
+        # type: (str) -> bool
+        with store.locked(self.path):
+            snapshot = self._locked_snapshot()
+            if source_hostname not in snapshot.source_status:
+                return False
+
+            self._append(("remove", [source_hostname], []), [])
+            return True
+
+    def remove(self, outdated_snapshot, source_hostnames, payload_keys):
+        # type: (PiggybackStoreSnapshot, List[str], List[Tuple[str, str]]) -> None
+        """Remove source states and payloads which were outdated in the given snapshot
+
+        Entries which have been updated since the snapshot was taken are kept."""
+        if not source_hostnames and not payload_keys:
+            return
+
+        with store.locked(self.path):
+            snapshot = self._locked_snapshot()
+            removed_source_hostnames = [
+                source_hostname for source_hostname in source_hostnames
+                if _unchanged_source_status(snapshot, outdated_snapshot, source_hostname)
+            ]
+            removed_payload_keys = [
+                payload_key for payload_key in payload_keys
+                if _unchanged_payload(snapshot, outdated_snapshot, payload_key)
+            ]
+            if removed_source_hostnames or removed_payload_keys:
+                self._append(("remove", removed_source_hostnames, removed_payload_keys), [])
+
+    def rename(self, oldname, newname):
+        # type: (str, str) -> Tuple[int, int]
+        """Rename a host, both as piggybacked host and as source host
+
+        The data of a host with the new name is replaced. Returns the number of
+        renamed piggybacked hosts and of the piggybacked hosts with data from the
+        renamed source host."""
+        with store.locked(self.path):
+            snapshot = self._locked_snapshot()
+            num_piggybacked = int(oldname in snapshot.stored)
+            num_sourced = sum(oldname in entries for entries in snapshot.stored.values())
+            if num_piggybacked or num_sourced or oldname in snapshot.source_status:
+                self._append(("rename", oldname, newname), [])
+            return num_piggybacked, num_sourced
+
+    def remove_piggybacked_host(self, piggybacked_hostname):
+        # type: (str) -> bool
+        """Remove the data of all sources for a piggybacked host"""
+        with store.locked(self.path):
+            snapshot = self._locked_snapshot()
+            if piggybacked_hostname not in snapshot.stored:
+                return False
+
+            payload_keys = [(piggybacked_hostname, source_hostname)
+                            for source_hostname in snapshot.stored[piggybacked_hostname]]
+            self._append(("remove", [], payload_keys), [])
+            return True
+
+    def _locked_snapshot(self):
+        # type: () -> PiggybackStoreSnapshot
+        """Read the store again, it may have been changed while waiting for the lock"""
+        return self.snapshot()
+
+    def _append(self, header, payloads):
+        # type: (Tuple, List[bytes]) -> None
+        """Append a record to the locked store file and compact it when needed"""
+        pickled_header = pickle.dumps(header, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.path.open("r+b") as f:
+            # Drop the incomplete record of an interrupted writer
+            f.truncate(self._read_size)
+            f.seek(self._read_size)
+            if not self._read_size:
+                f.write(self._MAGIC)
+            f.write(
+                self._RECORD_HEADER.pack(len(pickled_header),
+                                         sum(len(payload) for payload in payloads)))
+            f.write(pickled_header)
+            for payload in payloads:
+                f.write(payload)
+
+        snapshot = self.snapshot()
+        if self._read_size > max(self._MIN_COMPACTION_SIZE, 2 * snapshot.payloads_size()):
+            self._compact(snapshot)
+
+    def _compact(self, snapshot):
+        # type: (PiggybackStoreSnapshot) -> None
+        stored = {}  # type: Dict[str, Dict[str, _PiggybackStoreEntry]]
+        payload_keys = []  # type: List[Tuple[str, str]]
+        offset = 0
+        for piggybacked_hostname, entries in snapshot.stored.items():
+            compacted_entries = stored.setdefault(piggybacked_hostname, {})
+            for source_hostname, (stored_at, _old_offset, size) in entries.items():
+                compacted_entries[source_hostname] = (stored_at, offset, size)
+                payload_keys.append((piggybacked_hostname, source_hostname))
+                offset += size
+        pickled_header = pickle.dumps(("state", snapshot.source_status, stored),
+                                      protocol=pickle.HIGHEST_PROTOCOL)
+
+        with tempfile.NamedTemporaryFile("wb",
+                                         dir=str(self.path.parent),
+                                         prefix=".%s.new" % self.path.name,
+                                         delete=False) as tmp:
+            tmp_path = tmp.name
+            os.chmod(tmp_path, 0o660)
+            tmp.write(self._MAGIC)
+            tmp.write(self._RECORD_HEADER.pack(len(pickled_header), offset))
+            tmp.write(pickled_header)
+            # The payloads are copied one by one from the old file to not need them all in memory
+            for piggybacked_hostname, source_hostname in payload_keys:
+                tmp.write(snapshot.payload(piggybacked_hostname, source_hostname))
+        os.rename(tmp_path, str(self.path))
+
+
+def _replay_piggyback_store_record(header, payloads_offset, source_status, stored):
+    # type: (Tuple, int, Dict[str, float], Dict[str, Dict[str, _PiggybackStoreEntry]]) -> None
+    """Apply a record of the PiggybackStore file to the index
+
+    The offsets of the payloads in the record are relative to the first payload of the record.
+    The nested dictionaries of the index are replaced, not changed."""
+    if header[0] == "state":
+        _kind, state_source_status, state_stored = header
+        source_status.clear()
+        source_status.update(state_source_status)
+        stored.clear()
+        for piggybacked_hostname, entries in state_stored.items():
+            stored[piggybacked_hostname] = {
+                source_hostname: (stored_at, payloads_offset + offset, size)
+                for source_hostname, (stored_at, offset, size) in entries.items()
+            }
+
+    elif header[0] == "update":
+        _kind, source_hostname, stored_at, payload_entries = header
+        if payload_entries:
+            source_status[source_hostname] = stored_at
+        else:
+            source_status.pop(source_hostname, None)
+        for piggybacked_hostname, (offset, size) in payload_entries.items():
+            entries = dict(stored.get(piggybacked_hostname, {}))
+            entries[source_hostname] = (stored_at, payloads_offset + offset, size)
+            stored[piggybacked_hostname] = entries
+
+    elif header[0] == "remove":
+        _kind, source_hostnames, payload_keys = header
+        for source_hostname in source_hostnames:
+            source_status.pop(source_hostname, None)
+        for piggybacked_hostname, source_hostname in payload_keys:
+            entries = dict(stored.get(piggybacked_hostname, {}))
+            entries.pop(source_hostname, None)
+            if entries:
+                stored[piggybacked_hostname] = entries
+            else:
+                stored.pop(piggybacked_hostname, None)
+
+    elif header[0] == "rename":
+        _kind, oldname, newname = header
+        if oldname in source_status:
+            source_status[newname] = source_status.pop(oldname)
+        if oldname in stored:
+            stored[newname] = stored.pop(oldname)
+        for piggybacked_hostname, entries in list(stored.items()):
+            if oldname in entries:
+                entries = dict(entries)
+                entries[newname] = entries.pop(oldname)
+                stored[piggybacked_hostname] = entries
+
+    else:
+        raise MKGeneralException("Unknown record in the piggyback store: %r" % (header[0],))
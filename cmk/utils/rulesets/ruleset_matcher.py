@@ -264,11 +264,6 @@ class RulesetOptimizer(object):
         # may contain a reduced set of hosts, since each process handles a subset
         self._all_processed_hosts = self._all_configured_hosts
 
-        # A factor which indicates how much hosts share the same host tag configuration (excluding folders).
-        # len(all_processed_hosts) / len(different tag combinations)
-        # It is used to determine the best rule evualation method
-        self._all_processed_hosts_similarity = 1.0
-
         self._service_ruleset_cache = {}  # type: Dict
         self._host_ruleset_cache = {}  # type: Dict
         self._all_matching_hosts_match_cache = {}  # type: Dict
@@ -276,16 +271,17 @@ class RulesetOptimizer(object):
         # Reference dirname -> hosts in this dir including subfolders
         self._folder_host_lookup = {}  # type: Dict[Tuple[bool, str], Set[HostName]]
 
-        # Provides a list of hosts with the same hosttags, excluding the folder
-        self._hosts_grouped_by_tags = {}  # type: Dict
-        # Reference hostname -> tag group reference
-        self._host_grouped_ref = {}  # type: Dict
-
-        # TODO: The folder will not be part of new dict tags anymore. This can
-        # be cleaned up then.
-        self._hosttags_without_folder = {}  # type: Dict[HostName, TagList]
+        # Inverted indexes which are used to compute the hosts matching a rule condition
+        # with a few set operations instead of checking each host individually.
+        # Reference tag -> hosts having this tag
+        self._hosts_by_tag = {}  # type: Dict[str, Set[HostName]]
+        # Reference dirname -> hosts in exactly this dir
+        self._hosts_by_folder = {}  # type: Dict[str, Set[HostName]]
+        # Reference (label name, label value) -> hosts having this label. This index is
+        # filled lazily, because computing the labels of a host needs the ruleset matcher.
+        self._hosts_by_label = {}  # type: Dict[Tuple[str, str], Set[HostName]]
+        self._hosts_with_indexed_labels = set()  # type: Set[HostName]
 
-        # TODO: Clean this one up?
         self._initialize_host_lookup()
 
     def clear_host_ruleset_cache(self):
@@ -317,24 +313,6 @@ class RulesetOptimizer(object):
         # lookup are iterated one by one later on in all_matching_hosts
         self._folder_host_lookup = {}
 
-        self._adjust_processed_hosts_similarity()
-
-    def _adjust_processed_hosts_similarity(self):
-        # type: () -> None
-        """ This function computes the tag similarities between of the processed hosts
-        The result is a similarity factor, which helps finding the most perfomant operation
-        for the current hostset """
-        used_groups = set()
-        for hostname in self._all_processed_hosts:
-            used_groups.add(self._host_grouped_ref.get(hostname, ()))
-
-        if not used_groups:
-            self._all_processed_hosts_similarity = 1.0
-            return
-
-        self._all_processed_hosts_similarity = (1.0 * len(self._all_processed_hosts) /
-                                                len(used_groups))
-
     def get_host_ruleset(self, ruleset, with_foreign_hosts, is_binary):
         # type: (Ruleset, bool, bool) -> PreprocessedHostRuleset
         cache_id = id(ruleset), with_foreign_hosts
@@ -446,47 +424,33 @@ class RulesetOptimizer(object):
         valid_hosts = self.get_hosts_within_folder(rule_path,
                                                    with_foreign_hosts).intersection(valid_hosts)
 
-        if tags and hostlist is None and not labels:
-            # TODO: Labels could also be optimized like the tags
-            matched_by_tags = self._match_hosts_by_tags(cache_id, valid_hosts, tags)
-            if matched_by_tags is not None:
-                return matched_by_tags
+        if hostlist == []:
+            # Empty host list -> Nothing matches
+            self._all_matching_hosts_match_cache[cache_id] = set()
+            return set()
 
-        matching = set()  # type: Set[str]
         only_specific_hosts = hostlist is not None \
             and not isinstance(hostlist, dict) \
             and all(not isinstance(x, dict) for x in hostlist)
 
-        if hostlist == []:
-            pass  # Empty host list -> Nothing matches
-        elif not tags and not labels and not hostlist:
-            # If no tags are specified and the hostlist only include @all (all hosts)
-            matching = valid_hosts
-        elif not tags and not labels and only_specific_hosts and hostlist is not None:
-            # If no tags are specified and there are only specific hosts we already have the matches
+        # If the rule has only exact host restrictions, we can thin out the list of hosts to check
+        if only_specific_hosts and hostlist is not None:
             matching = valid_hosts.intersection(hostlist)
         else:
-            # If the rule has only exact host restrictions, we can thin out the list of hosts to check
-            if only_specific_hosts and hostlist is not None:
-                hosts_to_check = valid_hosts.intersection(hostlist)
-            else:
-                hosts_to_check = valid_hosts
+            matching = valid_hosts
 
-            for hostname in hosts_to_check:
-                # When no tag matching is requested, do not filter by tags. Accept all hosts
-                # and filter only by hostlist
-                if tags and not self.matches_host_tags(self._host_tag_lists[hostname], tags):
-                    continue
+        if tags:
+            matching = self._filter_hosts_by_tags(matching, tags)
 
-                if labels:
-                    host_labels = self._labels.labels_of_host(self._ruleset_matcher, hostname)
-                    if not _matches_labels(host_labels, labels):
-                        continue
+        if labels:
+            matching = self._filter_hosts_by_labels(matching, labels)
 
-                if not self.matches_host_name(hostlist, hostname):
-                    continue
-
-                matching.add(hostname)
+        # Regex or negated host conditions still need to be checked host by host, but only for the
+        # hosts that are left after applying the indexed conditions.
+        if hostlist and not only_specific_hosts:
+            matching = {
+                hostname for hostname in matching if self.matches_host_name(hostlist, hostname)
+            }
 
         self._all_matching_hosts_match_cache[cache_id] = matching
         return matching
@@ -572,72 +536,76 @@ class RulesetOptimizer(object):
             rule_path,
         )
 
-    # TODO: Generalize this optimization: Build some kind of key out of the tag conditions
-    # (positive, negative, ...). Make it work with the new tag group based "$or" handling.
-    def _match_hosts_by_tags(self, cache_id, valid_hosts, tags):
-        matching = set()
-        negative_match_tags = set()
-        positive_match_tags = set()
-        for tag in tags.values():
-            if isinstance(tag, dict):
-                if "$ne" in tag:
-                    negative_match_tags.add(tag["$ne"])
-                    continue
+    def _filter_hosts_by_tags(self, hosts, required_tags):
+        # type: (Set[HostName], Dict[str, Any]) -> Set[HostName]
+        """Returns the subset of the given hosts matching all tag conditions
 
-                if "$or" in tag:
-                    return None  # Can not be optimized, makes _all_matching_hosts proceed
+        This is the indexed equivalent of calling matches_host_tags() for each host."""
+        for tag_spec in required_tags.values():
+            if not hosts:
+                break
+            hosts = self._filter_hosts_by_tag_spec(hosts, tag_spec)
+        return hosts
 
-                if "$nor" in tag:
-                    return None  # Can not be optimized, makes _all_matching_hosts proceed
+    def _filter_hosts_by_tag_spec(self, hosts, tag_spec):
+        # type: (Set[HostName], Any) -> Set[HostName]
+        if isinstance(tag_spec, dict):
+            if "$ne" in tag_spec:
+                return hosts.difference(self._hosts_by_tag.get(tag_spec["$ne"], ()))
 
-                raise NotImplementedError()
+            if "$or" in tag_spec:
+                matching = set()  # type: Set[HostName]
+                for sub_tag_spec in tag_spec["$or"]:
+                    matching.update(self._filter_hosts_by_tag_spec(hosts, sub_tag_spec))
+                return matching
 
-            positive_match_tags.add(tag)
-
-        # TODO:
-        #if has_specific_folder_tag or self._all_processed_hosts_similarity < 3.0:
-        if self._all_processed_hosts_similarity < 3.0:
-            # Without shared folders
-            for hostname in valid_hosts:
-                host_tags = self._host_tag_lists[hostname]
-                if not positive_match_tags - host_tags:
-                    if not negative_match_tags.intersection(host_tags):
-                        matching.add(hostname)
-
-            self._all_matching_hosts_match_cache[cache_id] = matching
-            return matching
-
-        # With shared folders
-        checked_hosts = set()  # type: Set[str]
-        for hostname in valid_hosts:
-            if hostname in checked_hosts:
-                continue
+            if "$nor" in tag_spec:
+                return hosts.difference(
+                    self._filter_hosts_by_tag_spec(hosts, {"$or": tag_spec["$nor"]}))
 
-            hosts_with_same_tag = self._filter_hosts_with_same_tags_as_host(hostname, valid_hosts)
-            checked_hosts.update(hosts_with_same_tag)
+            raise NotImplementedError()
 
-            tags = self._host_tag_lists[hostname]
-            if not positive_match_tags - tags:
-                if not negative_match_tags.intersection(tags):
-                    matching.update(hosts_with_same_tag)
+        return hosts.intersection(self._hosts_by_tag.get(tag_spec, ()))
 
-        self._all_matching_hosts_match_cache[cache_id] = matching
-        return matching
+    def _filter_hosts_by_labels(self, hosts, required_labels):
+        # type: (Set[HostName], Dict[str, Any]) -> Set[HostName]
+        """Returns the subset of the given hosts matching all label conditions
+
+        This is the indexed equivalent of calling _matches_labels() for each host."""
+        self._index_host_labels(hosts)
+
+        for label_group_id, label_spec in required_labels.items():
+            if not hosts:
+                break
+
+            if isinstance(label_spec, dict):
+                hosts = hosts.difference(
+                    self._hosts_by_label.get((label_group_id, label_spec["$ne"]), ()))
+            else:
+                hosts = hosts.intersection(
+                    self._hosts_by_label.get((label_group_id, label_spec), ()))
 
-    def _filter_hosts_with_same_tags_as_host(self, hostname, hosts):
-        return self._hosts_grouped_by_tags[self._host_grouped_ref[hostname]].intersection(hosts)
+        return hosts
+
+    def _index_host_labels(self, hosts):
+        # type: (Set[HostName]) -> None
+        for hostname in hosts.difference(self._hosts_with_indexed_labels):
+            host_labels = self._labels.labels_of_host(self._ruleset_matcher, hostname)
+            for label_id, label_value in host_labels.items():
+                self._hosts_by_label.setdefault((label_id, label_value), set()).add(hostname)
+            self._hosts_with_indexed_labels.add(hostname)
 
     def get_hosts_within_folder(self, folder_path, with_foreign_hosts):
         # type: (str, bool) -> Set[HostName]
         cache_id = with_foreign_hosts, folder_path
         if cache_id not in self._folder_host_lookup:
-            hosts_in_folder = set()
-            relevant_hosts = self._all_configured_hosts if with_foreign_hosts else self._all_processed_hosts
-
-            for hostname in relevant_hosts:
-                host_path = self._host_paths.get(hostname, "/")
+            hosts_in_folder = set()  # type: Set[HostName]
+            for host_path, hosts in self._hosts_by_folder.items():
                 if host_path.startswith(folder_path):
-                    hosts_in_folder.add(hostname)
+                    hosts_in_folder.update(hosts)
+
+            relevant_hosts = self._all_configured_hosts if with_foreign_hosts else self._all_processed_hosts
+            hosts_in_folder.intersection_update(relevant_hosts)
 
             self._folder_host_lookup[cache_id] = hosts_in_folder
             return hosts_in_folder
@@ -645,21 +613,14 @@ class RulesetOptimizer(object):
         return self._folder_host_lookup[cache_id]
 
     def _initialize_host_lookup(self):
-        # Determine hosttags without folder tag
+        # type: () -> None
         for hostname in self._all_configured_hosts:
-            tags_without_folder = set(self._host_tag_lists[hostname])
-            try:
-                tags_without_folder.remove(self._host_paths.get(hostname, "/"))
-            except (KeyError, ValueError):
-                pass
+            self._hosts_by_folder.setdefault(self._host_paths.get(hostname, "/"),
+                                             set()).add(hostname)
 
-            self._hosttags_without_folder[hostname] = tags_without_folder
-
-        # Determine hosts with same tag setup (ignoring folder tag)
-        for hostname in self._all_configured_hosts:
-            group_ref = tuple(sorted(self._hosttags_without_folder[hostname]))
-            self._hosts_grouped_by_tags.setdefault(group_ref, set()).add(hostname)
-            self._host_grouped_ref[hostname] = group_ref
+        for hostname, host_tags in self._host_tag_lists.items():
+            for tag_id in host_tags:
+                self._hosts_by_tag.setdefault(tag_id, set()).add(hostname)
 
 
 def _tags_or_labels_cache_id(tag_or_label_spec):
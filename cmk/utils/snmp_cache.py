@@ -6,7 +6,7 @@
 """SNMP caching"""
 
 import os
-from typing import Dict, List, Optional
+from typing import Dict, Optional
 
 import cmk.utils.paths
 import cmk.utils.store as store
@@ -16,8 +16,6 @@ from cmk.utils.type_defs import OID, DecodedString, HostAddress, HostName, SNMPH
 _g_single_oid_hostname = None  # type: Optional[HostName]
 _g_single_oid_ipaddress = None  # type: Optional[HostAddress]
 _g_single_oid_cache = None  # type: Optional[Dict[OID, Optional[DecodedString]]]
-# TODO: Move to StoredWalkSNMPBackend?
-_g_walk_cache = {}  # type: Dict[str, List[str]]
 
 
 def initialize_single_oid_cache(snmp_config, from_disk=False):
@@ -73,26 +71,9 @@ def _load_single_oid_cache(snmp_config):
 
 def cleanup_host_caches():
     # type: () -> None
-    global _g_walk_cache
-    _g_walk_cache = {}
     _clear_other_hosts_oid_cache(None)
 
 
-def host_cache_contains(name):
-    # type: (HostName) -> bool
-    return name in _g_walk_cache
-
-
-def host_cache_get(name):
-    # type: (HostName) -> List[str]
-    return _g_walk_cache[name]
-
-
-def host_cache_set(name, contents):
-    # type: (HostName, List[str]) -> None
-    _g_walk_cache[name] = contents
-
-
 def _clear_other_hosts_oid_cache(hostname):
     # type: (Optional[str]) -> None
     global _g_single_oid_cache, _g_single_oid_ipaddress, _g_single_oid_hostname
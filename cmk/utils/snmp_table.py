@@ -5,7 +5,7 @@
 # conditions defined in the file COPYING, which is part of this source code package.
 
 import os
-from typing import Any, List, Optional, Set, Tuple, Union, cast
+from typing import Any, Dict, List, Optional, Set, Tuple, Union, cast
 
 from six import ensure_binary
 
@@ -15,6 +15,7 @@ from cmk.utils.encoding import convert_to_unicode
 from cmk.utils.exceptions import MKGeneralException
 from cmk.utils.log import console
 from cmk.utils.type_defs import (
+    ContextName,
     OID,
     OID_BIN,
     OID_END,
@@ -46,16 +47,54 @@ from cmk.fetchers.factory import SNMPBackendFactory  # pylint: disable=cmk-modul
 ResultColumnsUnsanitized = List[Tuple[OID, SNMPRowInfo, SNMPValueEncoding]]
 ResultColumnsSanitized = List[Tuple[List[RawValue], SNMPValueEncoding]]
 ResultColumnsDecoded = List[List[DecodedValues]]
+# The ranges of the first snmp_limit_oid_range rule matching a check plugin
+OIDRangeLimit = Optional[Tuple[Any, ...]]
 
 
-def get_snmp_table(snmp_config, check_plugin_name, oid_info):
-    # type: (SNMPHostConfig, CheckPluginName, Union[OIDInfo, ABCSNMPTree]) -> SNMPTable
-    return _get_snmp_table(snmp_config, check_plugin_name, oid_info, False)
+class FetchedWalks(object):  # pylint: disable=useless-object-inheritance
+    """The walks done while fetching the SNMP tables of one host
 
+    The check plugins of a host often fetch the same columns. Each of them is walked
+    only once per fetch of the host data when the tables are fetched with the same
+    FetchedWalks object. The walks requested and saved are counted for reporting.
 
-def get_snmp_table_cached(snmp_config, check_plugin_name, oid_info):
-    # type: (SNMPHostConfig, CheckPluginName, Union[OIDInfo, ABCSNMPTree]) -> SNMPTable
-    return _get_snmp_table(snmp_config, check_plugin_name, oid_info, True)
+    A walk is only shared between plugins having the same OID range limit (see the
+    ruleset snmp_limit_oid_range), since the backends cut the walks short according
+    to the limit of the plugin they walk for.
+    """
+    def __init__(self):
+        # type: () -> None
+        super(FetchedWalks, self).__init__()
+        self._rows = {}  # type: Dict[Tuple[OID, Optional[ContextName], OIDRangeLimit], SNMPRowInfo]
+        # Walks of single columns the tables consist of
+        self.requested = 0
+        # Walks not done because the same column has been walked before
+        self.deduplicated = 0
+        # Walks not done because the column has been walked together with others
+        self.merged = 0
+
+    def get(self, fetchoid, context_name, oid_range_limit):
+        # type: (OID, Optional[ContextName], OIDRangeLimit) -> Optional[SNMPRowInfo]
+        return self._rows.get((fetchoid, context_name, oid_range_limit))
+
+    def add(self, fetchoid, context_name, oid_range_limit, rows):
+        # type: (OID, Optional[ContextName], OIDRangeLimit, SNMPRowInfo) -> None
+        self._rows[(fetchoid, context_name, oid_range_limit)] = rows
+
+    @property
+    def saved(self):
+        # type: () -> int
+        return self.deduplicated + self.merged
+
+
+def get_snmp_table(snmp_config, check_plugin_name, oid_info, fetched_walks=None):
+    # type: (SNMPHostConfig, CheckPluginName, Union[OIDInfo, ABCSNMPTree], Optional[FetchedWalks]) -> SNMPTable
+    return _get_snmp_table(snmp_config, check_plugin_name, oid_info, False, fetched_walks)
+
+
+def get_snmp_table_cached(snmp_config, check_plugin_name, oid_info, fetched_walks=None):
+    # type: (SNMPHostConfig, CheckPluginName, Union[OIDInfo, ABCSNMPTree], Optional[FetchedWalks]) -> SNMPTable
+    return _get_snmp_table(snmp_config, check_plugin_name, oid_info, True, fetched_walks)
 
 
 SPECIAL_COLUMNS = [
@@ -68,10 +107,17 @@ SPECIAL_COLUMNS = [
 
 
 # TODO: OID_END_OCTET_STRING is not used at all. Drop it.
-def _get_snmp_table(snmp_config, check_plugin_name, oid_info, use_snmpwalk_cache):
-    # type: (SNMPHostConfig, CheckPluginName, Union[OIDInfo, ABCSNMPTree], bool) -> SNMPTable
+def _get_snmp_table(snmp_config, check_plugin_name, oid_info, use_snmpwalk_cache, fetched_walks):
+    # type: (SNMPHostConfig, CheckPluginName, Union[OIDInfo, ABCSNMPTree], bool, Optional[FetchedWalks]) -> SNMPTable
     oid, suboids, targetcolumns = _make_target_columns(oid_info)
 
+    # All columns of the table are fetched at once to be able to merge their walks
+    fetch_columns = [(_compute_fetch_oid(oid, suboid, column), column)
+                     for suboid in suboids
+                     for column in targetcolumns]
+    rowinfos = _get_snmpwalks(snmp_config, check_plugin_name, oid, fetch_columns,
+                              use_snmpwalk_cache, fetched_walks)
+
     index_column = -1
     index_format = None
     info = []  # type: SNMPTable
@@ -97,8 +143,7 @@ def _get_snmp_table(snmp_config, check_plugin_name, oid_info, use_snmpwalk_cache
                     "You can only use one of OID_END, OID_STRING, OID_BIN, OID_END_BIN and OID_END_OCTET_STRING."
                 )
 
-            rowinfo = _get_snmpwalk(snmp_config, check_plugin_name, oid, fetchoid, column,
-                                    use_snmpwalk_cache)
+            rowinfo = [] if column in SPECIAL_COLUMNS else rowinfos[fetchoid]
 
             if column in SPECIAL_COLUMNS:
                 index_column = len(columns)
@@ -241,51 +286,96 @@ def _key_oid_pairs(pair1):
     return _oid_to_intlist(pair1[0].lstrip('.'))
 
 
-def _get_snmpwalk(snmp_config, check_plugin_name, oid, fetchoid, column, use_snmpwalk_cache):
-    # type: (SNMPHostConfig, CheckPluginName, OID, OID, Column, bool) -> SNMPRowInfo
-    if column in SPECIAL_COLUMNS:
-        return []
-
-    save_to_cache = isinstance(column, OIDCached)
-    get_from_cache = save_to_cache and use_snmpwalk_cache
-    cached = _get_cached_snmpwalk(snmp_config.hostname, fetchoid) if get_from_cache else None
-    if cached is not None:
-        return cached
-    rowinfo = _perform_snmpwalk(snmp_config, check_plugin_name, oid, fetchoid)
-    if save_to_cache:
-        _save_snmpwalk_cache(snmp_config.hostname, fetchoid, rowinfo)
-    return rowinfo
-
-
-def _perform_snmpwalk(snmp_config, check_plugin_name, base_oid, fetchoid):
-    # type: (SNMPHostConfig, CheckPluginName, OID, OID) -> SNMPRowInfo
-    added_oids = set([])  # type: Set[OID]
-    rowinfo = []  # type: SNMPRowInfo
-
+def _get_snmpwalks(snmp_config, check_plugin_name, base_oid, fetch_columns, use_snmpwalk_cache,
+                   fetched_walks):
+    # type: (SNMPHostConfig, CheckPluginName, OID, List[Tuple[OID, Column]], bool, Optional[FetchedWalks]) -> Dict[OID, SNMPRowInfo]
+    rowinfos = {}  # type: Dict[OID, SNMPRowInfo]
+    fetchoids = []  # type: List[OID]
+    save_to_cache = set()  # type: Set[OID]
+    for fetchoid, column in fetch_columns:
+        if column in SPECIAL_COLUMNS or fetchoid in rowinfos or fetchoid in fetchoids:
+            continue
+
+        if isinstance(column, OIDCached):
+            cached = _get_cached_snmpwalk(snmp_config.hostname,
+                                          fetchoid) if use_snmpwalk_cache else None
+            if cached is not None:
+                rowinfos[fetchoid] = cached
+                continue
+            save_to_cache.add(fetchoid)
+        fetchoids.append(fetchoid)
+
+    rowinfos.update(
+        _perform_snmpwalks(snmp_config, check_plugin_name, base_oid, fetchoids, fetched_walks))
+    for fetchoid in fetchoids:
+        if fetchoid in save_to_cache:
+            _save_snmpwalk_cache(snmp_config.hostname, fetchoid, rowinfos[fetchoid])
+    return rowinfos
+
+
+def _perform_snmpwalks(snmp_config, check_plugin_name, base_oid, fetchoids, fetched_walks):
+    # type: (SNMPHostConfig, CheckPluginName, OID, List[OID], Optional[FetchedWalks]) -> Dict[OID, SNMPRowInfo]
+    added_oids = {fetchoid: set() for fetchoid in fetchoids}  # type: Dict[OID, Set[OID]]
+    rowinfos = {fetchoid: [] for fetchoid in fetchoids}  # type: Dict[OID, SNMPRowInfo]
+    if not fetchoids:
+        return rowinfos
+
+    merges_columns = SNMPBackendFactory.merges_columns(snmp_config)
+    oid_range_limit = _oid_range_limit_of(snmp_config, check_plugin_name)
     for context_name in snmp_config.snmpv3_contexts_of(check_plugin_name):
-        rows = SNMPBackendFactory.walk(snmp_config,
-                                       oid=fetchoid,
-                                       check_plugin_name=check_plugin_name,
-                                       table_base_oid=base_oid,
-                                       context_name=context_name)
-
-        # I've seen a broken device (Mikrotik Router), that broke after an
-        # update to RouterOS v6.22. It would return 9 time the same OID when
-        # .1.3.6.1.2.1.1.1.0 was being walked. We try to detect these situations
-        # by removing any duplicate OID information
-        if len(rows) > 1 and rows[0][0] == rows[1][0]:
-            console.vverbose("Detected broken SNMP agent. Ignoring duplicate OID %s.\n" %
-                             rows[0][0])
-            rows = rows[:1]
-
-        for row_oid, val in rows:
-            if row_oid in added_oids:
-                console.vverbose("Duplicate OID found: %s (%r)\n" % (row_oid, val))
-            else:
-                rowinfo.append((row_oid, val))
-                added_oids.add(row_oid)
-
-    return rowinfo
+        walks = {}  # type: Dict[OID, SNMPRowInfo]
+        for fetchoid in fetchoids:
+            rows = None if fetched_walks is None else fetched_walks.get(
+                fetchoid, context_name, oid_range_limit)
+            if rows is not None:
+                walks[fetchoid] = rows
+
+        to_walk = [fetchoid for fetchoid in fetchoids if fetchoid not in walks]
+        if to_walk:
+            walks.update(
+                zip(
+                    to_walk,
+                    SNMPBackendFactory.walk_columns(snmp_config,
+                                                    oids=to_walk,
+                                                    check_plugin_name=check_plugin_name,
+                                                    table_base_oid=base_oid,
+                                                    context_name=context_name)))
+
+        if fetched_walks is not None:
+            fetched_walks.requested += len(fetchoids)
+            fetched_walks.deduplicated += len(fetchoids) - len(to_walk)
+            if merges_columns and to_walk:
+                fetched_walks.merged += len(to_walk) - 1
+            for fetchoid in to_walk:
+                fetched_walks.add(fetchoid, context_name, oid_range_limit, walks[fetchoid])
+
+        for fetchoid in fetchoids:
+            rows = walks[fetchoid]
+            # I've seen a broken device (Mikrotik Router), that broke after an
+            # update to RouterOS v6.22. It would return 9 time the same OID when
+            # .1.3.6.1.2.1.1.1.0 was being walked. We try to detect these situations
+            # by removing any duplicate OID information
+            if len(rows) > 1 and rows[0][0] == rows[1][0]:
+                console.vverbose("Detected broken SNMP agent. Ignoring duplicate OID %s.\n" %
+                                 rows[0][0])
+                rows = rows[:1]
+
+            for row_oid, val in rows:
+                if row_oid in added_oids[fetchoid]:
+                    console.vverbose("Duplicate OID found: %s (%r)\n" % (row_oid, val))
+                else:
+                    rowinfos[fetchoid].append((row_oid, val))
+                    added_oids[fetchoid].add(row_oid)
+
+    return rowinfos
+
+
+def _oid_range_limit_of(snmp_config, check_plugin_name):
+    # type: (SNMPHostConfig, CheckPluginName) -> OIDRangeLimit
+    for check_plugin_names, ranges in snmp_config.oid_range_limits:
+        if check_plugin_name in check_plugin_names:
+            return tuple(ranges)
+    return None
 
 
 def _compute_fetch_oid(oid, suboid, column):
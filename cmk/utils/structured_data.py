@@ -9,9 +9,13 @@ structured monitoring data of Check_MK.
 """
 
 import gzip
+import marshal
+import os
 import re
 import pprint
-from typing import AnyStr, Dict, List, Optional
+import struct
+import zlib
+from typing import AnyStr, BinaryIO, Dict, Iterable, List, Optional, Sequence, Tuple
 
 from six import ensure_binary, ensure_text
 
@@ -113,11 +117,19 @@ class StructuredDataTree:
         # TODO: Can be set to encoding="utf-8" once we are on Python 3 only
         with gzip.open(filepath + ".gz", "wb") as f:
             f.write(ensure_binary(repr(output) + "\n"))
+        save_binary_tree_file(filepath, output)
         # Inform Livestatus about the latest inventory update
         store.save_text_to_file("%s/.last" % path, u"")
 
-    def load_from(self, filepath):
-        raw_tree = store.load_object_from_file(filepath)
+    def load_from(self, filepath, tree_paths=None):
+        """Load the tree, preferably from the binary file
+
+        The binary file allows to read only the sub trees below the given tree paths
+        (lists of edges like used by get_filtered_tree). The loaded tree may contain more
+        than these sub trees, e.g. when the binary file is missing."""
+        raw_tree = load_binary_tree_file(filepath, tree_paths)
+        if raw_tree is None:
+            raw_tree = store.load_object_from_file(filepath)
         return self.create_tree_from_raw_tree(raw_tree)
 
     def create_tree_from_raw_tree(self, raw_tree):
@@ -1012,3 +1024,177 @@ def _changed_delta_tree_node(old_value, new_value):
 
 def _identical_delta_tree_node(value):
     return (value, value)
+
+
+#.
+#   .--binary files--------------------------------------------------------.
+#   |          _     _                          __ _ _                     |
+#   |         | |__ (_)_ __   __ _ _ __ _   _  / _(_) | ___  ___           |
+#   |         | '_ \| | '_ \ / _` | '__| | | || |_| | |/ _ \/ __|          |
+#   |         | |_) | | | | | (_| | |  | |_| ||  _| | |  __/\__ \          |
+#   |         |_.__/|_|_| |_|\__,_|_|   \__, ||_| |_|_|\___||___/          |
+#   |                                   |___/                              |
+#   +----------------------------------------------------------------------+
+#   | Besides the Python literal files the raw trees are stored in a      |
+#   | binary format which allows to load single sub trees:                |
+#   |                                                                      |
+#   |   MAGIC | offset of TOC (8 bytes) | chunk | chunk | ... | TOC       |
+#   |                                                                      |
+#   | There is one zlib compressed marshal chunk per dict of the raw tree |
+#   | holding its items in order: (key, value) for all values which are   |
+#   | no dicts and (key,) for the sub dicts, which have their own chunks. |
+#   | The TOC maps the paths of all dicts to the (offset, length) of      |
+#   | their chunks.                                                        |
+#   '----------------------------------------------------------------------'
+
+BINARY_TREE_FILE_SUFFIX = ".sdt"
+
+_BINARY_TREE_MAGIC = b"CMKSDT1\n"
+_BINARY_TREE_HEADER = struct.Struct(">Q")
+
+
+def binary_tree_file_path(filepath):
+    # type: (str) -> str
+    return filepath + BINARY_TREE_FILE_SUFFIX
+
+
+def serialize_raw_tree(raw_tree):
+    # type: (Dict) -> bytes
+    chunks = []  # type: List[bytes]
+    toc = {}  # type: Dict[Tuple, Tuple[int, int]]
+    offset = len(_BINARY_TREE_MAGIC) + _BINARY_TREE_HEADER.size
+
+    def add_chunk(path, node):
+        nonlocal offset
+        items = []  # type: List[Tuple]
+        sub_nodes = []  # type: List[Tuple[Tuple, Dict]]
+        for key, value in node.items():
+            if isinstance(value, dict):
+                items.append((key,))
+                sub_nodes.append((path + (key,), value))
+            else:
+                items.append((key, value))
+
+        chunk = zlib.compress(marshal.dumps(items))
+        toc[path] = (offset, len(chunk))
+        chunks.append(chunk)
+        offset += len(chunk)
+
+        for sub_path, sub_node in sub_nodes:
+            add_chunk(sub_path, sub_node)
+
+    add_chunk((), raw_tree)
+    return b"".join([_BINARY_TREE_MAGIC, _BINARY_TREE_HEADER.pack(offset)] + chunks +
+                    [zlib.compress(marshal.dumps(toc))])
+
+
+def save_binary_tree_file(filepath, raw_tree):
+    # type: (str, Dict) -> None
+    store.save_bytes_to_file(binary_tree_file_path(filepath), serialize_raw_tree(raw_tree))
+
+
+def load_raw_tree_from_binary(f, tree_paths=None):
+    # type: (BinaryIO, Optional[Iterable[Sequence]]) -> Dict
+    """Read a raw tree from a file object in the binary format
+
+    In case tree_paths are given, only the sub trees below these paths are read. The
+    result may contain more than these, e.g. the whole numeration for a path which
+    points into a nested numeration, so it has to be filtered later."""
+    if f.read(len(_BINARY_TREE_MAGIC)) != _BINARY_TREE_MAGIC:
+        raise MKGeneralException("Invalid binary tree file")
+    toc_offset = _BINARY_TREE_HEADER.unpack(f.read(_BINARY_TREE_HEADER.size))[0]
+    f.seek(toc_offset)
+    toc = marshal.loads(zlib.decompress(f.read()))
+
+    def read_items(path):
+        offset, length = toc[path]
+        f.seek(offset)
+        return marshal.loads(zlib.decompress(f.read(length)))
+
+    def read_node(path):
+        node = {}
+        for item in read_items(path):
+            if len(item) == 1:
+                node[item[0]] = read_node(path + item)
+            else:
+                node[item[0]] = item[1]
+        return node
+
+    if tree_paths is None:
+        return read_node(())
+
+    raw_tree = {}  # type: Dict
+    for tree_path in tree_paths:
+        path = tuple(tree_path)
+        # The longest prefix of the path which is a dict in the raw tree
+        depth = 0
+        while depth < len(path) and path[:depth + 1] in toc:
+            depth += 1
+
+        node = raw_tree
+        for edge in path[:depth]:
+            node = node.setdefault(edge, {})
+
+        if depth == len(path):
+            _merge_raw_trees(node, read_node(path))
+            continue
+
+        edge = path[depth]
+        for item in read_items(path[:depth]):
+            if item[0] == edge:
+                node[edge] = item[1]
+                break
+    return raw_tree
+
+
+def _merge_raw_trees(raw_tree, foreign):
+    # type: (Dict, Dict) -> None
+    for key, value in foreign.items():
+        if isinstance(value, dict) and isinstance(raw_tree.get(key), dict):
+            _merge_raw_trees(raw_tree[key], value)
+        else:
+            raw_tree[key] = value
+
+
+def load_binary_tree_file(filepath, tree_paths=None):
+    # type: (str, Optional[Iterable[Sequence]]) -> Optional[Dict]
+    """Load the raw tree of a tree file from its binary file
+
+    Returns None in case there is no binary file or it is older than the tree file."""
+    binary_filepath = binary_tree_file_path(filepath)
+    try:
+        binary_mtime = os.stat(binary_filepath).st_mtime
+    except OSError:
+        return None
+
+    try:
+        if os.stat(filepath).st_mtime > binary_mtime:
+            return None
+    except OSError:
+        pass
+
+    try:
+        with open(binary_filepath, "rb") as f:
+            return load_raw_tree_from_binary(f, tree_paths)
+    except (OSError, EOFError, ValueError, TypeError, KeyError, struct.error, zlib.error,
+            MKGeneralException):
+        return None
+
+
+def convert_tree_file(filepath):
+    # type: (str) -> bool
+    """Create the missing or outdated binary file of a tree file
+
+    Returns True in case the binary file has been written."""
+    binary_filepath = binary_tree_file_path(filepath)
+    try:
+        if os.stat(binary_filepath).st_mtime >= os.stat(filepath).st_mtime:
+            return False
+    except OSError:
+        pass
+
+    raw_tree = store.load_object_from_file(filepath)
+    if not raw_tree:
+        return False
+    save_binary_tree_file(filepath, raw_tree)
+    return True
@@ -134,6 +134,7 @@ class SNMPHostConfig(
             ("character_encoding", Optional[str]),
             ("is_usewalk_host", bool),
             ("is_inline_snmp_host", bool),
+            ("is_builtin_snmp_host", bool),
             ("record_stats", bool),
         ])):
     @property
@@ -159,6 +160,9 @@ class SNMPHostConfig(
 
 
 class ABCSNMPBackend(metaclass=abc.ABCMeta):
+    # Whether or not walk_columns() fetches the OIDs with the same requests
+    merges_columns = False
+
     @abc.abstractmethod
     def get(self, snmp_config, oid, context_name=None):
         # type: (SNMPHostConfig, OID, Optional[ContextName]) -> Optional[RawValue]
@@ -179,6 +183,26 @@ class ABCSNMPBackend(metaclass=abc.ABCMeta):
         # type: (SNMPHostConfig, OID, Optional[CheckPluginName], Optional[OID], Optional[ContextName]) -> SNMPRowInfo
         return []
 
+    def walk_columns(self,
+                     snmp_config,
+                     oids,
+                     check_plugin_name=None,
+                     table_base_oid=None,
+                     context_name=None):
+        # type: (SNMPHostConfig, List[OID], Optional[CheckPluginName], Optional[OID], Optional[ContextName]) -> List[SNMPRowInfo]
+        """Walk the OIDs of several columns of a table, one row info per OID
+
+        The OIDs are walked one after another. Backends able to walk several OIDs with
+        the same GETBULK requests override this and set merges_columns.
+        """
+        return [
+            self.walk(snmp_config,
+                      oid,
+                      check_plugin_name=check_plugin_name,
+                      table_base_oid=table_base_oid,
+                      context_name=context_name) for oid in oids
+        ]
+
 
 OID_END = 0  # Suffix-part of OID that was not specified
 OID_STRING = -1  # Complete OID as string ".1.3.6.1.4.1.343...."
@@ -10,9 +10,18 @@ import time
 import re
 import os
 import ast
+import errno
+import json
+import select
 import ssl
 import sys
-from typing import NewType, AnyStr, Any, Type, List, cast, Tuple, Union, Dict, Pattern, Optional
+from typing import (NewType, NamedTuple, AnyStr, Any, Type, List, cast, Tuple, Union, Dict,
+                    Iterator, Pattern, Optional)
+
+try:
+    import selectors
+except ImportError:
+    selectors = None  # type: ignore[assignment]  # Python 2, see _SelectSelector
 
 # TODO: Find a better solution for this issue. Astroid 2.x bug prevents us from using NewType :(
 # (https://github.com/PyCQA/pylint/issues/2296)
@@ -44,6 +53,17 @@ persistent_connections = {}  # type: Dict[str, socket.socket]
 # Regular expression for removing Cache: headers if caching is not allowed
 remove_cache_regex = re.compile("\nCache:[^\n]*")  # type: Pattern
 
+# Length of the response header requested with "ResponseHeader: fixed16"
+RESPONSE_HEADER_LENGTH = 16
+
+# Maximum number of bytes read at once while receiving responses of multiple sites
+RECEIVE_CHUNK_SIZE = 1024 * 1024
+
+# Output formats which can be requested for a query. JSON is decoded much faster, but blob
+# columns are rendered as latin-1 decoded strings instead of bytes.
+OUTPUT_FORMAT_PYTHON = "python3" if sys.version_info[0] >= 3 else "python"
+OUTPUT_FORMAT_JSON = "json"
+
 
 def _ensure_unicode(value):
     # type: (Union[str, bytes]) -> str
@@ -80,6 +100,17 @@ class MKLivestatusTableNotFoundError(MKLivestatusException):
     pass
 
 
+def _decode_python(data):
+    # type: (bytes) -> Any
+    return ast.literal_eval(data.decode("utf-8"))
+
+
+# Decoders of the response data by output format
+_DECODERS = {
+    OUTPUT_FORMAT_PYTHON: _decode_python,
+    OUTPUT_FORMAT_JSON: json.loads,
+}
+
 # We need some unique value here
 NO_DEFAULT = lambda: None
 
@@ -259,8 +290,8 @@ class Query(object):  # pylint: disable=useless-object-inheritance
 
     default_suppressed_exceptions = [MKLivestatusTableNotFoundError]  # type: List[Type[Exception]]
 
-    def __init__(self, query, suppress_exceptions=None):
-        # type: (Union[str, bytes], Optional[List[Type[Exception]]]) -> None
+    def __init__(self, query, suppress_exceptions=None, output_format=OUTPUT_FORMAT_PYTHON):
+        # type: (Union[str, bytes], Optional[List[Type[Exception]]], str) -> None
         super(Query, self).__init__()
 
         self._query = _ensure_unicode(query)
@@ -270,6 +301,10 @@ class Query(object):  # pylint: disable=useless-object-inheritance
         else:
             self.suppress_exceptions = suppress_exceptions
 
+        if output_format not in _DECODERS:
+            raise MKLivestatusConfigError("Unsupported output format '%s'" % output_format)
+        self.output_format = output_format
+
     def __unicode__(self):
         # type: () -> str
         return self._query
@@ -476,7 +511,7 @@ class SingleSiteConnection(Helpers):
             query += "\n"
         query += self.auth_header + self.add_headers
         query += "Localtime: %d\n" % int(time.time())
-        query += "OutputFormat: %s\n" % ("python3" if sys.version_info[0] >= 3 else "python")
+        query += "OutputFormat: %s\n" % query_obj.output_format
         query += "KeepAlive: on\n"
         query += "ResponseHeader: fixed16\n"
         query += add_headers
@@ -513,31 +548,10 @@ class SingleSiteConnection(Helpers):
     def recv_response(self, query=None, add_headers="", timeout_at=None):
         # type: (Query, str, Optional[float]) -> LivestatusResponse
         try:
-            # Headers are always ASCII encoded
-            resp = self.receive_data(16)
-            code = resp[0:3].decode("ascii")
-            try:
-                length = int(resp[4:15].lstrip())
-            except:
-                self.disconnect()
-                raise MKLivestatusSocketError(
-                    "Malformed output. Livestatus TCP socket might be unreachable or wrong"
-                    "encryption settings are used.")
-
-            data = self.receive_data(length).decode("utf-8")
-
-            if code == "200":
-                try:
-                    return ast.literal_eval(data)
-                except:
-                    self.disconnect()
-                    raise MKLivestatusSocketError("Malformed output")
-
-            elif code == "404":
-                raise MKLivestatusTableNotFoundError("Not Found (%s): %s" % (code, data.strip()))
-
-            else:
-                raise MKLivestatusQueryError("%s: %s" % (code, data.strip()))
+            header = self.receive_data(RESPONSE_HEADER_LENGTH)
+            return self.parse_response(
+                header, self.receive_data(self.response_length(header)),
+                OUTPUT_FORMAT_PYTHON if query is None else query.output_format)
 
         except (MKLivestatusSocketClosed, IOError) as e:
             # In case of an IO error or the other side having
@@ -570,6 +584,36 @@ class SingleSiteConnection(Helpers):
             # FIXME: ? self.disconnect()
             raise MKLivestatusSocketError("Unhandled exception: %s" % e)
 
+    def response_length(self, header):
+        # type: (bytes) -> int
+        """Length of the response data announced by the fixed16 response header"""
+        try:
+            return int(header[4:15].lstrip())
+        except:
+            self.disconnect()
+            raise MKLivestatusSocketError(
+                "Malformed output. Livestatus TCP socket might be unreachable or wrong"
+                "encryption settings are used.")
+
+    def parse_response(self, header, data, output_format=OUTPUT_FORMAT_PYTHON):
+        # type: (bytes, bytes, str) -> LivestatusResponse
+        # Headers are always ASCII encoded
+        code = header[0:3].decode("ascii")
+
+        if code == "200":
+            try:
+                return _DECODERS[output_format](data)
+            except:
+                self.disconnect()
+                raise MKLivestatusSocketError("Malformed output")
+
+        text = data.decode("utf-8")
+        if code == "404":
+            raise MKLivestatusTableNotFoundError("Not Found (%s): %s" % (code, text.strip()))
+
+        else:
+            raise MKLivestatusQueryError("%s: %s" % (code, text.strip()))
+
     def set_prepend_site(self, p):
         # type: (bool) -> None
         self.prepend_site = p
@@ -591,7 +635,8 @@ class SingleSiteConnection(Helpers):
 
         if self.limit is not None:
             normalized_query = Query(u"%sLimit: %d\n" % (normalized_query, self.limit),
-                                     normalized_query.suppress_exceptions)
+                                     normalized_query.suppress_exceptions,
+                                     normalized_query.output_format)
 
         response = self.do_query(normalized_query, normalized_add_headers)
         if self.prepend_site:
@@ -599,6 +644,62 @@ class SingleSiteConnection(Helpers):
                 row.insert(0, b"")
         return response
 
+    def iter_query(self, query, add_headers=u""):
+        # type: (QueryTypes, Union[str, bytes]) -> Iterator[LivestatusRow]
+        """Like query(), but yields the rows while the response is being received
+
+        Huge responses don't need to be held in memory as a whole. As rows may already
+        have been handed out, the query is not sent again after connection errors.
+        """
+        normalized_query = Query(query) if not isinstance(query, Query) else query
+        if self.limit is not None:
+            normalized_query = Query(u"%sLimit: %d\n" % (normalized_query, self.limit),
+                                     normalized_query.suppress_exceptions,
+                                     normalized_query.output_format)
+
+        self.send_query(normalized_query, _ensure_unicode(add_headers))
+        header = self.receive_data(RESPONSE_HEADER_LENGTH)
+        length = self.response_length(header)
+        if header[0:3] != b"200":
+            self.parse_response(header, self.receive_data(length))
+
+        decode = _DECODERS[normalized_query.output_format]
+        complete = False
+        try:
+            # The rows are separated by ",\n" and newlines within the data are always escaped.
+            # The first line starts with the opening bracket of the row list and the last one
+            # ends with its closing bracket.
+            first = True
+            rest = b""
+            while length:
+                chunk = self.receive_data(min(length, RECEIVE_CHUNK_SIZE))
+                length -= len(chunk)
+                lines = (rest + chunk).split(b"\n")
+                # The last line may not be terminated by a newline
+                rest = lines.pop() if length else b""
+                for line in lines:
+                    if first:
+                        line = line[1:]
+                        first = False
+
+                    data = line[:-1]
+                    if not data:
+                        continue
+
+                    try:
+                        row = decode(data)
+                    except Exception:
+                        raise MKLivestatusSocketError("Malformed output")
+
+                    if self.prepend_site:
+                        row.insert(0, b"")
+                    yield row
+            complete = True
+        finally:
+            # Unread data would be taken as the response to the next query
+            if not complete:
+                self.disconnect()
+
     # TODO: Cleanup all call sites to hand over str types
     def command(self, command, site=None):
         # type: (AnyStr, Optional[SiteId]) -> None
@@ -665,6 +766,112 @@ class SingleSiteConnection(Helpers):
 # it possible to connect/disconnect duing existance of a single object.
 
 
+class PendingResponse(object):  # pylint: disable=useless-object-inheritance
+    """The response of a site to a query sent by MultiSiteConnection.iter_query_parallel
+
+    The socket of the connection is switched to non-blocking mode. The response is read
+    in pieces whenever the socket gets readable. Like the socket timeout of a blocking
+    receive, the timeout of the connection limits the time without receiving anything.
+    """
+    def __init__(self, sitename, site, connection, output_format):
+        # type: (SiteId, SiteConfiguration, SingleSiteConnection, str) -> None
+        super(PendingResponse, self).__init__()
+        self.sitename = sitename
+        self.site = site
+        self.connection = connection
+        self.deadline = None  # type: Optional[float]
+        self.output_format = output_format
+        self.retried = False
+        self.start()
+
+    def start(self):
+        # type: () -> None
+        """Start receiving the response from the current socket of the connection"""
+        self.socket = cast(socket.socket, self.connection.socket)
+        self.socket.setblocking(False)
+        self._header = None  # type: Optional[bytes]
+        self._chunks = []  # type: List[bytes]
+        self._missing = RESPONSE_HEADER_LENGTH
+        self._extend_deadline()
+
+    def _extend_deadline(self):
+        # type: () -> None
+        if self.connection.timeout:
+            self.deadline = time.time() + self.connection.timeout
+
+    def read(self):
+        # type: () -> bool
+        """Read the available data and tell whether or not the response is complete"""
+        while self._missing:
+            try:
+                packet = self.socket.recv(min(self._missing, RECEIVE_CHUNK_SIZE))
+            except ssl.SSLWantReadError:
+                return False
+            except socket.error as e:
+                if e.errno in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    return False
+                raise
+
+            if not packet:
+                raise MKLivestatusSocketClosed(
+                    "Read zero data from socket, nagios server closed connection")
+
+            self._extend_deadline()
+            self._chunks.append(packet)
+            self._missing -= len(packet)
+            if not self._missing and self._header is None:
+                self._header = b"".join(self._chunks)
+                self._chunks = []
+                self._missing = self.connection.response_length(self._header)
+        return True
+
+    def response(self):
+        # type: () -> LivestatusResponse
+        self.socket.settimeout(None)
+        return self.connection.parse_response(cast(bytes, self._header), b"".join(self._chunks),
+                                              self.output_format)
+
+
+_SelectorKey = NamedTuple("_SelectorKey", [
+    ("fileobj", socket.socket),
+    ("events", int),
+    ("data", PendingResponse),
+])
+
+
+class _SelectSelector(object):  # pylint: disable=useless-object-inheritance
+    """Replaces selectors.DefaultSelector on Python 2, which has no selectors module
+
+    Only provides what MultiSiteConnection.iter_query_parallel needs."""
+    EVENT_READ = 1
+
+    def __init__(self):
+        # type: () -> None
+        super(_SelectSelector, self).__init__()
+        self._map = {}  # type: Dict[socket.socket, _SelectorKey]
+
+    def register(self, fileobj, events, data):
+        # type: (socket.socket, int, PendingResponse) -> None
+        self._map[fileobj] = _SelectorKey(fileobj, events, data)
+
+    def unregister(self, fileobj):
+        # type: (socket.socket) -> None
+        del self._map[fileobj]
+
+    def get_map(self):
+        # type: () -> Dict[socket.socket, _SelectorKey]
+        return self._map
+
+    def select(self, timeout=None):
+        # type: (Optional[float]) -> List[Tuple[_SelectorKey, int]]
+        readable, _writable, _exceptional = select.select(list(self._map), [], [], timeout)
+        return [(self._map[fileobj], self.EVENT_READ) for fileobj in readable]
+
+    def close(self):
+        # type: () -> None
+        self._map.clear()
+
+
 class MultiSiteConnection(Helpers):
     def __init__(self, sites, disabled_sites=None):
         # type: (SiteConfigurations, Optional[SiteConfigurations]) -> None
@@ -921,6 +1128,23 @@ class MultiSiteConnection(Helpers):
     # applied to all sites - resulting in possibly more results then Limit requests.
     def query_parallel(self, query, add_headers=u""):
         # type: (Query, str) -> LivestatusResponse
+        sitenames = [sitename for sitename, _site, _connection in self.connections]
+        responses = dict(self.iter_query_parallel(query, add_headers))
+
+        # Keep the order of the sites independent of the response times
+        result = LivestatusResponse([])
+        for sitename in sitenames:
+            result += responses.get(sitename, [])
+        return result
+
+    def iter_query_parallel(self, query, add_headers=u""):
+        # type: (Query, str) -> Iterator[Tuple[SiteId, LivestatusResponse]]
+        """Send the query to all sites and yield the responses in the order they arrive
+
+        The responses of all sites are received at the same time. A site not having
+        sent anything within its "timeout" is considered dead. Sites which did not
+        respond until the caller stopped the iteration are disconnected.
+        """
         stillalive = []
         if self.only_sites is not None:
             connect_to_sites = [c for c in self.connections if c[0] in self.only_sites]
@@ -934,43 +1158,130 @@ class MultiSiteConnection(Helpers):
             limit_header = u"Limit: %d\n" % limit
         else:
             limit_header = u""
+        headers = add_headers + limit_header
 
         # First send all queries
+        pending = []  # type: List[PendingResponse]
         for sitename, site, connection in connect_to_sites:
             try:
-                connection.send_query(query, add_headers + limit_header)
+                connection.send_query(query, headers)
             except Exception as e:
+                connection.disconnect()
                 self.deadsites[sitename] = {
                     "exception": e,
                     "site": site,
                 }
+                continue
+
+            pending.append(PendingResponse(sitename, site, connection, query.output_format))
 
         suppress_exceptions = tuple(query.suppress_exceptions)
 
-        # Then retrieve all answers. We will be as slow as the slowest of all
-        # connections.
-        result = LivestatusResponse([])
-        for sitename, site, connection in connect_to_sites:
-            try:
-                r = connection.recv_response(query, add_headers + limit_header)
-                stillalive.append((sitename, site, connection))
-                if self.prepend_site:
-                    for row in r:
-                        row.insert(0, sitename)
-                result += r
-            except suppress_exceptions:  # pylint: disable=catching-non-exception
-                stillalive.append((sitename, site, connection))
-                continue
+        # Then retrieve all answers as they arrive
+        if selectors is None:
+            selector = _SelectSelector()  # type: Any
+            event_read = _SelectSelector.EVENT_READ
+        else:
+            selector = selectors.DefaultSelector()
+            event_read = selectors.EVENT_READ
 
-            except Exception as e:
-                connection.disconnect()
-                self.deadsites[sitename] = {
-                    "exception": e,
-                    "site": site,
-                }
+        def unregister(response):
+            # type: (PendingResponse) -> None
+            if response.socket in selector.get_map():
+                selector.unregister(response.socket)
 
-        self.connections = stillalive
-        return result
+        try:
+            for response in pending:
+                selector.register(response.socket, event_read, response)
+
+            while selector.get_map():
+                deadlines = [
+                    key.data.deadline
+                    for key in selector.get_map().values()
+                    if key.data.deadline is not None
+                ]
+                timeout = max(0.0, min(deadlines) - time.time()) if deadlines else None
+
+                for key, _events in selector.select(timeout):
+                    response = key.data
+                    try:
+                        if not response.read():
+                            continue
+                        unregister(response)
+                        rows = response.response()
+
+                    except (MKLivestatusSocketClosed, IOError) as e:
+                        unregister(response)
+                        if self._resend_query(response, query, headers):
+                            selector.register(response.socket, event_read, response)
+                            continue
+                        self._site_died(response, MKLivestatusSocketError(str(e)))
+                        continue
+
+                    except Exception as e:
+                        unregister(response)
+                        error = e if isinstance(e, MKLivestatusTableNotFoundError) else \
+                            MKLivestatusSocketError("Unhandled exception: %s" % e)
+                        if isinstance(error, suppress_exceptions):
+                            stillalive.append(
+                                (response.sitename, response.site, response.connection))
+                        else:
+                            self._site_died(response, error)
+                        continue
+
+                    stillalive.append((response.sitename, response.site, response.connection))
+                    if self.prepend_site:
+                        for row in rows:
+                            row.insert(0, response.sitename)
+                    yield response.sitename, rows
+
+                now = time.time()
+                for key in list(selector.get_map().values()):
+                    response = key.data
+                    if response.deadline is not None and response.deadline <= now:
+                        unregister(response)
+                        self._site_died(
+                            response,
+                            MKLivestatusSocketError("Timeout while waiting for the response"))
+
+        finally:
+            # The iteration may have been stopped before all sites responded. Their
+            # connections can not be used anymore.
+            for key in list(selector.get_map().values()):
+                response = key.data
+                response.connection.disconnect()
+                stillalive.append((response.sitename, response.site, response.connection))
+            selector.close()
+            alive_sitenames = {sitename for sitename, _site, _connection in stillalive}
+            self.connections = [c for c in self.connections if c[0] in alive_sitenames]
+
+    def _resend_query(self, response, query, add_headers):
+        # type: (PendingResponse, Query, str) -> bool
+        """Reconnect and send the query again (once) after the site closed the connection
+
+        This is due to timeouts during keepalive."""
+        response.connection.disconnect()
+        if response.retried or (response.deadline is not None and response.deadline <= time.time()):
+            return False
+
+        try:
+            response.connection.connect()
+            response.connection.send_query(query, add_headers)
+        except Exception:
+            response.connection.disconnect()
+            return False
+
+        response.retried = True
+        response.start()
+        return True
+
+    def _site_died(self, response, exception):
+        # type: (PendingResponse, Exception) -> None
+        response.connection.disconnect()
+        self.deadsites[response.sitename] = {
+            "exception": exception,
+            "site": response.site,
+        }
 
     # TODO: Is this SiteId(...) the way to go? Without this mypy complains about incompatible bytes
     # vs. Optional[SiteId]
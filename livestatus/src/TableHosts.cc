@@ -719,6 +719,18 @@ void TableHosts::addColumns(Table *table, const std::string &prefix,
             }
             return {};
         }));
+    table->addColumn(std::make_unique<HostFileColumn>(
+        prefix + "mk_inventory_binary",
+        "The file content of the Check_MK HW/SW-Inventory in the binary tree format",
+        Column::Offsets{indirect_offset, extra_offset, -1, 0},
+        [mc]() { return mc->mkInventoryPath(); },
+        [](const Column &col,
+           const Row &row) -> std::optional<std::filesystem::path> {
+            if (auto hst = col.columnData<host>(row)) {
+                return std::string{hst->name} + ".sdt";
+            }
+            return {};
+        }));
     table->addColumn(std::make_unique<HostFileColumn>(
         prefix + "structured_status",
         "The file content of the structured status of the Check_MK HW/SW-Inventory",
@@ -139,6 +139,7 @@ def snmp_config_fixture(request, snmpsim, monkeypatch):
         character_encoding=None,
         is_usewalk_host=backend_name == "stored_snmp",
         is_inline_snmp_host=backend_name == "inline_snmp",
+        is_builtin_snmp_host=backend_name == "builtin_snmp",
         record_stats=False,
     )
 
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+"""Compare a complete BI compilation with an incremental one after some hosts changed
+
+The synthetic forest has one aggregation per host with NUM_SERVICES leaves each, built with
+FOREACH_HOST, and an aggregation which collects the web services of some hosts by a regex."""
+
+import marshal
+import time
+
+import cmk.gui.bi as bi
+import cmk.gui.config as config
+
+NUM_HOSTS = 5000
+NUM_SERVICES = 10
+
+SERVICES = ["CPU load", "Memory", "Uptime", "HTTP"
+           ] + ["Filesystem /fs%d" % i for i in range(NUM_SERVICES - 4)]
+
+
+def _site_data(num_hosts):
+    site_data = {"services": {}, "services_by_hostname": {}}
+    for index in range(num_hosts):
+        host_name = "host%05d" % index
+        entry = (["prod", "lan"], list(SERVICES), [], [], "Alias %s" % host_name)
+        site_data["services"][("site", host_name)] = entry
+        site_data["services_by_hostname"][host_name] = [("site", entry)]
+    return site_data
+
+
+def _setup_forest(monkeypatch):
+    monkeypatch.setattr(config, "bi_packs", {})
+    monkeypatch.setattr(config, "host_aggregations", [])
+    monkeypatch.setattr(config, "aggregations", [
+        ({}, ["Hosts"], config.FOREACH_HOST, [], config.ALL_HOSTS, "host", ["$1$"]),
+        ({}, ["Web"], "web", []),
+    ])
+    monkeypatch.setattr(
+        config, "aggregation_rules", {
+            "host": {
+                "title": "Host $HOST$",
+                "params": ["HOST"],
+                "aggregation": "worst",
+                "nodes": [
+                    ("$HOST$", config.HOST_STATE),
+                    ("general", ["$HOST$"]),
+                    ("$HOST$", config.REMAINING),
+                ],
+            },
+            "general": {
+                "title": "General state",
+                "params": ["HOST"],
+                "aggregation": "worst",
+                "nodes": [("$HOST$", "CPU load|Memory|Uptime")],
+            },
+            "web": {
+                "title": "Web services",
+                "params": [],
+                "aggregation": "best",
+                "nodes": [("host00[0-4].*", "HTTP")],
+            },
+        })
+
+
+def _compile(site_data, previous_compilation=None):
+    compilation = {
+        "aggr_ref": {},
+        "compile_state": {},
+        "host_fingerprints": bi.get_host_fingerprints(site_data["services"]),
+    }
+    host_changes = None
+    if previous_compilation is not None:
+        host_changes = bi.BIHostChanges(previous_compilation["host_fingerprints"],
+                                        compilation["host_fingerprints"])
+
+    worker = bi.JobWorker(site_data, [])
+    num_compiled = 0
+    for job_id in bi.get_aggr_ids([bi.AGGR_HOST, bi.AGGR_MULTI]):
+        job = {"id": job_id, "info": {"compiled": False}}
+        new_data = None
+        if previous_compilation is not None and host_changes is not None:
+            new_data = bi.reuse_compiled_job(job, previous_compilation, host_changes)
+        if new_data is None:
+            new_data = worker.compile_job(job["id"], job["info"])
+            num_compiled += 1
+        compilation["aggr_ref"].update(new_data["aggr_ref"])
+        compilation["compile_state"][job_id] = new_data["compile_state"]
+
+    return compilation, num_compiled
+
+
+def _measure(site_data, previous_compilation=None):
+    start = time.time()
+    compilation, num_compiled = _compile(site_data, previous_compilation)
+    duration = time.time() - start
+    # Like loading the cachefile of the BICacheManager
+    return duration, marshal.loads(marshal.dumps(compilation)), num_compiled
+
+
+def test_bi_incremental_compilation(monkeypatch):
+    _setup_forest(monkeypatch)
+
+    site_data = _site_data(NUM_HOSTS)
+    full_duration, compilation, _num_compiled = _measure(site_data)
+    num_leaves = sum(len(bi.find_all_leaves(aggr)) for aggr in compilation["aggr_ref"].values())
+    assert len(compilation["aggr_ref"]) == NUM_HOSTS + 1
+
+    # A new service on a host only affects the aggregation of that host
+    site_data["services"][("site", "host01234")][1].append("Filesystem /new")
+    incremental_duration, incremental, num_compiled = _measure(site_data, compilation)
+    _full_duration, expected, _num_compiled = _measure(site_data)
+    assert incremental["aggr_ref"].keys() == expected["aggr_ref"].keys()
+    assert incremental["aggr_ref"].keys() != compilation["aggr_ref"].keys()
+    assert num_compiled == 1
+
+    # A new host may be matched by the regex of the web aggregation
+    new_site_data = _site_data(NUM_HOSTS + 1)
+    new_site_data["services"][("site", "host01234")][1].append("Filesystem /new")
+    added_duration, incremental, num_compiled = _measure(new_site_data, incremental)
+    _full_duration, expected, _num_compiled = _measure(new_site_data)
+    assert incremental["aggr_ref"].keys() == expected["aggr_ref"].keys()
+    assert num_compiled == 2
+
+    print("\n%d aggregations with %d leaves: full %.2fs / changed host %.2fs / added host %.2fs" %
+          (len(compilation["aggr_ref"]), num_leaves, full_duration, incremental_duration,
+           added_duration))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+"""Compare the sync state computation of an activation with and without the hash cache
+
+The synthetic WATO tree has NUM_FOLDERS folders, each having its hosts.mk, rules.mk and
+.wato file. Between the two cached runs some of the folders are modified, like it happens
+when a user changes some hosts before activating the changes."""
+
+import os
+import time
+
+import cmk.gui.watolib.activate_changes as activate_changes
+from cmk.gui.watolib.config_sync import ReplicationPath
+
+NUM_FOLDERS = 10000
+NUM_MODIFIED = 50
+
+
+def _create_wato_tree(base_dir):
+    wato_dir = base_dir / "etc/check_mk/conf.d/wato"
+    past = time.time() - 3600
+    for index in range(NUM_FOLDERS):
+        folder_dir = wato_dir / ("folder%d" % (index // 100)) / ("sub%05d" % index)
+        folder_dir.mkdir(parents=True)
+        files = {
+            "hosts.mk": "all_hosts += %r\n" % ["host%05d-%02d" % (index, n) for n in range(20)],
+            "rules.mk": "checkgroup_parameters.setdefault('filesystem', [])\n" * 10,
+            ".wato": "{'title': u'Folder %d', 'attributes': {}, 'num_hosts': 20}\n" % index,
+        }
+        for name, content in files.items():
+            file_path = folder_dir / name
+            file_path.write_text(content)
+            os.utime(str(file_path), (past, past))
+
+
+def _measure(base_dir, hash_cache=None):
+    replication_paths = [ReplicationPath("dir", "check_mk", "etc/check_mk/conf.d/wato", [])]
+    start = time.time()
+    infos = activate_changes._get_config_sync_file_infos(replication_paths, base_dir, hash_cache)
+    return time.time() - start, infos
+
+
+def test_config_sync_hash_cache(tmp_path):
+    base_dir = tmp_path / "site"
+    _create_wato_tree(base_dir)
+    cache_path = tmp_path / "config-sync-hashes.marshal"
+
+    uncached_duration, expected = _measure(base_dir)
+    cold_duration, infos = _measure(base_dir, activate_changes.ConfigSyncHashCache(cache_path))
+    assert infos == expected
+
+    for index in range(0, NUM_FOLDERS, NUM_FOLDERS // NUM_MODIFIED):
+        hosts_path = (base_dir / "etc/check_mk/conf.d/wato" / ("folder%d" % (index // 100)) /
+                      ("sub%05d" % index) / "hosts.mk")
+        hosts_path.write_text(hosts_path.read_text() + "# modified\n")
+        os.utime(str(hosts_path), (time.time() - 60,) * 2)
+    _uncached_duration, expected = _measure(base_dir)
+
+    hash_cache = activate_changes.ConfigSyncHashCache(cache_path)
+    warm_duration, infos = _measure(base_dir, hash_cache)
+    assert infos == expected
+    assert (hash_cache.hits, hash_cache.misses) == (3 * NUM_FOLDERS - NUM_MODIFIED, NUM_MODIFIED)
+
+    print("\n%d files: uncached %.2fs / cold cache %.2fs / warm cache %.2fs (%d KB cache)" %
+          (len(infos), uncached_duration, cold_duration, warm_duration,
+           os.stat(str(cache_path)).st_size / 1024))
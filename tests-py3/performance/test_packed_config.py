@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+"""Compare loading the binary packed config with the former marshalled Python code
+
+Each format is loaded in a fresh interpreter, like a keepalive helper does during
+startup. The load time, the growth of the peak RSS while loading and the RSS kept for the
+loaded values are measured in there. The loaded values are not shared between the helpers,
+the packed format does not reduce the memory they keep."""
+
+import json
+import marshal
+import os
+import subprocess
+import sys
+
+from testlib import repo_path
+
+import cmk.base.config as config
+
+NUM_HOSTS = 40000
+NUM_RULES = 3000
+
+_LOAD_SCRIPT = r"""
+import json, marshal, sys, time
+
+import cmk.base.config as config
+
+
+def memory_kb(field):
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+
+
+path, packed_format = sys.argv[1:]
+
+# Reset the peak RSS to exclude the memory needed for the imports. The peak RSS of the
+# resource module can not be used, it includes the peak RSS of the forking process.
+with open("/proc/self/clear_refs", "w") as clear_refs:
+    clear_refs.write("5")
+rss_before = memory_kb("VmRSS")
+
+start = time.time()
+if packed_format == "marshal":
+    helper_config = {}
+    with open(path, "rb") as f:
+        exec(marshal.load(f), helper_config)
+else:
+    helper_config = config.PackedConfigStore(path).read()
+duration = time.time() - start
+
+print(json.dumps({
+    "duration": duration,
+    "peak_rss_kb": memory_kb("VmHWM") - rss_before,
+    "rss_kb": memory_kb("VmRSS") - rss_before,
+}))
+"""
+
+
+def _synthetic_helper_config():
+    hostnames = ["host%05d" % index for index in range(NUM_HOSTS)]
+    return {
+        "all_hosts": [
+            "%s|lan|prod|/wato/folder%d/" % (hostname, index % 100)
+            for index, hostname in enumerate(hostnames)
+        ],
+        "ipaddresses": {
+            hostname: "10.%d.%d.%d" % (index // 65536, index // 256 % 256, index % 256)
+            for index, hostname in enumerate(hostnames)
+        },
+        "host_attributes": {
+            hostname: {
+                "alias": hostname.upper(),
+                "snmp_community": "public",
+            } for hostname in hostnames
+        },
+        "host_tags": {
+            hostname: {
+                "site": "heute",
+                "criticality": "prod",
+                "networking": "lan",
+                "agent": "cmk-agent",
+                "address_family": "ip-v4-only",
+            } for hostname in hostnames
+        },
+        "checkgroup_parameters": {
+            "filesystem": [{
+                "value": {
+                    "levels": (80.0, 90.0),
+                    "magic": 0.8,
+                },
+                "condition": {
+                    "host_name": hostnames[index:index + 20],
+                    "host_tags": {
+                        "criticality": "prod",
+                    },
+                },
+                "options": {},
+            } for index in range(NUM_RULES)],
+        },
+    }
+
+
+def _load(path, packed_format):
+    env = dict(os.environ, PYTHONPATH=repo_path())
+    output = subprocess.check_output([sys.executable, "-c", _LOAD_SCRIPT, path, packed_format],
+                                     env=env)
+    return json.loads(output)
+
+
+def test_packed_config_load(tmp_path):
+    helper_config = _synthetic_helper_config()
+
+    marshal_path = str(tmp_path / "precompiled_check_config.mk.marshal")
+    code = compile(
+        "".join("\n%s = %r\n" % (varname, val) for varname, val in helper_config.items()),
+        "<string>", "exec")
+    with open(marshal_path, "wb") as f:
+        marshal.dump(code, f)
+
+    packed_path = str(tmp_path / "precompiled_check_config.mk")
+    config.PackedConfigStore(packed_path).write(helper_config)
+
+    assert config.PackedConfigStore(packed_path).read() == helper_config
+
+    marshal_result = _load(marshal_path, "marshal")
+    packed_result = _load(packed_path, "packed")
+
+    print()
+    for packed_format, path, result in [
+        ("marshal", marshal_path, marshal_result),
+        ("packed", packed_path, packed_result),
+    ]:
+        print("%d hosts, %s: %.2fs, %d KB peak RSS, %d KB RSS, %d KB file" %
+              (NUM_HOSTS, packed_format, result["duration"], result["peak_rss_kb"],
+               result["rss_kb"], os.stat(path).st_size / 1024))
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+"""Compare precompiling one complete host check per host with the shared modules
+
+The synthetic hosts use NUM_PLUGIN_SETS distinct sets of NUM_PLUGINS check plugins each,
+like the hosts created from a few folder templates do. Reported are the wall time of a
+first precompilation, of a second one with unchanged hosts and the disk footprint."""
+
+import os
+import time
+
+from testlib.base import Scenario
+
+import cmk.utils.paths
+import cmk.base.config as config
+import cmk.base.core_nagios as core_nagios
+
+NUM_HOSTS = 3000
+NUM_PLUGIN_SETS = 10
+NUM_PLUGINS = 30
+
+
+def _setup_hosts(monkeypatch):
+    check_plugin_names = sorted(name for name in os.listdir(cmk.utils.paths.checks_dir)
+                                if "." not in name and not name.startswith("agent_"))
+    plugin_sets = [
+        check_plugin_names[index * NUM_PLUGINS:(index + 1) * NUM_PLUGINS]
+        for index in range(NUM_PLUGIN_SETS)
+    ]
+
+    def get_needed_check_plugin_names(host_config):
+        return set(plugin_sets[int(host_config.hostname[4:]) % NUM_PLUGIN_SETS])
+
+    monkeypatch.setattr(core_nagios, "_get_needed_check_plugin_names",
+                        get_needed_check_plugin_names)
+
+    ts = Scenario()
+    ipaddresses = {}
+    for index in range(NUM_HOSTS):
+        ts.add_host("host%05d" % index)
+        ipaddresses["host%05d" % index] = "10.0.%d.%d" % (index // 256, index % 256)
+    ts.set_option("ipaddresses", ipaddresses)
+    ts.apply(monkeypatch).initialize()
+
+
+def _measure(precompile_mode, num_processes, monkeypatch):
+    monkeypatch.setattr(config, "precompile_mode", precompile_mode)
+    monkeypatch.setattr(config, "precompile_processes", num_processes)
+    start = time.time()
+    core_nagios.precompile_hostchecks()
+    return time.time() - start
+
+
+def _disk_footprint(path):
+    num_files, size = 0, 0
+    for dirpath, _dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            num_files += 1
+            size += os.lstat(os.path.join(dirpath, filename)).st_size
+    return num_files, size
+
+
+def test_precompile_hostchecks(monkeypatch, tmp_path):
+    _setup_hosts(monkeypatch)
+
+    results = []
+    for precompile_mode, num_processes in [("host", 1), ("shared", 1), ("shared", 4)]:
+        precompiled_dir = tmp_path / ("%s-%d" % (precompile_mode, num_processes))
+        monkeypatch.setattr(cmk.utils.paths, "precompiled_hostchecks_dir", str(precompiled_dir))
+        cold_duration = _measure(precompile_mode, num_processes, monkeypatch)
+        warm_duration = _measure(precompile_mode, num_processes, monkeypatch)
+        num_files, size = _disk_footprint(precompiled_dir)
+        results.append(
+            (precompile_mode, num_processes, cold_duration, warm_duration, num_files, size))
+
+    print()
+    for precompile_mode, num_processes, cold_duration, warm_duration, num_files, size in results:
+        print("%d hosts, %s mode, %d processes: %.2fs / unchanged %.2fs, %d files with %d KB" %
+              (NUM_HOSTS, precompile_mode, num_processes, cold_duration, warm_duration, num_files,
+               size / 1024))
+
+    host_mode, shared_mode = results[0], results[-1]
+    assert shared_mode[5] < host_mode[5]
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+"""Compare the indexed host ruleset matching with a host by host evaluation
+
+The reference implementation evaluates every condition for every host, which
+is what the ruleset optimizer did before the tag / folder / label indexes were
+introduced."""
+
+import random
+import time
+from typing import Dict, List
+
+from cmk.utils.labels import LabelManager
+from cmk.utils.rulesets.ruleset_matcher import RulesetMatcher, _matches_labels
+
+NUM_HOSTS = 50000
+NUM_FOLDERS = 200
+NUM_RULES = 100
+
+TAG_GROUPS = {
+    "criticality": ["prod", "critical", "test", "offline"],
+    "networking": ["lan", "wan", "dmz"],
+    "agent": ["cmk-agent", "snmp-only", "no-agent"],
+    "location": ["loc%d" % i for i in range(20)],
+}
+
+
+def _synthetic_config(rnd):
+    host_tag_lists = {}
+    host_paths = {}
+    host_labels = {}
+    folders = ["/wato/f%d/sub%d/" % (i % 20, i) for i in range(NUM_FOLDERS)]
+
+    for index in range(NUM_HOSTS):
+        hostname = "host%05d" % index
+        host_path = rnd.choice(folders)
+        host_paths[hostname] = host_path
+        host_tag_lists[hostname] = {rnd.choice(tags) for tags in TAG_GROUPS.values()}
+        host_tag_lists[hostname].add(host_path)
+        host_labels[hostname] = {"os": rnd.choice(["linux", "windows", "aix"])}
+
+    return host_tag_lists, host_paths, host_labels, folders
+
+
+def _synthetic_ruleset(rnd, folders):
+    ruleset = []
+    for index in range(NUM_RULES):
+        tag_group_id, tags = rnd.choice(list(TAG_GROUPS.items()))
+        condition = {
+            "host_tags": {
+                tag_group_id: rnd.choice([
+                    rnd.choice(tags),
+                    {
+                        "$ne": rnd.choice(tags)
+                    },
+                    {
+                        "$or": rnd.sample(tags, 2)
+                    },
+                ]),
+            },
+        }
+
+        if index % 3 == 0:
+            condition["host_folder"] = rnd.choice(folders).split("sub")[0]
+
+        if index % 5 == 0:
+            condition["host_labels"] = {"os": "linux"}
+
+        if index % 7 == 0:
+            condition["host_name"] = [{"$regex": "host0[0-4]"}]
+
+        ruleset.append({"value": index, "condition": condition, "options": {}})
+    return ruleset
+
+
+def _reference_matching_hosts(optimizer, host_tag_lists, host_paths, labels_of_host, condition):
+    matching = set()
+    for hostname in optimizer.all_processed_hosts():
+        if not host_paths[hostname].startswith(condition.get("host_folder", "/")):
+            continue
+
+        tags = condition.get("host_tags", {})
+        if tags and not optimizer.matches_host_tags(host_tag_lists[hostname], tags):
+            continue
+
+        required_labels = condition.get("host_labels", {})
+        if required_labels and not _matches_labels(labels_of_host[hostname], required_labels):
+            continue
+
+        if not optimizer.matches_host_name(condition.get("host_name"), hostname):
+            continue
+
+        matching.add(hostname)
+    return matching
+
+
+def test_indexed_host_ruleset_matching():
+    rnd = random.Random(42)
+    host_tag_lists, host_paths, host_labels, folders = _synthetic_config(rnd)
+    ruleset = _synthetic_ruleset(rnd, folders)
+
+    labels = LabelManager(host_labels, [], [], lambda hostname, service_desc: {})
+    matcher = RulesetMatcher(
+        tag_to_group_map={},
+        host_tag_lists=host_tag_lists,
+        host_paths=host_paths,
+        labels=labels,
+        all_configured_hosts=set(host_tag_lists),
+        clusters_of={},
+        nodes_of={},
+    )
+    optimizer = matcher.ruleset_optimizer
+
+    # Computing the host labels is the same for both approaches. Do it upfront to
+    # only measure the matching itself.
+    labels_of_host = {
+        hostname: labels.labels_of_host(matcher, hostname)
+        for hostname in optimizer.all_processed_hosts()
+    }
+    optimizer._index_host_labels(optimizer.all_processed_hosts())
+
+    start = time.time()
+    expected = {}  # type: Dict[str, List[int]]
+    for rule in ruleset:
+        for hostname in _reference_matching_hosts(optimizer, host_tag_lists, host_paths,
+                                                  labels_of_host, rule["condition"]):
+            expected.setdefault(hostname, []).append(rule["value"])
+    reference_duration = time.time() - start
+
+    start = time.time()
+    host_ruleset = optimizer.get_host_ruleset(ruleset, with_foreign_hosts=False, is_binary=False)
+    indexed_duration = time.time() - start
+
+    assert host_ruleset == expected
+
+    print("\n%d hosts, %d rules: host by host %.2fs, indexed %.2fs (%.1fx)" %
+          (NUM_HOSTS, NUM_RULES, reference_duration, indexed_duration,
+           reference_duration / indexed_duration))
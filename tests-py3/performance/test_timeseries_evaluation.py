@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+"""Compare the vectorized evaluation of graph expressions with a point by point one
+
+The reference implementation applies the operators to the points of the operands one
+after another, which is what the time series evaluation did before it used NumPy. The
+synthetic combined graphs cover NUM_SERVICES services at one minute resolution."""
+
+import random
+import time
+
+from cmk.utils.prediction import TimeSeries
+from cmk.gui.plugins.metrics import stats
+import cmk.gui.plugins.metrics.timeseries as timeseries
+
+NUM_SERVICES = 300
+NUM_POINTS = 24 * 60
+
+
+def _reference_operators():
+    def clean(tsp):
+        return [x for x in tsp if x is not None]
+
+    def product(tsp):
+        result = 1
+        for x in tsp:
+            result *= x
+        return result
+
+    return {
+        "+": lambda tsp: sum(clean(tsp)),
+        "*": lambda tsp: None if None in tsp else product(tsp),
+        "-": lambda tsp: None if None in tsp else tsp[0] - tsp[1],
+        "/": lambda tsp: None if None in tsp else tsp[0] / tsp[1],
+        "MAX": lambda tsp: max(clean(tsp)),
+        "MIN": lambda tsp: min(clean(tsp)),
+        "AVERAGE": lambda tsp: sum(clean(tsp)) / len(clean(tsp)),
+        "MERGE": lambda tsp: next(iter(clean(tsp))),
+    }
+
+
+def _reference_evaluation(expression, rrd_data, num_points):
+    if expression[0] == "operator":
+        operator_id, operands = expression[1:]
+        op_func = _reference_operators()[operator_id]
+        operands_evaluated = [_reference_evaluation(a, rrd_data, num_points) for a in operands]
+        result = []
+        for tsp in zip(*operands_evaluated):
+            value = None
+            if tsp.count(None) < len(tsp):
+                try:
+                    value = op_func(tsp)
+                except ZeroDivisionError:
+                    pass
+            result.append(value)
+        return result
+
+    if expression[0] == "transformation":
+        (_transform, percentile), operands = expression[1:]
+        tsp = [x for x in _reference_evaluation(operands[0], rrd_data, num_points) if x is not None]
+        return [stats.percentile(tsp, percentile) if tsp else None] * num_points
+
+    if expression[0] == "rrd":
+        return rrd_data[tuple(expression[1:])].values
+
+    return [expression[1]] * num_points
+
+
+def _rrd_data():
+    rng = random.Random(42)
+    time_range = (0, NUM_POINTS * 60, 60)
+    rrd_data = {}
+    for index in range(NUM_SERVICES):
+        for metric in ["in", "out"]:
+            values = [
+                None if rng.random() < 0.05 else rng.uniform(0, 1000) for _ in range(NUM_POINTS)
+            ]
+            rrd_data[("heute", "host%03d" % index, "Interface 1", metric, "max",
+                      1)] = TimeSeries(values, time_range)
+    # Like fetch_rrd_data_for_graph(), the range is added after the data
+    rrd_data["__range"] = time_range
+    return rrd_data
+
+
+def _expressions():
+    def metrics(metric):
+        return [("rrd", "heute", "host%03d" % index, "Interface 1", metric, "max", 1)
+                for index in range(NUM_SERVICES)]
+
+    total_in = ("operator", "+", metrics("in"))
+    total_out = ("operator", "+", metrics("out"))
+    return [
+        total_in,
+        ("operator", "AVERAGE", metrics("in")),
+        ("operator", "MAX", metrics("out")),
+        ("operator", "MIN", metrics("out")),
+        ("operator", "/", [total_in, ("operator", "+", [total_in, total_out])]),
+        ("operator", "*", [("operator", "-", [total_out, total_in]), ("constant", 8)]),
+        ("transformation", ("percentile", 95), [total_in]),
+    ]
+
+
+def test_timeseries_evaluation():
+    rrd_data = _rrd_data()
+    expressions = _expressions()
+
+    start = time.time()
+    expected = [
+        _reference_evaluation(expression, rrd_data, NUM_POINTS) for expression in expressions
+    ]
+    reference_duration = time.time() - start
+
+    # Like a combined graph with a curve per expression
+    start = time.time()
+    curves = timeseries.compute_graph_curves([{
+        "expression": expression,
+        "line_type": "line",
+        "color": "#000000",
+        "title": "Curve %d" % index,
+    } for index, expression in enumerate(expressions)], rrd_data)
+    duration = time.time() - start
+    results = [curve["rrddata"] for curve in curves]
+
+    for result, expected_result in zip(results, expected):
+        assert len(result) == len(expected_result)
+        for value, expected_value in zip(result, expected_result):
+            if expected_value is None:
+                assert value is None
+            else:
+                assert abs(value - expected_value) <= 1e-9 * max(1.0, abs(expected_value))
+
+    print("\n%d expressions over %d series of %d points: point by point %.2fs / vectorized %.2fs" %
+          (len(results), 2 * NUM_SERVICES, NUM_POINTS, reference_duration, duration))
@@ -4,13 +4,19 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
+import asyncio
+
 import pytest  # type: ignore[import]
 
 from testlib.base import Scenario
 
 from cmk.utils.type_defs import ServiceCheckResult
 
+from cmk.fetchers import TCPDataFetcher
+from cmk.fetchers._base import MKFetcherError
+
 import cmk.base.data_sources.abstract as _abstract
+import cmk.base.data_sources.tcp as _tcp
 from cmk.base.data_sources.tcp import TCPDataSource
 
 
@@ -71,3 +77,158 @@ def test_get_summary_result_requires_host_sections(monkeypatch, ipaddress):
     assert source.get_summary_result_for_discovery() == defaults
     assert source.get_summary_result_for_inventory() == defaults
     assert source.get_summary_result_for_checking() == defaults
+
+
+def test_parse_host_section(monkeypatch):
+    Scenario().add_host("testhost").apply(monkeypatch)
+    monkeypatch.setattr(_abstract.time, "time", lambda: 1000)
+    source = TCPDataSource("testhost", "127.0.0.1")
+
+    host_sections = source._parse_host_section(b"\n".join([
+        b"ignored line before the first section",
+        b"<<<check_mk>>>",
+        b"Version: 1.7.0",
+        b"  <<<df>>>  ",
+        b"/dev/sda1   ext4  100 50 50  50%  /",
+        b"",
+        b"<<<ps:sep(59)>>>",
+        b"root;1; /sbin/init",
+        b"<<<logwatch:nostrip>>>",
+        b"  indented line\r",
+        b"<<<<piggy host>>>>",
+        b"<<<mem>>>",
+        b" MemTotal: 1 kB\r",
+        b"",
+        b"<<<<>>>>",
+        b"/dev/sdb1 ext4 1 1 0 100% /data",
+        b"<<<local:persist(2000)>>>",
+        b"0 Service - OK",
+        b"<<<df>>>",
+        b"/dev/sdc1 xfs 2 1 1 50% /srv",
+        b"<<<empty>>>",
+    ]))
+
+    assert host_sections.sections == {
+        "check_mk": [["Version:", "1.7.0"]],
+        "df": [
+            ["/dev/sda1", "ext4", "100", "50", "50", "50%", "/"],
+            ["/dev/sdc1", "xfs", "2", "1", "1", "50%", "/srv"],
+        ],
+        "ps": [["root", "1", " /sbin/init"]],
+        "logwatch": [["indented", "line"], ["/dev/sdb1", "ext4", "1", "1", "0", "100%", "/data"]],
+        "local": [["0", "Service", "-", "OK"]],
+        "empty": [],
+    }
+    assert host_sections.cache_info == {"local": (1000, 1000)}
+    assert host_sections.persisted_sections == {
+        "local": (1000, 2000, [["0", "Service", "-", "OK"]]),
+    }
+    assert b"\n".join(host_sections.piggybacked_raw_data["piggy_host"]) == b"\n".join([
+        b"<<<mem:cached(1000,90)>>>",
+        b" MemTotal: 1 kB",
+        b"",
+    ])
+
+
+@pytest.mark.parametrize("header,expected", [
+    (b"<<<dmidecode:sep(58):nostrip>>>", [["Handle 0x0", " DMI type 0"]]),
+    (b"<<<dmidecode:sep(58):nostrip(1)>>>", [["\tHandle 0x0", " DMI type 0"]]),
+])
+def test_parse_host_section_nostrip(monkeypatch, header, expected):
+    Scenario().add_host("testhost").apply(monkeypatch)
+    source = TCPDataSource("testhost", "127.0.0.1")
+
+    host_sections = source._parse_host_section(header + b"\n\tHandle 0x0: DMI type 0\r\n")
+    assert host_sections.sections["dmidecode"] == expected
+
+
+def test_parse_host_section_is_lazy(monkeypatch):
+    Scenario().add_host("testhost").apply(monkeypatch)
+    source = TCPDataSource("testhost", "127.0.0.1")
+
+    sections = source._parse_host_section(b"<<<df>>>\n/ 1 2\n<<<ps>>>\nroot /sbin/init\n").sections
+    assert isinstance(sections, _abstract.LazyAgentSections)
+    assert all(
+        isinstance(content, _abstract._UnparsedAgentSection)
+        for _section_name, content in sections.unparsed_items())
+
+    assert sections["df"] == [["/", "1", "2"]]
+    assert dict(sections.unparsed_items())["df"] == [["/", "1", "2"]]
+    assert isinstance(dict(sections.unparsed_items())["ps"], _abstract._UnparsedAgentSection)
+
+
+def test_agent_host_sections_update_keeps_sections_unparsed(monkeypatch):
+    Scenario().add_host("testhost").apply(monkeypatch)
+    source = TCPDataSource("testhost", "127.0.0.1")
+
+    host_sections = _abstract.AgentHostSections(sections={"df": [["/", "1", "2"]]})
+    host_sections.update(source._parse_host_section(b"<<<df>>>\n/srv 3 4\n<<<ps>>>\nroot\n"))
+
+    assert isinstance(
+        dict(host_sections.sections.unparsed_items())["ps"], _abstract._UnparsedAgentSection)
+    assert host_sections.sections == {
+        "df": [["/", "1", "2"], ["/srv", "3", "4"]],
+        "ps": [["root"]],
+    }
+
+
+def test_prefetch(monkeypatch):
+    ts = Scenario()
+    for hostname in ["host1", "host2", "host3"]:
+        ts.add_host(hostname)
+    ts.apply(monkeypatch)
+
+    fetched = []
+
+    def fetch_concurrently(fetchers, max_concurrency, timeout):
+        fetched.extend(sorted(fetchers))
+        return {
+            "host1": b"<<<check_mk>>>\nVersion: 1.7.0\n",
+            "host2": MKFetcherError("Not connected"),
+            "host3": b"<<<check_mk>>>\nVersion: 1.7.0\n",
+        }
+
+    monkeypatch.setattr(_tcp, "fetch_concurrently", fetch_concurrently)
+    monkeypatch.setattr(TCPDataFetcher, "data", lambda self: b"<<<check_mk>>>\nfetched again\n")
+    monkeypatch.setattr(TCPDataFetcher, "__enter__", lambda self: self)
+    monkeypatch.setattr(TCPDataFetcher, "__exit__", lambda self, *args: None)
+
+    sources = [TCPDataSource(hostname, "127.0.0.1") for hostname in ["host1", "host2", "host3"]]
+    for source in sources:
+        source.set_max_cachefile_age(0)
+    TCPDataSource.prefetch(sources)
+    assert fetched == ["host1", "host2", "host3"]
+
+    assert TCPDataSource("host1", "127.0.0.1")._execute() == b"<<<check_mk>>>\nVersion: 1.7.0\n"
+    # Failed agents are contacted again
+    assert TCPDataSource("host2", "127.0.0.1")._execute() == b"<<<check_mk>>>\nfetched again\n"
+    # The data of another address is not used
+    assert TCPDataSource("host3", "127.0.0.2")._execute() == b"<<<check_mk>>>\nfetched again\n"
+    # The prefetched data is used only once
+    assert TCPDataSource("host1", "127.0.0.1")._execute() == b"<<<check_mk>>>\nfetched again\n"
+
+
+def test_prefetch_timeout_falls_back_to_fetching(monkeypatch):
+    ts = Scenario()
+    for hostname in ["fast", "slow"]:
+        ts.add_host(hostname)
+    ts.apply(monkeypatch)
+    monkeypatch.setattr(_tcp.config, "agent_fetch_timeout", 0.1)
+
+    async def async_data(self):
+        if self._address[0] == "127.0.0.2":
+            await asyncio.sleep(1)
+        return b"<<<check_mk>>>\nprefetched\n"
+
+    monkeypatch.setattr(TCPDataFetcher, "async_data", async_data)
+    monkeypatch.setattr(TCPDataFetcher, "data", lambda self: b"<<<check_mk>>>\nslow agent\n")
+    monkeypatch.setattr(TCPDataFetcher, "__enter__", lambda self: self)
+    monkeypatch.setattr(TCPDataFetcher, "__exit__", lambda self, *args: None)
+
+    sources = [TCPDataSource("fast", "127.0.0.1"), TCPDataSource("slow", "127.0.0.2")]
+    for source in sources:
+        source.set_max_cachefile_age(0)
+    TCPDataSource.prefetch(sources)
+
+    assert TCPDataSource("fast", "127.0.0.1")._execute() == b"<<<check_mk>>>\nprefetched\n"
+    assert TCPDataSource("slow", "127.0.0.2")._execute() == b"<<<check_mk>>>\nslow agent\n"
@@ -4,7 +4,9 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
+import marshal
 from pathlib import Path
+from typing import Any, Dict
 
 import pytest  # type: ignore[import]
 import six
@@ -12,7 +14,9 @@ import six
 from testlib import CheckManager
 from testlib.base import Scenario
 
+from cmk.utils.exceptions import MKGeneralException
 from cmk.utils.rulesets.ruleset_matcher import RulesetMatchObject
+from cmk.utils.type_defs import OIDBytes, OIDCached
 import cmk.utils.version as cmk_version
 import cmk.utils.paths
 import cmk.utils.piggyback as piggyback
@@ -1888,11 +1892,72 @@ cmc_host_rrd_config = [
 """ % (condition, value))
 
 
-@pytest.mark.parametrize("pack_string", [
-    "_test_var = OIDBytes('6')\n\n",
-    "_test_var = OIDCached('6')\n\n",
+@pytest.mark.parametrize("value", [
+    OIDBytes('6'),
+    OIDCached('6'),
 ])
-def test_packed_config(pack_string):
+def test_packed_config(monkeypatch, value):
+    monkeypatch.setattr(config, "_test_var", None, raising=False)
     packed_config = config.PackedConfig()
-    packed_config._write(pack_string)
+    packed_config._write({"_test_var": value})
     packed_config.load()
+    assert config._test_var == value  # type: ignore[attr-defined] # pylint: disable=no-member
+
+
+def test_packed_config_store_write_and_read(tmp_path):
+    packed_config_store = config.PackedConfigStore(str(tmp_path / "packed"))
+    packed_config_store.write({
+        "all_hosts": ["host1", "host2"],
+        "ipaddresses": {
+            "host1": "127.0.0.1",
+        },
+        "explicit_snmp_communities": {},
+    })
+
+    assert packed_config_store.read() == {
+        "all_hosts": ["host1", "host2"],
+        "ipaddresses": {
+            "host1": "127.0.0.1",
+        },
+        "explicit_snmp_communities": {},
+    }
+
+
+def test_packed_config_store_equals_marshalled_code(tmp_path):
+    """The packed config loads the same values as the former marshalled Python code"""
+    helper_config = {
+        "all_hosts": ["host%d|lan|prod" % index for index in range(10)],
+        "ipaddresses": {
+            "host1": "127.0.0.1",
+            u"h\xe4st": None,
+        },
+        "check_parameters": [((80.0, 90), [], ["@all"], ["CPU load$"], {
+            "comment": u"\xe4"
+        })],
+        "snmp_ports": {
+            "host2": 1161
+        },
+        "bulkwalk_hosts": set(["host3", "host4"]),
+        "nested": {
+            ("a", 1): [[], (), {}, b"bytes", True, 1e-05]
+        },
+    }
+    code = compile(
+        "".join("\n%s = %r\n" % (varname, val) for varname, val in helper_config.items()),
+        "<string>", "exec")
+    marshalled_config = {}  # type: Dict[str, Any]
+    exec(marshal.loads(marshal.dumps(code)), {}, marshalled_config)
+
+    packed_config_store = config.PackedConfigStore(str(tmp_path / "packed"))
+    packed_config_store.write(helper_config)
+    packed = packed_config_store.read()
+
+    assert packed == marshalled_config
+    assert repr(packed) == repr(marshalled_config)
+
+
+def test_packed_config_store_unknown_format(tmp_path):
+    path = tmp_path / "packed"
+    path.write_bytes(b"all_hosts = []\n")
+    with pytest.raises(MKGeneralException, match="unknown format"):
+        config.PackedConfigStore(str(path)).read()
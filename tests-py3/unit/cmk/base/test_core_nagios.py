@@ -5,16 +5,26 @@
 # conditions defined in the file COPYING, which is part of this source code package.
 
 # pylint: disable=redefined-outer-name
+import importlib.util
 import io
 import itertools
+import os
+import shutil
+import subprocess
+import sys
 
 import pytest  # type: ignore[import]
 
 from testlib.base import Scenario
 
+import cmk.utils.log
+import cmk.utils.paths
 import cmk.utils.version as cmk_version
+import cmk.base.checking as checking
+import cmk.base.config as config
 import cmk.base.core_config as core_config
 import cmk.base.core_nagios as core_nagios
+import cmk.base.utils
 
 
 def test_format_nagios_object():
@@ -198,3 +208,253 @@ def test_create_nagios_host_spec(hostname, result, monkeypatch):
 
     host_spec = core_nagios._create_nagios_host_spec(cfg, config_cache, hostname, host_attrs)
     assert host_spec == result
+
+
+def _create_config(ts, monkeypatch, host_objects_cache=None):
+    config_cache = ts.apply(monkeypatch)
+    config_cache.initialize()
+    outfile = io.StringIO()
+    core_nagios.create_config(outfile, hostnames=None, host_objects_cache=host_objects_cache)
+    return outfile.getvalue()
+
+
+@pytest.mark.parametrize("num_processes", [1, 3])
+def test_create_config_with_host_objects_cache(monkeypatch, tmp_path, num_processes):
+    monkeypatch.setattr(config, "nagios_config_processes", num_processes)
+    cache_path = str(tmp_path / "nagios_host_objects.marshal")
+
+    ts = Scenario()
+    ipaddresses = {}
+    for index in range(100):
+        ts.add_host("host%03d" % index)
+        ipaddresses["host%03d" % index] = "10.0.0.%d" % index
+    ts.add_cluster("cluster", nodes=["host001", "host002"])
+    ts.set_option("ipaddresses", ipaddresses)
+    ts.set_ruleset("parents", [("host000", [], ["host003", "host004"])])
+
+    expected = _create_config(ts, monkeypatch)
+    assert "host000" in expected.split("# host003\n", 1)[1].split("# host004\n", 1)[0]
+    host_objects_cache = core_nagios.HostObjectsCache(cache_path)
+    assert _create_config(ts, monkeypatch, host_objects_cache) == expected
+    assert (host_objects_cache.hits, host_objects_cache.misses) == (0, 101)
+
+    host_objects_cache = core_nagios.HostObjectsCache(cache_path)
+    assert _create_config(ts, monkeypatch, host_objects_cache) == expected
+    assert (host_objects_cache.hits, host_objects_cache.misses) == (101, 0)
+
+    # A changed host and the cluster of the node are created again
+    ipaddresses["host002"] = "10.0.1.2"
+    expected = _create_config(ts, monkeypatch)
+    host_objects_cache = core_nagios.HostObjectsCache(cache_path)
+    assert _create_config(ts, monkeypatch, host_objects_cache) == expected
+    assert (host_objects_cache.hits, host_objects_cache.misses) == (99, 2)
+
+    # Removing a parent host changes the objects of its children
+    ts = Scenario()
+    for index in range(1, 100):
+        ts.add_host("host%03d" % index)
+    ts.add_cluster("cluster", nodes=["host001", "host002"])
+    ts.set_option("ipaddresses", ipaddresses)
+    ts.set_ruleset("parents", [("host000", [], ["host003", "host004"])])
+    expected = _create_config(ts, monkeypatch)
+    host_objects_cache = core_nagios.HostObjectsCache(cache_path)
+    assert _create_config(ts, monkeypatch, host_objects_cache) == expected
+    assert (host_objects_cache.hits, host_objects_cache.misses) == (98, 2)
+
+    # A changed rule changes all hosts
+    ts.set_option("extra_host_conf", {"notification_interval": [(60, [], ["@all"])]})
+    expected = _create_config(ts, monkeypatch)
+    host_objects_cache = core_nagios.HostObjectsCache(cache_path)
+    assert _create_config(ts, monkeypatch, host_objects_cache) == expected
+    assert (host_objects_cache.hits, host_objects_cache.misses) == (0, 100)
+
+
+_PRINT_CONFIG_FINGERPRINT = """
+import cmk.base.config as config
+import cmk.base.core_nagios as core_nagios
+
+config._check_contexts["ntp"] = {
+    "ntp_default_levels": (10, 200.0, 500.0),
+    "ntp_states": {"TYPE_FUNCTION": lambda x: x, "names": {"sys.peer", "candidate", "outlyer"}},
+}
+config._check_variables["ntp_default_levels"] = ["ntp"]
+config._check_variables["ntp_states"] = ["ntp"]
+print(core_nagios._config_fingerprint().hex())
+"""
+
+
+def test_config_fingerprint_is_stable_across_processes():
+    fingerprints = set()
+    for hash_seed in ["1", "2"]:
+        fingerprints.add(
+            subprocess.check_output(
+                [sys.executable, "-c", _PRINT_CONFIG_FINGERPRINT],
+                env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path),
+                         PYTHONHASHSEED=hash_seed),
+                encoding="utf-8",
+            ))
+    assert len(fingerprints) == 1
+
+
+def test_literal_repr():
+    assert core_nagios._literal_repr(("a", 1, None, [1.5], {"b": {2, 1}})) == \
+        "tuple('a', 1, None, list(1.5), dict('b': set(1, 2)))"
+    assert core_nagios._literal_repr(lambda x: x) == "<builtins.function>"
+
+
+def _setup_precompile(monkeypatch, tmp_path, num_hosts, check_plugin_names):
+    monkeypatch.setattr(cmk.utils.paths, "precompiled_hostchecks_dir", str(tmp_path))
+    # Not influenced by the includes of the checks loaded by other tests
+    monkeypatch.setattr(config, "check_includes", {})
+    monkeypatch.setattr(core_nagios, "_get_needed_check_plugin_names",
+                        lambda host_config: set(check_plugin_names[host_config.hostname]))
+
+    ts = Scenario()
+    ipaddresses = {}
+    for index in range(num_hosts):
+        ts.add_host("host%03d" % index)
+        ipaddresses["host%03d" % index] = "10.0.0.%d" % index
+    ts.set_option("ipaddresses", ipaddresses)
+    ts.apply(monkeypatch).initialize()
+
+
+def _execute_hostcheck(monkeypatch, path):
+    """Execute a precompiled host check without actually loading the checks and checking"""
+    checked = []
+
+    def load_checks(_get_context, filelist):
+        checked.append([p.rsplit("/", 1)[-1] for p in filelist])
+
+    with monkeypatch.context() as m:
+        m.setattr(sys, "executable", "/omd/sites/heute/bin/python3")
+        m.setattr(sys, "path", ["precompiled"] + sys.path)
+        m.setattr(sys, "dont_write_bytecode", False)
+        m.setattr(cmk.utils.log, "setup_console_logging", lambda: None)
+        m.setattr(cmk.base.utils, "register_sigint_handler", lambda: None)
+        m.setattr(config, "load_checks", load_checks)
+        m.setattr(config, "load_packed_config", lambda: None)
+        m.setattr(config, "ipaddresses", {})
+        m.setattr(checking, "do_check", lambda hostname, ipaddress: checked.append(
+            (hostname, config.ipaddresses)) or 0)
+
+        with open(path) as f:
+            code = compile(f.read(), path, "exec")
+        with pytest.raises(SystemExit) as e:
+            exec(code, {"__name__": "__main__"})  # pylint: disable=exec-used
+    assert e.value.code == 0
+    return checked
+
+
+@pytest.mark.parametrize("precompile_mode", ["host", "shared"])
+@pytest.mark.parametrize("num_processes", [1, 3])
+def test_precompile_hostchecks(monkeypatch, tmp_path, precompile_mode, num_processes):
+    monkeypatch.setattr(config, "precompile_mode", precompile_mode)
+    monkeypatch.setattr(config, "precompile_processes", num_processes)
+    check_plugin_names = {
+        "host%03d" % index: ["mem.used", "df"] if index % 2 else ["uptime"] for index in range(60)
+    }
+    _setup_precompile(monkeypatch, tmp_path, 60, check_plugin_names)
+
+    core_nagios.precompile_hostchecks()
+
+    with (tmp_path / "host007").open("rb") as f:
+        assert f.read(4) == importlib.util.MAGIC_NUMBER
+    assert _execute_hostcheck(monkeypatch, str(tmp_path / "host007.py")) == [
+        ["df", "mem"],
+        ("host007", {
+            "host007": "10.0.0.7"
+        }),
+    ]
+
+    if precompile_mode == "shared":
+        shared_modules = sorted(p.name for p in (tmp_path / ".shared").glob("*.py"))
+        assert len(shared_modules) == 2
+    else:
+        shared_modules = []
+
+    # Unchanged host checks are not compiled again, obsolete shared modules are removed
+    mtime = (tmp_path / "host007").stat().st_mtime_ns
+    check_plugin_names.update({"host%03d" % index: ["uptime"] for index in range(60)})
+    check_plugin_names["host007"] = ["mem.used", "df"]
+    core_nagios.precompile_hostchecks()
+    assert (tmp_path / "host007").stat().st_mtime_ns == mtime
+    assert (tmp_path / "host008").stat().st_mtime_ns != mtime
+    if precompile_mode == "shared":
+        assert sorted(p.name for p in (tmp_path / ".shared").glob("*.py")) == shared_modules
+
+    check_plugin_names["host007"] = []
+    core_nagios.precompile_hostchecks()
+    assert not (tmp_path / "host007").exists()
+    assert not (tmp_path / "host007.py").exists()
+    if precompile_mode == "shared":
+        assert len(list((tmp_path / ".shared").glob("*.py"))) == 1
+        assert len(list((tmp_path / ".shared" / "__pycache__").glob("*.pyc"))) == 1
+
+
+def test_precompile_hostchecks_shared_modules_in_parallel(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "precompile_mode", "shared")
+    monkeypatch.setattr(config, "precompile_processes", 6)
+    _setup_precompile(monkeypatch, tmp_path, 120,
+                      {"host%03d" % index: ["uptime"] for index in range(120)})
+
+    # All processes compile the same shared module at the same time
+    for _round in range(10):
+        shutil.rmtree(str(tmp_path / ".shared"), ignore_errors=True)
+        core_nagios.precompile_hostchecks()
+        module_paths = list((tmp_path / ".shared").glob("*.py"))
+        assert len(module_paths) == 1
+        # Only the compiled module is left, no temporary files
+        compiled_path = importlib.util.cache_from_source(str(module_paths[0]))
+        assert os.listdir(os.path.dirname(compiled_path)) == [os.path.basename(compiled_path)]
+
+    assert _execute_hostcheck(monkeypatch, str(tmp_path / "host099.py")) == [
+        ["uptime"],
+        ("host099", {
+            "host099": "10.0.0.99"
+        }),
+    ]
+
+
+def test_precompile_hostchecks_delayed(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "precompile_mode", "shared")
+    monkeypatch.setattr(config, "delay_precompile", True)
+    _setup_precompile(monkeypatch, tmp_path, 1, {"host000": ["uptime"]})
+
+    core_nagios.precompile_hostchecks()
+    assert (tmp_path / "host000").is_symlink()
+    assert not list((tmp_path / ".shared").glob("__pycache__/*.pyc"))
+
+    # The first execution compiles the host check and the shared module
+    assert _execute_hostcheck(monkeypatch, str(tmp_path / "host000")) == [
+        ["uptime"],
+        ("host000", {
+            "host000": "10.0.0.0"
+        }),
+    ]
+    assert not (tmp_path / "host000").is_symlink()
+    with (tmp_path / "host000").open("rb") as f:
+        assert f.read(4) == importlib.util.MAGIC_NUMBER
+    assert len(list((tmp_path / ".shared").glob("__pycache__/*.pyc"))) == 1
+
+
+def test_precompile_hostchecks_saves_shared_modules_before_stubs(monkeypatch, tmp_path):
+    monkeypatch.setattr(config, "precompile_mode", "shared")
+    _setup_precompile(monkeypatch, tmp_path, 2, {"host000": ["uptime"], "host001": ["df"]})
+
+    def get_needed_check_file_names(names):
+        if names != {"uptime"}:
+            raise Exception("Failed to precompile %r" % names)
+        return ["uptime"]
+
+    monkeypatch.setattr(core_nagios, "_get_needed_check_file_names", get_needed_check_file_names)
+
+    # The precompilation fails for the second host, the stub of the first host works anyway
+    with pytest.raises(SystemExit) as e:
+        core_nagios.precompile_hostchecks()
+    assert e.value.code == 5
+    assert _execute_hostcheck(monkeypatch, str(tmp_path / "host000.py")) == [
+        ["uptime"],
+        ("host000", {
+            "host000": "10.0.0.0"
+        }),
+    ]
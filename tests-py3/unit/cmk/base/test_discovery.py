@@ -4,9 +4,16 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
+import os
+
 import pytest  # type: ignore[import]
 
+from cmk.utils.exceptions import MKGeneralException
+from cmk.utils.log import console
+
+import cmk.base.autochecks as autochecks
 import cmk.base.discovery as discovery
+import cmk.base.section as section
 from cmk.base.discovered_labels import ServiceLabel
 
 
@@ -51,3 +58,54 @@ def test_discovered_service_eq():
     assert s1 not in {s3}
     assert s1 not in {s4}
     assert s1 in {s5}
+
+
+@pytest.fixture(name="fake_discovery")
+def fixture_fake_discovery(monkeypatch):
+    def fake_do_discovery_for(hostname, ipaddress, multi_host_sections, check_plugin_names,
+                              only_new, on_error):
+        if hostname == "host3":
+            raise MKGeneralException("Failed to fetch data")
+        autochecks.save_autochecks_file(
+            hostname, [discovery.DiscoveredService("uptime", None, u"Uptime", "None")])
+        section.section_success("Found 1 services from process %d" % os.getpid())
+
+    monkeypatch.setattr(discovery, "_preprocess_hostnames",
+                        lambda host_names, config_cache: set(host_names))
+    monkeypatch.setattr(discovery.ip_lookup, "lookup_ip_address", lambda hostname: "127.0.0.1")
+    monkeypatch.setattr(discovery, "_get_sources_for_discovery",
+                        lambda hostname, ipaddress, do_snmp_scan, on_error: None)
+    monkeypatch.setattr(discovery, "_get_host_sections_for_discovery",
+                        lambda sources, use_caches: None)
+    monkeypatch.setattr(discovery, "_do_discovery_for", fake_do_discovery_for)
+
+
+@pytest.mark.parametrize("max_processes", [1, 4])
+def test_do_discovery_parallel(fake_discovery, monkeypatch, caplog, capsys, max_processes):
+    monkeypatch.setattr(discovery.config, "agent_fetch_concurrency", 1)
+    caplog.set_level(console.VERBOSE, logger="cmk.base")
+    host_names = {"host%d" % num for num in range(10)}
+
+    discovery.do_discovery(host_names, None, False, max_processes=max_processes)
+
+    # The output of each host is kept together and the hosts are in order
+    output = capsys.readouterr().out
+    lines = [line for line in output.splitlines() if "with 4 processes" not in line]
+    assert lines[:20:2] == ["host%d:" % num for num in range(10)]
+    for num, line in enumerate(lines[1:20:2]):
+        if num == 3:
+            assert line == "ERROR - Failed to fetch data"
+        else:
+            assert line.startswith("SUCCESS - Found 1 services from process ")
+
+    if max_processes > 1:
+        assert len({line.rsplit(" ", 1)[-1] for line in lines if line.startswith("SUCCESS")}) > 1
+        assert lines[20:] == ["Discovery failed on 1 of 10 hosts: host3"]
+    else:
+        assert lines[20:] == []
+
+    for host_name in host_names - {"host3"}:
+        assert [
+            s.check_plugin_name for s in autochecks.parse_autochecks_file(
+                host_name, lambda hostname, check_plugin_name, item: u"Uptime")
+        ] == ["uptime"]
@@ -5,12 +5,15 @@
 # conditions defined in the file COPYING, which is part of this source code package.
 
 import socket
+import threading
+import time
 from pathlib import Path
 
 import pytest  # type: ignore[import]
 
 from testlib.base import Scenario
 import cmk.base.ip_lookup as ip_lookup
+from cmk.base.exceptions import MKIPAddressLookupError
 
 
 # TODO: Can be removed when this is not executed through a symlink anymore.
@@ -112,6 +115,24 @@ def test_ip_lookup_cache_update_without_persistence(_cache_file):
     assert not _cache_file.exists()
 
 
+def test_ip_lookup_cache_batched_updates(monkeypatch, _cache_file):
+    ip_lookup_cache = ip_lookup._get_ip_lookup_cache()
+    saved = []
+    monkeypatch.setattr(ip_lookup_cache, "save_persisted",
+                        lambda: saved.append(ip_lookup_cache.copy()))
+
+    with ip_lookup.batched_ip_lookup_cache_updates():
+        ip_lookup_cache.update_cache(("host1", 4), "127.0.0.1")
+        ip_lookup_cache.update_cache(("host2", 4), "127.0.0.2")
+        # Another process updates the persisted cache in the meantime
+        with _cache_file.open(mode="w", encoding="utf-8") as f:
+            f.write(u"%r" % {("host2", 4): "1", ("host3", 4): "3"})
+        assert ip_lookup_cache[("host1", 4)] == "127.0.0.1"
+        assert saved == []
+
+    assert saved == [{("host1", 4): "127.0.0.1", ("host2", 4): "127.0.0.2", ("host3", 4): "3"}]
+
+
 def test_load_legacy_lookup_cache(_cache_file):
     cache_id1 = "host1", 4
     cache_id2 = "host2", 4
@@ -150,6 +171,68 @@ def test_update_dns_cache(monkeypatch, _cache_file):
     assert ("dual", 6) not in cache
 
 
+def test_update_dns_cache_with_stub_resolver(monkeypatch, _cache_file):
+    monkeypatch.setattr(ip_lookup.config, "dns_lookup_concurrency", 4)
+    resolved = []
+
+    def resolve(hostname, family):
+        resolved.append((hostname, family))
+        if hostname == "unknown":
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return "10.0.0.%d" % int(hostname[4:])
+
+    ts = Scenario()
+    for index in range(20):
+        ts.add_host("host%02d" % index)
+    ts.add_host("unknown")
+    ts.add_host("static")
+    ts.set_option("ipaddresses", {"static": "127.0.0.1"})
+    ts.apply(monkeypatch)
+
+    assert ip_lookup.update_dns_cache(resolve) == (20, ["unknown"])
+    assert sorted(resolved) == sorted([("host%02d" % index, 4) for index in range(20)] +
+                                      [("unknown", 4)])
+
+    cache = ip_lookup._load_ip_lookup_cache(lock=False)
+    assert cache[("host07", 4)] == "10.0.0.7"
+    assert ("static", 4) not in cache
+    assert ("unknown", 4) not in cache
+
+
+def test_resolve_concurrently():
+    lock = threading.Lock()
+    running = [0, 0]  # current, maximum
+    release_slow = threading.Event()
+
+    def resolve(hostname, family):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        try:
+            if hostname == "slow":
+                release_slow.wait(10.0)
+            else:
+                time.sleep(0.05)
+            if hostname == "broken":
+                raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+            return "%s-%d" % (hostname, family)
+        finally:
+            with lock:
+                running[0] -= 1
+
+    lookups = [("host%d" % index, 4) for index in range(12)] + [("broken", 6), ("slow", 4)]
+    try:
+        results = ip_lookup.resolve_concurrently(lookups, resolve, 4, 0.5)
+    finally:
+        release_slow.set()
+
+    assert running[1] == 4
+    assert results[("host3", 4)] == "host3-4"
+    assert isinstance(results[("broken", 6)], socket.gaierror)
+    assert isinstance(results[("slow", 4)], MKIPAddressLookupError)
+    assert len(results) == len(lookups)
+
+
 def test_clear_ip_lookup_cache(_cache_file):
     with _cache_file.open(mode="w", encoding="utf-8") as f:
         f.write(u"%r" % {("host1", 4): "127.0.0.1"})
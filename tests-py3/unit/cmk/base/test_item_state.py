@@ -5,8 +5,12 @@
 # conditions defined in the file COPYING, which is part of this source code package.
 
 # pylint: disable=protected-access
+import os
+
 import pytest  # type: ignore[import]
 
+import cmk.utils.store as store
+
 from cmk.base import item_state
 
 
@@ -68,3 +72,159 @@ def test_get_average(ini_zero, backlog_min, timeseries):
             initialize_zero=ini_zero,
         )
         assert avg == expected_average, "at [%r]: got %r expected %r" % (idx, avg, expected_average)
+
+
+def _cached_item_states(hostname, prefix=("check", "item")):
+    cached_item_states = item_state.CachedItemStates()
+    cached_item_states.load(hostname)
+    cached_item_states.set_item_state_prefix(prefix)
+    return cached_item_states
+
+
+def test_item_states_save_and_load():
+    states = _cached_item_states("saved-host")
+    assert states.get_all_item_states() == {}
+    states.set_item_state("counter", (1.0, 42))
+    states.set_item_state("average", {"values": [1, 2.5, None]})
+    states.save("saved-host")
+
+    assert _cached_item_states("saved-host").get_all_item_states() == {
+        ("check", "item", "counter"): (1.0, 42),
+        ("check", "item", "average"): {
+            "values": [1, 2.5, None]
+        },
+    }
+
+
+def test_item_states_keep_concurrent_modifications():
+    states = _cached_item_states("concurrent-host")
+    states.set_item_state("kept", 1)
+    states.set_item_state("removed", 2)
+    states.save("concurrent-host")
+
+    first = _cached_item_states("concurrent-host")
+    second = _cached_item_states("concurrent-host")
+
+    first.set_item_state("kept", 10)
+    first.set_item_state("first", 11)
+    first.save("concurrent-host")
+
+    second.clear_item_state("removed")
+    second.set_item_state("second", 20)
+    second.save("concurrent-host")
+
+    assert _cached_item_states("concurrent-host").get_all_item_states() == {
+        ("check", "item", "kept"): 10,
+        ("check", "item", "first"): 11,
+        ("check", "item", "second"): 20,
+    }
+
+
+def test_item_states_set_and_cleared_before_save():
+    states = _cached_item_states("cleared-host")
+    states.set_item_state("foo", 1)
+    states.clear_item_state("foo")
+    states.save("cleared-host")
+    assert _cached_item_states("cleared-host").get_all_item_states() == {}
+
+
+def test_item_states_are_compacted(monkeypatch):
+    monkeypatch.setattr(item_state.ItemStateFile, "_COMPACTION_MIN_SIZE", 0)
+    item_state_file = item_state.ItemStateFile("compacted-host")
+
+    states = _cached_item_states("compacted-host")
+    states.set_item_state("foo", 0)
+    states.save("compacted-host")
+    initial_size = os.stat(item_state_file.path).st_size
+
+    for value in range(1, 20):
+        states = _cached_item_states("compacted-host")
+        states.set_item_state("foo", value)
+        states.save("compacted-host")
+        assert os.stat(item_state_file.path).st_size <= 4 * initial_size
+
+    assert item_state_file.load() == {("check", "item", "foo"): 19}
+
+
+def test_item_states_former_format_is_migrated():
+    item_state_file = item_state.ItemStateFile("former-host")
+    store.save_object_to_file(item_state_file.path, {("check", "item", "foo"): 1}, pretty=False)
+
+    states = _cached_item_states("former-host")
+    assert states.get_all_item_states() == {("check", "item", "foo"): 1}
+    states.set_item_state("bar", 2)
+    states.save("former-host")
+
+    with open(item_state_file.path, "rb") as f:
+        assert f.read().startswith(item_state.ItemStateFile._MAGIC)
+    assert item_state_file.load() == {("check", "item", "foo"): 1, ("check", "item", "bar"): 2}
+
+
+def test_item_states_truncated_record_is_ignored():
+    states = _cached_item_states("truncated-host")
+    states.set_item_state("foo", 1)
+    states.save("truncated-host")
+
+    item_state_file = item_state.ItemStateFile("truncated-host")
+    with open(item_state_file.path, "ab") as f:
+        f.write(b"\x00\x00\x01")
+
+    assert item_state_file.load() == {("check", "item", "foo"): 1}
+
+
+def test_item_states_partial_record_is_cut_off_before_append():
+    states = _cached_item_states("crashed-host")
+    states.set_item_state("foo", 1)
+    states.save("crashed-host")
+
+    # A crash while appending a record leaves only its first part
+    item_state_file = item_state.ItemStateFile("crashed-host")
+    record = item_state_file._record([], {("check", "item", "lost"): 2})
+    with open(item_state_file.path, "ab") as f:
+        f.write(record[:len(record) // 2])
+
+    states = _cached_item_states("crashed-host")
+    states.set_item_state("bar", 3)
+    states.save("crashed-host")
+
+    assert item_state_file.load() == {("check", "item", "foo"): 1, ("check", "item", "bar"): 3}
+    states = _cached_item_states("crashed-host")
+    states.set_item_state("baz", 4)
+    states.save("crashed-host")
+    assert item_state_file.load() == {
+        ("check", "item", "foo"): 1,
+        ("check", "item", "bar"): 3,
+        ("check", "item", "baz"): 4,
+    }
+
+
+def test_item_states_append_reads_only_record_headers(monkeypatch):
+    states = _cached_item_states("appending-host")
+    for index in range(10):
+        states.set_item_state("foo%d" % index, "x" * 100)
+        states.save("appending-host")
+
+    item_state_file = item_state.ItemStateFile("appending-host")
+    read_sizes = []
+    pread = os.pread
+    monkeypatch.setattr(os, "pread",
+                        lambda fd, size, offset: read_sizes.append(size) or pread(fd, size, offset))
+    states.set_item_state("bar", 1)
+    states.save("appending-host")
+    monkeypatch.undo()
+
+    assert max(read_sizes) <= len(item_state_file._MAGIC) + item_state_file._RECORD_HEADER.size
+    assert item_state_file.load()[("check", "item", "bar")] == 1
+
+
+def test_item_states_undecodable_record_ends_the_log():
+    states = _cached_item_states("corrupted-host")
+    states.set_item_state("foo", 1)
+    states.save("corrupted-host")
+
+    item_state_file = item_state.ItemStateFile("corrupted-host")
+    with open(item_state_file.path, "ab") as f:
+        f.write(item_state_file._RECORD_HEADER.pack(3) + b"\xff\xff\xff")
+        f.write(item_state_file._record([], {("check", "item", "bar"): 2}))
+
+    assert item_state_file.load() == {("check", "item", "foo"): 1}
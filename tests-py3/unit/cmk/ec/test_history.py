@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+
+import logging
+
+import pytest  # type: ignore[import]
+
+import cmk.ec.export as ec
+import cmk.ec.history
+import cmk.ec.main
+from cmk.ec.query import QueryGET
+
+
+class FakeStatusServer:
+    def __init__(self, history):
+        self._table = cmk.ec.main.StatusTableHistory(logging.getLogger("cmk.mkeventd"), history)
+
+    def table(self, name):
+        assert name == "history"
+        return self._table
+
+
+@pytest.fixture(name="history")
+def fixture_history(tmp_path, monkeypatch):
+    settings = ec.settings('1.2.3i45', tmp_path, tmp_path / "etc", ['mkeventd'])
+    history = cmk.ec.history.History(settings, ec.default_config(),
+                                     logging.getLogger("cmk.mkeventd"),
+                                     cmk.ec.main.StatusTableEvents.columns,
+                                     cmk.ec.main.StatusTableHistory.columns)
+    # Small blocks to get a lot of them
+    monkeypatch.setattr(cmk.ec.history.HistoryFileIndex, "BLOCK_LINES", 4)
+    return history
+
+
+def _add_events(history, monkeypatch, first, last):
+    for num in range(first, last):
+        monkeypatch.setattr(cmk.ec.history.time, "time", lambda num=num: 1590000000.0 + num)
+        history.add(
+            {
+                "id": num,
+                "host": "host%d" % (num % 7),
+                "rule_id": "rule%d" % (num % 3),
+                "text": "Event number %d" % num,
+            }, "NEW")
+
+
+def _history_file(history):
+    paths = list(history._settings.paths.history_dir.value.glob("*.log"))
+    assert len(paths) == 1
+    return paths[0]
+
+
+def _query(history, *headers):
+    return QueryGET(FakeStatusServer(history), ["GET history"] + list(headers),
+                    logging.getLogger("cmk.mkeventd"))
+
+
+@pytest.mark.parametrize("headers", [
+    ["Filter: event_host = host3"],
+    ["Filter: event_host =~ HOST3"],
+    ["Filter: event_host in host1 host5"],
+    ["Filter: event_host = unknown"],
+    ["Filter: event_rule_id = rule2", "Filter: event_host = host4"],
+    ["Filter: history_time >= 1590000030", "Filter: history_time < 1590000060"],
+    ["Filter: history_time = 1590000042"],
+    ["Filter: history_time > 1590000090", "Filter: event_rule_id = rule1", "Limit: 3"],
+])
+def test_indexed_history_file_equals_whole_file(history, monkeypatch, headers):
+    _add_events(history, monkeypatch, 0, 70)
+    path = _history_file(history)
+    query = _query(history, *headers)
+    assert cmk.ec.history._indexed_filters(query.filters)
+
+    expected = cmk.ec.history._parse_history_file(history, path, query, [], query.limit,
+                                                  history._logger)
+    entries = cmk.ec.history._parse_indexed_history_file(history, path, query, query.limit,
+                                                         history._logger)
+    assert entries == expected
+    assert path.with_suffix(".idx").exists()
+
+    # The index is updated with the lines added in the meantime
+    _add_events(history, monkeypatch, 70, 101)
+    expected = cmk.ec.history._parse_history_file(history, path, query, [], query.limit,
+                                                  history._logger)
+    entries = cmk.ec.history._parse_indexed_history_file(history, path, query, query.limit,
+                                                         history._logger)
+    assert entries == expected
+
+
+def test_history_file_index_blocks(history, monkeypatch):
+    _add_events(history, monkeypatch, 0, 10)
+    path = _history_file(history)
+    index = cmk.ec.history.HistoryFileIndex()
+    assert index.update(path)
+    assert not index.update(path)
+
+    assert index.num_lines == 10
+    assert index.size == path.stat().st_size
+    assert [block[1:] for block in index.blocks] == [
+        (0, 1590000000.0, 1590000003.0),
+        (4, 1590000004.0, 1590000007.0),
+        (8, 1590000008.0, 1590000009.0),
+    ]
+    assert index.postings["event_host"]["host1"] == [0, 2]
+    assert index.postings["event_rule_id"]["rule0"] == [0, 1, 2]
+
+    # The last block is filled up before new blocks are started
+    _add_events(history, monkeypatch, 10, 13)
+    assert index.update(path)
+    assert [block[1:] for block in index.blocks][2:] == [
+        (8, 1590000008.0, 1590000011.0),
+        (12, 1590000012.0, 1590000012.0),
+    ]
+    assert index.postings["event_host"]["host1"] == [0, 2]
+    assert index.postings["event_host"]["host5"] == [1, 3]
+
+
+def test_history_file_index_skips_partial_line(history, monkeypatch):
+    _add_events(history, monkeypatch, 0, 5)
+    path = _history_file(history)
+    complete_size = path.stat().st_size
+    with path.open("ab") as f:
+        f.write(b"1590000005.0\tpartial")
+
+    index = cmk.ec.history.HistoryFileIndex()
+    assert index.update(path)
+    assert index.num_lines == 5
+    assert index.size == complete_size
+
+    with path.open("ab") as f:
+        f.write(b" line\n")
+    assert index.update(path)
+    assert index.num_lines == 6
+    assert index.size == path.stat().st_size
+
+
+def test_history_get_uses_index(history, monkeypatch):
+    _add_events(history, monkeypatch, 0, 20)
+    monkeypatch.setattr(cmk.ec.history, "_parse_history_file", None)
+
+    entries = history.get(_query(history, "Filter: event_host = host2"))
+
+    assert [entry[5] for entry in entries] == [16, 9, 2]  # event_id, newest first
+    assert [entry[0] for entry in entries] == [4, 11, 18]  # history_line
+
+
+def test_expire_history_file_index(history, monkeypatch):
+    _add_events(history, monkeypatch, 0, 5)
+    history.get(_query(history, "Filter: event_host = host2"))
+    index_path = _history_file(history).with_suffix(".idx")
+    assert index_path.exists()
+
+    history.flush()
+
+    assert not index_path.exists()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+
+import re
+import sys
+
+import pytest  # type: ignore[import]
+
+from cmk.ec.main import EventServer, match
+from cmk.ec.rule_index import RuleLiteralIndex, rule_literals, _ASCII_FOLDING, _LiteralAutomaton
+
+
+def _rule(rule_id, pattern, **kwargs):
+    rule = {"id": rule_id, "pack": "default"}
+    rule.update(kwargs)
+    compiled = EventServer._compile_matching_value("match", pattern)
+    if compiled is not None:
+        rule["match"] = compiled
+    return rule
+
+
+@pytest.mark.parametrize("pattern,expected", [
+    ("Disk full", {"disk full"}),
+    ("Disk full$", {"disk full"}),
+    ("^kernel: (.*) segfault at", {" segfault at"}),
+    ("^sshd.*Failed password for (\\w+)", {"failed password for "}),
+    ("(ERROR|CRIT)ICAL", {"ical"}),
+    ("(ERROR|CRITICAL) in [0-9]+", {"error", "critical"}),
+    ("(error|.*) in", {" in"}),
+    ("(error|.*)", None),
+    ("(?:link )+down", {"link "}),
+    ("(?:link )*down", {"down"}),
+    ("Temp \\d+\xb0C", {"temp "}),
+    ("[a-z]+\\d", None),
+    (".*", None),
+    ("", None),
+])
+def test_rule_literals(pattern, expected):
+    literals = rule_literals(_rule("r", pattern))
+    assert literals == (None if expected is None else frozenset(expected))
+
+
+@pytest.mark.parametrize("rule", [
+    _rule("r", "Disk full$", invert_matching=True),
+    _rule("r", "Disk full$", match_ok=EventServer._compile_matching_value("match_ok", "ok$")),
+    _rule("r", "Disk full$", cancel_priority=(7, 5)),
+    _rule("r", "Disk full$", cancel_application="app"),
+])
+def test_rule_literals_of_rules_matching_otherwise(rule):
+    assert rule_literals(rule) is None
+
+
+def test_ascii_folding_is_complete():
+    all_chars = u"".join(
+        chr(c) for c in range(sys.maxunicode + 1) if not 0xd800 <= c < 0xe000 and c >= 0x80)
+    for m in re.finditer(u"[\x00-\x7f]", all_chars, re.IGNORECASE):
+        folded = m.group().translate(_ASCII_FOLDING).lower()
+        assert folded.isascii() and re.fullmatch(re.escape(folded), m.group(), re.IGNORECASE)
+
+
+def test_automaton_finds_overlapping_literals():
+    automaton = _LiteralAutomaton(["he", "she", "his", "hers", "x"])
+    assert automaton.search("ushers") == {0, 1, 3}
+    assert automaton.search("this") == {2}
+    assert automaton.search("") == set()
+
+
+_PATTERNS = [
+    "Disk full",
+    "(ERROR|CRIT)ICAL",
+    "^kernel: (.*) segfault at",
+    "Failed password for (\\w+)",
+    "(?:link )+down",
+    "[a-z]+\\d",
+    "stra\xdfe",
+    "KILL",
+    "service (\\S+) stopped",
+    "",
+]
+
+_TEXTS = [
+    "Disk FULL on /var",
+    "kernel: foo[123] SEGFAULT at 0000",
+    "sshd[1]: Failed password for root",
+    "link link DOWN",
+    "criticalical error",
+    "CRITICAL",
+    "Stra\xdfe",
+    "\u212aill",
+    "service \u017fshd stopped",
+    "nothing to see here",
+    "",
+]
+
+
+def _matching(rules, text):
+    return [rule for rule in rules if match(rule.get("match"), text, complete=False) is not False]
+
+
+@pytest.mark.parametrize("text", _TEXTS)
+def test_rule_candidates(text):
+    rules = [_rule("r%d" % n, pattern) for n, pattern in enumerate(_PATTERNS)]
+    index = RuleLiteralIndex(rules, {1: {2: rules, 3: rules[:2]}})
+
+    candidates = index.rule_candidates(1, 2, text)
+    assert candidates == [rule for rule in rules if rule in candidates]
+    assert _matching(rules, text) == _matching(candidates, text)
+    assert index.rule_candidates(1, 4, text) == []
+    assert index.hits + index.skips == len([r for r in rules if rule_literals(r) is not None])
+
+
+def test_rule_candidates_counters():
+    rules = [_rule("a", "Disk full"), _rule("b", "link down"), _rule("c", "[a-z]+\\d")]
+    index = RuleLiteralIndex(rules, {1: {2: rules}})
+
+    assert index.rule_candidates(1, 2, "LINK DOWN") == [rules[1], rules[2]]
+    assert (index.hits, index.skips) == (1, 1)
+    assert index.rule_candidates(1, 2, "unrelated") == [rules[2]]
+    assert (index.hits, index.skips) == (1, 3)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+
+import bisect
+import socket
+import threading
+
+import pytest  # type: ignore[import]
+
+from cmk.utils.exceptions import MKSNMPError
+from cmk.utils.type_defs import SNMPHostConfig
+
+import cmk.fetchers.snmp_backend.builtin as builtin
+from cmk.fetchers.snmp_backend import BuiltinSNMPBackend, cleanup_builtin_snmp_sessions
+from cmk.fetchers.snmp_backend.stored_walk import StoredWalk
+
+WALK = """.1.3.6.1.2.1.1.1.0 Linux zeus 4.8.6.5-smp
+.1.3.6.1.2.1.1.2.0 .1.3.6.1.4.1.8072.3.2.10
+.1.3.6.1.2.1.1.9.1.2.1 .1.3.6.1.6.3.10.3.1.1
+.1.3.6.1.2.1.1.9.1.2.2 .1.3.6.1.6.3.11.3.1.1
+.1.3.6.1.2.1.1.10.0 after 9 in OID order
+.1.3.6.1.2.1.2.2.1.1.1 1
+.1.3.6.1.2.1.2.2.1.1.2 2
+.1.3.6.1.2.1.2.2.1.1.3 3
+.1.3.6.1.2.1.2.2.1.2.1 lo
+.1.3.6.1.2.1.2.2.1.2.2 eth0
+.1.3.6.1.2.1.2.2.1.2.3 eth1
+.1.3.6.1.2.1.2.2.1.6.1 ""
+.1.3.6.1.2.1.2.2.1.6.2 "00 12 79 62 F9 40 "
+.1.3.6.1.2.1.2.2.1.6.3 "00 12 79 62 F9 41 "
+.1.3.6.1.2.1.2.2.1.8.2 1
+.1.3.6.1.2.1.2.2.1.8.3 2
+.1.3.6.1.4.1.2021.9.1.2.1 /
+"""
+
+
+class _StandInAgent(object):  # pylint: disable=useless-object-inheritance
+    """An SNMP agent answering from a stored walk"""
+    def __init__(self, rows):
+        super(_StandInAgent, self).__init__()
+        self.rows = sorted(rows)
+        self.oids = [row[0] for row in self.rows]
+        self.requests = []  # type: list
+        self.answer = True
+        self.max_response_varbinds = None
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(("127.0.0.1", 0))
+        self.port = self._socket.getsockname()[1]
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.start()
+
+    def close(self):
+        self._socket.sendto(b"stop", ("127.0.0.1", self.port))
+        self._thread.join()
+        self._socket.close()
+
+    def _serve(self):
+        while True:
+            data, address = self._socket.recvfrom(65535)
+            if data == b"stop":
+                return
+            message = builtin._decode_message(data)
+            self.requests.append(message)
+            if self.answer:
+                self._socket.sendto(self._response(*message), address)
+
+    def _next(self, oid):
+        index = bisect.bisect_right(self.oids, oid)
+        if index < len(self.rows):
+            return self.rows[index]
+        return oid, builtin._END_OF_MIB_VIEW, b""
+
+    def _response(self, version, community, pdu_type, request_id, field1, field2, varbinds):
+        oids = [varbind[0] for varbind in varbinds]
+        error_status = error_index = 0
+        if pdu_type == builtin._GET_REQUEST:
+            rows = []
+            for oid in oids:
+                index = bisect.bisect_left(self.oids, oid)
+                if index < len(self.rows) and self.oids[index] == oid:
+                    rows.append(self.rows[index])
+                else:
+                    rows.append((oid, builtin._NO_SUCH_INSTANCE, b""))
+        elif pdu_type == builtin._GET_NEXT_REQUEST:
+            rows = [self._next(oid) for oid in oids]
+        else:
+            rows = []
+            current = list(oids)
+            for _repetition in range(field2):
+                for column, oid in enumerate(current):
+                    row = self._next(oid)
+                    rows.append(row)
+                    current[column] = row[0]
+            rows = rows[:self.max_response_varbinds]
+
+        if version == builtin._VERSION_1:
+            for index, row in enumerate(rows):
+                if row[1] in builtin._NO_VALUE_TYPES:
+                    error_status, error_index = builtin._NO_SUCH_NAME, index + 1
+                    rows = [(oid, builtin._NULL, b"") for oid in oids]
+                    break
+
+        return builtin._encode_message(version, community, builtin._RESPONSE, request_id,
+                                       error_status, error_index, [row[0] for row in rows],
+                                       [(row[1], row[2]) for row in rows])
+
+
+@pytest.fixture(name="walk_path")
+def fixture_walk_path(tmp_path):
+    path = tmp_path / "testhost"
+    path.write_text(WALK)
+    return str(path)
+
+
+@pytest.fixture(name="agent")
+def fixture_agent(walk_path):
+    rows = [(builtin._parse_oid(oid), builtin._OCTET_STRING, value)
+            for oid, value in StoredWalk(walk_path).walk(".1", include_base=True)]
+    agent = _StandInAgent(rows)
+    yield agent
+    cleanup_builtin_snmp_sessions()
+    agent.close()
+
+
+def _snmp_config(port, version="v2c", bulk_walk_size_of=10):
+    return SNMPHostConfig(
+        is_ipv6_primary=False,
+        hostname="testhost",
+        ipaddress="127.0.0.1",
+        credentials="public",
+        port=port,
+        is_bulkwalk_host=version == "v2c",
+        is_snmpv2or3_without_bulkwalk_host=version == "v2c_nobulk",
+        bulk_walk_size_of=bulk_walk_size_of,
+        timing={
+            "timeout": 1.0,
+            "retries": 1
+        },
+        oid_range_limits=[],
+        snmpv3_contexts=[],
+        character_encoding=None,
+        is_usewalk_host=False,
+        is_inline_snmp_host=False,
+        is_builtin_snmp_host=True,
+        record_stats=False,
+    )
+
+
+@pytest.mark.parametrize("version", ["v1", "v2c_nobulk", "v2c"])
+@pytest.mark.parametrize("oid", [
+    ".1.3.6.1.2.1.1",
+    ".1.3.6.1.2.1.1.9",
+    ".1.3.6.1.2.1.1.1.0",
+    ".1.3.6.1.2.1.2.2.1",
+    ".1.3.6.1.2.1.2.2.1.8",
+    ".1.3.6.1.2.1.3",
+    ".1.3.6.1.4.1.2021",
+    ".1.3.6.1.4.1.2022",
+])
+def test_walk_like_stored_walk(agent, walk_path, version, oid):
+    snmp_config = _snmp_config(agent.port, version, bulk_walk_size_of=2)
+    expected = StoredWalk(walk_path).walk(oid, include_base=True)
+    assert BuiltinSNMPBackend().walk(snmp_config, oid) == expected
+
+
+@pytest.mark.parametrize("version", ["v1", "v2c"])
+def test_walk_columns_merges_requests(agent, walk_path, version):
+    snmp_config = _snmp_config(agent.port, version)
+    oids = [".1.3.6.1.2.1.2.2.1.%d" % column for column in [1, 2, 6, 8]]
+
+    expected = [StoredWalk(walk_path).walk(oid, include_base=True) for oid in oids]
+    assert BuiltinSNMPBackend().walk_columns(snmp_config, oids) == expected
+    # GETBULK: one request covers all rows. GETNEXT: one request per row
+    assert len(agent.requests) == (1 if version == "v2c" else 4)
+    assert all(len(request[-1]) <= len(oids) for request in agent.requests)
+
+
+def test_walk_columns_sends_requests_at_once(agent):
+    snmp_config = _snmp_config(agent.port)
+    oids = [".1.3.6.1.2.1.2.2.1.2"] * 20
+
+    result = BuiltinSNMPBackend().walk_columns(snmp_config, oids)
+    assert result == [[
+        (".1.3.6.1.2.1.2.2.1.2.1", b"lo"),
+        (".1.3.6.1.2.1.2.2.1.2.2", b"eth0"),
+        (".1.3.6.1.2.1.2.2.1.2.3", b"eth1"),
+    ]] * 20
+    assert sorted(len(request[-1]) for request in agent.requests) == [4, 16]
+
+
+def test_walk_truncated_bulk_responses(agent, walk_path):
+    agent.max_response_varbinds = 3
+    snmp_config = _snmp_config(agent.port)
+    oids = [".1.3.6.1.2.1.2.2.1.1", ".1.3.6.1.2.1.2.2.1.2"]
+
+    expected = [StoredWalk(walk_path).walk(oid, include_base=True) for oid in oids]
+    assert BuiltinSNMPBackend().walk_columns(snmp_config, oids) == expected
+
+
+def test_walk_stops_on_not_increasing_oids():
+    agent = _StandInAgent([])
+    agent._next = lambda oid: ((1, 3, 6, 1, 2, 1, 1, 1, 0), builtin._OCTET_STRING, b"loop")
+    try:
+        snmp_config = _snmp_config(agent.port)
+        assert BuiltinSNMPBackend().walk(snmp_config, ".1.3.6.1.2.1.1") == [
+            (".1.3.6.1.2.1.1.1.0", b"loop"),
+        ]
+    finally:
+        cleanup_builtin_snmp_sessions()
+        agent.close()
+
+
+@pytest.mark.parametrize("version", ["v1", "v2c"])
+@pytest.mark.parametrize("oid,expected", [
+    (".1.3.6.1.2.1.1.1.0", b"Linux zeus 4.8.6.5-smp"),
+    (".1.3.6.1.2.1.1.9.1.*", b".1.3.6.1.6.3.10.3.1.1"),
+    (".1.3.6.1.2.1.1.1", None),
+    (".1.3.6.1.2.1.1.1.0.1", None),
+    (".1.3.6.1.4.1.2021.9.1.2.1.*", None),
+])
+def test_get_like_stored_walk(agent, walk_path, version, oid, expected):
+    snmp_config = _snmp_config(agent.port, version)
+    assert BuiltinSNMPBackend().get(snmp_config, oid) == expected
+
+
+def test_session_is_kept(agent):
+    snmp_config = _snmp_config(agent.port)
+    backend = BuiltinSNMPBackend()
+    backend.get(snmp_config, ".1.3.6.1.2.1.1.1.0")
+    session = builtin._sessions[(int(socket.AF_INET), "127.0.0.1", agent.port)]
+    backend.walk(snmp_config, ".1.3.6.1.2.1.1")
+    assert list(builtin._sessions.values()) == [session]
+
+    cleanup_builtin_snmp_sessions()
+    assert builtin._sessions == {}
+
+
+def test_timeout(agent):
+    agent.answer = False
+    snmp_config = _snmp_config(agent.port)._replace(timing={"timeout": 0.1, "retries": 2})
+
+    with pytest.raises(MKSNMPError, match="Timeout"):
+        BuiltinSNMPBackend().walk(snmp_config, ".1.3.6.1.2.1.1")
+    assert len(agent.requests) == 3
+    assert BuiltinSNMPBackend().get(snmp_config, ".1.3.6.1.2.1.1.1.0") is None
+
+
+@pytest.mark.parametrize("tag,content,expected", [
+    (builtin._OCTET_STRING, b"  text  ", b"text"),
+    (builtin._OCTET_STRING, b"\x00\x12yb\xf9 ", b"\x00\x12yb\xf9 "),
+    (builtin._INTEGER, b"\xff", b"-1"),
+    (builtin._INTEGER, b"\x00\x80", b"128"),
+    (builtin._COUNTER32, b"\xff\xff\xff\xff", b"4294967295"),
+    (builtin._COUNTER64, b"\x01\x00\x00\x00\x00\x00\x00\x00\x00", b"18446744073709551616"),
+    (builtin._TIME_TICKS, b"\x01\x00", b"256"),
+    (builtin._IP_ADDRESS, b"\x0a\x00\x00\x01", b"10.0.0.1"),
+    (builtin._OBJECT_IDENTIFIER, b"\x2b\x06\x01\x04\x01\xbf\x08", b".1.3.6.1.4.1.8072"),
+    (builtin._NULL, b"", b""),
+])
+def test_raw_value(tag, content, expected):
+    assert builtin._raw_value(tag, content) == expected
+
+
+@pytest.mark.parametrize("oid", [
+    (1, 3, 6, 1, 2, 1, 1, 1, 0),
+    (1, 3, 6, 1, 4, 1, 8072, 3, 2, 10),
+    (1, 3, 6, 1, 4, 1, 2**32 - 1),
+    (2, 5, 127, 128, 16383, 16384),
+])
+def test_oid_encoding(oid):
+    tag, start, end = builtin._decode_tlv(builtin._encode_oid(oid), 0)
+    assert tag == builtin._OBJECT_IDENTIFIER
+    assert builtin._decode_oid(builtin._encode_oid(oid)[start:end]) == oid
+
+
+def test_message_encoding():
+    message = builtin._encode_message(builtin._VERSION_2C, b"public", builtin._GET_BULK_REQUEST,
+                                      2**31 - 1, 0, 10, [(1, 3, 6, 1), (1, 3, 6, 2)])
+    assert builtin._decode_message(message) == (
+        builtin._VERSION_2C,
+        b"public",
+        builtin._GET_BULK_REQUEST,
+        2**31 - 1,
+        0,
+        10,
+        [((1, 3, 6, 1), builtin._NULL, b""), ((1, 3, 6, 2), builtin._NULL, b"")],
+    )
+
+    with pytest.raises(ValueError):
+        builtin._decode_message(message[:-1])
+    with pytest.raises(ValueError):
+        builtin._decode_response(message)
@@ -32,6 +32,7 @@ def test_snmp_port_spec(port, expected):
         character_encoding=None,
         is_usewalk_host=False,
         is_inline_snmp_host=False,
+        is_builtin_snmp_host=False,
         record_stats=False,
     )
     assert ClassicSNMPBackend()._snmp_port_spec(snmp_config) == expected
@@ -57,6 +58,7 @@ def test_snmp_proto_spec(monkeypatch, is_ipv6, expected):
         character_encoding=None,
         is_usewalk_host=False,
         is_inline_snmp_host=False,
+        is_builtin_snmp_host=False,
         record_stats=False,
     )
     assert ClassicSNMPBackend()._snmp_proto_spec(snmp_config) == expected
@@ -88,6 +90,7 @@ SNMPSettings = collections.namedtuple("SNMPSettings", [
             character_encoding=None,
             is_usewalk_host=False,
             is_inline_snmp_host=False,
+            is_builtin_snmp_host=False,
             record_stats=False,
         ),
         context_name=None,
@@ -114,6 +117,7 @@ SNMPSettings = collections.namedtuple("SNMPSettings", [
             character_encoding=None,
             is_usewalk_host=False,
             is_inline_snmp_host=False,
+            is_builtin_snmp_host=False,
             record_stats=False,
         ),
         context_name="blabla",
@@ -140,6 +144,7 @@ SNMPSettings = collections.namedtuple("SNMPSettings", [
             character_encoding=None,
             is_usewalk_host=False,
             is_inline_snmp_host=False,
+            is_builtin_snmp_host=False,
             record_stats=False,
         ),
         context_name="blabla",
@@ -166,6 +171,7 @@ SNMPSettings = collections.namedtuple("SNMPSettings", [
             character_encoding=None,
             is_usewalk_host=False,
             is_inline_snmp_host=False,
+            is_builtin_snmp_host=False,
             record_stats=False,
         ),
         context_name=None,
@@ -192,6 +198,7 @@ SNMPSettings = collections.namedtuple("SNMPSettings", [
             character_encoding=None,
             is_usewalk_host=False,
             is_inline_snmp_host=False,
+            is_builtin_snmp_host=False,
             record_stats=False,
         ),
         context_name=None,
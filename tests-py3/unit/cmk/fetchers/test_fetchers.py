@@ -6,6 +6,9 @@
 
 import json
 import socket
+import socketserver
+import threading
+import time
 from collections import namedtuple
 
 import pytest  # type: ignore[import]
@@ -120,3 +123,79 @@ class TestTCPDataFetcher:
 
         with pytest.raises(MKFetcherError):
             fetcher._decrypt(output)
+
+
+class _AgentHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        server = self.server
+        with server.lock:  # type: ignore[attr-defined]
+            server.connected += 1  # type: ignore[attr-defined]
+            server.max_connected = max(  # type: ignore[attr-defined]
+                server.max_connected, server.connected)  # type: ignore[attr-defined]
+        try:
+            time.sleep(server.delay)  # type: ignore[attr-defined]
+            self.request.sendall(server.output)  # type: ignore[attr-defined]
+        finally:
+            with server.lock:  # type: ignore[attr-defined]
+                server.connected -= 1  # type: ignore[attr-defined]
+
+
+@pytest.fixture(name="agent")
+def fixture_agent():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _AgentHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()  # type: ignore[attr-defined]
+    server.connected = server.max_connected = 0  # type: ignore[attr-defined]
+    server.delay = 0.0  # type: ignore[attr-defined]
+    server.output = b"<<<check_mk>>>\nVersion: 1.7.0\n" * 10000  # type: ignore[attr-defined]
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05})
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def _unused_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestFetchConcurrently:
+    @staticmethod
+    def _fetcher(port, timeout=1.0):
+        return TCPDataFetcher(socket.AF_INET, ("127.0.0.1", port), timeout,
+                              {"use_regular": "allow"})
+
+    def test_fetch_many_agents(self, agent):
+        fetchers = {"host%d" % n: self._fetcher(agent.server_address[1]) for n in range(20)}
+        results = fetch_concurrently(fetchers, 5, 10.0)
+        assert results == {hostname: agent.output for hostname in fetchers}
+        assert 1 <= agent.max_connected <= 5
+
+    def test_same_data_as_blocking_fetch(self, agent):
+        with self._fetcher(agent.server_address[1]) as fetcher:
+            data = fetcher.data()
+        fetchers = {"host": self._fetcher(agent.server_address[1])}
+        assert fetch_concurrently(fetchers, 1, None) == {"host": data}
+
+    def test_errors_are_returned_per_agent(self, agent):
+        agent.delay = 0.5
+        results = fetch_concurrently(
+            {
+                "ok": self._fetcher(agent.server_address[1]),
+                "down": self._fetcher(_unused_port()),
+            }, 2, 5.0)
+        assert results["ok"] == agent.output
+        assert isinstance(results["down"], MKFetcherError)
+        assert str(results["down"]) == "Not connected"
+
+    def test_timeout_per_agent(self, agent):
+        agent.delay = 2.0
+        results = fetch_concurrently({"slow": self._fetcher(agent.server_address[1])}, 1, 0.2)
+        assert isinstance(results["slow"], MKFetcherError)
+        assert "Timeout" in str(results["slow"])
+
+    def test_no_fetchers(self):
+        assert fetch_concurrently({}, 10, 1.0) == {}
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+
+import os
+
+import pytest  # type: ignore[import]
+
+import cmk.utils.paths
+from cmk.utils.exceptions import MKSNMPError
+from cmk.utils.type_defs import SNMPHostConfig
+
+from cmk.fetchers.snmp_backend import StoredWalkSNMPBackend, cleanup_stored_walk_cache
+from cmk.fetchers.snmp_backend.stored_walk import StoredWalk
+
+WALK = """.1.3.6.1.2.1.1.1.0 Linux zeus 4.8.6.5-smp
+.1.3.6.1.2.1.1.2.0 .1.3.6.1.4.1.8072.3.2.10
+.1.3.6.1.2.1.1.10.0 after 9 in OID order
+.1.3.6.1.2.1.1.9.1.2.1 .1.3.6.1.6.3.10.3.1.1
+.1.3.6.1.2.1.1.9.1.2.2 .1.3.6.1.6.3.11.3.1.1
+.1.3.6.1.2.1.2.2.1.6.1 ""
+.1.3.6.1.2.1.2.2.1.6.2 "00 12 79 62 F9 40 "
+.1.3.6.1.2.1.2.2.1.7.1 "C:\\\\"
+.1.3.6.1.2.1.2.2.1.8.1
+"""
+
+
+@pytest.fixture(name="snmp_config")
+def fixture_snmp_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(cmk.utils.paths, "snmpwalks_dir", str(tmp_path))
+    with (tmp_path / "testhost").open("w") as f:
+        f.write(WALK)
+
+    cleanup_stored_walk_cache()
+    yield SNMPHostConfig(
+        is_ipv6_primary=False,
+        hostname="testhost",
+        ipaddress="127.0.0.1",
+        credentials="public",
+        port=161,
+        is_bulkwalk_host=False,
+        is_snmpv2or3_without_bulkwalk_host=False,
+        bulk_walk_size_of=10,
+        timing={},
+        oid_range_limits=[],
+        snmpv3_contexts=[],
+        character_encoding=None,
+        is_usewalk_host=True,
+        is_inline_snmp_host=False,
+        is_builtin_snmp_host=False,
+        record_stats=False,
+    )
+    cleanup_stored_walk_cache()
+
+
+@pytest.mark.parametrize("oid,expected", [
+    (".1.3.6.1.2.1.1", [
+        (".1.3.6.1.2.1.1.1.0", b"Linux zeus 4.8.6.5-smp"),
+        (".1.3.6.1.2.1.1.2.0", b".1.3.6.1.4.1.8072.3.2.10"),
+        (".1.3.6.1.2.1.1.9.1.2.1", b".1.3.6.1.6.3.10.3.1.1"),
+        (".1.3.6.1.2.1.1.9.1.2.2", b".1.3.6.1.6.3.11.3.1.1"),
+        (".1.3.6.1.2.1.1.10.0", b"after 9 in OID order"),
+    ]),
+    (".1.3.6.1.2.1.1.9", [
+        (".1.3.6.1.2.1.1.9.1.2.1", b".1.3.6.1.6.3.10.3.1.1"),
+        (".1.3.6.1.2.1.1.9.1.2.2", b".1.3.6.1.6.3.11.3.1.1"),
+    ]),
+    (".1.3.6.1.2.1.1.1.0", [
+        (".1.3.6.1.2.1.1.1.0", b"Linux zeus 4.8.6.5-smp"),
+    ]),
+    (".1.3.6.1.2.1.2.2.1", [
+        (".1.3.6.1.2.1.2.2.1.6.1", b""),
+        (".1.3.6.1.2.1.2.2.1.6.2", b"\x00\x12yb\xf9@"),
+        (".1.3.6.1.2.1.2.2.1.7.1", b"C:\\"),
+        (".1.3.6.1.2.1.2.2.1.8.1", b""),
+    ]),
+    (".1.3.6.1.2.1.1.9.1.*", [
+        (".1.3.6.1.2.1.1.9.1.2.1", b".1.3.6.1.6.3.10.3.1.1"),
+    ]),
+    (".1.3.6.1.2.1.1.1", [
+        (".1.3.6.1.2.1.1.1.0", b"Linux zeus 4.8.6.5-smp"),
+    ]),
+    (".1.3.6.1.2.1.1.1.0.1", []),
+    (".1.3.6.1.2.1.3", []),
+    (".1.3.7", []),
+])
+def test_walk(snmp_config, oid, expected):
+    assert StoredWalkSNMPBackend().walk(snmp_config, oid) == expected
+
+
+@pytest.mark.parametrize("oid,expected", [
+    (".1.3.6.1.2.1.1.1.0", b"Linux zeus 4.8.6.5-smp"),
+    (".1.3.6.1.2.1.1.9.1.*", b".1.3.6.1.6.3.10.3.1.1"),
+    (".1.3.6.1.2.1.1.1", None),
+    (".1.3.6.1.2.1.1.1.0.1", None),
+])
+def test_get(snmp_config, oid, expected):
+    assert StoredWalkSNMPBackend().get(snmp_config, oid) == expected
+
+
+def test_missing_walk(snmp_config):
+    with pytest.raises(MKSNMPError, match="No snmpwalk file"):
+        StoredWalkSNMPBackend().get(snmp_config._replace(hostname="unknown"), ".1.3.6")
+
+
+def test_index_is_reused_and_rebuilt(snmp_config):
+    walk_path = os.path.join(cmk.utils.paths.snmpwalks_dir, "testhost")
+    stored_walk = StoredWalk(walk_path)
+    assert os.path.exists(stored_walk.index_path)
+    assert stored_walk.get(".1.3.6.1.2.1.1.1.0") == b"Linux zeus 4.8.6.5-smp"
+
+    index_mtime = os.stat(stored_walk.index_path).st_mtime_ns
+    assert StoredWalk(walk_path).get(".1.3.6.1.2.1.1.1.0") == b"Linux zeus 4.8.6.5-smp"
+    assert os.stat(stored_walk.index_path).st_mtime_ns == index_mtime
+
+    with open(walk_path, "w") as f:
+        f.write(".1.3.6.1.2.1.1.1.0 Changed walk\n")
+    assert StoredWalk(walk_path).get(".1.3.6.1.2.1.1.1.0") == b"Changed walk"
+    # The instance created before still uses the former index
+    assert stored_walk.get(".1.3.6.1.2.1.1.1.0") == b"Linux zeus 4.8.6.5-smp"
+
+
+def test_agent_simulator_values_are_processed_on_access(snmp_config, monkeypatch):
+    with open(os.path.join(cmk.utils.paths.snmpwalks_dir, "testhost"), "w") as f:
+        f.write(".1.3.6.1.2.1.1.3.0 %{uptime()}\n")
+
+    uptimes = iter([10.0, 20.0])
+    monkeypatch.setattr("cmk.utils.agent_simulator.our_uptime", lambda: next(uptimes))
+    backend = StoredWalkSNMPBackend()
+    assert backend.get(snmp_config, ".1.3.6.1.2.1.1.3.0") == b"10"
+    assert backend.get(snmp_config, ".1.3.6.1.2.1.1.3.0") == b"20"
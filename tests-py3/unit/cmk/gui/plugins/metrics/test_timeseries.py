@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+
+import pytest  # type: ignore[import]
+
+from cmk.utils.prediction import TimeSeries
+from cmk.gui.exceptions import MKGeneralException
+import cmk.gui.plugins.metrics.timeseries as ts
+
+RRD_DATA = {
+    ("heute", "host", "svc", "a", "max", 1): TimeSeries([0, 300, 60, 1.0, None, 3.0, None, 0.0]),
+    ("heute", "host", "svc", "b", "max", 1): TimeSeries([0, 300, 60, 2.0, 5.0, None, None, 0.0]),
+    "__range": (0, 300, 60),
+}
+A = ("rrd", "heute", "host", "svc", "a", "max", 1)
+B = ("rrd", "heute", "host", "svc", "b", "max", 1)
+
+
+@pytest.mark.parametrize("operator_id, result", [
+    ("+", [3.0, 5.0, 3.0, None, 0.0]),
+    ("*", [2.0, None, None, None, 0.0]),
+    ("-", [-1.0, None, None, None, 0.0]),
+    ("/", [0.5, None, None, None, None]),
+    ("MAX", [2.0, 5.0, 3.0, None, 0.0]),
+    ("MIN", [1.0, 5.0, 3.0, None, 0.0]),
+    ("AVERAGE", [1.5, 5.0, 3.0, None, 0.0]),
+    ("MERGE", [1.0, 5.0, 3.0, None, 0.0]),
+])
+def test_evaluate_time_series_operator(operator_id, result):
+    assert ts.evaluate_time_series_expression(("operator", operator_id, [A, B]), RRD_DATA) == result
+
+
+def test_evaluate_time_series_nested_expression():
+    expression = ("operator", "+", [
+        ("operator", "*", [A, ("constant", 10)]),
+        ("rrd", "heute", "host", "svc", "unknown", "max", 1),
+        ("constant", 1),
+    ])
+    assert ts.evaluate_time_series_expression(expression, RRD_DATA) == [11.0, 1.0, 31.0, 1.0, 1.0]
+
+
+def test_evaluate_time_series_rrd_and_constant():
+    assert ts.evaluate_time_series_expression(A, RRD_DATA) is RRD_DATA[A[1:]]
+    assert ts.evaluate_time_series_expression(("constant", 2), RRD_DATA) == [2.0] * 5
+
+
+@pytest.mark.parametrize("percentile, result", [
+    (0, 0.0),
+    (50, 2.0),
+    (100, 5.0),
+])
+def test_evaluate_time_series_percentile(percentile, result):
+    expression = ("transformation", ("percentile", percentile), [("operator", "MERGE", [A, B])])
+    assert ts.evaluate_time_series_expression(expression, RRD_DATA) == [result] * 5
+
+
+def test_evaluate_time_series_percentile_without_values():
+    unknown = ("rrd", "heute", "host", "svc", "unknown", "max", 1)
+    expression = ("transformation", ("percentile", 50), [unknown])
+    assert ts.evaluate_time_series_expression(expression, RRD_DATA) == [None] * 5
+
+
+def test_evaluate_time_series_nested_forecast():
+    expression = ("operator", "+", [("transformation", ("forecast", {}), [A]), B])
+    with pytest.raises(MKGeneralException, match="Forecasts can not be used as operands"):
+        ts.evaluate_time_series_expression(expression, RRD_DATA)
+
+
+def test_time_series_math_undefined_operator():
+    with pytest.raises(MKGeneralException, match="Undefined operator"):
+        ts.time_series_math("POW", [[1.0], [2.0]])
+
+
+def test_time_series_values_conversion():
+    assert ts.time_series_values(ts.time_series_array([1, None, 2.5])) == [1.0, None, 2.5]
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+
+import copy
+import random
+
+import pytest  # type: ignore[import]
+
+import cmk.gui.availability as availability
+
+
+# The span by span computation which was used before the columnar one
+def _reference_availability_table(what, av_rawdata, avoptions):
+    availability_table = []
+    os_aggrs, os_states = availability.get_outage_statistic_options(avoptions)
+    need_statistics = os_aggrs and os_states
+    grouping = avoptions["grouping"]
+
+    for site_host, site_host_entry in av_rawdata.items():
+        for service, service_entry in site_host_entry.items():
+            if grouping == "host":
+                group_ids = [site_host]
+            elif grouping in ["host_groups", "service_groups"]:
+                group_ids = set()
+            else:
+                group_ids = None
+
+            timeline_rows = []
+            total_duration = 0
+            considered_duration = 0
+            for span in service_entry:
+                if grouping in ["host_groups", "service_groups"] and what != "bi":
+                    group_ids.update(span[grouping])
+
+                display_name = span.get("service_display_name", service)
+                state = span["state"]
+                host_alias = span.get("host_alias", site_host[1])
+                consider = True
+
+                if avoptions["service_period"] != "ignore" and (
+                    (span["in_service_period"] and avoptions["service_period"] != "honor") or
+                    (not span["in_service_period"] and avoptions["service_period"] == "honor")):
+                    s = "outof_service_period"
+                    consider = False
+                elif state == -1:
+                    s = "unmonitored"
+                    if not avoptions["consider"]["unmonitored"]:
+                        consider = False
+                elif state is None:
+                    consider = False
+                elif span["in_notification_period"] == 0 and avoptions[
+                        "notification_period"] == "exclude":
+                    consider = False
+                elif span["in_notification_period"] == 0 and avoptions[
+                        "notification_period"] == "honor":
+                    s = "outof_notification_period"
+                elif (span["in_downtime"] or span["in_host_downtime"]
+                     ) and not (avoptions["downtimes"]["exclude_ok"] and
+                                state == 0) and not avoptions["downtimes"]["include"] == "ignore":
+                    if avoptions["downtimes"]["include"] == "exclude":
+                        consider = False
+                    else:
+                        s = "in_downtime"
+                elif what != "host" and span["host_down"] and avoptions["consider"]["host_down"]:
+                    s = avoptions["state_grouping"].get("host_down", "host_down")
+                elif span["is_flapping"] and avoptions["consider"]["flapping"]:
+                    s = "flapping"
+                else:
+                    if what in ["service", "bi"]:
+                        s = {0: "ok", 1: "warn", 2: "crit", 3: "unknown"}.get(state, "unmonitored")
+                    else:
+                        s = {0: "up", 1: "down", 2: "unreach"}.get(state, "unmonitored")
+                    if s in avoptions["state_grouping"]:
+                        s = avoptions["state_grouping"][s]
+                    elif s in avoptions["host_state_grouping"]:
+                        s = avoptions["host_state_grouping"][s]
+
+                total_duration += span["duration"]
+                if consider:
+                    timeline_rows.append((span, s))
+                    considered_duration += span["duration"]
+
+            if not avoptions["dont_merge"]:
+                availability.merge_timeline(timeline_rows)
+
+            if avoptions["short_intervals"]:
+                availability.melt_short_intervals(timeline_rows, avoptions["short_intervals"],
+                                                  avoptions["dont_merge"])
+
+            states = {}
+            statistics = {}
+            for span, s in timeline_rows:
+                states.setdefault(s, 0)
+                duration = span["duration"]
+                states[s] += duration
+                if need_statistics:
+                    entry = statistics.get(s)
+                    if entry:
+                        statistics[s] = (entry[0] + 1, min(entry[1],
+                                                           duration), max(entry[2], duration))
+                    else:
+                        statistics[s] = (1, duration, duration)
+
+            availability_table.append({
+                "site": site_host[0],
+                "host": site_host[1],
+                "alias": host_alias,
+                "service": service,
+                "display_name": display_name,
+                "states": states,
+                "considered_duration": considered_duration,
+                "total_duration": total_duration,
+                "statistics": statistics,
+                "groups": group_ids,
+                "timeline": timeline_rows,
+            })
+
+    return availability_table
+
+
+def _random_rawdata(rand, what, num_objects):
+    av_rawdata = {}
+    for index in range(num_objects):
+        host_name = "host%d" % (index // 3)
+        service = "" if what == "host" else "service%d" % index
+        spans = []
+        # Few states and short durations to get a lot of mergeable and meltable spans
+        states = rand.sample([None, -1, 0, 1, 2, 3], rand.randint(1, 3))
+        from_time = 1590530400
+        for _n in range(rand.randint(1, 40)):
+            duration = rand.choice([1, 5, 10, 60, 300, 3600])
+            spans.append({
+                "site": "heute",
+                "host_name": host_name,
+                "host_alias": "Alias of %s" % host_name,
+                "service_description": service,
+                "service_display_name": "Display %s" % service,
+                "from": from_time,
+                "until": from_time + duration,
+                "duration": duration,
+                "state": rand.choice(states),
+                "host_down": int(rand.random() < 0.1),
+                "in_downtime": int(rand.random() < 0.1),
+                "in_host_downtime": int(rand.random() < 0.05),
+                "in_notification_period": int(rand.random() < 0.9),
+                "in_service_period": int(rand.random() < 0.9),
+                "is_flapping": int(rand.random() < 0.05),
+                "host_groups": rand.sample(["linux", "windows", "prod"], rand.randint(0, 2)),
+                "service_groups": rand.sample(["db", "web"], rand.randint(0, 1)),
+            })
+            # Leave some gaps in the history
+            from_time += duration + rand.choice([0, 0, 0, 0, 30])
+        av_rawdata.setdefault(("heute", host_name), {})[service] = spans
+    return av_rawdata
+
+
+def _random_avoptions(rand):
+    avoptions = availability.get_default_avoptions()
+    avoptions.update({
+        "service_period": rand.choice(["honor", "ignore", "exclude"]),
+        "notification_period": rand.choice(["honor", "ignore", "exclude"]),
+        "grouping": rand.choice([None, "host", "host_groups", "service_groups"]),
+        "short_intervals": rand.choice([0, 0, 5, 60, 300]),
+        "dont_merge": rand.random() < 0.3,
+        "outage_statistics": rand.choice([([], []), (["min", "max", "avg"], ["crit", "warn"])]),
+        "downtimes": {
+            "include": rand.choice(["honor", "ignore", "exclude"]),
+            "exclude_ok": rand.random() < 0.5,
+        },
+        "consider": {
+            "flapping": rand.random() < 0.5,
+            "host_down": rand.random() < 0.5,
+            "unmonitored": rand.random() < 0.5,
+        },
+    })
+    if rand.random() < 0.3:
+        avoptions["state_grouping"] = {"warn": "crit", "unknown": "ok", "host_down": "ok"}
+        avoptions["host_state_grouping"] = {"unreach": "down"}
+    return avoptions
+
+
+@pytest.mark.parametrize("seed", range(50))
+@pytest.mark.parametrize("what", ["host", "service", "bi"])
+def test_compute_availability_table_equals_reference(what, seed):
+    rand = random.Random("%s-%d" % (what, seed))
+    av_rawdata = _random_rawdata(rand, what, rand.randint(1, 20))
+    avoptions = _random_avoptions(rand)
+
+    expected_rawdata = copy.deepcopy(av_rawdata)
+    expected = _reference_availability_table(what, expected_rawdata, avoptions)
+    availability_table = availability._compute_availability_table(what, av_rawdata, avoptions)
+
+    assert availability_table == expected
+    for entry, expected_entry in zip(availability_table, expected):
+        # The order of the states is the order of the table columns
+        assert list(entry["states"]) == list(expected_entry["states"])
+        assert list(entry["statistics"]) == list(expected_entry["statistics"])
+    # Merging timeline rows changes the spans of the raw data
+    assert av_rawdata == expected_rawdata
+
+
+@pytest.mark.parametrize("short_intervals, dont_merge, expected_timeline, expected_states", [
+    (0, False, [(0, 10, "ok"), (10, 11, "crit"), (11, 12, "ok"), (12, 13, "crit"),
+                (13, 24, "ok")], {
+                    "ok": 22,
+                    "crit": 2
+                }),
+    (5, True, [(0, 10, "ok"), (10, 11, "ok"), (11, 12, "ok"), (12, 13, "ok"), (13, 14, "ok"),
+               (14, 24, "ok")], {
+                   "ok": 24
+               }),
+    (5, False, [(0, 24, "ok")], {
+        "ok": 24
+    }),
+])
+def test_compute_availability_table_melts_short_intervals(short_intervals, dont_merge,
+                                                          expected_timeline, expected_states):
+    spans = []
+    for from_time, until, state in [(0, 10, 0), (10, 11, 2), (11, 12, 0), (12, 13, 2), (13, 14, 0),
+                                    (14, 24, 0)]:
+        spans.append({
+            "from": from_time,
+            "until": until,
+            "duration": until - from_time,
+            "state": state,
+            "host_down": 0,
+            "in_downtime": 0,
+            "in_host_downtime": 0,
+            "in_notification_period": 1,
+            "in_service_period": 1,
+            "is_flapping": 0,
+        })
+    avoptions = availability.get_default_avoptions()
+    avoptions.update({"short_intervals": short_intervals, "dont_merge": dont_merge})
+
+    av_rawdata = {("heute", "heute"): {"CPU load": spans}}
+    availability_table = availability._compute_availability_table("service", av_rawdata, avoptions)
+
+    assert [(span["from"], span["until"], state_name)
+            for span, state_name in availability_table[0]["timeline"]] == expected_timeline
+    assert availability_table[0]["states"] == expected_states
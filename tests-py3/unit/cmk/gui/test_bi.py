@@ -4,9 +4,17 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
+import marshal
+from typing import Any, Dict
+
 import pytest  # type: ignore[import]
+from werkzeug.test import create_environ
+
+from testlib.utils import DummyApplication
 
 import cmk.gui.bi as bi
+import cmk.gui.config as config
+from cmk.gui.globals import AppContext
 
 
 # NOTE: The host_aggregations variable only contains necessary elements.
@@ -42,3 +50,271 @@ def test_get_aggregation_group_trees(monkeypatch, host_aggregations, expected):
     monkeypatch.setattr(bi.config, "aggregations", [])
     monkeypatch.setattr(bi.config, "host_aggregations", host_aggregations)
     assert bi.get_aggregation_group_trees() == expected
+
+
+def _host_fingerprints(hosts):
+    host_data = {("site", host_name): (tags, services, [], [], host_name)
+                 for host_name, (tags, services) in hosts.items()}
+    return bi.get_host_fingerprints(host_data)
+
+
+@pytest.mark.parametrize(
+    "new_hosts, dependencies, affected",
+    [
+        # Unchanged hosts affect nothing
+        ({
+            "a": (["prod"], ["CPU"]),
+            "b": (["test"], ["CPU"]),
+        }, (True, {("site", "a")}, {"a"}), False),
+        # A changed service only affects the users of the host
+        ({
+            "a": (["prod"], ["CPU", "Memory"]),
+            "b": (["test"], ["CPU"]),
+        }, (True, {("site", "b")}, {"b"}), False),
+        ({
+            "a": (["prod"], ["CPU", "Memory"]),
+            "b": (["test"], ["CPU"]),
+        }, (False, {("site", "a")}, set()), True),
+        ({
+            "a": (["prod"], ["CPU", "Memory"]),
+            "b": (["test"], ["CPU"]),
+        }, (False, set(), {"a"}), True),
+        # Changed tags and new hosts may change the matches of host scans
+        ({
+            "a": (["test"], ["CPU"]),
+            "b": (["test"], ["CPU"]),
+        }, (True, {("site", "b")}, {"b"}), True),
+        ({
+            "a": (["prod"], ["CPU"]),
+            "b": (["test"], ["CPU"]),
+            "c": (["test"], ["CPU"]),
+        }, (True, set(), set()), True),
+        ({
+            "a": (["prod"], ["CPU"]),
+            "b": (["test"], ["CPU"]),
+            "c": (["test"], ["CPU"]),
+        }, (False, {("site", "a")}, {"a"}), False),
+    ],
+)
+def test_bi_host_changes(new_hosts, dependencies, affected):
+    host_changes = bi.BIHostChanges(
+        _host_fingerprints({
+            "a": (["prod"], ["CPU"]),
+            "b": (["test"], ["CPU"]),
+        }), _host_fingerprints(new_hosts))
+    assert host_changes.affects(dependencies) is affected
+
+
+def test_bi_dependency_tracker_reuses_unaffected_rules():
+    host_changes = bi.BIHostChanges(_host_fingerprints({"a": ([], ["CPU"])}),
+                                    _host_fingerprints({"a": ([], ["CPU", "Memory"])}))
+    previous_entry, compiled_entry = {"title": "previous"}, {"title": "compiled"}
+    tracker = bi.BIDependencyTracker(
+        host_changes, {
+            "rule/['a']": (["hash-a"], [previous_entry], (False, {("site", "a")}, {"a"})),
+            "rule/['b']": (["hash-b"], [previous_entry], (False, {("site", "b")}, {"b"})),
+        })
+
+    def _compile():
+        tracker.track_scan()
+        tracker.track_host(("site", "a"))
+        return [compiled_entry]
+
+    assert tracker.compile_root_rule("rule/['a']", _compile) == [compiled_entry]
+    assert tracker.compile_root_rule("rule/['b']", _compile) == [previous_entry]
+    assert tracker.num_reused_rules == 1
+    assert tracker.reused_hashes == {id(previous_entry): "hash-b"}
+    assert tracker.compiled_rules["rule/['a']"] == ([compiled_entry], (True, {("site", "a")},
+                                                                       set()))
+    assert tracker.job_dependencies() == (True, {("site", "a"), ("site", "b")}, {"b"})
+
+
+def _site_data(hosts):
+    site_data = {"services": {}, "services_by_hostname": {}}  # type: Dict[str, Dict]
+    for host_name, services in hosts.items():
+        entry = (["prod", "lan"], services, [], [], "Alias %s" % host_name)
+        site_data["services"][("site", host_name)] = entry
+        site_data["services_by_hostname"][host_name] = [("site", entry)]
+    return site_data
+
+
+def _compile(site_data, previous_compilation=None):
+    compilation = {
+        "aggr_ref": {},
+        "compile_state": {},
+        "host_fingerprints": bi.get_host_fingerprints(site_data["services"]),
+    }  # type: Dict[str, Any]
+    host_changes = None
+    if previous_compilation is not None:
+        host_changes = bi.BIHostChanges(previous_compilation["host_fingerprints"],
+                                        compilation["host_fingerprints"])
+
+    worker = bi.JobWorker(site_data, [])
+    compiled_job_ids = []
+    for job_id in bi.get_aggr_ids([bi.AGGR_HOST, bi.AGGR_MULTI]):
+        job = {"id": job_id, "info": {"compiled": False}}
+        new_data = None
+        if previous_compilation is not None and host_changes is not None:
+            new_data = bi.reuse_compiled_job(job, previous_compilation, host_changes)
+        if new_data is None:
+            new_data = worker.compile_job(job["id"], job["info"])
+            compiled_job_ids.append(job_id)
+        compilation["aggr_ref"].update(new_data["aggr_ref"])
+        compilation["compile_state"][job_id] = new_data["compile_state"]
+
+    # Like loading the cachefile of the BICacheManager
+    return marshal.loads(marshal.dumps(compilation)), compiled_job_ids
+
+
+def test_bi_incremental_compilation_equals_full_compilation(monkeypatch):
+    monkeypatch.setattr(config, "bi_packs", {})
+    monkeypatch.setattr(config, "host_aggregations", [])
+    monkeypatch.setattr(config, "aggregations", [
+        ({}, ["Hosts"], config.FOREACH_HOST, [], config.ALL_HOSTS, "host", ["$1$"]),
+        ({}, ["Web"], "web", []),
+    ])
+    monkeypatch.setattr(
+        config, "aggregation_rules", {
+            "host": {
+                "title": "Host $HOST$",
+                "params": ["HOST"],
+                "aggregation": "worst",
+                "nodes": [
+                    ("$HOST$", config.HOST_STATE),
+                    ("general", ["$HOST$"]),
+                    ("$HOST$", config.REMAINING),
+                ],
+            },
+            "general": {
+                "title": "General state",
+                "params": ["HOST"],
+                "aggregation": "worst",
+                "nodes": [("$HOST$", "CPU load|Memory")],
+            },
+            "web": {
+                "title": "Web services",
+                "params": [],
+                "aggregation": "best",
+                "nodes": [("web.*", "HTTP")],
+            },
+        })
+
+    hosts = {
+        "db1": ["CPU load", "Memory", "Filesystem /"],
+        "web1": ["CPU load", "HTTP"],
+        "web2": ["Memory", "HTTP"],
+    }
+    compilation, _compiled_job_ids = _compile(_site_data(hosts))
+
+    changes = [
+        # A new service only affects the aggregations using the host
+        (dict(hosts, db1=["CPU load", "Memory", "Filesystem /", "Filesystem /srv"]), [("Hosts",)]),
+        (dict(hosts, web2=["Memory", "HTTP", "Uptime"]), [("Hosts",), ("Web",)]),
+        # A new host may be matched by the regex of the web aggregation
+        (dict(hosts, web3=["HTTP"]), [("Hosts",), ("Web",)]),
+        (dict(hosts, db2=["Memory"]), [("Hosts",), ("Web",)]),
+        # Removed hosts and services
+        ({
+            "db1": ["CPU load"],
+            "web2": ["Memory", "HTTP"],
+        }, [("Hosts",), ("Web",)]),
+    ]
+    for changed_hosts, compiled_groups in changes:
+        site_data = _site_data(changed_hosts)
+        incremental, compiled_job_ids = _compile(site_data, compilation)
+        expected, _compiled_job_ids = _compile(site_data)
+        assert incremental["aggr_ref"] == expected["aggr_ref"]
+        assert incremental["compile_state"] == expected["compile_state"]
+        assert [job_id[2] for job_id in compiled_job_ids] == compiled_groups
+
+
+class _FakeLive(object):  # pylint: disable=useless-object-inheritance
+    def __init__(self, hosts):
+        self._hosts = hosts
+        self._only_sites = None
+        self.queries = []
+
+    def set_auth_domain(self, domain):
+        pass
+
+    def set_prepend_site(self, prepend_site):
+        pass
+
+    def set_only_sites(self, only_sites):
+        self._only_sites = only_sites
+
+    def query(self, query):
+        self.queries.append((sorted(self._only_sites), query.count("Filter: ")))
+        host_names = {
+            line[len("Filter: name = "):]
+            for line in query.splitlines()
+            if line.startswith("Filter: ")
+        }
+        return [[site, host_name, 0, 0, "OK", 0, 0, 1, []]
+                for site, host_name in self._hosts
+                if site in self._only_sites and (not host_names or host_name in host_names)]
+
+
+@pytest.fixture(name="fake_live")
+def fixture_fake_live(monkeypatch):
+    hosts = [("site1", "host%d" % i) for i in range(200)] + [("site2", "host0"), ("site2", "other")]
+    fake_live = _FakeLive(hosts)
+    monkeypatch.setattr(bi.sites, "live", lambda: fake_live)
+    monkeypatch.setattr(bi.sites, "states", lambda: {
+        "site1": {
+            "num_hosts": 200
+        },
+        "site2": {
+            "num_hosts": 2000
+        },
+    })
+    return fake_live
+
+
+def test_bi_status_cache_bulk_query(fake_live):
+    status_cache = bi.BIStatusCache()
+    required_hosts = {("site1", "host%d" % i) for i in range(40)} | {("site2", "host0")}
+
+    status_info = status_cache.get_status_info(required_hosts)
+    assert set(status_info) == required_hosts
+    assert fake_live.queries == [(["site1"], 0), (["site2"], 1)]
+
+    # Everything of site1 is known now
+    status_info = status_cache.get_status_info({("site1", "host199"), ("site1", "missing")})
+    assert set(status_info) == {("site1", "host199")}
+    assert len(fake_live.queries) == 2
+
+
+def test_bi_status_cache_bulk_query_relative_to_site_size(fake_live):
+    status_cache = bi.BIStatusCache()
+    required_hosts = {("site1", "host%d" % i) for i in range(39)}
+
+    status_info = status_cache.get_status_info(required_hosts)
+    assert set(status_info) == required_hosts
+    assert fake_live.queries == [(["site1"], 39)]
+
+
+def test_bi_status_cache_filtered_query(fake_live):
+    status_cache = bi.BIStatusCache()
+
+    status_info = status_cache.get_status_info({("site1", "host1"), ("site2", "other")})
+    assert set(status_info) == {("site1", "host1"), ("site2", "other")}
+    assert fake_live.queries == [(["site1", "site2"], 2)]
+
+    status_cache.get_status_info({("site1", "host1")})
+    assert len(fake_live.queries) == 1
+
+    status_info = status_cache.get_status_info({("site1", "host1"), ("site1", "host2")})
+    assert set(status_info) == {("site1", "host1"), ("site1", "host2")}
+    assert fake_live.queries[1:] == [(["site1"], 1)]
+
+
+def test_bi_status_cache_per_request(register_builtin_html, fake_live):
+    bi.get_status_info({("site1", "host1")})
+    bi.get_status_info({("site1", "host1")})
+    assert len(fake_live.queries) == 1
+
+    # The next request fetches the current states
+    with AppContext(DummyApplication(create_environ(), None)):
+        bi.get_status_info({("site1", "host1")})
+    assert len(fake_live.queries) == 2
@@ -4,7 +4,12 @@
 # This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
 # conditions defined in the file COPYING, which is part of this source code package.
 
+import socket
+
 import pytest  # type: ignore[import]
+
+import livestatus
+
 import cmk.gui.sites as sites
 
 
@@ -69,3 +74,39 @@ def test_encode_socket_for_livestatus(site_spec, result):
 ])
 def test_site_config_for_livestatus_tcp_tls(site_spec, result):
     assert sites._site_config_for_livestatus("mysite", site_spec) == result
+
+
+class _User:
+    def __init__(self, site_configs):
+        self._site_configs = site_configs
+
+    def authorized_sites(self):
+        return self._site_configs
+
+    def is_site_disabled(self, site_id):
+        return False
+
+
+def test_connect_timeout_limits_parallel_query(tmp_path):
+    # The site accepts the connection (in the backlog), but never responds
+    hanging_path = tmp_path / "hanging"
+    hanging = socket.socket(socket.AF_UNIX)
+    hanging.bind(str(hanging_path))
+    hanging.listen(5)
+
+    try:
+        enabled_sites, _disabled_sites = sites._get_enabled_and_disabled_sites(
+            _User({
+                "hanging": {
+                    "socket": ("unix", {
+                        "path": str(hanging_path)
+                    }),
+                    "proxy": None,
+                    "timeout": 1,
+                },
+            }))
+        live = livestatus.MultiSiteConnection(enabled_sites)
+        assert live.query("GET hosts\nColumns: name\n") == []
+        assert "Timeout" in str(live.dead_sites()["hanging"]["exception"])
+    finally:
+        hanging.close()
@@ -11,11 +11,14 @@ from pathlib import Path
 
 import pytest  # type: ignore[import]
 
+from livestatus import SiteId
+
 import cmk.utils.paths
 import cmk.utils.version as cmk_version
 import cmk.gui.watolib.activate_changes as activate_changes
 from cmk.gui.watolib.activate_changes import ConfigSyncFileInfo
-from cmk.gui.watolib.config_sync import ReplicationPath
+from cmk.gui.exceptions import MKGeneralException
+from cmk.gui.watolib.config_sync import ReplicationPath, create_delta, get_delta_signature
 
 import testlib
 
@@ -224,6 +227,7 @@ def test_automation_get_config_sync_state():
                              'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'),
         },
         0,
+        ["chunked-upload", "deltas"],
     )
 
 
@@ -299,6 +303,69 @@ def test_get_config_sync_file_infos():
     }
 
 
+def test_get_config_sync_file_infos_hash_cache(monkeypatch):
+    base_dir = Path(cmk.utils.paths.omd_root) / "replication"
+    _create_get_config_sync_file_infos_test_config(base_dir)
+    replication_paths = [
+        ReplicationPath("dir", "d4-multiple-files", "etc/d4", []),
+        ReplicationPath("file", "f2", "bla/blub/f2", []),
+        ReplicationPath("dir", "links", "links", []),
+    ]
+    expected = activate_changes._get_config_sync_file_infos(replication_paths, base_dir)
+
+    # Pretend the test files have been written long ago
+    monkeypatch.setattr(activate_changes.ConfigSyncHashCache, "_racy_mtime_ns", -10**18)
+    cache_path = activate_changes._config_sync_hash_cache_path(SiteId("site1"))
+
+    hash_cache = activate_changes.ConfigSyncHashCache(cache_path)
+    assert activate_changes._get_config_sync_file_infos(replication_paths, base_dir,
+                                                        hash_cache) == expected
+    assert (hash_cache.hits, hash_cache.misses) == (0, 5)
+    assert cache_path.exists()
+
+    hash_cache = activate_changes.ConfigSyncHashCache(cache_path)
+    assert activate_changes._get_config_sync_file_infos(replication_paths, base_dir,
+                                                        hash_cache) == expected
+    assert (hash_cache.hits, hash_cache.misses) == (5, 0)
+
+    # Modified and vanished files
+    with base_dir.joinpath("etc/d4/x1").open("w", encoding="utf-8") as f:
+        f.write(u"Däng1 modified")
+    base_dir.joinpath("etc/d4/x2").unlink()
+    expected = activate_changes._get_config_sync_file_infos(replication_paths, base_dir)
+
+    hash_cache = activate_changes.ConfigSyncHashCache(cache_path)
+    assert activate_changes._get_config_sync_file_infos(replication_paths, base_dir,
+                                                        hash_cache) == expected
+    assert (hash_cache.hits, hash_cache.misses) == (3, 1)
+    assert "etc/d4/x2" not in activate_changes.ConfigSyncHashCache(cache_path)._entries
+
+    activate_changes.remove_site_config_directory(SiteId("site1"))
+    assert not cache_path.exists()
+
+
+def test_config_sync_hash_cache_skips_recently_modified_files(tmp_path):
+    file_path = tmp_path / "file"
+    file_path.write_bytes(b"abc")
+    file_path_str = str(file_path)
+
+    cache_path = tmp_path / "cache"
+    hash_cache = activate_changes.ConfigSyncHashCache(cache_path)
+    file_hash = hash_cache.file_hash("file", file_path_str, file_path.lstat())
+    assert file_hash == activate_changes._create_config_sync_file_hash(file_path_str)
+    hash_cache.save()
+
+    hash_cache = activate_changes.ConfigSyncHashCache(cache_path)
+    assert hash_cache.file_hash("file", file_path_str, file_path.lstat()) == file_hash
+    assert (hash_cache.hits, hash_cache.misses) == (0, 1)
+
+
+def test_config_sync_hash_cache_broken_file(tmp_path):
+    cache_path = tmp_path / "cache"
+    cache_path.write_bytes(b"\x00garbage")
+    assert activate_changes.ConfigSyncHashCache(cache_path)._entries == {}
+
+
 def _create_get_config_sync_file_infos_test_config(base_dir):
     base_dir.joinpath("etc/d1").mkdir(parents=True, exist_ok=True)
 
@@ -558,6 +625,8 @@ def test_automation_receive_config_sync(monkeypatch, tmp_path):
                 "file-to-dir",
             ],
             config_generation=0,
+            sync_deltas=None,
+            deltas={},
         ))
 
     assert not to_delete_path.exists()
@@ -599,3 +668,88 @@ def test_remove_site_config_directory():
 
     assert not site1_dir.exists()
     assert site2_dir.exists()
+
+
+def test_automation_receive_config_sync_chunk():
+    automation = activate_changes.AutomationReceiveConfigSyncChunk()
+    upload_id = "0123456789abcdef0123456789abcdef"
+    assert automation.execute(activate_changes.ReceiveConfigSyncChunkRequest(upload_id, 0, b"abc"))
+    assert automation.execute(activate_changes.ReceiveConfigSyncChunkRequest(upload_id, 3, b"de"))
+    assert activate_changes._config_sync_upload_path(upload_id).read_bytes() == b"abcde"
+
+    with pytest.raises(MKGeneralException, match="offset 3"):
+        automation.execute(activate_changes.ReceiveConfigSyncChunkRequest(upload_id, 3, b"de"))
+
+    with pytest.raises(MKGeneralException, match="Invalid upload ID"):
+        automation.execute(activate_changes.ReceiveConfigSyncChunkRequest("../../x", 0, b""))
+
+
+def test_automation_receive_config_sync_upload_with_deltas(monkeypatch, tmp_path):
+    remote_path = tmp_path.joinpath("remote")
+    monkeypatch.setattr(cmk.utils.paths, "omd_root", remote_path)
+    monkeypatch.setattr(cmk.gui.watolib.activate_changes, "_execute_post_config_sync_actions",
+                        lambda site_id: None)
+
+    lines = [u"all_hosts += ['host%06d']\n" % i for i in range(10000)]
+    remote_path.joinpath("etc").mkdir(parents=True)
+    with remote_path.joinpath("etc/hosts.mk").open("w", encoding="utf-8") as f:
+        f.write(u"".join(lines))
+
+    central_path = tmp_path.joinpath("central")
+    central_path.joinpath("etc").mkdir(parents=True)
+    with central_path.joinpath("etc/hosts.mk").open("w", encoding="utf-8") as f:
+        f.write(u"".join(lines[:5000] + [u"all_hosts += ['new']\n"] + lines[5000:]))
+    with central_path.joinpath("etc/new.mk").open("w", encoding="utf-8") as f:
+        f.write(u"new = 1\n")
+
+    base_hash, signature = get_delta_signature(remote_path.joinpath("etc/hosts.mk"))
+    deltas_path = tmp_path.joinpath("deltas")
+    deltas_path.joinpath("etc").mkdir(parents=True)
+    assert create_delta(central_path.joinpath("etc/hosts.mk"), signature,
+                        deltas_path.joinpath("etc/hosts.mk"))
+
+    sync_archive = activate_changes._config_sync_upload_path("a" * 32)
+    sync_archive.parent.mkdir(parents=True, exist_ok=True)
+    activate_changes._create_sync_archive_file(["etc/new.mk"], central_path, sync_archive)
+    sync_deltas = activate_changes._config_sync_upload_path("b" * 32)
+    activate_changes._create_sync_archive_file(["etc/hosts.mk"], deltas_path, sync_deltas)
+
+    central_info = activate_changes._get_config_sync_file_infos(
+        [ReplicationPath("file", "hosts", "etc/hosts.mk", [])], central_path)["etc/hosts.mk"]
+    automation = activate_changes.AutomationReceiveConfigSync()
+    assert automation.execute(
+        activate_changes.ReceiveConfigSyncRequest(
+            site_id="remote",
+            sync_archive=sync_archive,
+            to_delete=[],
+            config_generation=0,
+            sync_deltas=sync_deltas,
+            deltas={
+                "etc/hosts.mk": (base_hash, central_info.file_hash, central_info.st_mode),
+            },
+        ))
+
+    for name in ["hosts.mk", "new.mk"]:
+        remote_file_path = remote_path.joinpath("etc", name)
+        assert remote_file_path.read_bytes() == central_path.joinpath("etc", name).read_bytes()
+    assert not sync_archive.exists()
+    assert not sync_deltas.exists()
+
+
+def test_get_delta_candidates(monkeypatch):
+    monkeypatch.setattr(activate_changes, "_SYNC_DELTA_MIN_SIZE", 10)
+    remote = {
+        "large": ConfigSyncFileInfo(33200, 20, None, "r1"),
+        "small": ConfigSyncFileInfo(33200, 5, None, "r2"),
+        "large-to-link": ConfigSyncFileInfo(33200, 20, None, "r3"),
+        "link-to-large": ConfigSyncFileInfo(41471, 1, "abc", None),
+    }
+    central = {
+        "large": ConfigSyncFileInfo(33204, 30, None, "c1"),
+        "small": ConfigSyncFileInfo(33200, 6, None, "c2"),
+        "large-to-link": ConfigSyncFileInfo(41471, 20, "abc", None),
+        "link-to-large": ConfigSyncFileInfo(33200, 20, None, "c4"),
+    }
+    assert activate_changes._get_delta_candidates(sorted(remote), central, remote) == {
+        "large": ("r1", "c1", 33204),
+    }
@@ -20,6 +20,7 @@ import cmk.utils.paths
 import cmk.utils.version as cmk_version
 
 import cmk.gui.config as config
+from cmk.gui.exceptions import MKGeneralException
 import cmk.gui.wato.mkeventd
 import cmk.gui.watolib.activate_changes as activate_changes
 import cmk.gui.watolib.config_sync as config_sync
@@ -526,25 +527,34 @@ def test_update_contacts_dict(master, slave, result):
 
 # This test does not perform the full synchronization. It executes the central site parts and mocks
 # the remote site HTTP calls
+@pytest.mark.parametrize("sync_features", [[], activate_changes._SYNC_FEATURES])
 @pytest.mark.usefixtures("register_builtin_html")
-def test_synchronize_site(mocked_responses, monkeypatch, edition_short, tmp_path, mocker):
+def test_synchronize_site(mocked_responses, monkeypatch, edition_short, tmp_path, mocker,
+                          sync_features):
     if edition_short == "cme":
         pytest.skip("Seems faked site environment is not 100% correct")
 
+    sync_state = ({
+        'etc/check_mk/conf.d/wato/hosts.mk':
+            (33204, 15, None, '0fc4df48a03c3e972a86c9d573bc04f6e2a5d91aa368d7f4ce4ec5cd93ee5725'),
+        'etc/check_mk/multisite.d/wato/global.mk':
+            (33204, 6, None, '0e10d5fc5aedd798b68706c0189aeccadccae1fa6cc72324524293769336571c'),
+        'etc/htpasswd':
+            (33204, 0, None, 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855')
+    }, 0)
+    if sync_features:
+        mocked_responses.add(
+            method=responses.POST,
+            url=
+            "http://localhost/unit_remote_1/check_mk/automation.py?command=receive-config-sync-chunk&debug=&secret=watosecret",
+            body="True",
+        )
+
     mocked_responses.add(
         method=responses.POST,
         url=
         "http://localhost/unit_remote_1/check_mk/automation.py?command=get-config-sync-state&debug=&secret=watosecret",
-        body=repr(({
-            'etc/check_mk/conf.d/wato/hosts.mk':
-                (33204, 15, None, '0fc4df48a03c3e972a86c9d573bc04f6e2a5d91aa368d7f4ce4ec5cd93ee5725'
-                ),
-            'etc/check_mk/multisite.d/wato/global.mk':
-                (33204, 6, None, '0e10d5fc5aedd798b68706c0189aeccadccae1fa6cc72324524293769336571c'
-                ),
-            'etc/htpasswd':
-                (33204, 0, None, 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855')
-        }, 0)),
+        body=repr(sync_state + ((sync_features,) if sync_features else ())),
     )
 
     mocked_responses.add(
@@ -625,3 +635,66 @@ def test_synchronize_pre_17_site(monkeypatch, edition_short, tmp_path, mocker):
 
     file_name = kwargs["files"]["snapshot"].name  # type: ignore[attr-defined]
     assert file_name == snapshot_settings.snapshot_path
+
+
+def _write_lines(path, lines):
+    with path.open("w", encoding="utf-8") as f:
+        f.write(u"".join(lines))
+
+
+def test_delta_roundtrip(tmp_path):
+    sync_dir = tmp_path / "sync"
+    sync_dir.mkdir()
+    lines = [u"all_hosts += ['host%06d|lan|prod|/wato/']\n" % i for i in range(20000)]
+    base_path = sync_dir / "base.mk"
+    _write_lines(base_path, lines)
+    base_hash, signature = config_sync.get_delta_signature(base_path)
+
+    lines.insert(100, u"all_hosts += ['new-host|lan|prod|/wato/']\n")
+    del lines[10000:10050]
+    lines.append(u"# no newline at end")
+    file_path = sync_dir / "file.mk"
+    _write_lines(file_path, lines)
+    file_hash = config_sync.get_delta_signature(file_path)[0]
+
+    delta_path = sync_dir / "delta"
+    assert config_sync.create_delta(file_path, signature, delta_path)
+    assert delta_path.stat().st_size < file_path.stat().st_size / 20
+
+    config_sync.apply_delta(base_path, delta_path, base_hash, file_hash, 0o100640)
+    assert base_path.read_bytes() == file_path.read_bytes()
+    assert base_path.stat().st_mode == 0o100640
+    assert sorted(p.name for p in sync_dir.iterdir()) == ["base.mk", "delta", "file.mk"]
+
+
+def test_create_delta_not_worth_it(tmp_path):
+    base_path = tmp_path / "base.mk"
+    _write_lines(base_path, [u"a = %d\n" % i for i in range(10000)])
+    file_path = tmp_path / "file.mk"
+    _write_lines(file_path, [u"b = %d\n" % i for i in range(10000)])
+
+    delta_path = tmp_path / "delta"
+    assert not config_sync.create_delta(file_path,
+                                        config_sync.get_delta_signature(base_path)[1], delta_path)
+    assert not delta_path.exists()
+
+
+def test_apply_delta_to_changed_file(tmp_path):
+    base_path = tmp_path / "base.mk"
+    _write_lines(base_path, [u"a = %d\n" % i for i in range(1000)])
+    base_hash, signature = config_sync.get_delta_signature(base_path)
+
+    file_path = tmp_path / "file.mk"
+    _write_lines(file_path, [u"a = %d\n" % i for i in range(1001)])
+    delta_path = tmp_path / "delta"
+    assert config_sync.create_delta(file_path, signature, delta_path)
+    file_hash = config_sync.get_delta_signature(file_path)[0]
+
+    _write_lines(base_path, [u"x = 1\n"])
+    with pytest.raises(MKGeneralException, match="has changed"):
+        config_sync.apply_delta(base_path, delta_path, base_hash, file_hash, 0o100660)
+
+    changed_hash = config_sync.get_delta_signature(base_path)[0]
+    with pytest.raises(MKGeneralException, match="Invalid delta"):
+        config_sync.apply_delta(base_path, delta_path, changed_hash, file_hash, 0o100660)
+    assert base_path.read_bytes() == b"x = 1\n"
@@ -17,7 +17,7 @@ import cmk.gui.watolib.hosts_and_folders as hosts_and_folders
 import cmk.gui.htmllib as htmllib
 
 from cmk.gui.http import Request
-from cmk.gui.globals import AppContext, RequestContext
+from cmk.gui.globals import AppContext, RequestContext, g
 
 from testlib.utils import DummyApplication
 
@@ -377,3 +377,105 @@ def test_subfolder_creation():
     # Upon instantiation, all the subfolders should be already known.
     folder = hosts_and_folders.Folder.root_folder()
     assert len(folder._subfolders) == 1
+
+
+def _load_folder_tree_from_cache():
+    hosts_and_folders.Folder.invalidate_caches()
+    g.pop("wato_folder_tree_cache", None)
+    return hosts_and_folders.Folder.all_folders()
+
+
+@pytest.fixture(name="cached_folder_tree")
+def fixture_cached_folder_tree(monkeypatch):
+    # The test files are written right before they are read. Cache them nevertheless.
+    monkeypatch.setattr(hosts_and_folders._FolderTreeCache, "_racy_mtime_ns", -10**12)
+
+    root = hosts_and_folders.Folder.root_folder()
+    root.create_subfolder("sub1", "Sub 1", {}).create_hosts([("host1", {
+        "ipaddress": "127.0.0.1"
+    }, None)])
+    root.create_subfolder("sub2", "Sub 2", {})
+
+    folders = _load_folder_tree_from_cache()
+    folders["sub1"].hosts()
+    _load_folder_tree_from_cache()
+
+
+@pytest.fixture(name="loaded_files")
+def fixture_loaded_files(monkeypatch, cached_folder_tree):
+    loaded_files = []
+    root_dir = hosts_and_folders.Folder.root_folder().filesystem_path()
+    load_object_from_file = hosts_and_folders.store.load_object_from_file
+
+    def _load_object_from_file(path, *args, **kwargs):
+        if str(path).startswith(root_dir):
+            loaded_files.append(os.path.relpath(str(path), root_dir))
+        return load_object_from_file(path, *args, **kwargs)
+
+    monkeypatch.setattr(hosts_and_folders.store, "load_object_from_file", _load_object_from_file)
+
+    load_hosts_file = hosts_and_folders.CREFolder._load_hosts_file
+
+    def _load_hosts_file(self):
+        loaded_files.append(os.path.join(self.path(), "hosts.mk"))
+        return load_hosts_file(self)
+
+    monkeypatch.setattr(hosts_and_folders.CREFolder, "_load_hosts_file", _load_hosts_file)
+    return loaded_files
+
+
+def test_folder_tree_cache_unchanged(loaded_files):
+    folders = _load_folder_tree_from_cache()
+    assert sorted(folders) == ["", "sub1", "sub2"]
+    assert folders["sub1"].title() == "Sub 1"
+    assert folders["sub2"].title() == "Sub 2"
+    assert loaded_files == []
+
+    host = folders["sub1"].host("host1")
+    assert host is not None
+    assert host.attribute("ipaddress") == "127.0.0.1"
+    assert loaded_files == []
+
+
+def test_folder_tree_cache_missing_root_wato_file(loaded_files):
+    root_dir = hosts_and_folders.Folder.root_folder().filesystem_path()
+    assert not os.path.exists(os.path.join(root_dir, ".wato"))
+
+    assert sorted(_load_folder_tree_from_cache()) == ["", "sub1", "sub2"]
+    assert loaded_files == []
+
+
+def test_folder_tree_cache_invalidates_changed_folders(loaded_files):
+    folders = _load_folder_tree_from_cache()
+    folders["sub2"].edit("Sub 2 renamed", {})
+    folders["sub1"].host("host1").edit({"ipaddress": "127.0.0.2"}, None)
+    # The request modifying the folder already reads and caches the new .wato file
+    assert loaded_files == ["sub2/.wato"]
+
+    folders = _load_folder_tree_from_cache()
+    assert folders["sub2"].title() == "Sub 2 renamed"
+    assert folders["sub1"].host("host1").attribute("ipaddress") == "127.0.0.2"
+    assert loaded_files == ["sub2/.wato", "sub1/hosts.mk"]
+
+
+def test_folder_tree_cache_removed_and_added_folders(loaded_files):
+    root = hosts_and_folders.Folder.root_folder()
+    root.delete_subfolder("sub2")
+    root.create_subfolder("sub3", "Sub 3", {})
+    assert loaded_files == ["sub3/.wato"]
+
+    folders = _load_folder_tree_from_cache()
+    assert sorted(folders) == ["", "sub1", "sub3"]
+    assert folders["sub3"].title() == "Sub 3"
+    assert loaded_files == ["sub3/.wato"]
+
+
+def test_folder_tree_cache_removes_hosts_of_removed_folders(cached_folder_tree):
+    folders = _load_folder_tree_from_cache()
+    cache_path = hosts_and_folders._folder_tree_cache()._hosts_cache_path(
+        folders["sub1"].hosts_file_path())
+    assert os.path.exists(cache_path)
+
+    hosts_and_folders.Folder.root_folder().delete_subfolder("sub1")
+    assert sorted(_load_folder_tree_from_cache()) == ["", "sub2"]
+    assert not os.path.exists(cache_path)
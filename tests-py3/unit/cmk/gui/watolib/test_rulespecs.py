@@ -1241,6 +1241,7 @@ def test_grouped_rulespecs():
             'snmpv3_contexts',
             'snmp_timing',
             'non_inline_snmp_hosts',
+            'builtin_snmp_hosts',
             'usewalk_hosts',
             'snmp_ports',
             'snmp_limit_oid_range',
@@ -59,7 +59,9 @@ def test_registered_automation_commands():
         'ping',
         'push-snapshot',
         'get-config-sync-state',
+        'get-config-sync-signatures',
         'receive-config-sync',
+        'receive-config-sync-chunk',
         'service-discovery-job',
         'checkmk-remote-automation-start',
         'checkmk-remote-automation-get-status',
@@ -135,6 +137,7 @@ def test_registered_configvars():
         'pagetitle_date_format',
         'password_policy',
         'piggyback_max_cachefile_age',
+        'piggyback_store',
         'profile',
         'quicksearch_dropdown_limit',
         'quicksearch_search_order',
@@ -5,6 +5,10 @@
 # conditions defined in the file COPYING, which is part of this source code package.
 
 # pylint: disable=redefined-outer-name
+import random
+import re
+from typing import Any, Dict
+
 import pytest  # type: ignore[import]
 from testlib.base import Scenario
 from cmk.base.check_utils import Service
@@ -429,6 +433,173 @@ def test_ruleset_matcher_get_host_ruleset_values_tags(monkeypatch, hostname, exp
                                         is_binary=False)) == expected_result
 
 
+mixed_condition_ruleset = [
+    # test tags combined with labels
+    {
+        "value": "prod_linux",
+        "condition": {
+            "host_tags": {
+                "criticality": "prod",
+            },
+            "host_labels": {
+                "os": "linux",
+            },
+        },
+        "options": {},
+    },
+    # test tags combined with a host name regex
+    {
+        "value": "test_regex",
+        "condition": {
+            "host_tags": {
+                "criticality": "test",
+            },
+            "host_name": [{
+                "$regex": "host[23]$"
+            },],
+        },
+        "options": {},
+    },
+    # test negated host names combined with negated tags and folder
+    {
+        "value": "not_host3_not_prod_in_lvl1",
+        "condition": {
+            "host_tags": {
+                "criticality": {
+                    "$ne": "prod"
+                },
+            },
+            "host_name": {
+                "$nor": ["host3"]
+            },
+            "host_folder": "/lvl1/",
+        },
+        "options": {},
+    },
+]
+
+
+@pytest.mark.parametrize("hostname,expected_result", [
+    ("host1", ["prod_linux"]),
+    ("host2", ["test_regex", "not_host3_not_prod_in_lvl1"]),
+    ("host3", ["test_regex"]),
+    ("host4", []),
+])
+def test_ruleset_matcher_get_host_ruleset_values_mixed_conditions(monkeypatch, hostname,
+                                                                  expected_result):
+    ts = Scenario()
+    ts.add_host("host1", tags={"criticality": "prod"}, labels={"os": "linux"})
+    ts.add_host("host2", tags={"criticality": "test"}, host_path="/lvl1/hosts.mk")
+    ts.add_host("host3", tags={"criticality": "test"}, host_path="/lvl1/hosts.mk")
+    ts.add_host("host4", tags={"criticality": "test"}, labels={"os": "linux"})
+    config_cache = ts.apply(monkeypatch)
+    matcher = config_cache.ruleset_matcher
+
+    assert list(
+        matcher.get_host_ruleset_values(RulesetMatchObject(host_name=hostname,
+                                                           service_description=None),
+                                        ruleset=mixed_condition_ruleset,
+                                        is_binary=False)) == expected_result
+
+
+def _random_host_condition(rnd, folders):
+    tag_values = {
+        "criticality": ["prod", "critical", "test", "offline"],
+        "networking": ["lan", "wan", "dmz"],
+    }
+    condition = {"host_tags": {}}  # type: Dict[str, Any]
+    for tag_group_id in rnd.sample(list(tag_values), rnd.randint(0, 2)):
+        tags = tag_values[tag_group_id]
+        condition["host_tags"][tag_group_id] = rnd.choice([
+            rnd.choice(tags),
+            {
+                "$ne": rnd.choice(tags)
+            },
+            {
+                "$or": rnd.sample(tags, 2)
+            },
+        ])
+    if rnd.random() < 0.3:
+        condition["host_folder"] = rnd.choice(folders)
+    if rnd.random() < 0.3:
+        condition["host_labels"] = {"os": rnd.choice(["linux", "windows"])}
+    if rnd.random() < 0.2:
+        condition["host_name"] = [{"$regex": "host0[0-4]"}, "host77"]
+    elif rnd.random() < 0.2:
+        condition["host_name"] = {"$nor": ["host%02d" % i for i in range(0, 40, 3)]}
+    return condition
+
+
+def _matches_host_condition(host, condition):
+    hostname, tags, folder, labels = host
+    for tag_group_id, tag_spec in condition["host_tags"].items():
+        if isinstance(tag_spec, dict) and "$ne" in tag_spec:
+            if tags[tag_group_id] == tag_spec["$ne"]:
+                return False
+        elif isinstance(tag_spec, dict):
+            if tags[tag_group_id] not in tag_spec["$or"]:
+                return False
+        elif tags[tag_group_id] != tag_spec:
+            return False
+
+    if not folder.startswith(condition.get("host_folder", "/")):
+        return False
+
+    if any(labels.get(key) != value for key, value in condition.get("host_labels", {}).items()):
+        return False
+
+    host_name = condition.get("host_name")
+    if isinstance(host_name, dict):
+        return hostname not in host_name["$nor"]
+    if host_name is not None:
+        return any(
+            re.match(entry["$regex"], hostname) if isinstance(entry, dict) else entry == hostname
+            for entry in host_name)
+    return True
+
+
+def test_ruleset_matcher_get_host_ruleset_values_equals_host_by_host_evaluation(monkeypatch):
+    """The indexed matching gives the same result as evaluating the conditions per host"""
+    rnd = random.Random(42)
+    folders = ["/wato/", "/wato/a/", "/wato/a/b/", "/wato/c/"]
+
+    ts = Scenario()
+    hosts = []
+    for index in range(100):
+        host = (
+            "host%02d" % index,
+            {
+                "criticality": rnd.choice(["prod", "critical", "test", "offline"]),
+                "networking": rnd.choice(["lan", "wan", "dmz"]),
+            },
+            rnd.choice(folders),
+            {
+                "os": rnd.choice(["linux", "windows", "aix"])
+            },
+        )
+        hosts.append(host)
+        ts.add_host(host[0], tags=host[1], host_path=host[2] + "hosts.mk", labels=host[3])
+    matcher = ts.apply(monkeypatch).ruleset_matcher
+
+    random_ruleset = [{
+        "value": index,
+        "condition": _random_host_condition(rnd, folders),
+        "options": {},
+    } for index in range(200)]
+
+    for host in hosts:
+        expected = [
+            rule["value"]
+            for rule in random_ruleset
+            if _matches_host_condition(host, rule["condition"])
+        ]
+        assert list(
+            matcher.get_host_ruleset_values(RulesetMatchObject(host_name=host[0],
+                                                               service_description=None),
+                                            ruleset=random_ruleset,
+                                            is_binary=False)) == expected
+
+
 service_label_ruleset = [
     # test simple label match
     {
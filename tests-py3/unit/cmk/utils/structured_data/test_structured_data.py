@@ -6,12 +6,22 @@
 
 from typing import Dict, List
 
+import io
+import os
 import shutil
 import pytest  # type: ignore[import]
 from testlib import cmk_path  # type: ignore[import]
 
 from cmk.utils.exceptions import MKGeneralException
-from cmk.utils.structured_data import StructuredDataTree, Container, Attributes, Numeration
+from cmk.utils.structured_data import (
+    StructuredDataTree,
+    Container,
+    Attributes,
+    Numeration,
+    convert_tree_file,
+    load_raw_tree_from_binary,
+    serialize_raw_tree,
+)
 
 # Convention: test functions are named like
 #   test_structured_data_INFIX_METHODNAME where
@@ -721,6 +731,122 @@ def test_structured_data_StructuredDataTree_filtered_tree_networking(tree, paths
         assert interfaces is None
 
 
+@pytest.mark.parametrize("tree", trees)
+def test_structured_data_serialize_raw_tree(tree):
+    raw_tree = tree.get_raw_tree()
+    loaded_raw_tree = load_raw_tree_from_binary(io.BytesIO(serialize_raw_tree(raw_tree)))
+    assert loaded_raw_tree == raw_tree
+    assert repr(loaded_raw_tree) == repr(raw_tree)
+
+
+RAW_TREE_NESTED = {
+    "hardware": {
+        "cpu": {
+            "model": "Intel",
+            "cores": 4
+        },
+        "memory": {
+            "total_ram_usable": 1024,
+            "arrays": [{
+                "maximum_capacity": 4096,
+                "devices": [{
+                    "size": 1024,
+                    "type": "DDR3"
+                }],
+            }],
+        },
+    },
+    "networking": {
+        "interfaces": [{
+            "index": 1,
+            "admin_status": 1
+        }, {
+            "index": 2,
+            "admin_status": 2
+        }],
+        "total_interfaces": 2,
+    },
+    "software": {
+        "packages": [{
+            "name": "bash"
+        }],
+        "os": {
+            "name": "Debian"
+        },
+    },
+}
+
+
+@pytest.mark.parametrize("paths,expected_raw_tree", [
+    ([], {}),
+    ([([], None)], RAW_TREE_NESTED),
+    ([(["hardware", "cpu"], ["model"])], {
+        "hardware": {
+            "cpu": RAW_TREE_NESTED["hardware"]["cpu"]
+        }
+    }),
+    ([(["networking", "interfaces"], ["index"]), (["software"], None)], {
+        "networking": {
+            "interfaces": RAW_TREE_NESTED["networking"]["interfaces"]
+        },
+        "software": RAW_TREE_NESTED["software"],
+    }),
+    ([(["hardware", "memory", "arrays", 0, "devices"], [])], {
+        "hardware": {
+            "memory": {
+                "arrays": RAW_TREE_NESTED["hardware"]["memory"]["arrays"]
+            }
+        }
+    }),
+    ([(["hardware", "cpu"], None), (["hardware"], None), (["unknown", "path"], None)], {
+        "hardware": RAW_TREE_NESTED["hardware"],
+    }),
+])
+def test_structured_data_load_raw_tree_from_binary_paths(paths, expected_raw_tree):
+    binary = io.BytesIO(serialize_raw_tree(RAW_TREE_NESTED))
+    raw_tree = load_raw_tree_from_binary(binary, [path for path, _keys in paths])
+    assert raw_tree == expected_raw_tree
+
+    # The sub trees are a superset of the permitted paths
+    tree = StructuredDataTree().create_tree_from_raw_tree(RAW_TREE_NESTED)
+    assert StructuredDataTree().create_tree_from_raw_tree(raw_tree).get_filtered_tree(
+        paths).is_equal(tree.get_filtered_tree(paths))
+
+
+@pytest.mark.parametrize("paths", [
+    [(["hardware", "components"], None), (["networking", "interfaces"], None),
+     (["software", "os"], None)],
+    [(["networking"], ["total_interfaces", "total_ethernet_ports"])],
+    [(["networking", "interfaces"], ["admin_status", "oper_status"])],
+])
+def test_structured_data_StructuredDataTree_load_from_paths(tmp_path, paths):
+    tree_new_interfaces.save_to(str(tmp_path), "foo")
+    loaded_tree = StructuredDataTree().load_from(str(tmp_path / "foo"),
+                                                 [path for path, _keys in paths])
+    assert loaded_tree.count_entries() < tree_new_interfaces.count_entries()
+    assert loaded_tree.get_filtered_tree(paths).is_equal(
+        tree_new_interfaces.get_filtered_tree(paths))
+
+
+def test_structured_data_StructuredDataTree_load_from_outdated_binary(tmp_path):
+    tree_path = tmp_path / "foo"
+    tree_new_memory.save_to(str(tmp_path), "foo")
+    tree_path.write_text(repr(tree_new_arrays.get_raw_tree()))
+    os.utime(str(tmp_path / "foo.sdt"), (0, 0))
+    assert StructuredDataTree().load_from(str(tree_path)).is_equal(tree_new_arrays)
+
+    assert convert_tree_file(str(tree_path)) is True
+    assert convert_tree_file(str(tree_path)) is False
+    tree_path.unlink()
+    assert StructuredDataTree().load_from(str(tree_path)).is_equal(tree_new_arrays)
+
+
+def test_structured_data_StructuredDataTree_load_from_broken_binary(tmp_path):
+    tree_new_memory.save_to(str(tmp_path), "foo")
+    (tmp_path / "foo.sdt").write_bytes(b"CMKSDT1\n")
+    assert StructuredDataTree().load_from(str(tmp_path / "foo")).is_equal(tree_new_memory)
+
+
 def test_structured_data_StructuredDataTree_building_tree():
     def plugin_dict():
         node = struct_tree.get_dict("level0_0.level1_dict.")
@@ -432,3 +432,219 @@ def test_get_piggyback_matching_time_settings(time_settings, expected_time_setti
         piggyback._get_matching_time_settings(
             ["source-host"], "piggybacked-host",
             time_settings).keys()) == sorted(expected_time_setting_keys)
+
+
+@pytest.fixture(name="indexed_store")
+def fixture_indexed_store():
+    store_file = cmk.utils.paths.piggyback_store_file
+    if store_file.exists():
+        store_file.unlink()
+
+    piggyback.set_piggyback_store("indexed")
+    try:
+        yield piggyback._indexed_store
+    finally:
+        piggyback.set_piggyback_store("directory")
+
+
+def test_indexed_store_get_piggyback_raw_data(indexed_store):
+    time_settings = [(None, "max_cache_age", piggyback_max_cachefile_age)
+                    ]  # type: piggyback.PiggybackTimeSettings
+    assert piggyback.get_piggyback_raw_data("test-host", time_settings) == []
+    assert piggyback.has_piggyback_raw_data("test-host", time_settings) is False
+
+    piggyback.store_piggyback_raw_data("source1", {
+        "test-host": [b"<<<check_mk>>>", b"source1"],
+        "test-host2": [b"<<<check_mk>>>", b"source1 2"],
+    })
+    piggyback.store_piggyback_raw_data("source2", {"test-host": [b"<<<check_mk>>>", b"source2"]})
+
+    raw_data_infos = sorted(piggyback.get_piggyback_raw_data("test-host", time_settings))
+    assert [info.source_hostname for info in raw_data_infos] == ["source1", "source2"]
+    assert raw_data_infos[0].file_path.endswith("/test-host/source1")
+    assert all(info.successfully_processed for info in raw_data_infos)
+    assert raw_data_infos[0].reason == "Successfully processed from source 'source1'"
+    assert raw_data_infos[0].raw_data == b"<<<check_mk>>>\nsource1\n"
+    assert raw_data_infos[1].raw_data == b"<<<check_mk>>>\nsource2\n"
+    assert piggyback.has_piggyback_raw_data("test-host", time_settings) is True
+
+    assert sorted(piggyback.get_source_hostnames()) == ["source1", "source1", "source2"]
+    assert sorted(piggyback.get_source_hostnames("test-host")) == ["source1", "source2"]
+
+    # The directory layout is not touched
+    assert not (cmk.utils.paths.piggyback_dir / "test-host2").exists()
+
+
+def test_indexed_store_not_updated_and_not_sending(indexed_store, monkeypatch):
+    time_settings = [(None, "max_cache_age", piggyback_max_cachefile_age)
+                    ]  # type: piggyback.PiggybackTimeSettings
+    monkeypatch.setattr(piggyback.time, "time", lambda: 1000.0)
+    piggyback.store_piggyback_raw_data("source1", {
+        "test-host": [b"<<<check_mk>>>", b"lala"],
+        "test-host2": [b"<<<check_mk>>>", b"lala"],
+    })
+
+    monkeypatch.setattr(piggyback.time, "time", lambda: 1010.0)
+    piggyback.store_piggyback_raw_data("source1", {"test-host2": [b"<<<check_mk>>>", b"lulu"]})
+
+    raw_data_info, = piggyback.get_piggyback_raw_data("test-host", time_settings)
+    assert raw_data_info.successfully_processed is False
+    assert raw_data_info.reason == "Piggyback file not updated by source 'source1'"
+    assert raw_data_info.raw_data == b"<<<check_mk>>>\nlala\n"
+    assert sorted(piggyback.get_source_and_piggyback_hosts(time_settings)) == [
+        ("source1", "test-host2"),
+    ]
+
+    assert piggyback.remove_source_status_file("source1") is True
+    assert piggyback.remove_source_status_file("source1") is False
+    raw_data_info, = piggyback.get_piggyback_raw_data("test-host2", time_settings)
+    assert raw_data_info.successfully_processed is False
+    assert raw_data_info.reason == "Source 'source1' not sending piggyback data"
+
+    raw_data_info, = piggyback.get_piggyback_raw_data("test-host2", [
+        (None, "max_cache_age", piggyback_max_cachefile_age),
+        ("source1", "validity_period", 60),
+        ("source1", "validity_state", 1),
+    ])
+    assert raw_data_info.successfully_processed is True
+    assert raw_data_info.reason == "Source 'source1' not sending piggyback data (still valid, 60 s left)"
+    assert raw_data_info.reason_status == 1
+
+
+def test_indexed_store_cleanup(indexed_store, monkeypatch):
+    monkeypatch.setattr(piggyback.time, "time", lambda: 1000.0)
+    piggyback.store_piggyback_raw_data("source1", {"test-host": [b"<<<check_mk>>>", b"old"]})
+    monkeypatch.setattr(piggyback.time, "time", lambda: 2000.0)
+    piggyback.store_piggyback_raw_data("source2", {"test-host": [b"<<<check_mk>>>", b"new"]})
+
+    piggyback.cleanup_piggyback_files([(None, "max_cache_age", 500)])
+
+    snapshot = indexed_store.snapshot()
+    assert snapshot.source_status == {"source2": 2000.0}
+    assert list(snapshot.stored) == ["test-host"]
+    assert list(snapshot.stored["test-host"]) == ["source2"]
+    assert snapshot.payload("test-host", "source2") == b"<<<check_mk>>>\nnew\n"
+
+    piggyback.cleanup_piggyback_files([(None, "max_cache_age", -1)])
+    snapshot = indexed_store.snapshot()
+    assert snapshot.source_status == {}
+    assert snapshot.stored == {}
+
+
+def test_indexed_store_remove_keeps_updated_entries(indexed_store):
+    indexed_store.update("source1", {"test-host": b"old\n"})
+    outdated_snapshot = indexed_store.snapshot()
+
+    indexed_store.update("source1", {"test-host": b"new\n"})
+    indexed_store.remove(outdated_snapshot, ["source1"], [("test-host", "source1")])
+
+    snapshot = indexed_store.snapshot()
+    assert list(snapshot.source_status) == ["source1"]
+    assert snapshot.payload("test-host", "source1") == b"new\n"
+
+
+def test_indexed_store_shared_between_processes(indexed_store):
+    indexed_store.update("source1", {"test-host": b"lala\n"})
+    assert indexed_store.snapshot().payload("test-host", "source1") == b"lala\n"
+
+    # Another process appends to the store file
+    piggyback.PiggybackStore(indexed_store.path).update("source2", {"test-host": b"lulu\n"})
+
+    snapshot = indexed_store.snapshot()
+    assert snapshot.payload("test-host", "source1") == b"lala\n"
+    assert snapshot.payload("test-host", "source2") == b"lulu\n"
+
+
+def test_indexed_store_update_appends_record(indexed_store):
+    indexed_store.update("source1", {"test-host": b"lala\n" * 1000})
+    offset_before = indexed_store.snapshot().stored["test-host"]["source1"][1]
+    size_before = indexed_store.path.stat().st_size
+
+    indexed_store.update("source2", {"test-host": b"lulu\n"})
+
+    # The data of source1 has not been rewritten
+    snapshot = indexed_store.snapshot()
+    assert snapshot.stored["test-host"]["source1"][1] == offset_before
+    assert indexed_store.path.stat().st_size < size_before + 1000
+    assert snapshot.payload("test-host", "source1") == b"lala\n" * 1000
+    assert snapshot.payload("test-host", "source2") == b"lulu\n"
+
+
+def test_indexed_store_compaction(indexed_store, monkeypatch):
+    monkeypatch.setattr(piggyback.PiggybackStore, "_MIN_COMPACTION_SIZE", 0)
+    indexed_store.update("source1", {"test-host": b"lala\n" * 1000})
+    indexed_store.update("source2", {"test-host": b"lulu\n" * 2000})
+    old_snapshot = indexed_store.snapshot()
+    inode = indexed_store.path.stat().st_ino
+
+    # Outdating one payload does not make the majority of the file outdated
+    indexed_store.update("source1", {"test-host": b"new\n"})
+    assert indexed_store.path.stat().st_ino == inode
+
+    indexed_store.update("source2", {"test-host": b"new2\n"})
+    assert indexed_store.path.stat().st_ino != inode
+    assert indexed_store.path.stat().st_size < 1000
+
+    snapshot = piggyback.PiggybackStore(indexed_store.path).snapshot()
+    assert snapshot.source_status == indexed_store.snapshot().source_status
+    assert snapshot.payload("test-host", "source1") == b"new\n"
+    assert snapshot.payload("test-host", "source2") == b"new2\n"
+    # Snapshots taken before the compaction stay valid
+    assert old_snapshot.payload("test-host", "source2") == b"lulu\n" * 2000
+
+
+def test_indexed_store_incomplete_record(indexed_store):
+    indexed_store.update("source1", {"test-host": b"lala\n"})
+    with indexed_store.path.open("ab") as f:
+        f.write(b"\x00\x00\x00\xff")  # Interrupted writer
+
+    other_store = piggyback.PiggybackStore(indexed_store.path)
+    assert other_store.snapshot().payload("test-host", "source1") == b"lala\n"
+
+    other_store.update("source2", {"test-host": b"lulu\n"})
+    snapshot = indexed_store.snapshot()
+    assert snapshot.payload("test-host", "source1") == b"lala\n"
+    assert snapshot.payload("test-host", "source2") == b"lulu\n"
+
+
+def test_indexed_store_rename_host(indexed_store):
+    indexed_store.update("source1", {"test-host": b"lala\n", "old-host": b"lulu\n"})
+    indexed_store.update("old-host", {"test-host": b"lolo\n", "test-host2": b"lili\n"})
+    indexed_store.update("source2", {"new-host": b"replaced\n"})
+
+    assert piggyback.rename_host_in_piggyback_store("old-host", "new-host") == (1, 2)
+    assert piggyback.rename_host_in_piggyback_store("old-host", "new-host") == (0, 0)
+
+    snapshot = indexed_store.snapshot()
+    assert sorted(snapshot.source_status) == ["new-host", "source1", "source2"]
+    assert sorted(snapshot.stored) == ["new-host", "test-host", "test-host2"]
+    assert list(snapshot.stored["new-host"]) == ["source1"]
+    assert snapshot.payload("new-host", "source1") == b"lulu\n"
+    assert snapshot.payload("test-host", "new-host") == b"lolo\n"
+    assert snapshot.payload("test-host2", "new-host") == b"lili\n"
+
+
+def test_indexed_store_remove_host(indexed_store):
+    indexed_store.update("source1", {"test-host": b"lala\n", "test-host2": b"lulu\n"})
+    indexed_store.update("source2", {"test-host": b"lolo\n"})
+
+    assert piggyback.remove_host_from_piggyback_store("test-host") is True
+    assert piggyback.remove_host_from_piggyback_store("test-host") is False
+
+    snapshot = indexed_store.snapshot()
+    assert list(snapshot.stored) == ["test-host2"]
+    assert sorted(snapshot.source_status) == ["source1", "source2"]
+
+
+def test_directory_layout_not_handled_by_store_functions():
+    assert piggyback.rename_host_in_piggyback_store("old-host", "new-host") == (0, 0)
+    assert piggyback.remove_host_from_piggyback_store("test-host") is False
+
+
+def test_indexed_store_unknown_format(indexed_store):
+    indexed_store.path.parent.mkdir(parents=True, exist_ok=True)
+    with indexed_store.path.open("wb") as f:
+        f.write(b"garbage")
+
+    with pytest.raises(piggyback.MKGeneralException, match="unknown format"):
+        indexed_store.snapshot()
@@ -9,7 +9,7 @@ import pytest  # type: ignore[import]
 from testlib.base import Scenario
 
 import cmk.utils.snmp_table as snmp_table
-from cmk.utils.type_defs import OID_END, OIDBytes, OIDEnd, SNMPHostConfig
+from cmk.utils.type_defs import OID_END, ABCSNMPBackend, OIDBytes, OIDEnd, SNMPHostConfig
 
 import cmk.base.config as config
 from cmk.base.api.agent_based.register.section_plugins_legacy import _create_snmp_trees
@@ -32,6 +32,7 @@ SNMPConfig = SNMPHostConfig(
     character_encoding="ascii",
     is_usewalk_host=False,
     is_inline_snmp_host=False,
+    is_builtin_snmp_host=False,
     record_stats=False,
 )
 
@@ -42,9 +43,11 @@ class _SNMPTestFactory(SNMPBackendFactory):
         return _SNMPTestBackend()
 
 
-class _SNMPTestBackend:
-    @staticmethod
-    def walk(_snmp_config, oid, **_kwargs):
+class _SNMPTestBackend(ABCSNMPBackend):
+    def get(self, snmp_config, oid, context_name=None):
+        return None
+
+    def walk(self, snmp_config, oid, **_kwargs):
         return [("%s.%s" % (oid, r), b"C0FEFE") for r in (1, 2, 3)]
 
 
@@ -151,3 +154,64 @@ def test_is_bulkwalk_host(monkeypatch):
     config_cache = ts.apply(monkeypatch)
     assert config_cache.get_host_config("abc").snmp_config("").is_bulkwalk_host is False
     assert config_cache.get_host_config("localhost").snmp_config("").is_bulkwalk_host is True
+
+
+class _RecordingBackend(_SNMPTestBackend):
+    def __init__(self, merges_columns):
+        super().__init__()
+        self.merges_columns = merges_columns
+        self.walked = []  # type: list
+
+    def walk_columns(self, snmp_config, oids, **kwargs):
+        self.walked.append(oids)
+        return super().walk_columns(snmp_config, oids, **kwargs)
+
+
+@pytest.mark.parametrize("merges_columns,walked,merged", [
+    (False, [[".1.2.1", ".1.2.2", ".1.2.3"], [".1.2.4"]], 0),
+    (True, [[".1.2.1", ".1.2.2", ".1.2.3"], [".1.2.4"]], 2),
+])
+def test_get_snmp_table_fetched_walks(monkeypatch, merges_columns, walked, merged):
+    backend = _RecordingBackend(merges_columns)
+    monkeypatch.setattr(SNMPBackendFactory, "_factory", staticmethod(lambda *a, **kw: backend))
+
+    fetched_walks = snmp_table.FetchedWalks()
+    table_a = snmp_table.get_snmp_table(SNMPConfig, "plugin_a", (".1.2", ["1", "2", "3", "2"]),
+                                        fetched_walks)
+    table_b = snmp_table.get_snmp_table(SNMPConfig, "plugin_b", (".1.2", [OID_END, "3", "4"]),
+                                        fetched_walks)
+
+    assert backend.walked == walked
+    assert table_a == [["C0FEFE"] * 4] * 3
+    assert table_b == [["1", "C0FEFE", "C0FEFE"], ["2", "C0FEFE", "C0FEFE"],
+                       ["3", "C0FEFE", "C0FEFE"]]
+    assert fetched_walks.requested == 5
+    assert fetched_walks.deduplicated == 1
+    assert fetched_walks.merged == merged
+    assert fetched_walks.saved == 1 + merged
+
+
+def test_get_snmp_table_without_fetched_walks_walks_again(monkeypatch):
+    backend = _RecordingBackend(False)
+    monkeypatch.setattr(SNMPBackendFactory, "_factory", staticmethod(lambda *a, **kw: backend))
+
+    for _ in range(2):
+        snmp_table.get_snmp_table(SNMPConfig, "plugin", (".1.2", ["1"]))
+    assert backend.walked == [[".1.2.1"], [".1.2.1"]]
+
+
+def test_get_snmp_table_fetched_walks_per_oid_range_limit(monkeypatch):
+    backend = _RecordingBackend(False)
+    monkeypatch.setattr(SNMPBackendFactory, "_factory", staticmethod(lambda *a, **kw: backend))
+    snmp_config = SNMPConfig.update(oid_range_limits=[
+        (["plugin_a"], [("first", 2)]),
+        (["plugin_b"], [("last", 1)]),
+    ])
+
+    fetched_walks = snmp_table.FetchedWalks()
+    for plugin in ["plugin_a", "plugin_b", "plugin_c", "plugin_d"]:
+        snmp_table.get_snmp_table(snmp_config, plugin, (".1.2", ["1"]), fetched_walks)
+
+    # Only the two plugins without a limit share their walk
+    assert backend.walked == [[".1.2.1"]] * 3
+    assert fetched_walks.deduplicated == 1
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+
+import json
+import socket
+import threading
+import time
+
+import pytest  # type: ignore[import]
+
+
+class FakeLivestatusSite(threading.Thread):
+    """Answers each query after the given delay, the first connection may be closed"""
+    def __init__(self, path, rows, delay=0.0, code=200, close_first=False, trailing_newline=True):
+        super().__init__()
+        self.daemon = True
+        self.queries = []
+        self._rows = rows
+        self._delay = delay
+        self._code = code
+        self._close_first = close_first
+        self._trailing_newline = trailing_newline
+        self._server = socket.socket(socket.AF_UNIX)
+        self._server.bind(str(path))
+        self._server.listen(5)
+        self.start()
+
+    def run(self):
+        while True:
+            try:
+                conn, _addr = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        buf = b""
+        while True:
+            while b"\n\n" not in buf:
+                data = conn.recv(4096)
+                if not data:
+                    return
+                buf += data
+            query, buf = buf.split(b"\n\n", 1)
+            self.queries.append(query)
+            if self._close_first:
+                self._close_first = False
+                conn.close()
+                return
+
+            time.sleep(self._delay)
+            body = self._render(query) if self._code == 200 else b"Table not found"
+            try:
+                conn.sendall(b"%03d %11d\n" % (self._code, len(body)) + body)
+            except OSError:
+                return
+
+    def _render(self, query):
+        if b"\nOutputFormat: json\n" in query:
+            render = lambda row: json.dumps(
+                [v.decode("latin-1") if isinstance(v, bytes) else v for v in row])
+        else:
+            render = repr
+        body = "[%s]" % ",\n".join(render(row) for row in self._rows)
+        if self._trailing_newline:
+            body += "\n"
+        return body.encode("utf-8")
+
+    def close(self):
+        self._server.close()
+
+
+@pytest.fixture(name="make_site")
+def fixture_make_site(tmp_path):
+    servers = []
+
+    def make_site(name, rows, **kwargs):
+        path = tmp_path / name
+        servers.append(FakeLivestatusSite(path, rows, **kwargs))
+        return {"socket": "unix:%s" % path}
+
+    yield make_site
+    for server in servers:
+        server.close()
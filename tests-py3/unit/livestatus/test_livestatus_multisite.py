@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+
+import livestatus
+
+
+def test_query_parallel_keeps_site_order(make_site):
+    live = livestatus.MultiSiteConnection({
+        "slow": make_site("slow", [["a"]], delay=0.3),
+        "fast": make_site("fast", [["b"], ["c"]]),
+    })
+    live.set_prepend_site(True)
+    assert live.alive_sites() == ["slow", "fast"]
+    assert live.query("GET hosts\nColumns: name\n") == [["slow", "a"], ["fast", "b"], ["fast", "c"]]
+    assert live.dead_sites() == {}
+
+
+def test_iter_query_parallel_yields_responses_on_arrival(make_site):
+    live = livestatus.MultiSiteConnection({
+        "slow": make_site("slow", [["a"]], delay=0.3),
+        "fast": make_site("fast", [["b"]]),
+    })
+    responses = live.iter_query_parallel(livestatus.Query("GET hosts\nColumns: name\n"))
+    assert next(responses) == ("fast", [["b"]])
+    assert list(responses) == [("slow", [["a"]])]
+    assert live.alive_sites() == ["slow", "fast"]
+
+
+def test_iter_query_parallel_without_selectors_module(make_site, monkeypatch):
+    # Python 2 has no selectors module
+    monkeypatch.setattr(livestatus, "selectors", None)
+    hanging_site = make_site("hanging", [["a"]], delay=5.0)
+    hanging_site["timeout"] = 1
+    live = livestatus.MultiSiteConnection({
+        "hanging": hanging_site,
+        "slow": make_site("slow", [["b"]], delay=0.3),
+        "fast": make_site("fast", [["c"]]),
+    })
+    responses = live.iter_query_parallel(livestatus.Query("GET hosts\nColumns: name\n"))
+    assert list(responses) == [("fast", [["c"]]), ("slow", [["b"]])]
+    assert live.alive_sites() == ["slow", "fast"]
+    assert "Timeout" in str(live.dead_sites()["hanging"]["exception"])
+
+
+def test_query_parallel_timeout(make_site):
+    hanging_site = make_site("hanging", [["a"]], delay=5.0)
+    hanging_site["timeout"] = 1
+    live = livestatus.MultiSiteConnection({
+        "hanging": hanging_site,
+        "fast": make_site("fast", [["b"]]),
+    })
+
+    assert live.query("GET hosts\nColumns: name\n") == [["b"]]
+    assert live.alive_sites() == ["fast"]
+    assert "Timeout" in str(live.dead_sites()["hanging"]["exception"])
+
+
+def test_query_parallel_suppressed_exception(make_site):
+    live = livestatus.MultiSiteConnection({
+        "old": make_site("old", [], code=404),
+        "new": make_site("new", [["b"]]),
+    })
+    assert live.query("GET new_table\n") == [["b"]]
+    assert live.alive_sites() == ["old", "new"]
+
+    assert live.query(livestatus.Query("GET new_table\n", suppress_exceptions=[])) == [["b"]]
+    assert live.alive_sites() == ["new"]
+    assert isinstance(live.dead_sites()["old"]["exception"],
+                      livestatus.MKLivestatusTableNotFoundError)
+
+
+def test_query_parallel_reconnects_once(make_site):
+    live = livestatus.MultiSiteConnection({
+        "site": make_site("site", [["a"]], close_first=True),
+    })
+    assert live.query("GET hosts\nColumns: name\n") == [["a"]]
+    assert live.alive_sites() == ["site"]
+
+
+def test_iter_query_parallel_stopped_early(make_site):
+    live = livestatus.MultiSiteConnection({
+        "slow": make_site("slow", [["a"]], delay=0.3),
+        "fast": make_site("fast", [["b"]]),
+    })
+    responses = live.iter_query_parallel(livestatus.Query("GET hosts\nColumns: name\n"))
+    assert next(responses) == ("fast", [["b"]])
+    responses.close()
+
+    assert live.alive_sites() == ["slow", "fast"]
+    assert live.get_connection("slow").socket is None
+    # The disconnected site is connected again by the next query
+    assert live.query("GET hosts\nColumns: name\n") == [["a"], ["b"]]
+    assert live.dead_sites() == {}
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Copyright (C) 2019 tribe29 GmbH - License: GNU General Public License v2
+# This file is part of Checkmk (https://checkmk.com). It is subject to the terms and
+# conditions defined in the file COPYING, which is part of this source code package.
+
+import pytest  # type: ignore[import]
+
+import livestatus
+
+ROWS = [
+    ["heute", 0, 1.5, None],
+    [u"h\xe4ute\nzwei", -1, 0.0, {
+        "key": u"v\xe4l",
+        "k2": ""
+    }],
+    ["", 2, 1e-05, [["a", 1], ["b", 2]]],
+    ["[x],\n", 3, 3.0, []],
+]
+
+
+@pytest.fixture(name="connection")
+def fixture_connection(make_site):
+    return livestatus.SingleSiteConnection(make_site("site", ROWS)["socket"])
+
+
+@pytest.mark.parametrize("output_format", [
+    livestatus.OUTPUT_FORMAT_PYTHON,
+    livestatus.OUTPUT_FORMAT_JSON,
+])
+def test_query_output_format(connection, output_format):
+    query = livestatus.Query("GET hosts\n", output_format=output_format)
+    assert connection.query(query) == ROWS
+    assert list(connection.iter_query(query)) == ROWS
+
+
+def test_query_json_blobs(make_site):
+    connection = livestatus.SingleSiteConnection(make_site("site", [[b"\x00\xff"]])["socket"])
+    assert connection.query("GET hosts\n") == [[b"\x00\xff"]]
+    query = livestatus.Query("GET hosts\n", output_format="json")
+    assert connection.query(query) == [[u"\x00\xff"]]
+
+
+def test_query_unknown_output_format():
+    with pytest.raises(livestatus.MKLivestatusConfigError, match="Unsupported output format"):
+        livestatus.Query("GET hosts\n", output_format="python2")
+
+
+@pytest.mark.parametrize("rows", [[], [["a"]], [["a"], ["b"]]])
+def test_iter_query_few_rows(make_site, rows):
+    connection = livestatus.SingleSiteConnection(make_site("site", rows)["socket"])
+    query = livestatus.Query("GET hosts\n", output_format="json")
+    assert list(connection.iter_query(query)) == rows
+
+
+@pytest.mark.parametrize("chunk_size", [3, 4096])
+@pytest.mark.parametrize("rows", [[["a"]], ROWS])
+def test_iter_query_without_trailing_newline(make_site, monkeypatch, rows, chunk_size):
+    monkeypatch.setattr(livestatus, "RECEIVE_CHUNK_SIZE", chunk_size)
+    connection = livestatus.SingleSiteConnection(
+        make_site("site", rows, trailing_newline=False)["socket"])
+    assert list(connection.iter_query("GET hosts\n")) == rows
+    assert list(connection.iter_query("GET hosts\n")) == rows
+
+
+def test_iter_query_small_chunks(connection, monkeypatch):
+    monkeypatch.setattr(livestatus, "RECEIVE_CHUNK_SIZE", 3)
+    connection.set_prepend_site(True)
+    assert list(connection.iter_query("GET hosts\n")) == [[b""] + row for row in ROWS]
+
+
+def test_iter_query_stopped_early(connection):
+    rows = connection.iter_query("GET hosts\n")
+    assert next(rows) == ROWS[0]
+    rows.close()
+    assert connection.socket is None
+    assert connection.query("GET hosts\n") == ROWS
+
+
+def test_iter_query_error(make_site):
+    connection = livestatus.SingleSiteConnection(make_site("site", [], code=404)["socket"])
+    with pytest.raises(livestatus.MKLivestatusTableNotFoundError):
+        list(connection.iter_query("GET hosts\n"))